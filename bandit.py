@@ -0,0 +1,203 @@
+"""
+Thompson sampling для выбора лучшего варианта рекламы.
+
+Вместо полной одинаковой оценки каждого варианта распределяем бюджет
+симулированных показов между вариантами: на каждом раунде сэмплируем
+вероятность клика из Beta-апостериорного распределения каждого варианта
+и отдаём пачку показов тому, у кого сэмпл больше. Слабые варианты
+быстро перестают получать показы.
+
+Показы разыгрываются моделью отклика из simulation.py.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from simulation import (
+    PERSONAS_PATH,
+    AdProfile,
+    load_segment_distributions,
+    response_probabilities,
+    sample_consumers,
+)
+
+
+@dataclass
+class ArmPosterior:
+    """Beta-апостериорные распределения одного варианта (клик и покупка)."""
+    index: int
+    click_alpha: float = 1.0
+    click_beta: float = 1.0
+    purchase_alpha: float = 1.0
+    purchase_beta: float = 1.0
+    impressions: int = 0
+    clicks: int = 0
+    purchases: int = 0
+
+    @property
+    def click_mean(self) -> float:
+        return self.click_alpha / (self.click_alpha + self.click_beta)
+
+    @property
+    def purchase_mean(self) -> float:
+        return self.purchase_alpha / (self.purchase_alpha + self.purchase_beta)
+
+    def update(self, n: int, clicks: int, purchases: int) -> None:
+        self.impressions += n
+        self.clicks += clicks
+        self.purchases += purchases
+        self.click_alpha += clicks
+        self.click_beta += n - clicks
+        self.purchase_alpha += purchases
+        self.purchase_beta += n - purchases
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "index": self.index,
+            "impressions": self.impressions,
+            "clicks": self.clicks,
+            "purchases": self.purchases,
+            "click_alpha": self.click_alpha,
+            "click_beta": self.click_beta,
+            "click_mean": self.click_mean,
+            "purchase_alpha": self.purchase_alpha,
+            "purchase_beta": self.purchase_beta,
+            "purchase_mean": self.purchase_mean,
+        }
+
+
+@dataclass
+class BanditResult:
+    winner: int
+    posterior: ArmPosterior
+    arms: List[ArmPosterior]
+    total_cost: int          # сколько симулированных показов потрачено
+    prob_best: float         # апостериорная вероятность, что winner — лучший
+    rounds: int
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "winner": self.winner,
+            "posterior": self.posterior.to_dict(),
+            "arms": [a.to_dict() for a in self.arms],
+            "total_cost": self.total_cost,
+            "prob_best": self.prob_best,
+            "rounds": self.rounds,
+        }
+
+
+def _prob_best(arms: List[ArmPosterior], rng: np.random.Generator, draws: int = 2000) -> np.ndarray:
+    a = np.array([arm.click_alpha for arm in arms])[:, None]
+    b = np.array([arm.click_beta for arm in arms])[:, None]
+    samples = rng.beta(a, b, size=(len(arms), draws))
+    wins = np.bincount(samples.argmax(axis=0), minlength=len(arms))
+    return wins / draws
+
+
+def is_known_segment(target_audience: str, personas_path: str = PERSONAS_PATH) -> bool:
+    """Есть ли у сегмента распределение персон — без него симулировать показы не на чем."""
+    return target_audience.lower() in load_segment_distributions(personas_path)
+
+
+def thompson_select(
+    ads: Sequence[AdProfile | str],
+    target_audience: str,
+    budget: int = 50_000,
+    batch_size: int = 500,
+    prob_best_stop: float = 0.95,
+    check_every: int = 5,
+    prior: Tuple[float, float] = (1.0, 1.0),
+    seed: Optional[int] = None,
+    personas_path: str = PERSONAS_PATH,
+) -> BanditResult:
+    """
+    Распределяет budget симулированных показов между вариантами по Thompson sampling.
+
+    Останавливается раньше, если апостериорная вероятность того, что лидер
+    лучший, превысила prob_best_stop (проверка раз в check_every раундов).
+    """
+    if not ads:
+        raise ValueError("Нужен хотя бы один вариант рекламы")
+
+    profiles = [a if isinstance(a, AdProfile) else AdProfile(text=a) for a in ads]
+    segment_key = target_audience.lower()
+    distributions = load_segment_distributions(personas_path)
+    if segment_key not in distributions:
+        raise KeyError(f"Неизвестный сегмент: {target_audience}")
+    dist = distributions[segment_key]
+
+    rng = np.random.default_rng(seed)
+    arms = [
+        ArmPosterior(
+            index=i,
+            click_alpha=prior[0], click_beta=prior[1],
+            purchase_alpha=prior[0], purchase_beta=prior[1],
+        )
+        for i in range(len(profiles))
+    ]
+
+    spent = 0
+    rounds = 0
+    prob_best = np.full(len(arms), 1.0 / len(arms))
+
+    while spent < budget:
+        if len(arms) == 1:
+            chosen = 0
+        else:
+            theta = rng.beta(
+                [arm.click_alpha for arm in arms],
+                [arm.click_beta for arm in arms],
+            )
+            chosen = int(theta.argmax())
+
+        n = min(batch_size, budget - spent)
+        consumers = sample_consumers(dist, n, rng)
+        p_click, p_buy = response_probabilities(profiles[chosen], segment_key, dist, consumers)
+        clicked = rng.random(n) < p_click
+        bought = clicked & (rng.random(n) < p_buy)
+        arms[chosen].update(n, int(clicked.sum()), int(bought.sum()))
+
+        spent += n
+        rounds += 1
+
+        if rounds % check_every != 0:
+            continue
+        if len(arms) == 1:
+            # сравнивать не с кем — хватит одной порции для оценки
+            break
+        prob_best = _prob_best(arms, rng)
+        if prob_best.max() >= prob_best_stop:
+            break
+
+    if len(arms) > 1:
+        prob_best = _prob_best(arms, rng)
+    else:
+        prob_best = np.ones(1)
+
+    winner = int(prob_best.argmax())
+    return BanditResult(
+        winner=winner,
+        posterior=arms[winner],
+        arms=arms,
+        total_cost=spent,
+        prob_best=float(prob_best[winner]),
+        rounds=rounds,
+    )
+
+
+if __name__ == "__main__":
+    import json
+
+    test_ads = [
+        "iPhone 17 — твой следующий уровень технологий!\n"
+        "Ощути невероятную скорость и улучшенную камеру.\n"
+        "💥 Скидка 10% только сегодня!",
+        "iPhone 17. Новая камера и быстрый процессор. Купить онлайн с доставкой.",
+        "iPhone 17. Купить.",
+    ]
+
+    res = thompson_select(test_ads, "price_sensitive_students", seed=7)
+    print(json.dumps(res.to_dict(), ensure_ascii=False, indent=2))
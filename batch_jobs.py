@@ -0,0 +1,450 @@
+"""
+Офлайн-режим для ночных прогонов по всему каталогу через batch API провайдеров.
+
+Интерактивная задержка ночью не нужна, нужна дешёвая массовая обработка:
+1) пишем запросы генерации (Mistral) и оценки AdTest (OpenAI) в JSONL-файлы —
+   по строке на запрос, с custom_id;
+2) отправляем файл в batch-эндпоинт провайдера;
+3) опрашиваем статус до завершения;
+4) скачиваем результаты и склеиваем с товарами/объявлениями по custom_id.
+
+LocalBatchBackend обрабатывает тот же JSONL локально (MockLLMClient + эвристика
+main.evaluate_ad) — так весь путь проверяется без сети и ключей.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+from campaign import build_payload_for_record
+from feedback_helper import generate_prompt, parse_scores
+from prompt import (
+    SYSTEM_PROMPT,
+    AdVariant,
+    MockLLMClient,
+    _extract_json_from_content,
+    _variant_to_ad_text,
+    build_payload_from_request,
+    build_request_from_input_json,
+)
+
+CHAT_ENDPOINT = "/v1/chat/completions"
+GENERATION_MODEL = "mistral-small-latest"
+EVALUATION_MODEL = "gpt-4o-mini-2024-07-18"
+CHANNELS = ["telegram", "vk", "yandex_ads"]
+
+# custom_id: "<вид>|<ключ объекта>|<канал или сегмент>"
+ID_SEP = "|"
+
+
+# ==========================
+# 1. ФОРМИРОВАНИЕ JSONL
+# ==========================
+
+def product_to_input_json(record: Dict[str, Any], channel: str, n_variants: int = 3) -> Dict[str, Any]:
+    """
+    Товар из каталога (name/description/price/market_cost) или готовый input_json
+    с ключом "product" → input_json для AdGenerator на нужный канал. Тот же payload,
+    что у интерактивной генерации (campaign.build_payload_for_record); n_variants
+    записи каталога без своего input_json — из аргумента.
+    """
+    payload, _, _ = build_payload_for_record(record, "")
+    payload["channel"] = channel
+    if "product" not in record or "n_variants" not in record:
+        payload["n_variants"] = n_variants
+    return payload
+
+
+def build_generation_requests(
+    products: List[Dict[str, Any]],
+    channels: Iterable[str] = CHANNELS,
+    n_variants: int = 3,
+    model: str = GENERATION_MODEL,
+) -> List[Dict[str, Any]]:
+    """Запросы генерации: по одному на пару (товар, канал). Ключ товара — индекс в каталоге."""
+    requests = []
+    for idx, record in enumerate(products):
+        for channel in channels:
+            req = build_request_from_input_json(product_to_input_json(record, channel, n_variants))
+            payload = build_payload_from_request(req)
+            requests.append({
+                "custom_id": ID_SEP.join(["gen", str(idx), channel]),
+                "method": "POST",
+                "url": CHAT_ENDPOINT,
+                "body": {
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
+                    ],
+                    "temperature": 0.85,
+                },
+            })
+    return requests
+
+
+def build_evaluation_requests(
+    ads: Dict[str, str],
+    segments: Iterable[str],
+    model: str = EVALUATION_MODEL,
+) -> List[Dict[str, Any]]:
+    """Запросы оценки AdTest: ads — {ad_id: текст}, по запросу на пару (объявление, сегмент)."""
+    segments = list(segments)
+    requests = []
+    for ad_id, ad_text in ads.items():
+        for segment in segments:
+            requests.append({
+                "custom_id": ID_SEP.join(["eval", ad_id, segment]),
+                "method": "POST",
+                "url": CHAT_ENDPOINT,
+                "body": {
+                    "model": model,
+                    "messages": [{"role": "system", "content": generate_prompt(ad_text, [segment])}],
+                },
+            })
+    return requests
+
+
+def write_jsonl(path: str, rows: Iterable[Dict[str, Any]]) -> int:
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def read_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ==========================
+# 2. BACKENDS
+# ==========================
+
+class BatchBackend:
+    """submit → job_id; status → "in_progress" | "completed" | "failed"; download → путь к результатам."""
+
+    def submit(self, requests_path: str) -> str:
+        raise NotImplementedError
+
+    def status(self, job_id: str) -> str:
+        raise NotImplementedError
+
+    def download(self, job_id: str, output_path: str) -> str:
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    def __init__(self, client=None, completion_window: str = "24h"):
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=CHAT_ENDPOINT,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, job_id: str) -> str:
+        state = self.client.batches.retrieve(job_id).status
+        if state == "completed":
+            return "completed"
+        if state in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "in_progress"
+
+    def download(self, job_id: str, output_path: str) -> str:
+        batch = self.client.batches.retrieve(job_id)
+        content = self.client.files.content(batch.output_file_id)
+        with open(output_path, "wb") as f:
+            f.write(content.read())
+        return output_path
+
+
+class MistralBatchBackend(BatchBackend):
+    API_URL = "https://api.mistral.ai/v1"
+
+    def __init__(self, model: str = GENERATION_MODEL):
+        api_key = os.getenv("MISTRAL_API_KEY")
+        if not api_key:
+            raise ValueError("MISTRAL_API_KEY не задан в переменных окружения!")
+        self.model = model
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+
+    def submit(self, requests_path: str) -> str:
+        # Mistral ждёт строки вида {"custom_id", "body"} без method/url
+        lines = [
+            json.dumps({"custom_id": r["custom_id"], "body": r["body"]}, ensure_ascii=False)
+            for r in read_jsonl(requests_path)
+        ]
+        files = {"file": (os.path.basename(requests_path), "\n".join(lines).encode("utf-8"))}
+        resp = httpx.post(f"{self.API_URL}/files", headers=self.headers, files=files, data={"purpose": "batch"}, timeout=120.0)
+        resp.raise_for_status()
+        file_id = resp.json()["id"]
+
+        resp = httpx.post(
+            f"{self.API_URL}/batch/jobs",
+            headers=self.headers,
+            json={"input_files": [file_id], "model": self.model, "endpoint": CHAT_ENDPOINT},
+            timeout=40.0,
+        )
+        resp.raise_for_status()
+        return resp.json()["id"]
+
+    def _job(self, job_id: str) -> Dict[str, Any]:
+        resp = httpx.get(f"{self.API_URL}/batch/jobs/{job_id}", headers=self.headers, timeout=40.0)
+        resp.raise_for_status()
+        return resp.json()
+
+    def status(self, job_id: str) -> str:
+        state = self._job(job_id).get("status", "")
+        if state == "SUCCESS":
+            return "completed"
+        if state in ("FAILED", "TIMEOUT_EXCEEDED", "CANCELLED"):
+            return "failed"
+        return "in_progress"
+
+    def download(self, job_id: str, output_path: str) -> str:
+        output_file = self._job(job_id)["output_file"]
+        resp = httpx.get(f"{self.API_URL}/files/{output_file}/content", headers=self.headers, timeout=120.0)
+        resp.raise_for_status()
+        with open(output_path, "wb") as f:
+            f.write(resp.content)
+        return output_path
+
+
+def local_stub_handler(custom_id: str, body: Dict[str, Any]) -> str:
+    """
+    Ответ «модели» без сети: генерация — MockLLMClient, оценка — main.evaluate_ad
+    по тексту рекламы из промпта.
+    """
+    kind, _, target = custom_id.split(ID_SEP, 2)
+    messages = body["messages"]
+
+    if kind == "gen":
+        payload = json.loads(messages[-1]["content"])
+        variants = MockLLMClient().generate_variants(payload)
+        return json.dumps({"variants": [v.__dict__ for v in variants]}, ensure_ascii=False)
+
+    from main import evaluate_ad
+
+    prompt_text = messages[0]["content"]
+    ad_text = prompt_text.rsplit("РЕКЛАМА: ", 1)[-1].rsplit("PROMPT END", 1)[0].strip()
+    scores = evaluate_ad(ad_text, target)
+    return (
+        f"click_probability: {scores['click_probability']}\n"
+        f"purchase_probability: {scores['purchase_probability']}"
+    )
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Локальная замена batch API: «задача» выполняется синхронно при submit,
+    результаты пишутся в формате вывода OpenAI Batch.
+    """
+
+    def __init__(self, handler: Callable[[str, Dict[str, Any]], str] = local_stub_handler, workdir: str = "."):
+        self.handler = handler
+        self.workdir = workdir
+        self._jobs: Dict[str, List[Dict[str, Any]]] = {}
+
+    def submit(self, requests_path: str) -> str:
+        results = []
+        for row in read_jsonl(requests_path):
+            try:
+                content = self.handler(row["custom_id"], row["body"])
+                results.append({
+                    "custom_id": row["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"message": {"role": "assistant", "content": content}}]},
+                    },
+                    "error": None,
+                })
+            except Exception as e:
+                results.append({
+                    "custom_id": row["custom_id"],
+                    "response": None,
+                    "error": {"message": f"{type(e).__name__}: {e}"},
+                })
+        job_id = f"local-{len(self._jobs) + 1}"
+        self._jobs[job_id] = results
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        return "completed" if job_id in self._jobs else "failed"
+
+    def download(self, job_id: str, output_path: str) -> str:
+        write_jsonl(output_path, self._jobs[job_id])
+        return output_path
+
+
+# ==========================
+# 3. ЗАПУСК И СКЛЕЙКА
+# ==========================
+
+def run_batch_job(
+    backend: BatchBackend,
+    requests_path: str,
+    output_path: str,
+    poll_interval: float = 30.0,
+    timeout: float = 24 * 3600,
+) -> List[Dict[str, Any]]:
+    job_id = backend.submit(requests_path)
+    print(f"Batch-задача {job_id} отправлена ({requests_path})")
+
+    started = time.monotonic()
+    while True:
+        state = backend.status(job_id)
+        if state == "completed":
+            break
+        if state == "failed":
+            raise RuntimeError(f"Batch-задача {job_id} завершилась с ошибкой")
+        if time.monotonic() - started > timeout:
+            raise TimeoutError(f"Batch-задача {job_id} не завершилась за {timeout} с")
+        time.sleep(poll_interval)
+
+    backend.download(job_id, output_path)
+    return read_jsonl(output_path)
+
+
+def _result_content(row: Dict[str, Any]) -> Optional[str]:
+    response = row.get("response") or {}
+    if row.get("error") or response.get("status_code", 200) != 200:
+        return None
+    try:
+        return response["body"]["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+@dataclass
+class JoinReport:
+    joined: int = 0
+    failed: int = 0
+    unparsed: int = 0
+
+
+def join_generation_results(
+    products: List[Dict[str, Any]],
+    results: List[Dict[str, Any]],
+) -> tuple[List[Dict[str, Any]], JoinReport]:
+    """
+    Возвращает по товару: {"product": исходная запись, "variants": {канал: [AdVariant как dict]}}.
+    """
+    report = JoinReport()
+    out = [{"product": p, "variants": {}} for p in products]
+    for row in results:
+        kind, key, channel = row["custom_id"].split(ID_SEP, 2)
+        if kind != "gen":
+            continue
+        content = _result_content(row)
+        if content is None:
+            report.failed += 1
+            continue
+        try:
+            raw = _extract_json_from_content(content).get("variants", [])
+        except Exception:
+            report.unparsed += 1
+            continue
+        variants = [
+            AdVariant(
+                channel=v.get("channel", channel),
+                headline=v.get("headline", ""),
+                text=v.get("text", ""),
+                cta=v.get("cta", ""),
+                notes=v.get("notes", ""),
+            ).__dict__
+            for v in raw
+        ]
+        out[int(key)]["variants"][channel] = variants
+        report.joined += 1
+    return out, report
+
+
+def join_evaluation_results(
+    results: List[Dict[str, Any]],
+) -> tuple[Dict[str, Dict[str, Dict[str, float]]], JoinReport]:
+    """Возвращает {ad_id: {сегмент: {"click_probability", "purchase_probability"}}}."""
+    report = JoinReport()
+    out: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for row in results:
+        kind, ad_id, segment = row["custom_id"].split(ID_SEP, 2)
+        if kind != "eval":
+            continue
+        content = _result_content(row)
+        if content is None:
+            report.failed += 1
+            continue
+        scores = parse_scores(content)
+        if scores is None:
+            report.unparsed += 1
+            continue
+        out.setdefault(ad_id, {})[segment] = scores
+        report.joined += 1
+    return out, report
+
+
+def ads_from_generation(joined: List[Dict[str, Any]]) -> Dict[str, str]:
+    """{ad_id: текст} для всех сгенерированных вариантов; ad_id = "<товар>.<канал>.<номер>"."""
+    ads = {}
+    for idx, item in enumerate(joined):
+        for channel, variants in item["variants"].items():
+            for n, v in enumerate(variants):
+                ads[f"{idx}.{channel}.{n}"] = _variant_to_ad_text(v)
+    return ads
+
+
+def _backend(name: str, for_generation: bool) -> BatchBackend:
+    if name == "local":
+        return LocalBatchBackend()
+    if name == "remote":
+        return MistralBatchBackend() if for_generation else OpenAIBatchBackend()
+    raise ValueError(f"Неизвестный backend: {name}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from feedback import persona_types
+
+    parser = argparse.ArgumentParser(description="Ночной batch-прогон: генерация и оценка по всему каталогу")
+    parser.add_argument("--catalog", default="products.json")
+    parser.add_argument("--backend", choices=["local", "remote"], default="local")
+    parser.add_argument("--out", default="batch_campaign.json")
+    parser.add_argument("--poll", type=float, default=30.0)
+    args = parser.parse_args()
+
+    with open(args.catalog, "r", encoding="utf-8") as f:
+        catalog = json.load(f)
+    if isinstance(catalog, dict):
+        catalog = [catalog]
+
+    write_jsonl("batch_generation.jsonl", build_generation_requests(catalog))
+    gen_rows = run_batch_job(_backend(args.backend, True), "batch_generation.jsonl", "batch_generation_out.jsonl", args.poll)
+    joined, gen_report = join_generation_results(catalog, gen_rows)
+    print("Генерация:", gen_report)
+
+    ads = ads_from_generation(joined)
+    write_jsonl("batch_evaluation.jsonl", build_evaluation_requests(ads, persona_types))
+    eval_rows = run_batch_job(_backend(args.backend, False), "batch_evaluation.jsonl", "batch_evaluation_out.jsonl", args.poll)
+    scores, eval_report = join_evaluation_results(eval_rows)
+    print("Оценка:", eval_report)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"products": joined, "ads": ads, "scores": scores}, f, ensure_ascii=False, indent=2)
+    print(f"Результат записан в {args.out}")
@@ -0,0 +1,587 @@
+"""
+Бенчмарки горячих путей на синтетических данных и локальных стенд-серверах.
+
+Что меряется:
+  catalog_payloads      — подготовка payload генерации для каждой записи каталога
+  extract_json          — prompt._extract_json_from_content на ответах LLM разной формы
+  generate_prompt_cold  — сериализация сегмента синтетических персон без кэша
+  generate_prompt_warm  — generate_prompt на прогретых кэшах сегментов
+  evaluate_ad_uncached  — main.evaluate_ad без кэша
+  evaluate_ad_cached    — попадание в кэш оценок (EvalCache.get_or_compute); эвристика
+                          main.evaluate_ad кэш обходит, он нужен дорогим оценщикам
+  analyzer_scoring      — ProductAnalyzer.score_product (нужен sentence_transformers или EMBED_SERVER)
+  semantic_eval_uncached — SemanticEvaluator по всем сегментам с кодированием каждого объявления e5
+                          (сквозная цифра: энкодер + матричное произведение; нужен энкодер, как выше)
+  semantic_eval_cached  — то же при эмбеддингах объявлений из кэша (только матричная часть)
+  e2e_campaign          — сквозной прогон против локальных стенд-серверов
+                          Mistral-совместимого LLM и Wordstat (с заданной задержкой)
+
+Результат — JSON с временем на элемент и пропускной способностью. Регрессия —
+превышение абсолютного бюджета THRESHOLDS_US или замедление относительно
+--baseline больше чем на --tolerance. Код возврата 1 — есть регрессии.
+
+Запуск:
+    python benchmark.py --scale small --out bench_results.json
+    python benchmark.py --scale small --baseline bench_baseline.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Размеры синтетических данных для каждого масштаба
+SCALES: Dict[str, Dict[str, int]] = {
+    "small": {"products": 1_000, "variants": 10_000, "personas": 200, "analyzer_products": 200, "e2e_products": 30,
+              "semantic_ads": 500},
+    "medium": {"products": 100_000, "variants": 10_000, "personas": 1_000, "analyzer_products": 1_000, "e2e_products": 200,
+               "semantic_ads": 2_000},
+    "large": {"products": 1_000_000, "variants": 10_000, "personas": 5_000, "analyzer_products": 2_000, "e2e_products": 1_000,
+              "semantic_ads": 10_000},
+}
+
+# Бюджет времени на один элемент, микросекунды. С запасом под медленные CI-машины.
+THRESHOLDS_US: Dict[str, float] = {
+    "catalog_payloads": 50,
+    "extract_json": 300,
+    "generate_prompt_cold": 200_000,
+    "generate_prompt_warm": 100,
+    "evaluate_ad_uncached": 100,
+    "evaluate_ad_cached": 100,
+    "semantic_eval_uncached": 50_000,   # кодирование e5 на CPU — основная часть
+    "semantic_eval_cached": 2_000,
+    "analyzer_scoring": 100_000,
+    "e2e_campaign": 500_000,
+}
+
+DEFAULT_TOLERANCE = 0.25
+
+SEGMENTS = ["low_income_pragmatic_youth", "health_wellness_enthusiasts", "financially_conservative_adults"]
+
+
+# ==========================
+# 1. СИНТЕТИЧЕСКИЕ ДАННЫЕ
+# ==========================
+
+_CATEGORIES = ["Электроника", "Одежда", "Напитки", "Коллекции", "Дом", "Спорт", "Красота"]
+_NOUNS = ["наушники", "кроссовки", "энергетик", "фигурка", "лампа", "коврик", "крем", "рюкзак", "часы"]
+_ADJ = ["новый", "яркий", "лёгкий", "премиальный", "компактный", "хитовый", "базовый"]
+_PHRASES = [
+    "Новинка сезона.", "Хит продаж.", "Отличный подарок.", "Быстрая доставка.",
+    "Проверенное качество.", "Скидка 20%.", "Лимитированная серия.", "Для всей семьи.",
+]
+
+
+def synthetic_catalog(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Каталог в формате products.json."""
+    rng = random.Random(seed)
+    catalog = []
+    for i in range(n):
+        price = rng.randint(100, 50_000)
+        catalog.append({
+            "category": rng.choice(_CATEGORIES),
+            "name": f"{rng.choice(_ADJ).capitalize()} {rng.choice(_NOUNS)} #{i}",
+            "description": " ".join(rng.sample(_PHRASES, 3)),
+            "price": price,
+            "market_cost": int(price * rng.uniform(0.2, 0.9)),
+        })
+    return catalog
+
+
+def synthetic_personas(per_segment: int, segments: List[str] = SEGMENTS, seed: int = 0) -> Dict[str, List[Dict]]:
+    """Персоны в формате categorized_personas.json."""
+    from persona_sampling import AGE_ORDER, SOCIAL_ORDER
+
+    rng = random.Random(seed)
+    interests = ["tech_gadgets", "gaming", "fitness", "fashion", "travel", "cooking", "finance", "beauty"]
+    behaviors = ["reacts_to_discounts", "impulsive_buyer", "brand_loyal", "reads_reviews", "price_comparer"]
+    channels = ["messenger_tg_whatsapp_wechat", "social_vk_instagram", "search_yandex_google", "email"]
+    result = {}
+    for segment in segments:
+        result[segment] = [
+            {
+                "id": f"{segment}_{i:05d}",
+                "age_range": rng.choice(AGE_ORDER),
+                "gender": rng.choice(["male", "female"]),
+                "social": rng.choice(SOCIAL_ORDER),
+                "interests": rng.sample(interests, rng.randint(1, 3)),
+                "behaviors": rng.sample(behaviors, rng.randint(1, 3)),
+                "preferred_channel": rng.choice(channels),
+                "price_sensitivity": round(rng.random(), 3),
+            }
+            for i in range(per_segment)
+        ]
+    return result
+
+
+def synthetic_ads(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    ads = []
+    for i in range(n):
+        noun = rng.choice(_NOUNS)
+        ads.append(
+            f"{rng.choice(_ADJ).capitalize()} {noun} №{i}\n"
+            f"{' '.join(rng.sample(_PHRASES, 3))}\n"
+            f"{rng.choice(['Купить', 'Заказать', 'Узнать больше'])}"
+        )
+    return ads
+
+
+def synthetic_llm_responses(n: int, seed: int = 0) -> List[str]:
+    """Ответы LLM в трёх формах, которые встречаются на практике: ```json```, JSON в тексте, чистый JSON."""
+    from prompt import MockLLMClient
+
+    rng = random.Random(seed)
+    variants = MockLLMClient().generate_variants({"product": {"name": "Товар"}, "channel": "telegram", "n_variants": 3})
+    body = json.dumps({"variants": [v.__dict__ for v in variants]}, ensure_ascii=False)
+    forms = [
+        lambda: f"Вот варианты:\n```json\n{body}\n```\nУдачи!",
+        lambda: f"Конечно! {body} Надеюсь, подойдёт.",
+        lambda: body,
+    ]
+    return [rng.choice(forms)() for _ in range(n)]
+
+
+# ==========================
+# 2. ЛОКАЛЬНЫЕ СТЕНД-СЕРВЕРЫ
+# ==========================
+
+def _standin_app(llm_latency: float, wordstat_latency: float):
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    from batch_jobs import ID_SEP, local_stub_handler
+
+    async def chat_completions(request: Request) -> JSONResponse:
+        body = await request.json()
+        await asyncio.sleep(llm_latency)
+        content = local_stub_handler(f"gen{ID_SEP}0{ID_SEP}bench", body)
+        prompt_chars = sum(len(m["content"]) for m in body["messages"])
+        return JSONResponse({
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4},
+        })
+
+    async def top_requests(request: Request) -> JSONResponse:
+        body = await request.json()
+        await asyncio.sleep(wordstat_latency)
+        phrase = body.get("phrase", "")
+        count = sum(map(ord, phrase)) % 10_000
+        return JSONResponse({"topRequests": [{"phrase": phrase, "count": count}]})
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/v1/topRequests", top_requests, methods=["POST"]),
+    ])
+
+
+class StandinServer:
+    """Mistral-совместимый LLM и Wordstat на 127.0.0.1, в фоновом потоке."""
+
+    def __init__(self, llm_latency: float = 0.05, wordstat_latency: float = 0.02):
+        self.app = _standin_app(llm_latency, wordstat_latency)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self.port = self._sock.getsockname()[1]
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "StandinServer":
+        import uvicorn
+
+        config = uvicorn.Config(self.app, log_level="error", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [self._sock]}, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Стенд-сервер не запустился")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+        self._sock.close()
+
+
+# ==========================
+# 3. БЕНЧМАРКИ
+# ==========================
+
+def _best_of(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _result(n: int, seconds: float, **extra: Any) -> Dict[str, Any]:
+    return {
+        "n": n,
+        "seconds": round(seconds, 6),
+        "per_item_us": round(seconds / n * 1e6, 3) if n else 0.0,
+        "throughput_per_s": round(n / seconds, 1) if seconds else 0.0,
+        **extra,
+    }
+
+
+def bench_catalog_payloads(catalog: List[Dict], repeat: int) -> Dict[str, Any]:
+    from campaign import build_payload_for_record
+
+    seconds = _best_of(lambda: [build_payload_for_record(r, "") for r in catalog], repeat)
+    return _result(len(catalog), seconds)
+
+
+def bench_extract_json(responses: List[str], repeat: int) -> Dict[str, Any]:
+    from prompt import _extract_json_from_content
+
+    seconds = _best_of(lambda: [_extract_json_from_content(r) for r in responses], repeat)
+    return _result(len(responses), seconds)
+
+
+def bench_generate_prompt(personas_per_segment: int, ads: List[str], repeat: int) -> Dict[str, Dict[str, Any]]:
+    import feedback_helper
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "personas.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(synthetic_personas(personas_per_segment), f, ensure_ascii=False)
+
+        original_path = feedback_helper.personas_path
+        feedback_helper.personas_path = path
+        caches = [
+            feedback_helper.get_personas,
+            feedback_helper._segment_counts,
+            feedback_helper._aggregate_block,
+            feedback_helper._table_rows,
+            feedback_helper._json_block,
+        ]
+        try:
+            def cold() -> None:
+                for segment in SEGMENTS:
+                    for cache in caches:
+                        cache.cache_clear()
+                    feedback_helper.get_personas()  # чтение файла не входит в замер
+                    t0 = time.perf_counter()
+                    feedback_helper.generate_prompt(ads[0], [segment])
+                    cold_times.append(time.perf_counter() - t0)
+
+            cold_times: List[float] = []
+            for _ in range(repeat):
+                cold()
+            cold_seconds = min(sum(cold_times[i:i + len(SEGMENTS)]) for i in range(0, len(cold_times), len(SEGMENTS)))
+
+            warm_seconds = _best_of(
+                lambda: [feedback_helper.generate_prompt(ad, [SEGMENTS[i % len(SEGMENTS)]]) for i, ad in enumerate(ads)],
+                repeat,
+            )
+        finally:
+            feedback_helper.personas_path = original_path
+            for cache in caches:
+                cache.cache_clear()
+
+    return {
+        "generate_prompt_cold": _result(len(SEGMENTS), cold_seconds, personas_per_segment=personas_per_segment),
+        "generate_prompt_warm": _result(len(ads), warm_seconds),
+    }
+
+
+def bench_evaluate_ad(ads: List[str], repeat: int) -> Dict[str, Dict[str, Any]]:
+    from eval_cache import EvalCache
+    from main import EVALUATOR_VERSION, _compute, evaluate_ad
+
+    pairs = [(ad, SEGMENTS[i % len(SEGMENTS)]) for i, ad in enumerate(ads)]
+    uncached = _best_of(lambda: [evaluate_ad(a, s, use_cache=False) for a, s in pairs], repeat)
+
+    cache = EvalCache(max_size=len(pairs) + 1)
+    for a, s in pairs:
+        cache.get_or_compute(a, s, EVALUATOR_VERSION, lambda: _compute(a, s))
+    cached = _best_of(
+        lambda: [cache.get_or_compute(a, s, EVALUATOR_VERSION, lambda: _compute(a, s)) for a, s in pairs], repeat
+    )
+
+    return {
+        "evaluate_ad_uncached": _result(len(pairs), uncached),
+        "evaluate_ad_cached": _result(len(pairs), cached),
+    }
+
+
+def _encoder_available() -> bool:
+    # с EMBED_SERVER модель живёт в общем сервере эмбеддингов, локальная не нужна
+    if os.getenv("EMBED_SERVER"):
+        return True
+    try:
+        import sentence_transformers  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_NO_ENCODER = "sentence_transformers не установлен и EMBED_SERVER не задан"
+
+
+def _load_analyzer() -> Tuple[Any, Optional[str]]:
+    """(ProductAnalyzer, None) или (None, причина, по которой модель недоступна)."""
+    if not _encoder_available():
+        return None, _NO_ENCODER
+    from productAnalyzer import ProductAnalyzer
+
+    try:
+        return ProductAnalyzer(), None
+    except OSError as e:
+        # модель не скачана и хаб недоступен
+        return None, f"модель энкодера не загружена: {str(e).splitlines()[0]}"
+
+
+def bench_semantic_eval(ads: List[str], repeat: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Оценка объявлений по всем сегментам персон. uncached — с пустым кэшем эмбеддингов
+    объявлений на каждом повторе, то есть с кодированием e5: это и есть пропускная
+    способность оценщика на новых объявлениях. cached — только матричная часть.
+    """
+    if not _encoder_available():
+        skipped = {"skipped": _NO_ENCODER}
+        return {"semantic_eval_uncached": skipped, "semantic_eval_cached": dict(skipped)}
+    from semantic_eval import SemanticEvaluator
+
+    t0 = time.perf_counter()
+    try:
+        evaluator = SemanticEvaluator()
+    except OSError as e:
+        # модель не скачана и хаб недоступен
+        skipped = {"skipped": f"модель энкодера не загружена: {str(e).splitlines()[0]}"}
+        return {"semantic_eval_uncached": skipped, "semantic_eval_cached": dict(skipped)}
+    setup_seconds = time.perf_counter() - t0
+    segments = list(evaluator.segments)
+    evaluator.score_matrix(ads[:8], segments)   # прогрев модели, вне замера
+
+    def uncached():
+        evaluator._ad_cache.clear()
+        evaluator.score_matrix(ads, segments)
+
+    uncached_seconds = _best_of(uncached, repeat)
+    evaluator.score_matrix(ads, segments)
+    cached_seconds = _best_of(lambda: evaluator.score_matrix(ads, segments), repeat)
+    return {
+        "semantic_eval_uncached": _result(
+            len(ads), uncached_seconds, segments=len(segments), setup_s=round(setup_seconds, 3)
+        ),
+        "semantic_eval_cached": _result(len(ads), cached_seconds, segments=len(segments)),
+    }
+
+
+def bench_analyzer_scoring(analyzer, catalog: List[Dict], skip_reason: Optional[str] = None) -> Dict[str, Any]:
+    if analyzer is None:
+        return {"skipped": skip_reason or _NO_ENCODER}
+    t0 = time.perf_counter()
+    for p in catalog:
+        analyzer.score_product(p, {"topRequests": [{"count": 100}]})
+    return _result(len(catalog), time.perf_counter() - t0)
+
+
+def bench_e2e_campaign(
+    analyzer,
+    catalog: List[Dict],
+    llm_latency: float,
+    wordstat_latency: float,
+    skip_reason: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Сквозной прогон с реальными MistralClient и запросами к Wordstat, но против
+    локальных стенд-серверов. Без модели эмбеддингов — генерация и оценка всего
+    каталога через campaign.run_campaign (режим "generate+evaluate", причина — в
+    analyzer_skipped).
+    """
+    import productAnalyzer
+    import prompt
+    from main import evaluate_ad
+    from scheduler import call_context
+
+    with StandinServer(llm_latency, wordstat_latency) as server:
+        saved = (prompt.MISTRAL_API_URL, productAnalyzer.WORDSTAT_URL, os.environ.get("MISTRAL_API_KEY"))
+        prompt.MISTRAL_API_URL = f"{server.url}/v1/chat/completions"
+        productAnalyzer.WORDSTAT_URL = f"{server.url}/v1/topRequests"
+        os.environ.setdefault("MISTRAL_API_KEY", "standin")
+        try:
+            # стенд-серверы не ограничены — корзины scheduler измеряли бы лимиты, а не код
+            with call_context(rate_limited=False):
+                generator = prompt.AdGenerator(prompt.MistralClient())
+                t0 = time.perf_counter()
+                if analyzer is not None:
+                    from pipeline import run_campaign_pipeline
+
+                    campaign_json = asyncio.run(run_campaign_pipeline(
+                        catalog, analyzer=analyzer, generator=generator, segments=SEGMENTS,
+                        top_n=None, rate_limited=False,
+                    ))
+                    mode = "pipeline"
+                    errors = len(campaign_json["errors"])
+                else:
+                    from campaign import run_campaign
+
+                    run = run_campaign(catalog, "", generator)
+                    for result in run["results"].values():
+                        for v in result.get("variants", []):
+                            for segment in SEGMENTS:
+                                evaluate_ad(prompt._variant_to_ad_text(v), segment)
+                    mode = "generate+evaluate"
+                    errors = len(run["errors"])
+                seconds = time.perf_counter() - t0
+        finally:
+            prompt.MISTRAL_API_URL, productAnalyzer.WORDSTAT_URL = saved[0], saved[1]
+            if saved[2] is None:
+                os.environ.pop("MISTRAL_API_KEY", None)
+
+    extra = {"analyzer_skipped": skip_reason or _NO_ENCODER} if analyzer is None else {}
+    return _result(
+        len(catalog), seconds, mode=mode, errors=errors,
+        llm_latency_s=llm_latency, wordstat_latency_s=wordstat_latency, **extra,
+    )
+
+
+# ==========================
+# 4. ЗАПУСК И РЕГРЕССИИ
+# ==========================
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(
+    scale: str = "small",
+    repeat: int = 3,
+    only: Optional[List[str]] = None,
+    llm_latency: float = 0.05,
+    wordstat_latency: float = 0.02,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    sizes = SCALES[scale]
+    wanted = lambda name: not only or any(name.startswith(o) for o in only)  # noqa: E731
+
+    catalog = synthetic_catalog(sizes["products"], seed)
+    ads = synthetic_ads(sizes["variants"], seed)
+    results: Dict[str, Dict[str, Any]] = {}
+
+    if wanted("catalog_payloads"):
+        results["catalog_payloads"] = bench_catalog_payloads(catalog, repeat)
+    if wanted("extract_json"):
+        results["extract_json"] = bench_extract_json(synthetic_llm_responses(sizes["variants"], seed), repeat)
+    if wanted("generate_prompt"):
+        results.update(bench_generate_prompt(sizes["personas"], ads, repeat))
+    if wanted("evaluate_ad"):
+        results.update(bench_evaluate_ad(ads, repeat))
+
+    if wanted("semantic_eval"):
+        results.update(bench_semantic_eval(ads[: sizes["semantic_ads"]], repeat))
+
+    analyzer, skip_reason = None, None
+    if wanted("analyzer_scoring") or wanted("e2e_campaign"):
+        analyzer, skip_reason = _load_analyzer()
+    if wanted("analyzer_scoring"):
+        results["analyzer_scoring"] = bench_analyzer_scoring(
+            analyzer, catalog[: sizes["analyzer_products"]], skip_reason
+        )
+    if wanted("e2e_campaign"):
+        results["e2e_campaign"] = bench_e2e_campaign(
+            analyzer, catalog[: sizes["e2e_products"]], llm_latency, wordstat_latency, skip_reason
+        )
+
+    return {
+        "meta": {
+            "scale": scale,
+            "sizes": sizes,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def find_regressions(
+    report: Dict[str, Any],
+    baseline: Optional[Dict[str, Any]] = None,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    regressions = []
+    base_results = (baseline or {}).get("results", {})
+    for name, res in report["results"].items():
+        if "per_item_us" not in res:
+            continue
+        budget = THRESHOLDS_US.get(name)
+        if budget is not None and res["per_item_us"] > budget:
+            regressions.append(f"{name}: {res['per_item_us']} мкс/элемент > бюджета {budget}")
+        base = base_results.get(name, {})
+        if "per_item_us" in base and base["per_item_us"] > 0:
+            slowdown = res["per_item_us"] / base["per_item_us"] - 1
+            if slowdown > tolerance:
+                regressions.append(
+                    f"{name}: медленнее baseline на {slowdown:.0%} "
+                    f"({res['per_item_us']} против {base['per_item_us']} мкс/элемент)"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки GENAI-4")
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="*", help="префиксы имён бенчмарков")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="задержка стенд-LLM, с")
+    parser.add_argument("--wordstat-latency", type=float, default=0.02, help="задержка стенд-Wordstat, с")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.scale, args.repeat, args.only, args.llm_latency, args.wordstat_latency)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    report["regressions"] = find_regressions(report, baseline, args.tolerance)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"{'БЕНЧМАРК':<24} | {'N':>8} | {'мкс/элемент':>12} | {'в секунду':>10}")
+    print("-" * 64)
+    for name, res in report["results"].items():
+        if "skipped" in res:
+            print(f"{name:<24} | пропущен: {res['skipped']}")
+            continue
+        print(f"{name:<24} | {res['n']:>8} | {res['per_item_us']:>12} | {res['throughput_per_s']:>10}")
+    for r in report["regressions"]:
+        print("РЕГРЕССИЯ:", r)
+    return 1 if report["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Генерация креативов по каталогу без привязки к интерфейсу.
+
+Используется веб-приложением (webapp.py), фоновыми воркерами очереди задач
+(jobqueue.py) и всем, что запускает генерацию вне Streamlit.
+"""
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from journal import Journal, work_id
+from prompt import AdGenerator
+from sinks import PART_SUFFIX, NdjsonSink, read_ndjson
+
+# Параллельных запросов к LLM по умолчанию
+MAX_WORKERS = 8
+PLACEHOLDER_IMAGE_URL = "https://i.imgur.com/ilo8Prn.jpeg"
+
+
+class EmptyGenerationError(RuntimeError):
+    """LLM ответил, но ни одного варианта не разобрано."""
+
+
+def parse_products_json(data: Any) -> List[Dict]:
+    if isinstance(data, dict):
+        return [data]
+    elif isinstance(data, list):
+        return data
+    else:
+        raise ValueError("Ожидался объект JSON или список объектов JSON.")
+
+
+def build_payload_for_record(record: Dict, user_text: str) -> Tuple[Dict[str, Any], Dict[str, Any], str]:
+    """Запись каталога (или готовый input_json) → (payload для AdGenerator, product, channel)."""
+    if "product" in record:
+        product = record.get("product", {}) or {}
+        audience = record.get("audience_profile", {}) or {}
+        channel = record.get("channel", "telegram")
+        trends = record.get("trends", [])
+        n_variants = record.get("n_variants", 3)
+    else:
+        product = {
+            "name": record.get("name", ""),
+            "category": record.get("category", ""),
+            "price": record.get("price"),
+            "margin": "высокая" if (record.get("price") or 0) > (record.get("market_cost") or 0) * 1.5 else "средняя",
+            "tags": record.get("tags", []),
+            "features": [record.get("description", "")]
+        }
+        audience = {
+            "age_range": "20-35",
+            "interests": ["гаджеты", "технологии"],
+            "behavior": ["реагирует на скидки"]
+        }
+        channel = "telegram"
+        trends = ["минимализм", "FOMO"]
+        n_variants = 3
+
+    payload = {
+        "product": product,
+        "audience_profile": audience,
+        "channel": channel,
+        "trends": trends,
+        "n_variants": n_variants,
+    }
+
+    if user_text.strip():
+        if "user_instructions" not in payload:
+            payload["user_instructions"] = user_text.strip()
+
+    return payload, product, channel
+
+
+def generate_variants(generator: AdGenerator, payload: Dict[str, Any], return_human_texts: bool = True) -> Dict[str, Any]:
+    """
+    generate_from_json_dict, но пустой результат — ошибка. Так его journal.run
+    записывает как failed, а не done: повтор снова идёт в LLM, а не отдаёт пустоту.
+    """
+    result = generator.generate_from_json_dict(payload, return_human_texts=return_human_texts)
+    if not result.get("variants"):
+        raise EmptyGenerationError("LLM не вернул ни одного варианта")
+    return result
+
+
+def remember_variants(generator: AdGenerator, payload: Dict[str, Any], variants: List[Dict[str, Any]]) -> None:
+    """
+    Варианты кампании — в индекс креативов генератора (GENAI4_RAG=1): webapp и очередь
+    задач пополняют примеры для следующих генераций, а не только читают их.
+    У товара каталога нет своего сегмента, поэтому вариант оценивается по всем сегментам
+    локальным оценщиком (main.evaluate_ads) и записывается с лучшим из них. Варианты,
+    которые уже в индексе (повтор из журнала, одинаковый ответ LLM), не оцениваются.
+    """
+    index = getattr(generator, "index", None)
+    if index is None:
+        return
+    variants = [v for v in variants if not index.contains(v)]
+    if not variants:
+        return
+    from feedback import persona_types
+    from main import evaluate_ads
+    from prompt import _remember, _variant_to_ad_text
+
+    product = payload.get("product") or {}
+    evaluated = []
+    for v in variants:
+        scores = evaluate_ads([(_variant_to_ad_text(v), segment) for segment in persona_types])
+        best = max(range(len(persona_types)), key=lambda i: scores[i].get("click_probability", 0.0))
+        evaluated.append({
+            "variant": v, "scores": scores[best], "category": product.get("category", ""),
+            "segment": persona_types[best], "product": product.get("name", ""),
+        })
+    _remember(index, evaluated)
+
+
+def generate_for_record(
+    record: Dict,
+    user_text: str,
+    generator: AdGenerator,
+    journal: Optional[Journal] = None,
+) -> Dict[str, Any]:
+    """
+    Генерирует креативы через LLM API для одного товара.
+    С журналом уже сгенерированный payload берётся из него без вызова LLM.
+    """
+    payload, product, channel = build_payload_for_record(record, user_text)
+    try:
+        if journal is not None:
+            result = journal.run(work_id("generate", payload), "generate", lambda: generate_variants(generator, payload))
+        else:
+            result = generate_variants(generator, payload)
+    except EmptyGenerationError:
+        return {
+            "text": "❌ Не удалось сгенерировать креативы. Попробуйте еще раз.",
+            "image_url": PLACEHOLDER_IMAGE_URL,
+            "product": product,
+        }
+    remember_variants(generator, payload, result["variants"])
+
+    return {
+        "variants": result["variants"],
+        "channel": channel,
+        "image_url": PLACEHOLDER_IMAGE_URL,
+        "product": product,
+    }
+
+
+def generate_catalog(
+    records: List[Dict],
+    user_text: str,
+    generator: AdGenerator,
+    max_workers: int = MAX_WORKERS,
+    journal: Optional[Journal] = None,
+) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Генерирует креативы для всех записей пулом из max_workers потоков.
+    Отдаёт (индекс записи, результат, ошибка) по мере готовности, не в порядке каталога.
+
+    Отмена: если генератор закрыть (close() или выход из with closing(...)),
+    ещё не начатые задачи снимаются с очереди, новые запросы к LLM не уходят.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="genai4-gen")
+    try:
+        futures = {
+            # копия контекста — приоритет и арендатор scheduler доходят до потоков пула
+            executor.submit(
+                contextvars.copy_context().run, generate_for_record, record, user_text, generator, journal
+            ): idx
+            for idx, record in enumerate(records)
+        }
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                yield idx, future.result(), None
+            except Exception as e:
+                yield idx, None, str(e)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_campaign(
+    records: List[Dict],
+    user_text: str,
+    generator: AdGenerator,
+    max_workers: int = MAX_WORKERS,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    should_cancel: Optional[Callable[[], bool]] = None,
+    journal: Optional[Journal] = None,
+    sink: Optional[NdjsonSink] = None,
+) -> Dict[str, Any]:
+    """
+    Прогон по всему каталогу без интерфейса. Формат результата тот же,
+    что webapp держит в session_state:
+    {"total": N, "results": {индекс: результат}, "errors": {индекс: текст}, "done": bool, "failed": int}
+    done=False — прогон отменён через should_cancel. failed — товары с ошибкой или без
+    единого варианта (их повторный прогон снова пойдёт в LLM).
+    journal — возобновление: товары, уже сгенерированные в прошлых запусках, не идут в LLM.
+    sink — результаты пишутся в NDJSON по мере готовности ({"index", "result"} или
+    {"index", "error"}) и в памяти не копятся: results/errors остаются пустыми,
+    в run["output"] — путь файла (прочитать — load_run_output). Закрывает sink вызывающий.
+    """
+    run: Dict[str, Any] = {"total": len(records), "results": {}, "errors": {}, "done": False, "failed": 0}
+    if sink is not None:
+        run["output"] = sink.path
+    finished = 0
+    stream = generate_catalog(records, user_text, generator, max_workers=max_workers, journal=journal)
+    try:
+        for idx, res, err in stream:
+            if err is not None or "variants" not in res:
+                run["failed"] += 1
+            if sink is not None:
+                sink.write({"index": idx, "error": err} if err is not None else {"index": idx, "result": res})
+            elif err is not None:
+                run["errors"][idx] = err
+            else:
+                run["results"][idx] = res
+            finished += 1
+            if on_progress is not None:
+                on_progress(finished, run["total"])
+            if should_cancel is not None and should_cancel():
+                return run
+    finally:
+        stream.close()
+    run["done"] = True
+    return run
+
+
+def load_run_output(run: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    run-словарь с потоковым выводом (run["output"]) → обычный, с results/errors в памяти.
+    Если прогон не завершён и итогового файла ещё нет, читается частичный .part.
+    """
+    path = run.get("output")
+    if not path:
+        return run
+    if not os.path.exists(path) and os.path.exists(path + PART_SUFFIX):
+        path += PART_SUFFIX
+    if not os.path.exists(path):
+        return run
+    run = {**run, "results": {}, "errors": {}}
+    for line in read_ndjson(path):
+        if "error" in line:
+            run["errors"][line["index"]] = line["error"]
+        else:
+            run["results"][line["index"]] = line["result"]
+    return run
@@ -0,0 +1,83 @@
+"""
+Проверка времени импорта модулей (бюджет холодного старта CLI и воркеров Streamlit).
+
+Для каждого модуля запускает отдельный процесс `python -X importtime -c "import <модуль>"`,
+берёт накопленное время импорта самого модуля и сравнивает с бюджетом.
+Дополнительно проверяет, что при импорте не подтянулись тяжёлые пакеты
+(openai, torch, sentence_transformers, ...) — они должны грузиться лениво.
+
+Запуск:  python check_import_time.py        (код возврата 1 — бюджет превышен)
+"""
+from __future__ import annotations
+
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Бюджет накопленного времени импорта, мс. Щедрый запас на медленные CI-машины:
+# после ленивой инициализации эти модули импортируются за десятки миллисекунд,
+# а загрузка openai/torch при импорте — это сотни миллисекунд и секунды.
+IMPORT_BUDGET_MS: Dict[str, float] = {
+    "main": 150,
+    "feedback_helper": 150,
+    "prompt": 200,
+    "feedback": 250,
+    "productAnalyzer": 250,
+    "metrics": 50,
+}
+
+# Пакеты, которые не должны загружаться просто от импорта модулей проекта
+FORBIDDEN_AT_IMPORT = (
+    "openai",
+    "httpx",
+    "dotenv",
+    "torch",
+    "sentence_transformers",
+    "numpy",
+)
+
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str) -> Tuple[float, List[str]]:
+    """Возвращает (накопленное время импорта модуля в мс, список загруженных запрещённых пакетов)."""
+    code = (
+        f"import sys; import {module}; "
+        f"print(','.join(m for m in {FORBIDDEN_AT_IMPORT!r} if m in sys.modules))"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{proc.stderr[-2000:]}")
+
+    cumulative_us = None
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m and m.group(4) == module and len(m.group(3)) == 1:
+            cumulative_us = int(m.group(2))
+    if cumulative_us is None:
+        raise RuntimeError(f"Нет строки importtime для {module}")
+
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return cumulative_us / 1000.0, loaded
+
+
+def main() -> int:
+    failed = False
+    print(f"{'МОДУЛЬ':<18} | {'ВРЕМЯ, мс':>9} | {'БЮДЖЕТ':>6} | ТЯЖЁЛЫЕ ПАКЕТЫ")
+    print("-" * 60)
+    for module, budget in IMPORT_BUDGET_MS.items():
+        ms, loaded = measure(module)
+        ok = ms <= budget and not loaded
+        failed |= not ok
+        mark = "" if ok else "  <-- FAIL"
+        print(f"{module:<18} | {ms:>9.1f} | {budget:>6.0f} | {', '.join(loaded) or '-'}{mark}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,447 @@
+"""
+Локальный векторный индекс прошлых креативов для генерации с примерами (RAG few-shot).
+
+Каждый вызов AdGenerator начинался «с нуля», и generate_and_optimize_ad тратил
+несколько итераций, пока модель не находила текст, который хорошо оценивается.
+Индекс хранит все оценённые AdVariant с каналом, категорией, сегментом и оценками;
+при генерации из него достаются самые похожие на товар победители
+(click_probability ≥ WINNER_MIN_CLICK) и уходят в payload как examples.
+
+Хранение (каталог CREATIVE_INDEX_DIR, по умолчанию creative_index/):
+    index.json   — размерность эмбеддингов
+    vectors.i8   — эмбеддинги подряд: масштаб float32 + int8 на компоненту
+                   (768 измерений → 772 байта на креатив)
+    meta.jsonl   — по строке на креатив, в том же порядке
+Запись только дописыванием; недописанный при падении хвост отрезается при открытии.
+В памяти — только смещения строк meta, номера строк по каналу/категории и оценки; векторы
+читаются через memmap, поэтому миллионы креативов не требуют миллионов dict.
+
+Поиск — полный перебор скалярных произведений (с квантованием int8), но только
+среди кандидатов нужного канала и категории с достаточной оценкой: на миллионе
+креативов это десятки тысяч строк, которые просматриваются блоками.
+
+Замер выигрыша по итерациям до порога:
+    python creative_index.py measure --catalog products.json --limit 40
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+from eval_cache import normalize_ad_text
+
+try:
+    import fcntl
+except ImportError:  # Windows: между процессами не блокируем, пишет один процесс
+    fcntl = None
+
+INDEX_DIR = os.getenv("CREATIVE_INDEX_DIR", "creative_index")
+WINNER_MIN_CLICK = 0.6   # креатив с такой оценкой клика годится в примеры
+FEW_SHOT_K = 3           # сколько примеров класть в payload
+SCAN_CHUNK = 65_536      # строк за один блок скалярных произведений
+
+
+def _row_dtype(dim: int) -> np.dtype:
+    return np.dtype([("scale", "<f4"), ("q", "i1", (dim,))])
+
+
+def _quantize(vectors: np.ndarray) -> np.ndarray:
+    """int8 с масштабом на строку: вдвое компактнее float16 и быстрее разворачивается в float32."""
+    rows = np.empty(len(vectors), dtype=_row_dtype(vectors.shape[1]))
+    scale = np.abs(vectors).max(axis=1) / 127
+    scale[scale == 0] = 1.0
+    rows["scale"] = scale
+    rows["q"] = np.rint(vectors / scale[:, None])
+    return rows
+
+
+def _ad_text(variant: Dict[str, Any]) -> str:
+    return f"{variant.get('headline', '')}\n{variant.get('text', '')}\n{variant.get('cta', '')}"
+
+
+def _query_text(input_json: Dict[str, Any]) -> str:
+    p = input_json.get("product", {}) or {}
+    parts = [p.get("name", ""), p.get("category", "")]
+    parts += list(p.get("tags") or []) + list(p.get("features") or [])
+    return ". ".join(str(x) for x in parts if x)
+
+
+def _fingerprint(channel: str, ad_text: str) -> int:
+    digest = hashlib.sha1(f"{channel}\x00{normalize_ad_text(ad_text)}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+class CreativeIndex:
+    def __init__(self, path: str = INDEX_DIR, encoder=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._encoder = encoder
+        self._lock = threading.Lock()
+        self._meta_path = os.path.join(path, "meta.jsonl")
+        self._vec_path = os.path.join(path, "vectors.i8")
+        self._info_path = os.path.join(path, "index.json")
+        self.dim: Optional[int] = None
+        if os.path.exists(self._info_path):
+            with open(self._info_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+        self._offsets: List[int] = []
+        self._click: List[float] = []
+        self._rows_by_channel: Dict[str, List[int]] = {}
+        self._rows_by_key: Dict[Tuple[str, str], List[int]] = {}
+        self._seen: set = set()
+        self._disk: Optional[np.memmap] = None
+        self._fresh: List[np.void] = []
+        self._click_np: Optional[np.ndarray] = None
+        self._load()
+
+    # --- загрузка ---
+
+    def _load(self) -> None:
+        if not os.path.exists(self._meta_path):
+            return
+        n_vec = 0
+        if self.dim and os.path.exists(self._vec_path):
+            n_vec = os.path.getsize(self._vec_path) // _row_dtype(self.dim).itemsize
+        offset = 0
+        with open(self._meta_path, "rb") as f:
+            for raw in f:
+                if len(self._offsets) >= n_vec or not raw.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(raw)
+                except json.JSONDecodeError:
+                    break
+                self._index_entry(entry, offset)
+                offset += len(raw)
+        # хвост, недописанный при падении, отрезаем — иначе векторы и meta разъедутся
+        n = len(self._offsets)
+        if os.path.getsize(self._meta_path) != offset:
+            with open(self._meta_path, "r+b") as f:
+                f.truncate(offset)
+        if self.dim and os.path.exists(self._vec_path):
+            size = n * _row_dtype(self.dim).itemsize
+            if os.path.getsize(self._vec_path) != size:
+                with open(self._vec_path, "r+b") as f:
+                    f.truncate(size)
+        if n:
+            self._disk = np.memmap(self._vec_path, dtype=_row_dtype(self.dim), mode="r", shape=(n,))
+
+    def _index_entry(self, entry: Dict[str, Any], offset: int) -> None:
+        row = len(self._offsets)
+        self._offsets.append(offset)
+        self._click.append(float(entry.get("scores", {}).get("click_probability", 0.0)))
+        channel, category = entry.get("channel", ""), entry.get("category", "")
+        self._rows_by_channel.setdefault(channel, []).append(row)
+        self._rows_by_key.setdefault((channel, category), []).append(row)
+        fp = entry.get("fp")
+        self._seen.add(fp if fp is not None else _fingerprint(channel, _ad_text(entry)))
+
+    # --- эмбеддинги ---
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            from embedding_client import get_encoder
+
+            self._encoder = get_encoder()
+        return self._encoder
+
+    def _encode(self, texts: Sequence[str]) -> np.ndarray:
+        emb = self.encoder.encode(list(texts), convert_to_tensor=False, normalize_embeddings=True)
+        return np.asarray(emb, dtype=np.float32)
+
+    # --- запись ---
+
+    def contains(self, variant: Dict[str, Any]) -> bool:
+        """Вариант с тем же каналом и текстом уже в индексе — add_many его пропустит."""
+        return _fingerprint(variant.get("channel", ""), _ad_text(variant)) in self._seen
+
+    def add_many(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        records — dict с ключами variant, category, segment, scores и необязательным product.
+        Повторы (тот же канал и текст) пропускаются. Возвращает число добавленных.
+        """
+        fresh, batch_seen = [], set()
+        for r in records:
+            v = r["variant"]
+            channel = v.get("channel", "")
+            fp = _fingerprint(channel, _ad_text(v))
+            if fp in self._seen or fp in batch_seen:
+                continue
+            batch_seen.add(fp)
+            fresh.append({
+                "channel": channel,
+                "category": r.get("category", ""),
+                "segment": r.get("segment", ""),
+                "product": r.get("product", ""),
+                "headline": v.get("headline", ""),
+                "text": v.get("text", ""),
+                "cta": v.get("cta", ""),
+                "scores": r.get("scores", {}),
+                "ts": time.time(),
+                "fp": fp,
+            })
+        if not fresh:
+            return 0
+
+        vectors = self._encode([f"passage: {_ad_text(e)}" for e in fresh])
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self._info_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Размерность эмбеддингов {vectors.shape[1]} не совпадает с индексом ({self.dim})")
+
+            lines = [(json.dumps(e, ensure_ascii=False) + "\n").encode("utf-8") for e in fresh]
+            with open(self._vec_path, "ab") as vf, open(self._meta_path, "ab") as mf:
+                if fcntl is not None:
+                    fcntl.flock(mf, fcntl.LOCK_EX)
+                try:
+                    # сначала векторы, потом meta: строка meta без вектора не появится
+                    quantized = _quantize(vectors)
+                    vf.write(quantized.tobytes())
+                    vf.flush()
+                    offset = mf.seek(0, os.SEEK_END)
+                    mf.write(b"".join(lines))
+                    mf.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(mf, fcntl.LOCK_UN)
+            for e, line, vec in zip(fresh, lines, quantized):
+                self._index_entry(e, offset)
+                self._fresh.append(vec)
+                offset += len(line)
+            self._click_np = None
+        return len(fresh)
+
+    def add(self, variant: Dict[str, Any], scores: Dict[str, float], category: str = "", segment: str = "", product: str = "") -> bool:
+        record = {"variant": variant, "scores": scores, "category": category, "segment": segment, "product": product}
+        return self.add_many([record]) == 1
+
+    # --- поиск ---
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _similarities(self, rows: np.ndarray, q: np.ndarray) -> np.ndarray:
+        n_disk = 0 if self._disk is None else self._disk.shape[0]
+        if rows.size and rows[-1] < n_disk:
+            packed = self._disk[rows]
+        else:
+            packed = np.empty(rows.size, dtype=_row_dtype(self.dim))
+            on_disk = rows < n_disk
+            if on_disk.any():
+                packed[on_disk] = self._disk[rows[on_disk]]
+            for i in np.flatnonzero(~on_disk):
+                packed[i] = self._fresh[rows[i] - n_disk]
+        return (packed["q"].astype(np.float32) @ q) * packed["scale"]
+
+    def _candidates(self, channel: Optional[str], category: Optional[str], min_click: float) -> np.ndarray:
+        if channel is not None and category is not None:
+            rows = self._rows_by_key.get((channel, category), [])
+        elif channel is not None:
+            rows = self._rows_by_channel.get(channel, [])
+        else:
+            rows = range(len(self._offsets))
+        rows = np.fromiter(rows, dtype=np.int64)
+        if self._click_np is None or self._click_np.size != len(self._click):
+            self._click_np = np.array(self._click, dtype=np.float32)
+        return rows[self._click_np[rows] >= min_click]
+
+    def _read_meta(self, row: int) -> Dict[str, Any]:
+        with open(self._meta_path, "rb") as f:
+            f.seek(self._offsets[row])
+            return json.loads(f.readline())
+
+    def search(
+        self,
+        query: str,
+        k: int = FEW_SHOT_K,
+        channel: Optional[str] = None,
+        category: Optional[str] = None,
+        min_click: float = WINNER_MIN_CLICK,
+    ) -> List[Dict[str, Any]]:
+        """Ближайшие к query креативы; нет ничего в категории — ищем по всему каналу."""
+        with self._lock:
+            rows = self._candidates(channel, category, min_click)
+            if rows.size == 0 and category is not None:
+                rows = self._candidates(channel, None, min_click)
+            if rows.size == 0:
+                return []
+            q = self._encode([f"query: {query}"])[0]
+
+            best_rows = np.empty(0, dtype=np.int64)
+            best_sims = np.empty(0, dtype=np.float32)
+            for start in range(0, rows.size, SCAN_CHUNK):
+                chunk = rows[start: start + SCAN_CHUNK]
+                sims = self._similarities(chunk, q)
+                if sims.size > k:
+                    top = np.argpartition(-sims, k)[:k]
+                    chunk, sims = chunk[top], sims[top]
+                best_rows = np.concatenate([best_rows, chunk])
+                best_sims = np.concatenate([best_sims, sims])
+            order = np.argsort(-best_sims)[:k]
+            results = []
+            for i in order:
+                entry = self._read_meta(int(best_rows[i]))
+                entry["similarity"] = float(best_sims[i])
+                results.append(entry)
+            return results
+
+    def examples_for(self, input_json: Dict[str, Any], k: int = FEW_SHOT_K, min_click: float = WINNER_MIN_CLICK) -> List[Dict[str, Any]]:
+        """Примеры для payload генерации: похожие победители того же канала и категории."""
+        product = input_json.get("product", {}) or {}
+        found = self.search(
+            _query_text(input_json),
+            k=k,
+            channel=input_json.get("channel", "telegram"),
+            category=product.get("category") or None,
+            min_click=min_click,
+        )
+        metrics.inc("genai4_creative_index_total", result="hit" if found else "empty")
+        return [
+            {
+                "headline": e["headline"],
+                "text": e["text"],
+                "cta": e["cta"],
+                "click_probability": round(e["scores"].get("click_probability", 0.0), 3),
+            }
+            for e in found
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        click = np.array(self._click, dtype=np.float32)
+        return {
+            "creatives": len(self),
+            "winners": int((click >= WINNER_MIN_CLICK).sum()) if click.size else 0,
+            "channels": {ch: len(rows) for ch, rows in self._rows_by_channel.items()},
+            "dim": self.dim,
+        }
+
+
+_index: Optional[CreativeIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_default_index() -> CreativeIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CreativeIndex()
+        return _index
+
+
+# ==========================
+# ЗАМЕР: ИТЕРАЦИИ ДО ПОРОГА
+# ==========================
+
+def measure_iterations(
+    client,
+    records: List[Dict[str, Any]],
+    segment: str,
+    index: CreativeIndex,
+    threshold: Optional[float] = None,
+    max_iters: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Первая половина records прогревает индекс, на второй сравниваются генерация
+    без примеров и с примерами из индекса: среднее число итераций
+    generate_and_optimize_ad, доля дошедших до порога и средний лучший клик.
+    """
+    from campaign import build_payload_for_record
+    from prompt import BEST_CLICK_THRESHOLD, MAX_ITERS, AdGenerator, generate_and_optimize_ad
+
+    threshold = BEST_CLICK_THRESHOLD if threshold is None else threshold
+    max_iters = MAX_ITERS if max_iters is None else max_iters
+    payloads = [build_payload_for_record(r, "")[0] for r in records]
+    half = len(payloads) // 2
+    warmup, holdout = payloads[:half], payloads[half:]
+
+    warm_generator = AdGenerator(client, index=index)
+    for payload in warmup:
+        generate_and_optimize_ad(warm_generator, payload, segment, threshold, max_iters)
+
+    def run(generator) -> Dict[str, Any]:
+        iters, hits, clicks = [], 0, []
+        for payload in holdout:
+            # оценки holdout в индекс не пишем, чтобы второй прогон не подглядывал в первый
+            result = generate_and_optimize_ad(generator, payload, segment, threshold, max_iters, remember=False)
+            iters.append(result["iterations"])
+            hits += result["scores"]["click_probability"] >= threshold
+            clicks.append(result["scores"]["click_probability"])
+        n = max(len(holdout), 1)
+        return {
+            "mean_iterations": round(sum(iters) / n, 3),
+            "hit_rate": round(hits / n, 3),
+            "mean_best_click": round(sum(clicks) / n, 4),
+        }
+
+    cold = run(AdGenerator(client))
+    rag = run(AdGenerator(client, index=index))
+    return {
+        "warmup": len(warmup),
+        "holdout": len(holdout),
+        "segment": segment,
+        "threshold": threshold,
+        "max_iters": max_iters,
+        "index": index.stats(),
+        "cold": cold,
+        "rag": rag,
+        "iterations_saved": round(cold["mean_iterations"] - rag["mean_iterations"], 3),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Индекс удачных креативов GENAI-4")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_stats = sub.add_parser("stats", help="размер индекса")
+    p_stats.add_argument("--index", default=INDEX_DIR)
+
+    p_search = sub.add_parser("search", help="похожие победители для текста")
+    p_search.add_argument("query")
+    p_search.add_argument("--index", default=INDEX_DIR)
+    p_search.add_argument("--channel")
+    p_search.add_argument("--category")
+    p_search.add_argument("-k", type=int, default=FEW_SHOT_K)
+
+    p_measure = sub.add_parser("measure", help="итерации до порога без примеров и с примерами")
+    p_measure.add_argument("--catalog", default="products.json")
+    p_measure.add_argument("--limit", type=int, default=40)
+    p_measure.add_argument("--segment", default="low_income_pragmatic_youth")
+    p_measure.add_argument("--index", help="каталог индекса (по умолчанию — временный)")
+    p_measure.add_argument("--mock", action="store_true", help="MockLLMClient вместо Mistral")
+    p_measure.add_argument("--out", default="rag_measure.json")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(json.dumps(CreativeIndex(args.index).stats(), ensure_ascii=False, indent=2))
+    elif args.command == "search":
+        for e in CreativeIndex(args.index).search(args.query, args.k, args.channel, args.category):
+            print(f"{e['similarity']:.3f} | {e['scores'].get('click_probability', 0):.2f} | {e['headline']}")
+    else:
+        import tempfile
+
+        from campaign import parse_products_json
+        from prompt import get_llm_client
+
+        with open(args.catalog, "r", encoding="utf-8") as f:
+            records = parse_products_json(json.load(f))[: args.limit]
+        with tempfile.TemporaryDirectory() as tmp:
+            report = measure_iterations(
+                get_llm_client(use_mistral=not args.mock), records, args.segment, CreativeIndex(args.index or tmp)
+            )
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,291 @@
+"""
+Схлопывание почти-дубликатов каталога перед запросами к Wordstat и эмбеддингами.
+
+В реальных каталогах один товар встречается много раз: цвета, объём памяти,
+повторные карточки. ProductAnalyzer спрашивал Wordstat и кодировал описание для
+каждой такой карточки отдельно. Deduplicator раскладывает товары по группам,
+тренд и эмбеддинг считаются один раз на группу (по её первому товару) и
+раздаются остальным; маржа и итоговый счёт у каждого товара свои.
+
+Группа — это:
+  * тот же нормализованный name (регистр, ё, цвет, «128 ГБ», «500 мл», скобки
+    и пунктуация не важны), или
+  * похожий name по MinHash символьных 3-грамм: кандидаты ищутся LSH-корзинами
+    (BANDS полос по ROWS значений), совпадение подтверждается оценкой Жаккара
+    >= threshold.
+Модельные номера («iPhone 15» и «iPhone 16») и линейки (pro, max, ultra…: «Galaxy
+S24» и «Galaxy S24 Ultra») обязаны совпадать, категории — тоже, если заданы у
+обоих, — иначе это разные товары при любой похожести.
+
+Группы добавляются по мере прихода товаров, весь каталог заранее не нужен —
+работает с потоковым ProductAnalyzer.analyze. Группы хранятся LRU, не больше
+max_groups: вытесненная группа при следующем товаре создаётся заново.
+
+    dedup = Deduplicator()
+    group = dedup.assign(product)
+    trend = await dedup.amemo(group, "wordstat", lambda: analyzer.get_trend_info(dedup.representative(group)["name"]))
+    print(dedup.report())
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+
+NUM_PERM = 64
+BANDS, ROWS = 16, 4          # порог кандидатов ~ (1/16)^(1/4) ≈ 0.5, подтверждение — threshold
+SIMILARITY = 0.7             # оценка Жаккара 3-грамм name для объединения в группу
+SHINGLE = 3
+MAX_GROUPS = 20_000         # с эмбеддингом e5-base в memo — около 60 МБ
+_PRIME = (1 << 31) - 1
+
+_COLORS_RU = (
+    "черн|бел|красн|син|зелен|желт|сер|розов|фиолетов|голуб|оранжев|золот|серебрист|бежев|коричнев|графитов|бирюзов"
+)
+_COLOR_RE = re.compile(rf"\b(?:{_COLORS_RU})(?:ый|ая|ое|ые|ий|яя|ее|ие|ого|ой|ую)\b")
+_COLOR_EN_RE = re.compile(
+    r"\b(?:black|white|red|blue|green|yellow|gr[ae]y|pink|purple|gold|silver|beige|brown|graphite|midnight|starlight)\b"
+)
+_UNIT_RE = re.compile(
+    r"\b\d+(?:[.,]\d+)?\s*(?:гб|gb|тб|tb|мб|mb|мл|ml|л|l|г|g|кг|kg|мм|mm|см|cm|шт|pcs)\b"
+)
+_SIZE_RE = re.compile(r"\b(?:цвет|color|размер|size)\b|\b(?:xxs|xs|xl|xxl|xxxl)\b")
+_BRACKETS_RE = re.compile(r"[(\[{][^)\]}]*[)\]}]")
+_NON_WORD_RE = re.compile(r"[^\w]+")
+# слова линейки модели — такая же часть идентичности товара, как номер
+_TIER_WORDS = frozenset({
+    "ultra", "pro", "max", "mini", "plus", "lite",
+    "ультра", "про", "макс", "мини", "плюс", "лайт",
+})
+
+
+def normalize_name(name: str) -> str:
+    """Название без признаков варианта: «iPhone 15 (Black) 128 ГБ» → «iphone 15»."""
+    text = (name or "").lower().replace("ё", "е")
+    text = _BRACKETS_RE.sub(" ", text)
+    text = _UNIT_RE.sub(" ", text)
+    text = _COLOR_RE.sub(" ", text)
+    text = _COLOR_EN_RE.sub(" ", text)
+    text = _SIZE_RE.sub(" ", text)
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+def model_numbers(normalized: str) -> Tuple[str, ...]:
+    """Токены с цифрами и слова линейки — модельные номера, по ним группы не объединяются."""
+    return tuple(sorted({
+        t for t in normalized.split() if t in _TIER_WORDS or any(c.isdigit() for c in t)
+    }))
+
+
+def shingles(normalized: str, k: int = SHINGLE) -> List[str]:
+    text = f" {normalized} "
+    if len(text) <= k:
+        return [text] if normalized else []
+    return list({text[i: i + k] for i in range(len(text) - k + 1)})
+
+
+def offer_top(top: List[tuple], top_n: int, entry: tuple) -> None:
+    """
+    Кандидат (счёт, тай-брейк, группа, товар) в список top_n лучших. Товар группы,
+    уже представленной в top, может только заменить её товар — в итоге не больше
+    одного варианта на группу. group=None — обычный отбор top_n.
+    """
+    group = entry[2]
+    if group is not None:
+        for i, current in enumerate(top):
+            if current[2] == group:
+                if entry[:2] > current[:2]:
+                    top[i] = entry
+                return
+    if len(top) < top_n:
+        top.append(entry)
+        return
+    if top:
+        worst = min(range(len(top)), key=lambda i: top[i][:2])
+        if entry[:2] > top[worst][:2]:
+            top[worst] = entry
+
+
+@dataclass
+class _Group:
+    id: int
+    key: Tuple[str, str]
+    numbers: Tuple[str, ...]
+    category: str
+    signature: Optional[np.ndarray]
+    representative: Dict[str, Any]
+    size: int = 0
+    aliases: List[Tuple[str, str]] = field(default_factory=list)  # ключи вариантов, попавших в группу по MinHash
+    memo: Dict[str, Any] = field(default_factory=dict)
+
+
+class Deduplicator:
+    def __init__(self, threshold: float = SIMILARITY, max_groups: int = MAX_GROUPS, seed: int = 0):
+        self.threshold = threshold
+        self.max_groups = max_groups
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+        self._lock = threading.Lock()
+        self._groups: "OrderedDict[int, _Group]" = OrderedDict()
+        self._exact: Dict[Tuple[str, str], int] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(BANDS)]
+        self._next_id = 0
+        self.products = 0
+        self.groups_created = 0
+        self.largest_group = 0
+        self.calls: Counter = Counter()
+        self.saved: Counter = Counter()
+
+    # --- группы ---
+
+    def signature(self, normalized: str) -> Optional[np.ndarray]:
+        grams = shingles(normalized)
+        if not grams:
+            return None
+        h = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+        # (a·h + b) mod p для всех перестановок сразу: a, b < 2^31, h < 2^32 — без переполнения uint64
+        return ((self._a * h[None, :] + self._b) % _PRIME).min(axis=1).astype(np.uint32)
+
+    @staticmethod
+    def _bands(signature: np.ndarray) -> List[bytes]:
+        return [signature[i * ROWS: (i + 1) * ROWS].tobytes() for i in range(BANDS)]
+
+    def _match(self, signature: np.ndarray, numbers: Tuple[str, ...], category: str) -> Optional[_Group]:
+        best, best_sim = None, self.threshold
+        seen = set()
+        for band, key in enumerate(self._bands(signature)):
+            for gid in self._buckets[band].get(key, ()):
+                if gid in seen:
+                    continue
+                seen.add(gid)
+                g = self._groups.get(gid)
+                if g is None or g.signature is None or g.numbers != numbers:
+                    continue
+                if category and g.category and category != g.category:
+                    continue
+                sim = float(np.mean(g.signature == signature))
+                if sim >= best_sim:
+                    best, best_sim = g, sim
+        return best
+
+    def _evict(self) -> None:
+        while len(self._groups) > self.max_groups:
+            _, g = self._groups.popitem(last=False)
+            for key in [g.key, *g.aliases]:
+                if self._exact.get(key) == g.id:
+                    del self._exact[key]
+            if g.signature is not None:
+                for band, key in enumerate(self._bands(g.signature)):
+                    ids = self._buckets[band].get(key)
+                    if ids is not None and g.id in ids:
+                        ids.remove(g.id)
+                        if not ids:
+                            del self._buckets[band][key]
+
+    def _new_group(self, key, numbers, category, signature, product) -> _Group:
+        group = _Group(self._next_id, key, numbers, category, signature, product)
+        self._next_id += 1
+        self.groups_created += 1
+        self._groups[group.id] = group
+        if key[1]:
+            self._exact[key] = group.id
+        if signature is not None:
+            for band, band_key in enumerate(self._bands(signature)):
+                self._buckets[band].setdefault(band_key, []).append(group.id)
+        self._evict()
+        return group
+
+    def assign(self, product: Dict[str, Any]) -> int:
+        """Id группы товара; новый товар без похожих открывает свою группу."""
+        normalized = normalize_name(product.get("name", ""))
+        category = (product.get("category") or "").strip().lower()
+        key = (category, normalized)
+        with self._lock:
+            self.products += 1
+            gid = self._exact.get(key) if normalized else None
+            group = self._groups.get(gid) if gid is not None else None
+            if group is None:
+                signature = self.signature(normalized)
+                numbers = model_numbers(normalized)
+                if signature is not None:
+                    group = self._match(signature, numbers, category)
+                if group is not None:
+                    self._exact[key] = group.id
+                    group.aliases.append(key)
+                else:
+                    group = self._new_group(key, numbers, category, signature, product)
+            group.size += 1
+            self.largest_group = max(self.largest_group, group.size)
+            self._groups.move_to_end(group.id)
+            return group.id
+
+    def representative(self, gid: int) -> Dict[str, Any]:
+        return self._groups[gid].representative
+
+    # --- общий результат на группу ---
+
+    def _saved(self, kind: str) -> None:
+        self.saved[kind] += 1
+        metrics.inc("genai4_dedup_saved_total", kind=kind)
+
+    def memo(self, gid: int, kind: str, compute: Callable[[], Any]) -> Any:
+        """Результат kind для группы: первый товар считает, остальные получают готовое."""
+        with self._lock:
+            group = self._groups.get(gid)
+            if group is not None and kind in group.memo:
+                self._saved(kind)
+                return group.memo[kind]
+        value = compute()
+        with self._lock:
+            self.calls[kind] += 1
+            if group is not None:
+                group.memo[kind] = value
+        return value
+
+    async def amemo(self, gid: int, kind: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Как memo для корутин: товары группы, пришедшие одновременно, ждут один запрос.
+        Упавший запрос не запоминается — следующий товар группы повторит его.
+        """
+        with self._lock:
+            group = self._groups.get(gid)
+            task = group.memo.get(kind) if group is not None else None
+            if task is not None:
+                self._saved(kind)
+            else:
+                task = asyncio.ensure_future(compute())
+                self.calls[kind] += 1
+                if group is not None:
+                    group.memo[kind] = task
+                    task.add_done_callback(lambda t: self._forget_failed(group, kind, t))
+        return await asyncio.shield(task)
+
+    def _forget_failed(self, group, kind: str, task: asyncio.Future) -> None:
+        if task.cancelled() or task.exception() is not None:
+            with self._lock:
+                if group.memo.get(kind) is task:
+                    del group.memo[kind]
+
+    def report(self) -> Dict[str, Any]:
+        kinds = sorted(set(self.calls) | set(self.saved))
+        return {
+            "products": self.products,
+            "groups": self.groups_created,
+            "duplicates": self.products - self.groups_created,
+            "largest_group": self.largest_group,
+            "calls": {k: self.calls[k] for k in kinds},
+            "saved": {k: self.saved[k] for k in kinds},
+            "saved_share": {
+                k: round(self.saved[k] / (self.calls[k] + self.saved[k]), 3) if self.calls[k] + self.saved[k] else 0.0
+                for k in kinds
+            },
+        }
@@ -0,0 +1,204 @@
+"""
+Тонкий клиент общего сервера эмбеддингов (embedding_server.py).
+
+Вместо того чтобы каждый процесс (сессия Streamlit, воркер очереди, CLI) держал
+свою копию e5 (~1 ГБ), все ходят в один долгоживущий сервер по Unix-сокету
+или localhost. Клиент повторяет нужную часть интерфейса SentenceTransformer.encode,
+поэтому ProductAnalyzer и старые скрипты работают с ним без изменений.
+
+Адрес сервера — переменная окружения EMBED_SERVER:
+    unix:/tmp/genai4-embed.sock   (по умолчанию на Linux/macOS)
+    tcp:127.0.0.1:8765            (по умолчанию на Windows)
+
+get_encoder(): EMBED_SERVER задан — клиент сервера, иначе модель в процессе, как раньше.
+
+Протокол: кадры «4 байта длины (big-endian) + тело».
+Запрос — JSON {"id", "op": "encode"|"stats", "texts", "normalize", "dtype": "float32"|"float16"}.
+Ответ — заголовок RESPONSE_HEADER (id, статус, dtype, n, dim) и затем
+n*dim чисел little-endian (статус OK), UTF-8 текст ошибки (ERROR) или JSON (JSON).
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+MODEL_NAME = "intfloat/multilingual-e5-base"
+DEFAULT_ADDRESS = "tcp:127.0.0.1:8765" if os.name == "nt" else "unix:/tmp/genai4-embed.sock"
+
+LENGTH = struct.Struct("!I")
+RESPONSE_HEADER = struct.Struct("!IBBII")  # id, status, dtype, n, dim
+STATUS_OK, STATUS_ERROR, STATUS_JSON = 0, 1, 2
+DTYPES = {"float32": 0, "float16": 1}
+DTYPE_NAMES = {code: name for name, code in DTYPES.items()}
+MAX_FRAME = 256 * 1024 * 1024
+
+
+class EmbeddingServerError(RuntimeError):
+    pass
+
+
+def parse_address(address: str):
+    """'unix:/path' → (AF_UNIX, '/path'); 'tcp:host:port' → (AF_INET, (host, port))."""
+    kind, _, rest = address.partition(":")
+    if kind == "unix":
+        return socket.AF_UNIX, rest
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    raise ValueError(f"Неизвестный адрес сервера эмбеддингов: {address!r}")
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Сервер эмбеддингов закрыл соединение")
+        buf += chunk
+    return bytes(buf)
+
+
+def encode_response(req_id: int, status: int, body: bytes, dtype: int = 0, n: int = 0, dim: int = 0) -> bytes:
+    payload = RESPONSE_HEADER.pack(req_id, status, dtype, n, dim) + body
+    return LENGTH.pack(len(payload)) + payload
+
+
+class EmbeddingClient:
+    """
+    Синхронный клиент. Соединение своё у каждого потока: запросы из пула потоков
+    уходят параллельно, и сервер склеивает их в общие батчи.
+    """
+
+    def __init__(self, address: Optional[str] = None, timeout: float = 60.0, dtype: str = "float32"):
+        self.address = address or os.getenv("EMBED_SERVER") or DEFAULT_ADDRESS
+        self.timeout = timeout
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype должен быть одним из {list(DTYPES)}")
+        self.dtype = dtype
+        self._local = threading.local()
+        self._next_id = 0
+        self._id_lock = threading.Lock()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            family, addr = parse_address(self.address)
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(addr)
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._local.sock = sock
+        return sock
+
+    def _drop_connection(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _request(self, message: Dict[str, Any]):
+        with self._id_lock:
+            self._next_id = (self._next_id + 1) % 2**32
+            message["id"] = self._next_id
+        body = json.dumps(message, ensure_ascii=False).encode("utf-8")
+
+        for attempt in (0, 1):
+            try:
+                sock = self._connection()
+                sock.sendall(LENGTH.pack(len(body)) + body)
+                (length,) = LENGTH.unpack(_recv_exact(sock, LENGTH.size))
+                payload = _recv_exact(sock, length)
+                break
+            except (ConnectionError, BrokenPipeError, socket.timeout, OSError):
+                # сервер перезапускали — одно переподключение, потом ошибка наверх
+                self._drop_connection()
+                if attempt:
+                    raise
+
+        req_id, status, dtype, n, dim = RESPONSE_HEADER.unpack_from(payload)
+        body = payload[RESPONSE_HEADER.size:]
+        if req_id != message["id"]:
+            self._drop_connection()
+            raise EmbeddingServerError("Ответ сервера эмбеддингов не на тот запрос")
+        if status == STATUS_ERROR:
+            raise EmbeddingServerError(body.decode("utf-8", "replace"))
+        if status == STATUS_JSON:
+            return json.loads(body)
+
+        import numpy as np
+
+        np_dtype = "<f4" if DTYPE_NAMES[dtype] == "float32" else "<f2"
+        return np.frombuffer(body, dtype=np_dtype).reshape(n, dim).astype(np.float32, copy=False)
+
+    def encode(
+        self,
+        sentences: Union[str, Sequence[str]],
+        convert_to_tensor: bool = False,
+        normalize_embeddings: bool = False,
+        **_ignored: Any,
+    ):
+        """Тот же контракт, что у SentenceTransformer.encode: строка → вектор, список → матрица."""
+        single = isinstance(sentences, str)
+        texts: List[str] = [sentences] if single else list(sentences)
+        if not texts:
+            import numpy as np
+
+            result = np.zeros((0, 0), dtype=np.float32)
+        else:
+            result = self._request({
+                "op": "encode",
+                "texts": texts,
+                "normalize": normalize_embeddings,
+                "dtype": self.dtype,
+            })
+        if single:
+            result = result[0]
+        if convert_to_tensor:
+            import torch
+
+            return torch.from_numpy(result.copy())
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return self._request({"op": "stats"})
+
+    def close(self) -> None:
+        self._drop_connection()
+
+
+class LocalEncoder:
+    """Модель в процессе (прежнее поведение), с тем же интерфейсом encode."""
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, sentences, convert_to_tensor: bool = False, normalize_embeddings: bool = False, **kwargs: Any):
+        return self.model.encode(
+            sentences,
+            convert_to_tensor=convert_to_tensor,
+            normalize_embeddings=normalize_embeddings,
+            **kwargs,
+        )
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """Один энкодер на процесс: клиент сервера, если задан EMBED_SERVER, иначе локальная модель."""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            if os.getenv("EMBED_SERVER"):
+                _encoder = EmbeddingClient()
+            else:
+                _encoder = LocalEncoder()
+        return _encoder
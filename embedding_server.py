@@ -0,0 +1,253 @@
+"""
+Общий локальный сервер эмбеддингов: одна прогретая модель e5 на машину.
+
+Каждая сессия Streamlit, каждый воркер очереди и CLI раньше грузили свою копию
+модели (~1 ГБ резидентной памяти) и ничего не батчили между собой. Сервер держит
+модель один раз, а запросы всех клиентов за окно EMBED_MAX_WAIT (или до
+EMBED_MAX_BATCH текстов) склеивает в один вызов encode().
+Ответ — бинарные float32/float16 без JSON (протокол описан в embedding_client.py).
+
+Запуск:
+    python embedding_server.py                       (адрес — EMBED_SERVER или по умолчанию)
+    python embedding_server.py --address tcp:127.0.0.1:8765
+Клиенты: export EMBED_SERVER=unix:/tmp/genai4-embed.sock — и ProductAnalyzer
+берёт embedding_client.EmbeddingClient вместо своей модели.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from embedding_client import (
+    DEFAULT_ADDRESS,
+    DTYPES,
+    LENGTH,
+    MAX_FRAME,
+    MODEL_NAME,
+    STATUS_ERROR,
+    STATUS_JSON,
+    STATUS_OK,
+    encode_response,
+    parse_address,
+)
+
+EMBED_MAX_BATCH = 64      # текстов в одном вызове encode()
+EMBED_MAX_WAIT = 0.005    # сколько ждать попутчиков для батча, секунды
+
+# (тексты, normalize) -> матрица float32 [len(texts), dim]
+EncodeFn = Callable[[List[str], bool], np.ndarray]
+
+
+def sentence_transformer_encoder(model_name: str = MODEL_NAME, batch_size: int = EMBED_MAX_BATCH) -> EncodeFn:
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+
+    def encode(texts: List[str], normalize: bool) -> np.ndarray:
+        return model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=normalize,
+        ).astype(np.float32, copy=False)
+
+    return encode
+
+
+class EmbeddingServer:
+    def __init__(self, encode_fn: EncodeFn, max_batch: int = EMBED_MAX_BATCH, max_wait: float = EMBED_MAX_WAIT):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # модель одна — encode() всегда в одном потоке, event loop остаётся свободным
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="genai4-embed")
+        self._queue: Optional[asyncio.Queue] = None
+        self.started = time.time()
+        self.clients = 0
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.encode_seconds = 0.0
+
+    # --- батчинг ---
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            batch = [first]
+            n_texts = len(first[0])
+            deadline = loop.time() + self.max_wait
+            # добираем попутчиков с тем же normalize, пока не кончилось окно или место
+            while n_texts < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    job = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if job[1] != first[1]:
+                    await self._run_batch([job])
+                    continue
+                batch.append(job)
+                n_texts += len(job[0])
+            await self._run_batch(batch)
+
+    async def _run_batch(self, batch: List[Tuple[List[str], bool, asyncio.Future]]) -> None:
+        texts = [t for job in batch for t in job[0]]
+        normalize = batch[0][1]
+        t0 = time.perf_counter()
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.encode_fn, texts, normalize
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - t0
+        metrics.observe("genai4_embedding_seconds", elapsed, kind="server_batch")
+        self.encode_seconds += elapsed
+        self.batches += 1
+        self.texts += len(texts)
+
+        offset = 0
+        for job_texts, _, future in batch:
+            part = vectors[offset: offset + len(job_texts)]
+            offset += len(job_texts)
+            if not future.done():
+                future.set_result(part)
+
+    async def encode(self, texts: List[str], normalize: bool) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, normalize, future))
+        return await future
+
+    # --- соединения ---
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "clients": self.clients,
+            "requests": self.requests,
+            "texts": self.texts,
+            "batches": self.batches,
+            "mean_batch_texts": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "encode_seconds": round(self.encode_seconds, 3),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    async def _respond(self, message: Dict[str, Any], writer: asyncio.StreamWriter, write_lock: asyncio.Lock) -> None:
+        req_id = int(message.get("id", 0))
+        try:
+            op = message.get("op", "encode")
+            if op == "stats":
+                frame = encode_response(req_id, STATUS_JSON, json.dumps(self.stats()).encode("utf-8"))
+            elif op == "encode":
+                texts = message.get("texts") or []
+                if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                    raise ValueError("texts — список строк")
+                dtype = DTYPES.get(message.get("dtype", "float32"))
+                if dtype is None:
+                    raise ValueError(f"dtype должен быть одним из {list(DTYPES)}")
+                self.requests += 1
+                vectors = await self.encode(texts, bool(message.get("normalize", False)))
+                body = vectors.astype("<f4" if dtype == DTYPES["float32"] else "<f2").tobytes()
+                frame = encode_response(req_id, STATUS_OK, body, dtype, vectors.shape[0], vectors.shape[1])
+            else:
+                raise ValueError(f"неизвестная операция {op!r}")
+        except Exception as e:
+            frame = encode_response(req_id, STATUS_ERROR, str(e).encode("utf-8"))
+        async with write_lock:
+            writer.write(frame)
+            await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.clients += 1
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                    if length > MAX_FRAME:
+                        break
+                    message = json.loads(await reader.readexactly(length))
+                except (asyncio.IncompleteReadError, ConnectionError, json.JSONDecodeError):
+                    break
+                # запросы одного соединения обрабатываются конвейерно, ответы помечены id
+                task = asyncio.ensure_future(self._respond(message, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.clients -= 1
+            writer.close()
+
+    async def serve(self, address: str = DEFAULT_ADDRESS) -> None:
+        self._queue = asyncio.Queue()
+        batcher = asyncio.ensure_future(self._batch_loop())
+        family, addr = parse_address(address)
+        if family == socket.AF_UNIX:
+            _remove_stale_socket(addr)
+            server = await asyncio.start_unix_server(self._handle, path=addr)
+            os.chmod(addr, 0o660)
+        else:
+            server = await asyncio.start_server(self._handle, host=addr[0], port=addr[1])
+        print(f"Сервер эмбеддингов слушает {address}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self._executor.shutdown(wait=False)
+            if family == socket.AF_UNIX and os.path.exists(addr):
+                os.unlink(addr)
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Файл сокета от упавшего сервера удаляем; если сервер жив — не запускаем второй."""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"Сервер эмбеддингов уже запущен на {path}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Общий сервер эмбеддингов GENAI-4")
+    parser.add_argument("--address", default=os.getenv("EMBED_SERVER") or DEFAULT_ADDRESS)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--max-batch", type=int, default=EMBED_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=EMBED_MAX_WAIT * 1000)
+    args = parser.parse_args()
+
+    print(f"Загрузка модели {args.model}...")
+    server = EmbeddingServer(
+        sentence_transformer_encoder(args.model, args.max_batch),
+        max_batch=args.max_batch,
+        max_wait=args.max_wait_ms / 1000,
+    )
+    try:
+        asyncio.run(server.serve(args.address))
+    except KeyboardInterrupt:
+        pass
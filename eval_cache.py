@@ -0,0 +1,187 @@
+"""
+Общий слой мемоизации для оценки рекламы.
+
+Одна и та же связка заголовок/текст/CTA оценивается много раз: на итерациях
+оптимизации, при перезапусках интерфейса, в разных кампаниях. Когда в цикле
+стоит feedback.AdTest, каждый повтор — это платный вызов LLM.
+
+Ключ = нормализованный текст рекламы + сегмент + версия оценщика.
+Уровни:
+  1) LRU в памяти процесса;
+  2) (опционально) SQLite-файл — переживает перезапуски и общий для процессов.
+
+Включить SQLite-уровень для кэша по умолчанию: переменная окружения EVAL_CACHE_DB.
+"""
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+DEFAULT_MAX_SIZE = 10_000
+
+_WS_RE = re.compile(r"\s+")
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def normalize_ad_text(ad_text: str) -> str:
+    """
+    Приводит текст к каноническому виду: NFKC, регистр, схлопнутые пробелы.
+    "Скидка  10%!\\n" и "скидка 10%!" дают один ключ.
+    """
+    text = unicodedata.normalize("NFKC", ad_text)
+    text = text.casefold()
+    return _WS_RE.sub(" ", text).strip()
+
+
+def _copy(value: Any) -> Any:
+    """Копия для вызывающего: плоскому словарю оценок хватает dict(), вложенному — deepcopy."""
+    if isinstance(value, dict) and all(isinstance(v, _SCALARS) for v in value.values()):
+        return dict(value)
+    return copy.deepcopy(value)
+
+
+def make_key(ad_text: str, segment: str, evaluator_version: str) -> str:
+    raw = "\x1f".join([normalize_ad_text(ad_text), segment.strip().lower(), evaluator_version])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class EvalCache:
+    """
+    Двухуровневый кэш результатов оценки.
+    Значения должны сериализоваться в JSON (dict/list/str/float).
+    Потокобезопасен: webapp и асинхронные оценщики дергают его из разных потоков.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, sqlite_path: Optional[str] = None):
+        self.max_size = max_size
+        self.sqlite_path = sqlite_path
+        self._lru: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.sqlite_hits = 0
+        self.misses = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS eval_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    # --- базовые операции ---
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                metrics.inc("genai4_eval_cache_total", result="memory_hit")
+                return _copy(self._lru[key])
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value FROM eval_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._put_memory(key, value)
+                    self.sqlite_hits += 1
+                    metrics.inc("genai4_eval_cache_total", result="sqlite_hit")
+                    return _copy(value)
+
+            self.misses += 1
+            metrics.inc("genai4_eval_cache_total", result="miss")
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._put_memory(key, _copy(value))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO eval_cache (key, value, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), time.time()),
+                )
+                self._db.commit()
+
+    def _put_memory(self, key: str, value: Any) -> None:
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def get_or_compute(
+        self,
+        ad_text: str,
+        segment: str,
+        evaluator_version: str,
+        compute: Callable[[], Any],
+    ) -> Any:
+        """
+        Главная точка входа: вернуть закэшированную оценку или посчитать и запомнить.
+        """
+        key = make_key(ad_text, segment, evaluator_version)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        value = compute()
+        self.set(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM eval_cache")
+                self._db.commit()
+
+    # --- статистика ---
+
+    @property
+    def lookups(self) -> int:
+        return self.memory_hits + self.sqlite_hits + self.misses
+
+    @property
+    def hit_ratio(self) -> float:
+        return (self.memory_hits + self.sqlite_hits) / self.lookups if self.lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.lookups
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "sqlite_hits": self.sqlite_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+            "memory_hit_ratio": self.memory_hits / lookups if lookups else 0.0,
+            "sqlite_hit_ratio": self.sqlite_hits / lookups if lookups else 0.0,
+            "memory_size": len(self._lru),
+        }
+
+
+_default_cache: Optional[EvalCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> EvalCache:
+    """Общий кэш процесса — его используют main.evaluate_ad и feedback.AdTest."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = EvalCache(sqlite_path=os.getenv("EVAL_CACHE_DB") or None)
+        return _default_cache
@@ -1,14 +1,64 @@
-from openai import OpenAI
-from dotenv import load_dotenv
+from dataclasses import dataclass, field
+import asyncio
 import json
 import os
+import threading
 
-from feedback_helper import generate_prompt
-
-load_dotenv()
-openAI_client = OpenAI(
-  api_key=os.getenv("OPENAI_API_KEY")
+from feedback_helper import (
+    batch_promt,
+    count_tokens,
+    format_batch_slots,
+    generate_batch_prompt,
+    generate_persona_prompt,
+    generate_prompt,
+    parse_scores,
+    parse_batch_scores,
+    parse_persona_scores,
+    persona_key,
+    serialize_personas,
 )
+from eval_cache import EvalCache, get_default_cache, make_key
+from journal import Journal, work_id
+import metrics
+from scheduler import estimate_tokens, get_scheduler
+
+# Клиент OpenAI, .env и сам пакет openai подгружаются при первом обращении,
+# а не при импорте модуля: импорт feedback не должен тормозить CLI и Streamlit.
+_openai_client = None
+_openai_lock = threading.Lock()
+
+
+def _load_env() -> None:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def get_openai_client():
+    global _openai_client
+    with _openai_lock:
+        if _openai_client is None:
+            from openai import OpenAI
+            _load_env()
+            _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return _openai_client
+
+
+def _record_usage(provider: str, completion) -> None:
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        metrics.record_llm_usage(provider, usage.prompt_tokens, usage.completion_tokens)
+
+
+def _total_tokens(completion):
+    usage = getattr(completion, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def __getattr__(name):
+    # обратная совместимость: feedback.openAI_client
+    if name == "openAI_client":
+        return get_openai_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 personas_path = "categorized_personas.json"
 persona_types = [
@@ -30,31 +80,383 @@ persona_types = [
 ]
 
 
+# Поменяли шаблон промпта в feedback_helper — поднимаем, чтобы не брать старые ответы из кэша
+PROMPT_VERSION = "v2"
+
+# Бюджет входных токенов на один пакетный промпт и максимум слотов в нём:
+# слишком длинный список объявлений модель начинает путать по номерам.
+MAX_BATCH_PROMPT_TOKENS = 8000
+MAX_ADS_PER_BATCH = 10
+# Персон в одном промпте score_personas: медоиды (k до 20) уходят одним запросом
+MAX_PERSONAS_PER_PROMPT = 20
+
+
 class AdTest:
-    def __init__(self, model="gpt-4o-mini-2024-07-18"):
+    def __init__(
+        self,
+        model="gpt-4o-mini-2024-07-18",
+        cache: EvalCache | None = None,
+        use_cache: bool = True,
+        journal: Journal | None = None,
+    ):
         self.model = model
+        self.use_cache = use_cache
+        self.cache = cache if cache is not None else (get_default_cache() if use_cache else None)
+        # Журнал прогона: ответы LLM по промптам переживают падение процесса (см. journal.py)
+        self.journal = journal
+
+        # Сколько входных токенов реально ушло в LLM (попадания в кэш не считаются)
+        self.last_prompt_tokens = 0
+        self.prompt_tokens_total = 0
+        # Токены по данным провайдера (usage) — для учёта стоимости
+        self.usage_prompt_tokens = 0
+        self.usage_completion_tokens = 0
+
+    @property
+    def evaluator_version(self) -> str:
+        return f"adtest:{self.model}:{PROMPT_VERSION}"
 
 
     def _get_result(self, message) -> str:
-        completion = openAI_client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "system", "content": message}]
-        )
+        if self.journal is not None:
+            return self.journal.run(work_id("adtest", self.model, message), "adtest", lambda: self._request(message))
+        return self._request(message)
+
+    def _request(self, message) -> str:
+        with get_scheduler().slot("openai", tokens=estimate_tokens(message)) as grant:
+            with metrics.timer("genai4_llm_seconds", provider="openai"):
+                completion = get_openai_client().chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "system", "content": message}]
+                )
+            grant.settle(_total_tokens(completion))
+        self._add_usage("openai", completion)
         return completion.choices[0].message.content
 
+    def _add_usage(self, provider: str, completion) -> None:
+        _record_usage(provider, completion)
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            self.usage_prompt_tokens += usage.prompt_tokens or 0
+            self.usage_completion_tokens += usage.completion_tokens or 0
+
     
-    def run_test(self, ad: str, types: list[str]) -> tuple[str, str]:
-        result = []
+    def _evaluate(self, ad: str, types: list[str]) -> str:
+        prompt, tokens = generate_prompt(ad, types, with_token_count=True)
+        self.last_prompt_tokens = tokens
+        self.prompt_tokens_total += tokens
+        return self._get_result(prompt)
+
+    def run_test(self, ad: str, types: list[str]) -> tuple[str, dict[str, float] | None]:
+        """
+        (реклама, {"click_probability", "purchase_probability"}) — None, если ответ LLM не разобран.
+        Кэшируются только разобранные оценки: непарсящийся ответ при следующем вызове
+        запрашивается заново, а не отдаётся из кэша.
+        """
+        scores, _ = self._cached_scores([ad], types)
+        if scores[0] is None:
+            scores[0] = parse_scores(self._evaluate(ad, types))
+            self._store_scores(ad, types, scores[0])
+        return ad, scores[0]
+
+    def score_personas(self, ad: str, segment: str, personas: list[dict]) -> list[dict[str, float] | None]:
+        """
+        Оценка рекламы для каждой персоны отдельно — persona_sampling.PersonaEvaluator
+        на LLM (годится для fidelity_report). Персоны уходят пачками по
+        MAX_PERSONAS_PER_PROMPT в один промпт; оценка кэшируется по атрибутам персоны,
+        так что медоиды, уже оценённые в составе сегмента, повторно не запрашиваются.
+        Персоны, для которых ответ не разобран, — None.
+        """
+        scores: list[dict[str, float] | None] = [None] * len(personas)
+        pending: list[int] = []
+        for i, p in enumerate(personas):
+            cached = self.cache.get(self._scores_key(ad, [persona_key(p)])) if self.cache is not None else None
+            if cached is not None:
+                scores[i] = cached
+            else:
+                pending.append(i)
 
-        prompt = generate_prompt(ad, types)
-        print("\n\n\nel proompt type:\n\n\n", type(prompt))
-        prompt_result = self._get_result(prompt)
+        self.last_prompt_tokens = 0
+        for start in range(0, len(pending), MAX_PERSONAS_PER_PROMPT):
+            chunk = pending[start: start + MAX_PERSONAS_PER_PROMPT]
+            prompt, tokens = generate_persona_prompt(ad, [personas[i] for i in chunk], with_token_count=True)
+            self.last_prompt_tokens += tokens
+            self.prompt_tokens_total += tokens
+            for i, slot_scores in zip(chunk, parse_persona_scores(self._get_result(prompt), len(chunk))):
+                scores[i] = slot_scores
+                self._store_scores(ad, [persona_key(personas[i])], slot_scores)
+        return scores
 
-        result.append(ad)
-        result.append(prompt_result)
+    def run_representative(self, ad: str, segment: str, k: int = 10) -> dict[str, float] | None:
+        """
+        Оценка по k представителям сегмента вместо всех персон: каждый медоид
+        оценивается отдельно (score_personas), итог — среднее с весами кластеров.
+        Подбор k — persona_sampling.fidelity_report(evaluator=AdTest().score_personas).
+        """
+        from persona_sampling import representative_personas, weighted_scores
 
+        reps = representative_personas(segment, k)
+        types = [f"{segment}@medoids{k}"]
+        scores, _ = self._cached_scores([ad], types)
+        if scores[0] is not None:
+            return scores[0]
+
+        result = weighted_scores(self.score_personas(ad, segment, reps.medoids), reps.weights)
+        self._store_scores(ad, types, result)
         return result
 
+    def _scores_key(self, ad: str, types: list[str]) -> str:
+        return make_key(ad, ",".join(sorted(types)), f"{self.evaluator_version}:scores")
+
+    def _cached_scores(self, ads: list[str], types: list[str]) -> tuple[list[dict[str, float] | None], list[int]]:
+        """Достаёт из кэша уже посчитанные оценки; возвращает (оценки, индексы без оценки)."""
+        scores: list[dict[str, float] | None] = [None] * len(ads)
+        pending: list[int] = []
+        for i, ad in enumerate(ads):
+            cached = self.cache.get(self._scores_key(ad, types)) if self.cache is not None else None
+            if cached is not None:
+                scores[i] = cached
+            else:
+                pending.append(i)
+        return scores, pending
+
+    def _store_scores(self, ad: str, types: list[str], scores: dict[str, float] | None) -> None:
+        if scores is not None and self.cache is not None:
+            self.cache.set(self._scores_key(ad, types), scores)
+
+    def _split_batches(self, ads: list[str], types: list[str], max_prompt_tokens: int, max_ads: int) -> list[list[int]]:
+        """
+        Делит объявления на пачки так, чтобы каждый промпт влезал в бюджет токенов.
+        Объявление, которое одно не влезает, всё равно уходит отдельной пачкой.
+        """
+        base_tokens = count_tokens(batch_promt.format(serialize_personas(types), ""))
+        slot_tokens = [count_tokens(slot) for slot in format_batch_slots(ads)]
+
+        batches: list[list[int]] = []
+        current: list[int] = []
+        used = base_tokens
+        for i, tokens in enumerate(slot_tokens):
+            if current and (used + tokens > max_prompt_tokens or len(current) >= max_ads):
+                batches.append(current)
+                current, used = [], base_tokens
+            current.append(i)
+            used += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def run_batch(
+        self,
+        ads: list[str],
+        types: list[str],
+        max_prompt_tokens: int = MAX_BATCH_PROMPT_TOKENS,
+        max_ads: int = MAX_ADS_PER_BATCH,
+    ) -> list[dict[str, float] | None]:
+        """
+        Пакетная оценка: несколько объявлений в одном промпте с пронумерованными слотами.
+        Блок персон передаётся один раз на пачку. Возвращает по словарю
+        {"click_probability", "purchase_probability"} на каждое объявление, в исходном порядке.
+
+        Если модель пропустила слот, это объявление переоценивается отдельным запросом;
+        если и тогда числа не разобрались — на его месте None.
+        """
+        scores, pending = self._cached_scores(ads, types)
+
+        pending_ads = [ads[i] for i in pending]
+        for batch in self._split_batches(pending_ads, types, max_prompt_tokens, max_ads):
+            batch_ads = [pending_ads[j] for j in batch]
+            prompt, tokens = generate_batch_prompt(batch_ads, types, with_token_count=True)
+            self.last_prompt_tokens = tokens
+            self.prompt_tokens_total += tokens
+            parsed_slots = parse_batch_scores(self._get_result(prompt), len(batch_ads))
+
+            for j, slot_scores in zip(batch, parsed_slots):
+                if slot_scores is None:
+                    slot_scores = parse_scores(self._evaluate(pending_ads[j], types))
+                scores[pending[j]] = slot_scores
+                self._store_scores(pending_ads[j], types, slot_scores)
+
+        return scores
+
+
+def get_ad_test(**kwargs):
+    """
+    Оценщик на LLM: с ROUTING_CONFIG — router.RoutedAdTest (скрининг дешёвой моделью,
+    неразобранные объявления — следующему уровню), иначе AdTest одной модели.
+    У обоих есть run_batch(ads, types).
+    """
+    from router import RoutedAdTest, routing_enabled
+
+    if routing_enabled():
+        return RoutedAdTest(**kwargs)
+    return AdTest(**kwargs)
+
+
+@dataclass
+class EvaluationMatrix:
+    """
+    Матрица оценок сегмент × объявление.
+    scores[segment][i] — {"click_probability", "purchase_probability"} или None,
+    если ячейку не удалось получить (таймаут, ошибка провайдера, непарсящийся ответ).
+    """
+    segments: list[str]
+    ads: list[str]
+    scores: dict[str, list[dict[str, float] | None]] = field(default_factory=dict)
+    errors: dict[str, list[str]] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        return all(cell is not None for row in self.scores.values() for cell in row)
+
+    def click_matrix(self) -> list[list[float | None]]:
+        return [
+            [cell["click_probability"] if cell else None for cell in self.scores[segment]]
+            for segment in self.segments
+        ]
+
+    def purchase_matrix(self) -> list[list[float | None]]:
+        return [
+            [cell["purchase_probability"] if cell else None for cell in self.scores[segment]]
+            for segment in self.segments
+        ]
+
+
+class AsyncAdTest(AdTest):
+    """
+    Асинхронная оценка одного или многих объявлений сразу по многим сегментам.
+
+    Каждый сегмент — отдельная пачка запросов (объявления упакованы в слоты, как в run_batch),
+    все сегменты уходят конкурентно. Параллелизм ограничен семафором, частота запросов и
+    токены — общим планировщиком процесса (scheduler.py), у каждого запроса свой таймаут.
+    Ошибка или таймаут одного сегмента не роняет остальные: ячейки остаются None,
+    причина пишется в matrix.errors.
+    """
+
+    def __init__(
+        self,
+        model="gpt-4o-mini-2024-07-18",
+        cache: EvalCache | None = None,
+        use_cache: bool = True,
+        max_concurrency: int = 8,
+        timeout: float = 30.0,
+        provider: str = "openai",
+        client=None,
+        journal: Journal | None = None,
+    ):
+        super().__init__(model, cache=cache, use_cache=use_cache, journal=journal)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.provider = provider
+        self._client = client
+        self._own_client = client is None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    def _bind_loop(self) -> None:
+        # Семафор и пул соединений AsyncOpenAI привязаны к event loop, в котором созданы.
+        # Экземпляр переживает asyncio.run(...) — в новом loop создаём их заново.
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        self._loop = loop
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._own_client:
+            self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            _load_env()
+            self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    async def _aget_result(self, message) -> str:
+        if self.journal is not None:
+            return await self.journal.arun(
+                work_id("adtest", self.model, message), "adtest", lambda: self._arequest(message)
+            )
+        return await self._arequest(message)
+
+    async def _arequest(self, message) -> str:
+        self._bind_loop()
+        # сначала свой семафор, потом слот планировщика: иначе токены провайдера списаны,
+        # а запрос ещё стоит в локальной очереди
+        async with self._semaphore:
+            async with get_scheduler().aslot(self.provider, tokens=estimate_tokens(message)) as grant:
+                with metrics.timer("genai4_llm_seconds", provider=self.provider):
+                    completion = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            model=self.model,
+                            messages=[{"role": "system", "content": message}],
+                        ),
+                        timeout=self.timeout,
+                    )
+                grant.settle(_total_tokens(completion))
+        self._add_usage(self.provider, completion)
+        return completion.choices[0].message.content
+
+    async def _arun_batch(
+        self,
+        ads: list[str],
+        types: list[str],
+        max_prompt_tokens: int,
+        max_ads: int,
+        errors: list[str],
+    ) -> list[dict[str, float] | None]:
+        scores, pending = self._cached_scores(ads, types)
+        pending_ads = [ads[i] for i in pending]
+
+        async def run_one(batch: list[int]) -> None:
+            batch_ads = [pending_ads[j] for j in batch]
+            prompt, tokens = generate_batch_prompt(batch_ads, types, with_token_count=True)
+            self.prompt_tokens_total += tokens
+            try:
+                parsed_slots = parse_batch_scores(await self._aget_result(prompt), len(batch_ads))
+            except asyncio.TimeoutError:
+                errors.append(f"таймаут {self.timeout}s для объявлений {[pending[j] for j in batch]}")
+                return
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                return
+
+            for j, slot_scores in zip(batch, parsed_slots):
+                if slot_scores is None:
+                    errors.append(f"не удалось разобрать ответ для объявления {pending[j]}")
+                    continue
+                scores[pending[j]] = slot_scores
+                self._store_scores(pending_ads[j], types, slot_scores)
+
+        batches = self._split_batches(pending_ads, types, max_prompt_tokens, max_ads)
+        await asyncio.gather(*(run_one(b) for b in batches))
+        return scores
+
+    async def evaluate_matrix(
+        self,
+        ads: list[str] | str,
+        segments: list[str] | None = None,
+        max_prompt_tokens: int = MAX_BATCH_PROMPT_TOKENS,
+        max_ads: int = MAX_ADS_PER_BATCH,
+    ) -> EvaluationMatrix:
+        """
+        Оценивает объявления по всем сегментам (по умолчанию — все persona_types) конкурентно.
+        Общее время ≈ время самого медленного запроса, а не сумма по сегментам.
+        """
+        if isinstance(ads, str):
+            ads = [ads]
+        segments = list(segments) if segments is not None else list(persona_types)
+        matrix = EvaluationMatrix(segments=segments, ads=list(ads))
+
+        async def run_segment(segment: str) -> None:
+            errors: list[str] = []
+            matrix.scores[segment] = await self._arun_batch(
+                list(ads), [segment], max_prompt_tokens, max_ads, errors
+            )
+            if errors:
+                matrix.errors[segment] = errors
+
+        await asyncio.gather(*(run_segment(s) for s in segments))
+        return matrix
 
 
 if __name__ == "__main__":
@@ -64,7 +466,8 @@ if __name__ == "__main__":
 Ощути невероятную скорость, улучшенную камеру и долгий срок работы батареи.
 💥 Скидка 10% только сегодня!"""
 
-    result = tester.run_test(test_ad, ["low_income_pragmatic_youth"])
+    ad, scores = tester.run_test(test_ad, ["low_income_pragmatic_youth"])
 
-    print(result[0])
-    print(result[1])
\ No newline at end of file
+    print(ad)
+    print(scores)
+    print("Токенов в промпте:", tester.last_prompt_tokens)
\ No newline at end of file
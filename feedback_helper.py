@@ -1,7 +1,27 @@
 import json
+import re
+from collections import Counter
+from functools import lru_cache
+from statistics import mean, median
+from typing import Dict, List, Optional, Tuple
 
-with open('categorized_personas.json', 'r', encoding='utf-8') as f:
-    parsed = json.load(f) 
+import metrics
+
+personas_path = 'categorized_personas.json'
+
+
+@lru_cache(maxsize=1)
+def get_personas() -> Dict[str, List[Dict]]:
+    """Персоны читаются с диска при первом использовании, а не при импорте."""
+    with open(personas_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def __getattr__(name):
+    # обратная совместимость: feedback_helper.parsed
+    if name == "parsed":
+        return get_personas()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 ad = """iPhone 17 — твой следующий уровень технологий!
 Ощути невероятную скорость, улучшенную камеру и долгий срок работы батареи.
@@ -16,6 +36,7 @@ promt = """ PROMPT START
 Правила оценки:
 
 Анализируй поля каждой персоны: возрастной диапазон, пол, социальный статус, интересы, поведенческие паттерны, ценовую чувствительность и предпочитаемый канал.
+Если персоны даны распределением, проценты — доля персон группы с этим значением; учитывай их как веса.
 
 Учитывай соответствие рекламы интересам, стиль подачи, выгоду, цену, наличие скидки, эмоциональный тон.
 
@@ -33,16 +54,307 @@ purchase_probability: <число от 0 до 1>
 PROMPT END
 """
 
+# Пакетный вариант: одна группа персон, несколько объявлений в пронумерованных слотах.
+# Блок персон оплачивается один раз на пачку, а не на каждое объявление.
+batch_promt = """ PROMPT START
+Ты — система моделирования поведения пользователей в рекламе. Твоя задача — по описанию  персон и нескольких рекламных текстов предсказать эффективность КАЖДОЙ рекламы для группы независимо от остальных. Оценивай вероятность клика и вероятность покупки средними значениями по группе.
+
+Правила оценки:
+
+Анализируй поля каждой персоны: возрастной диапазон, пол, социальный статус, интересы, поведенческие паттерны, ценовую чувствительность и предпочитаемый канал.
+Если персоны даны распределением, проценты — доля персон группы с этим значением; учитывай их как веса.
+
+Учитывай соответствие рекламы интересам, стиль подачи, выгоду, цену, наличие скидки, эмоциональный тон.
+
+Ценовая чувствительность: ближе к 1 → сильно реагирует на цену, скидки; ближе к 0 → ориентирован на качество, ценник менее важен.
+
+Итоговые значения выдавай средние по группе в диапазоне от 0 до 1.
+
+Формат ответа строго такой (по две строки на каждую рекламу, в порядке номеров, без пояснений и лишнего текста):
+ad_1_click_probability: <число от 0 до 1>
+ad_1_purchase_probability: <число от 0 до 1>
+ad_2_click_probability: <число от 0 до 1>
+ad_2_purchase_probability: <число от 0 до 1>
+...
+
+Вот данные пользователей и реклама:
+ПЕРСОНЫ: {}
+{}
+PROMPT END
+"""
+
+_BATCH_SLOT = """РЕКЛАМА №{}:
+{}
+"""
+
+# Оценка по персонам: одна реклама, несколько пронумерованных персон, по паре чисел на каждую.
+# Усреднение по весам персон делается в коде (persona_sampling), а не моделью.
+persona_promt = """ PROMPT START
+Ты — система моделирования поведения пользователей в рекламе. Твоя задача — по описанию рекламного текста и нескольких персон предсказать реакцию КАЖДОЙ персоны на рекламу независимо от остальных. Оценивай вероятность клика и вероятность покупки для каждой персоны отдельно.
+
+Правила оценки:
+
+Анализируй поля персоны: возрастной диапазон, пол, социальный статус, интересы, поведенческие паттерны, ценовую чувствительность и предпочитаемый канал.
+
+Учитывай соответствие рекламы интересам, стиль подачи, выгоду, цену, наличие скидки, эмоциональный тон.
+
+Ценовая чувствительность: ближе к 1 → сильно реагирует на цену, скидки; ближе к 0 → ориентирован на качество, ценник менее важен.
+
+Значения выдавай в диапазоне от 0 до 1.
+
+Формат ответа строго такой (по две строки на каждую персону, в порядке номеров, без пояснений и лишнего текста):
+persona_1_click_probability: <число от 0 до 1>
+persona_1_purchase_probability: <число от 0 до 1>
+persona_2_click_probability: <число от 0 до 1>
+persona_2_purchase_probability: <число от 0 до 1>
+...
+
+Вот данные пользователей и реклама:
+ПЕРСОНЫ:
+{}
+РЕКЛАМА: {}
+PROMPT END
+"""
+
+# Форматы блока персон:
+#   "aggregate" — частоты атрибутов по группе (самый компактный, по умолчанию)
+#   "table"     — одна строка на персону, поля через ";", списки через ","
+#   "json"      — исходный json.dumps(indent=2), как раньше
+PERSONA_FORMATS = ("aggregate", "table", "json")
+DEFAULT_PERSONA_FORMAT = "aggregate"
+
+_CATEGORICAL_FIELDS = (
+    ("age_range", "возраст"),
+    ("gender", "пол"),
+    ("social", "соц. статус"),
+    ("preferred_channel", "канал"),
+)
+_LIST_FIELDS = (
+    ("interests", "интересы"),
+    ("behaviors", "поведение"),
+)
+_TABLE_HEADER = "age_range;gender;social;interests;behaviors;preferred_channel;price_sensitivity"
+
+
+# ==========================
+# Подсчёт токенов
+# ==========================
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:  # tiktoken не установлен или нет словаря — считаем приблизительно
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Число токенов промпта. С tiktoken — точно (o200k, как у gpt-4o-mini),
+    без него — оценка ~4 байта UTF-8 на токен (кириллица занимает 2 байта на символ).
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+# ==========================
+# Сериализация персон (кэшируется по сегментам)
+# ==========================
+
+@lru_cache(maxsize=None)
+def _segment_counts(segment: str) -> Tuple[int, Dict[str, Counter], Tuple[float, ...]]:
+    """Счётчики атрибутов одного сегмента — считаются один раз на процесс."""
+    people = get_personas()[segment]
+    counters: Dict[str, Counter] = {}
+    for field, _ in _CATEGORICAL_FIELDS:
+        counters[field] = Counter(p.get(field, "") for p in people)
+    for field, _ in _LIST_FIELDS:
+        counters[field] = Counter(v for p in people for v in p.get(field, []))
+    sensitivity = tuple(float(p.get("price_sensitivity", 0.5)) for p in people)
+    return len(people), counters, sensitivity
 
-def generate_prompt(ad, target_audiences):
-    for target_audience in target_audiences:
-        people = parsed[target_audience]
-        people_json = json.dumps(people, ensure_ascii=False, indent=2)
 
-    final = promt.format(people_json, ad)
-    
+def _format_counter(counter: Counter, total: int) -> str:
+    return ", ".join(f"{k} {round(100 * v / total)}%" for k, v in counter.most_common())
+
+
+@lru_cache(maxsize=256)
+def _aggregate_block(segments: Tuple[str, ...]) -> str:
+    """
+    Сводит несколько сегментов в одно распределение:
+    счётчики складываются, доли считаются от общего числа персон.
+    """
+    total = 0
+    merged: Dict[str, Counter] = {}
+    sensitivity: List[float] = []
+    for segment in segments:
+        n, counters, ps = _segment_counts(segment)
+        total += n
+        sensitivity.extend(ps)
+        for field, counter in counters.items():
+            merged.setdefault(field, Counter()).update(counter)
+
+    lines = [f"группа: {', '.join(segments)}; персон: {total}"]
+    for field, title in _CATEGORICAL_FIELDS + _LIST_FIELDS:
+        lines.append(f"{title}: {_format_counter(merged[field], total)}")
+    lines.append(
+        f"ценовая чувствительность: среднее {mean(sensitivity):.2f}, "
+        f"медиана {median(sensitivity):.2f}, "
+        f"диапазон {min(sensitivity):.2f}-{max(sensitivity):.2f}"
+    )
+    return "\n".join(lines)
+
+
+@lru_cache(maxsize=None)
+def _table_rows(segment: str) -> str:
+    return "\n".join(_table_row(p) for p in get_personas()[segment])
+
+
+@lru_cache(maxsize=None)
+def _json_block(segment: str) -> str:
+    return json.dumps(get_personas()[segment], ensure_ascii=False, indent=2)
+
+
+def serialize_personas(target_audiences, persona_format: str = DEFAULT_PERSONA_FORMAT) -> str:
+    """
+    Блок ПЕРСОНЫ для промпта по всем переданным сегментам (не только последнему).
+    Повторяющиеся сегменты учитываются один раз.
+    """
+    if persona_format not in PERSONA_FORMATS:
+        raise ValueError(f"Неизвестный формат персон: {persona_format}")
+
+    segments = tuple(dict.fromkeys(target_audiences))
+    if not segments:
+        raise ValueError("Нужен хотя бы один сегмент аудитории")
+
+    if persona_format == "aggregate":
+        return _aggregate_block(segments)
+    if persona_format == "table":
+        return _TABLE_HEADER + "\n" + "\n".join(_table_rows(s) for s in segments)
+
+    if len(segments) == 1:
+        return _json_block(segments[0])
+    people = [p for s in segments for p in get_personas()[s]]
+    return json.dumps(people, ensure_ascii=False, indent=2)
+
+
+def _table_row(p) -> str:
+    return ";".join([
+        p.get("age_range", ""),
+        p.get("gender", ""),
+        p.get("social", ""),
+        ",".join(p.get("interests", [])),
+        ",".join(p.get("behaviors", [])),
+        p.get("preferred_channel", ""),
+        f"{float(p.get('price_sensitivity', 0.5)):.2f}",
+    ])
+
+
+def persona_key(p) -> str:
+    """Ключ персоны для кэша оценок: оценка зависит только от её атрибутов."""
+    return "persona:" + _table_row(p)
+
+
+def serialize_numbered_personas(personas) -> str:
+    """Персоны по строке с номером — номер совпадает с persona_<номер> в ответе."""
+    lines = ["n;" + _TABLE_HEADER]
+    for i, p in enumerate(personas, start=1):
+        lines.append(f"{i};{_table_row(p)}")
+    return "\n".join(lines)
+
+
+def generate_persona_prompt(ad, personas, with_token_count=False):
+    final = persona_promt.format(serialize_numbered_personas(personas), ad)
+
+    if with_token_count:
+        return final, count_tokens(final)
+    return final
+
+
+def generate_prompt(ad, target_audiences, persona_format=DEFAULT_PERSONA_FORMAT, with_token_count=False):
+    people_block = serialize_personas(target_audiences, persona_format)
+
+    final = promt.format(people_block, ad)
+
+    if with_token_count:
+        return final, count_tokens(final)
+    return final
+
+
+def format_batch_slots(ads, start: int = 1) -> List[str]:
+    return [_BATCH_SLOT.format(i, a) for i, a in enumerate(ads, start=start)]
+
+
+def generate_batch_prompt(ads, target_audiences, persona_format=DEFAULT_PERSONA_FORMAT, with_token_count=False):
+    people_block = serialize_personas(target_audiences, persona_format)
+
+    final = batch_promt.format(people_block, "\n".join(format_batch_slots(ads)))
+
+    if with_token_count:
+        return final, count_tokens(final)
     return final
 
-    
+
+# ==========================
+# Разбор ответа LLM
+# ==========================
+
+_NUMBER = r"([01](?:[.,]\d+)?|[.,]\d+)"
+_SCORE_RE = re.compile(r"(click|purchase)_probability\s*[:=]\s*" + _NUMBER, re.IGNORECASE)
+_BATCH_SCORE_RE = re.compile(r"ad_(\d+)_(click|purchase)_probability\s*[:=]\s*" + _NUMBER, re.IGNORECASE)
+_PERSONA_SCORE_RE = re.compile(r"persona_(\d+)_(click|purchase)_probability\s*[:=]\s*" + _NUMBER, re.IGNORECASE)
+
+
+def _to_probability(raw: str) -> float:
+    return max(0.0, min(1.0, float(raw.replace(",", "."))))
+
+
+def parse_scores(text: str) -> Optional[Dict[str, float]]:
+    """
+    Разбирает ответ вида "click_probability: 0.4 / purchase_probability: 0.1".
+    Возвращает None, если какой-то из двух чисел не нашёлся.
+    """
+    found = {f"{kind.lower()}_probability": _to_probability(value) for kind, value in _SCORE_RE.findall(text)}
+    if "click_probability" not in found or "purchase_probability" not in found:
+        metrics.inc("genai4_llm_parse_failures_total", provider="adtest", kind="single")
+        return None
+    return found
+
+
+def _parse_slots(pattern, text: str, n: int, kind: str) -> List[Optional[Dict[str, float]]]:
+    slots: Dict[int, Dict[str, float]] = {}
+    for idx, name, value in pattern.findall(text):
+        slots.setdefault(int(idx), {})[f"{name.lower()}_probability"] = _to_probability(value)
+
+    result: List[Optional[Dict[str, float]]] = []
+    for i in range(1, n + 1):
+        scores = slots.get(i)
+        if scores and "click_probability" in scores and "purchase_probability" in scores:
+            result.append(scores)
+        else:
+            metrics.inc("genai4_llm_parse_failures_total", provider="adtest", kind=kind)
+            result.append(None)
+    return result
+
+
+def parse_batch_scores(text: str, n_ads: int) -> List[Optional[Dict[str, float]]]:
+    """
+    Разбирает пакетный ответ: по паре чисел на каждый слот ad_<номер>.
+    Слоты без полной пары возвращаются как None.
+    """
+    return _parse_slots(_BATCH_SCORE_RE, text, n_ads, "batch_slot")
+
+
+def parse_persona_scores(text: str, n_personas: int) -> List[Optional[Dict[str, float]]]:
+    """То же для ответа на persona_promt: пара чисел на каждую persona_<номер>."""
+    return _parse_slots(_PERSONA_SCORE_RE, text, n_personas, "persona_slot")
+
+
 if __name__ == "__main__":
-    generate_prompt(ad,['low_income_pragmatic_youth'])
\ No newline at end of file
+    segments = ['health_wellness_enthusiasts']
+    for fmt in PERSONA_FORMATS:
+        _, tokens = generate_prompt(ad, segments, persona_format=fmt, with_token_count=True)
+        print(f"{fmt:<10} токенов в промпте: {tokens}")
@@ -0,0 +1,480 @@
+"""
+Локальная очередь фоновых задач на SQLite — без внешнего брокера.
+
+Долгая генерация больше не живёт внутри браузерной сессии Streamlit:
+интерфейс кладёт кампанию в очередь и получает job_id, а выполняют её
+отдельные процессы-воркеры. Перезапуск скрипта или закрытая вкладка
+работу не убивают; интерфейс лишь опрашивает статус и забирает результат.
+
+Готовые задачи с теми же параметрами переиспользуются между сессиями:
+submit() вернёт id уже выполненной (или ещё выполняющейся) задачи.
+Генерация пишется в журнал (journal.py) по хэшу параметров: задача, брошенная
+упавшим воркером или упавшая сама, при повторе не платит за уже готовые товары.
+Результаты кампании пишутся потоково в RESULTS_DIR/<job_id>-<попытка>.ndjson.gz
+(sinks.py): память воркера и строка в SQLite не растут с размером каталога.
+
+Пока обработчик работает, фоновый поток воркера раз в HEARTBEAT_INTERVAL обновляет
+heartbeat — задача, долго ждущая провайдера, не считается брошенной. Все записи
+воркера о задаче идут с условием worker = <его id>: если задачу всё же отдали
+другому воркеру, прежний останавливается на следующем товаре и ничего не публикует.
+
+Воркеры и webapp делят лимиты провайдеров через scheduler_db_path(db) рядом с jobs.db:
+интерактивные запросы интерфейса идут раньше фоновых задач всех воркеров, а сумма
+запросов всех процессов не превышает лимит провайдера (scheduler.share_across_processes).
+
+Запуск воркеров отдельно от веб-приложения:
+    python jobqueue.py --workers 2
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from scheduler import BATCH, call_context, share_across_processes
+
+DEFAULT_DB_PATH = os.getenv("JOBS_DB", "jobs.db")
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journals")
+RESULTS_DIR = os.getenv("JOB_RESULTS_DIR", "job_results")
+POLL_INTERVAL = 1.0
+# running-задача без heartbeat дольше этого времени считается брошенной (воркер упал)
+STALE_AFTER = 300.0
+# как часто воркер подтверждает, что жив и выполняет задачу (много меньше STALE_AFTER)
+HEARTBEAT_INTERVAL = 30.0
+# как часто воркер возвращает в очередь брошенные задачи (не только при своём старте)
+REQUEUE_INTERVAL = 60.0
+# как часто процесс-надзиратель проверяет воркеров и родителя (--parent-pid)
+SUPERVISE_INTERVAL = 1.0
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    params_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    progress_done INTEGER NOT NULL DEFAULT 0,
+    progress_total INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_params_hash ON jobs (kind, params_hash);
+"""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    params: Dict[str, Any]
+    status: str
+    result: Optional[Any]
+    error: Optional[str]
+    progress_done: int
+    progress_total: int
+    cancel_requested: bool
+    worker: Optional[str]
+    created: float
+    started: Optional[float]
+    finished: Optional[float]
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+
+class JobLost(RuntimeError):
+    """Задачу вернули в очередь и отдали другому воркеру — результат этого уже не нужен."""
+
+
+def scheduler_db_path(db_path: str = DEFAULT_DB_PATH) -> str:
+    """Общие корзины планировщика для процессов, работающих с этой очередью."""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "scheduler.db")
+
+
+def _params_hash(kind: str, params: Dict[str, Any]) -> str:
+    raw = json.dumps({"kind": kind, "params": params}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _has_failures(result: Optional[str]) -> bool:
+    parsed = json.loads(result) if result else None
+    return isinstance(parsed, dict) and bool(parsed.get("failed"))
+
+
+class JobQueue:
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None — транзакции управляются явно (BEGIN IMMEDIATE в claim)
+        conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            kind=row["kind"],
+            params=json.loads(row["params"]),
+            status=row["status"],
+            result=json.loads(row["result"]) if row["result"] else None,
+            error=row["error"],
+            progress_done=row["progress_done"],
+            progress_total=row["progress_total"],
+            cancel_requested=bool(row["cancel_requested"]),
+            worker=row["worker"],
+            created=row["created"],
+            started=row["started"],
+            finished=row["finished"],
+        )
+
+    # --- API для интерфейса ---
+
+    def submit(self, kind: str, params: Dict[str, Any], reuse: bool = True) -> str:
+        """
+        Ставит задачу в очередь и возвращает её id.
+        reuse=True: если такая же задача уже выполнена или выполняется — вернуть её id.
+        running-задача без свежего heartbeat (воркер упал) не переиспользуется, как и
+        выполненная с неудачными товарами (run["failed"]) — повтор догенерирует их по журналу.
+        """
+        if kind not in HANDLERS:
+            raise ValueError(f"Неизвестный тип задачи: {kind}")
+        phash = _params_hash(kind, params)
+        with closing(self._connect()) as conn:
+            if reuse:
+                row = conn.execute(
+                    "SELECT id, status, result FROM jobs WHERE kind = ? AND params_hash = ? "
+                    "AND (status IN (?, ?) OR (status = ? AND heartbeat >= ?)) "
+                    "ORDER BY created DESC LIMIT 1",
+                    (kind, phash, DONE, QUEUED, RUNNING, time.time() - STALE_AFTER),
+                ).fetchone()
+                if row is not None and not (row["status"] == DONE and _has_failures(row["result"])):
+                    return row["id"]
+
+            job_id = uuid.uuid4().hex[:12]
+            conn.execute(
+                "INSERT INTO jobs (id, kind, params, params_hash, status, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), phash, QUEUED, time.time()),
+            )
+            return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 20) -> List[Job]:
+        query = "SELECT * FROM jobs"
+        args: tuple = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            args = (status,)
+        query += " ORDER BY created DESC LIMIT ?"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, args + (limit,)).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    def cancel(self, job_id: str) -> None:
+        """queued-задача отменяется сразу, running — по флагу, который воркер проверяет между товарами."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?",
+                (CANCELLED, now, job_id, QUEUED),
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+                (job_id, RUNNING),
+            )
+
+    # --- API для воркеров ---
+
+    def claim(self, worker_id: str) -> Optional[Job]:
+        """Атомарно забирает самую старую queued-задачу."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started = ?, heartbeat = ? WHERE id = ?",
+                (RUNNING, worker_id, now, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return self.get(row["id"])
+
+    # Записи воркера — только пока задача running и числится за ним (worker = ?).
+    # False — строка не изменилась: задачу вернули в очередь и, возможно, уже отдали другому.
+
+    def _update_owned(self, job_id: str, worker_id: str, assignments: str, args: tuple) -> bool:
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND worker = ? AND status = ?",
+                args + (job_id, worker_id, RUNNING),
+            )
+            return cur.rowcount > 0
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        return self._update_owned(job_id, worker_id, "heartbeat = ?", (time.time(),))
+
+    def update_progress(self, job_id: str, worker_id: str, done: int, total: int) -> bool:
+        return self._update_owned(
+            job_id, worker_id, "progress_done = ?, progress_total = ?, heartbeat = ?", (done, total, time.time())
+        )
+
+    def is_cancel_requested(self, job_id: str, worker_id: Optional[str] = None) -> bool:
+        """Отмена из интерфейса; с worker_id — также задача, которая больше не числится за ним."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT cancel_requested, status, worker FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return True
+        if worker_id is not None and (row["status"] != RUNNING or row["worker"] != worker_id):
+            return True
+        return bool(row["cancel_requested"])
+
+    def finish(self, job_id: str, worker_id: str, result: Any, status: str = DONE) -> bool:
+        return self._update_owned(
+            job_id, worker_id, "status = ?, result = ?, finished = ?",
+            (status, json.dumps(result, ensure_ascii=False), time.time()),
+        )
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        return self._update_owned(job_id, worker_id, "status = ?, error = ?, finished = ?", (FAILED, error, time.time()))
+
+    def requeue_stale(self, stale_after: float = STALE_AFTER) -> int:
+        """Возвращает в очередь running-задачи, у которых давно не было heartbeat."""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat < ?",
+                (QUEUED, RUNNING, time.time() - stale_after),
+            )
+            return cur.rowcount
+
+
+# ==========================
+# ОБРАБОТЧИКИ ЗАДАЧ
+# ==========================
+
+def run_campaign_job(queue: JobQueue, job: Job) -> Any:
+    """
+    params: {"records": [...], "user_text": str, "use_mistral": bool, "max_workers": int}
+    Результат — run-словарь campaign.run_campaign без results/errors: сами результаты
+    в run["output"] (NDJSON), полный run-словарь собирает load_campaign_run.
+    """
+    from campaign import MAX_WORKERS, run_campaign
+    from journal import Journal
+    from prompt import default_creative_index, get_generator
+    from sinks import NdjsonSink
+
+    params = job.params
+    generator = get_generator(params.get("use_mistral", True), index=default_creative_index())
+    last_beat = [0.0]
+    lost = [False]
+
+    def on_progress(done: int, total: int) -> None:
+        # не чаще раза в полсекунды — иначе SQLite станет узким местом на больших каталогах
+        now = time.monotonic()
+        if now - last_beat[0] >= 0.5 or done == total:
+            last_beat[0] = now
+            if not queue.update_progress(job.id, job.worker, done, total):
+                lost[0] = True
+
+    def should_cancel() -> bool:
+        return lost[0] or queue.is_cancel_requested(job.id, job.worker)
+
+    if not queue.update_progress(job.id, job.worker, 0, len(params["records"])):
+        raise JobLost(job.id)
+    journal = Journal(os.path.join(JOURNAL_DIR, f"{job.kind}-{_params_hash(job.kind, params)[:16]}.jsonl"))
+    # свой файл на попытку: прежний владелец задачи, если ещё жив, не пишет в файл нового
+    sink = NdjsonSink(os.path.join(RESULTS_DIR, f"{job.id}-{uuid.uuid4().hex[:8]}.ndjson.gz"))
+    try:
+        run = run_campaign(
+            params["records"],
+            params.get("user_text", ""),
+            generator,
+            max_workers=params.get("max_workers", MAX_WORKERS),
+            on_progress=on_progress,
+            should_cancel=should_cancel,
+            journal=journal,
+            sink=sink,
+        )
+        # задачу успели передать другому воркеру — публиковать нечего, файл у нового владельца свой
+        if lost[0] or not queue.heartbeat(job.id, job.worker):
+            raise JobLost(job.id)
+    except BaseException:
+        sink.abort()
+        raise
+    finally:
+        journal.close()
+    # отменённая задача тоже публикуется: в файле всё, что успели сгенерировать
+    sink.close()
+    return run
+
+
+HANDLERS: Dict[str, Callable[[JobQueue, Job], Any]] = {
+    "campaign": run_campaign_job,
+}
+
+
+def load_campaign_run(job: Job) -> Dict[str, Any]:
+    """Результат campaign-задачи в формате run-словаря webapp (индексы снова int)."""
+    from campaign import load_run_output
+
+    run = load_run_output(dict(job.result or {}))
+    run["results"] = {int(k): v for k, v in run.get("results", {}).items()}
+    run["errors"] = {int(k): v for k, v in run.get("errors", {}).items()}
+    return run
+
+
+# ==========================
+# ВОРКЕРЫ
+# ==========================
+
+class _Heartbeat:
+    """Фоновый поток: heartbeat задачи, пока работает её обработчик."""
+
+    def __init__(self, queue: JobQueue, job: Job, interval: Optional[float] = None):
+        self.queue = queue
+        self.job = job
+        self.interval = HEARTBEAT_INTERVAL if interval is None else interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{job.id}", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.job.id, self.job.worker):
+                    # задача уже не наша: обработчик узнает об этом через should_cancel
+                    return
+            except sqlite3.Error as e:
+                # база занята или недоступна — следующая попытка через interval
+                print(f"heartbeat задачи {self.job.id} не записан: {e}")
+
+    def __enter__(self) -> "_Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def worker_loop(db_path: str = DEFAULT_DB_PATH, poll_interval: float = POLL_INTERVAL, max_jobs: Optional[int] = None) -> None:
+    queue = JobQueue(db_path)
+    worker_id = f"{os.uname().nodename if hasattr(os, 'uname') else 'local'}:{os.getpid()}"
+    share_across_processes(scheduler_db_path(db_path))
+    last_requeue = float("-inf")
+
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        # задачи упавших соседей возвращаются в очередь, пока жив хоть один воркер
+        if time.monotonic() - last_requeue >= REQUEUE_INTERVAL:
+            last_requeue = time.monotonic()
+            queue.requeue_stale()
+        job = queue.claim(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        print(f"[{worker_id}] задача {job.id} ({job.kind})")
+        try:
+            # фоновая работа уступает интерактивным запросам, задачи чередуются между собой
+            with _Heartbeat(queue, job), call_context(priority=BATCH, tenant=f"job:{job.id}"):
+                result = HANDLERS[job.kind](queue, job)
+            cancelled = isinstance(result, dict) and result.get("done") is False
+            owned = queue.finish(job.id, worker_id, result, status=CANCELLED if cancelled else DONE)
+        except JobLost:
+            owned = False
+        except Exception:
+            owned = queue.fail(job.id, worker_id, traceback.format_exc(limit=5))
+        if not owned:
+            print(f"[{worker_id}] задача {job.id} передана другому воркеру — результат не записан")
+        processed += 1
+
+
+def _start_worker(db_path: str) -> multiprocessing.Process:
+    # spawn, а не fork: родитель (Streamlit) многопоточный, fork из него небезопасен
+    p = multiprocessing.get_context("spawn").Process(target=worker_loop, args=(db_path,), daemon=True)
+    p.start()
+    return p
+
+
+def start_workers(n: int, db_path: str = DEFAULT_DB_PATH) -> List[multiprocessing.Process]:
+    """Запускает n процессов-воркеров."""
+    return [_start_worker(db_path) for _ in range(n)]
+
+
+def supervise_workers(
+    processes: List[multiprocessing.Process],
+    db_path: str = DEFAULT_DB_PATH,
+    parent_pid: Optional[int] = None,
+) -> None:
+    """
+    Перезапускает упавших воркеров. С parent_pid — выходит, когда родитель
+    (сервер Streamlit) завершился: воркеры не остаются сиротами.
+    """
+    try:
+        while True:
+            if parent_pid is not None and os.getppid() != parent_pid:
+                print("Родительский процесс завершился — останавливаем воркеров")
+                return
+            for i, p in enumerate(processes):
+                if not p.is_alive():
+                    print(f"Воркер {p.pid} завершился (код {p.exitcode}) — перезапуск")
+                    processes[i] = _start_worker(db_path)
+            time.sleep(SUPERVISE_INTERVAL)
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Воркеры локальной очереди задач GENAI-4")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--parent-pid", type=int, default=None,
+                        help="завершиться вместе с этим процессом (так воркеров запускает webapp)")
+    args = parser.parse_args()
+
+    procs = start_workers(args.workers, args.db)
+    print(f"Запущено воркеров: {len(procs)} (очередь: {args.db})")
+    try:
+        supervise_workers(procs, args.db, parent_pid=args.parent_pid)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,148 @@
+"""
+Журнал выполненной работы для возобновления долгих прогонов.
+
+Каждый платный шаг (генерация AdGenerator, вызов LLM в AdTest, скоринг товара
+ProductAnalyzer, оценка варианта) — это work item со стабильным id: хэш вида
+работы и её входа. Результат дописывается в JSONL-файл сразу после выполнения
+(append-only, flush + fsync), поэтому падение или упор в лимиты на 4000-м товаре
+теряет только незавершённые элементы.
+
+При перезапуске журнал читается целиком; выполненные элементы берутся из него,
+заново выполняются только упавшие и недоделанные. Последняя запись по id главнее,
+обрезанная при падении последняя строка пропускается.
+
+    journal = Journal("run.journal.jsonl")
+    scored = journal.run(work_id("analyze", product), "analyze", lambda: analyzer.score_product(product, trend))
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+DONE, FAILED = "done", "failed"
+
+
+def work_id(kind: str, *parts: Any) -> str:
+    """Стабильный id: одинаковый вход — одинаковый id в любом процессе и после перезапуска."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return f"{kind}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:24]}"
+
+
+class Journal:
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        # id -> последняя запись
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self.corrupt_lines = 0
+        self._replay()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _replay(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # строка, недописанная при падении процесса
+                    self.corrupt_lines += 1
+                    continue
+                self._entries[entry["id"]] = entry
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._entries[entry["id"]] = entry
+
+    # --- чтение ---
+
+    def status(self, item_id: str) -> Optional[str]:
+        entry = self._entries.get(item_id)
+        return entry["status"] if entry else None
+
+    def is_done(self, item_id: str) -> bool:
+        return self.status(item_id) == DONE
+
+    def output(self, item_id: str) -> Any:
+        entry = self._entries.get(item_id)
+        if entry is None or entry["status"] != DONE:
+            raise KeyError(item_id)
+        return entry["output"]
+
+    def outputs(self, kind: Optional[str] = None) -> Iterator[Tuple[str, Any]]:
+        """(id, результат) всех выполненных элементов — для сборки итогов из журнала."""
+        for item_id, entry in list(self._entries.items()):
+            if entry["status"] == DONE and (kind is None or entry["kind"] == kind):
+                yield item_id, entry["output"]
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        counts: Dict[str, Dict[str, int]] = {}
+        for entry in list(self._entries.values()):
+            by_status = counts.setdefault(entry["kind"], {DONE: 0, FAILED: 0})
+            by_status[entry["status"]] = by_status.get(entry["status"], 0) + 1
+        return counts
+
+    # --- запись ---
+
+    def record_done(self, item_id: str, kind: str, output: Any) -> None:
+        self._append({"id": item_id, "kind": kind, "status": DONE, "ts": time.time(), "output": output})
+
+    def record_failed(self, item_id: str, kind: str, error: str) -> None:
+        attempts = self._entries.get(item_id, {}).get("attempts", 0) + 1
+        self._append({
+            "id": item_id, "kind": kind, "status": FAILED, "ts": time.time(),
+            "error": error, "attempts": attempts,
+        })
+
+    def run(self, item_id: str, kind: str, compute: Callable[[], Any]) -> Any:
+        """Результат из журнала, если элемент уже выполнен; иначе выполнить и записать."""
+        entry = self._entries.get(item_id)
+        if entry is not None and entry["status"] == DONE:
+            return entry["output"]
+        try:
+            output = compute()
+        except Exception as e:
+            self.record_failed(item_id, kind, str(e))
+            raise
+        self.record_done(item_id, kind, output)
+        return output
+
+    async def arun(self, item_id: str, kind: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(item_id)
+        if entry is not None and entry["status"] == DONE:
+            return entry["output"]
+        try:
+            output = await compute()
+        except Exception as e:
+            self.record_failed(item_id, kind, str(e))
+            raise
+        self.record_done(item_id, kind, output)
+        return output
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,166 @@
+"""
+Нагрузочный генератор для service.py: меряет запросы в секунду и задержки.
+
+По умолчанию бьёт по запущенному сервису:
+    python service.py --port 8000 &
+    python loadgen.py --url http://127.0.0.1:8000 --endpoint evaluate --concurrency 64 --requests 5000
+
+--inprocess гоняет приложение прямо в этом процессе через ASGI-транспорт httpx,
+без сети и без отдельного сервера — удобно для быстрой проверки батчинга.
+/generate по умолчанию идёт через MockLLMClient (--use-mistral — реальный API).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import httpx
+
+SEGMENTS = [
+    "low_income_pragmatic_youth",
+    "health_wellness_enthusiasts",
+    "financially_conservative_adults",
+]
+
+AD_TEMPLATES = [
+    "{name} — новинка сезона! Скидка 20% только сегодня.",
+    "{name}. Хит продаж, бесплатная доставка по всей России.",
+    "{name}. Надёжно, практично, выгодно. Купить онлайн.",
+]
+
+PRODUCT_NAMES = ["iPhone 17", "Фитнес-браслет", "Кофемашина", "Рюкзак для ноутбука"]
+
+
+def make_payload(endpoint: str, i: int, batch: int, unique: bool, use_mistral: bool) -> Dict[str, Any]:
+    rng = random.Random(i)
+    if endpoint == "evaluate":
+        ads = []
+        for j in range(batch):
+            text = rng.choice(AD_TEMPLATES).format(name=rng.choice(PRODUCT_NAMES))
+            # уникальный суффикс обходит кэш оценок — меряем сам оценщик, а не кэш
+            ads.append(f"{text} #{i}-{j}" if unique else text)
+        return {"ads": ads, "segments": [rng.choice(SEGMENTS)]}
+    if endpoint == "generate":
+        records = [
+            {
+                "name": rng.choice(PRODUCT_NAMES),
+                "category": "электроника",
+                "price": 1000 + rng.randint(0, 9000),
+                "market_cost": 800,
+                "description": "Тестовый товар нагрузочного прогона.",
+            }
+            for _ in range(batch)
+        ]
+        return {"records": records, "use_mistral": use_mistral, "stream": True}
+    raise ValueError(f"Неизвестный эндпоинт: {endpoint}")
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    total_requests: int,
+    concurrency: int,
+    batch: int = 1,
+    unique: bool = True,
+    use_mistral: bool = False,
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    items = 0
+    counter = iter(range(total_requests))
+
+    async def worker() -> None:
+        nonlocal items
+        for i in counter:
+            payload = make_payload(endpoint, i, batch, unique, use_mistral)
+            start = time.perf_counter()
+            try:
+                async with client.stream("POST", f"/{endpoint}", json=payload) as response:
+                    body = await response.aread()
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    if endpoint == "generate":
+                        items += sum(1 for line in body.splitlines() if line.strip())
+                    else:
+                        items += len(json.loads(body)["items"])
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ok = statuses.get(200, 0)
+    return {
+        "endpoint": endpoint,
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "batch": batch,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(total_requests / elapsed, 1) if elapsed else 0.0,
+        "ok_rps": round(ok / elapsed, 1) if elapsed else 0.0,
+        "items_per_s": round(items / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 2),
+            "max": round(max(latencies, default=0.0) * 1000, 2),
+        },
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.inprocess:
+        from service import app
+
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://service", timeout=args.timeout)
+    else:
+        client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout)
+
+    async with client:
+        report = await run_load(
+            client,
+            args.endpoint,
+            args.requests,
+            args.concurrency,
+            batch=args.batch,
+            unique=not args.cached,
+            use_mistral=args.use_mistral,
+        )
+        health = await client.get("/health")
+        if health.status_code == 200:
+            report["service"] = health.json()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест HTTP-сервиса GENAI-4")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=["evaluate", "generate"], default="evaluate")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch", type=int, default=1, help="объявлений/товаров в одном запросе")
+    parser.add_argument("--cached", action="store_true", help="повторять тексты (проверка кэша оценок)")
+    parser.add_argument("--use-mistral", action="store_true")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--inprocess", action="store_true", help="без сервера, через ASGI-транспорт")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(main_async(args)), ensure_ascii=False, indent=2))
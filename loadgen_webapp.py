@@ -0,0 +1,357 @@
+"""
+Нагрузочный тест Streamlit-приложения (webapp.py): сколько маркетологов
+одновременно выдерживает один процесс, прежде чем задержки начинают расти.
+
+Каждый пользователь — отдельная сессия streamlit.testing.v1.AppTest в своём потоке
+этого же процесса, как сессии браузеров в одном сервере Streamlit: общие
+cache_resource/cache_data, общий scheduler, один GIL. Сценарий пользователя:
+
+  open      — первая отрисовка страницы
+  upload    — загрузка своего каталога и текста инструкций
+  generate  — «Начать генерацию», до конца генерации всего каталога
+  rerender  — перезапуск скрипта с готовыми результатами в session_state
+
+LLM — Mistral-совместимый стенд-сервер из benchmark.py с заданной задержкой
+(настоящий MistralClient, httpx, scheduler), либо MockLLMClient (--mock).
+Лимиты провайдера в scheduler снимаются: меряем приложение, а не RPM
+(--provider-limits — оставить как в проде).
+
+Уровни параллельности прогоняются по очереди. На каждом уровне — процентили
+задержки по видам действий, пропускная способность, прирост RSS на сессию и
+сколько памяти осталось после закрытия сессий. Точка насыщения — первый уровень,
+после которого пропускная способность растёт меньше чем на SATURATION_GAIN,
+или где p95 генерации превышает --p95-budget.
+
+Запуск:
+    python loadgen_webapp.py --levels 1,2,4,8,16 --catalog-size 10 --llm-latency 0.2
+    python loadgen_webapp.py --levels 1,4,16 --mock --out webapp_load.json
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmark import StandinServer, synthetic_catalog
+from loadgen import _percentile
+
+WEBAPP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "webapp.py")
+INTERACTIONS = ["open", "upload", "generate", "rerender"]
+DEFAULT_LEVELS = "1,2,4,8,16"
+SATURATION_GAIN = 0.10   # прирост пропускной способности ниже 10% — дальше только очередь
+USER_INSTRUCTIONS = "Фокус на выгоде, без жёсткого давления."
+
+
+def _rss_mb() -> float:
+    """Текущий RSS процесса; без /proc (macOS, Windows) — пиковый из getrusage."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _latency_ms(values: List[float]) -> Dict[str, float]:
+    return {
+        "n": len(values),
+        "p50": round(_percentile(values, 0.50) * 1000, 1),
+        "p90": round(_percentile(values, 0.90) * 1000, 1),
+        "p95": round(_percentile(values, 0.95) * 1000, 1),
+        "p99": round(_percentile(values, 0.99) * 1000, 1),
+        "max": round(max(values, default=0.0) * 1000, 1),
+    }
+
+
+def _patch_app_test_for_concurrency() -> None:
+    """
+    AppTest рассчитан на одну сессию за раз, а здесь их десятки в потоках одного процесса.
+
+    Runtime: каждый run() кладёт свой mock-Runtime в глобальный Runtime._instance и
+    обнуляет его в конце — параллельная сессия посреди перезапуска падает с
+    "Runtime hasn't been created!". Пока глобальный пуст, отдаём последний созданный:
+    для сессий одного процесса они взаимозаменяемы, как единственный Runtime сервера.
+
+    ScriptCache: каждый run() заново компилирует webapp.py, а ast.parse из нескольких
+    потоков в CPython 3.11 падает (SystemError: AST constructor recursion depth mismatch).
+    Настоящий сервер компилирует скрипт один раз на все сессии — так и делаем.
+    """
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    last: List[Any] = [None]
+
+    def instance(cls):
+        if cls._instance is not None:
+            last[0] = cls._instance
+        if last[0] is None:
+            raise RuntimeError("Runtime hasn't been created!")
+        return last[0]
+
+    def exists(cls) -> bool:
+        return cls._instance is not None or last[0] is not None
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+    shared_cache = ScriptCache()
+    compile_lock = threading.Lock()
+    get_bytecode = ScriptCache.get_bytecode
+
+    def shared_bytecode(self, script_path: str):
+        with compile_lock:
+            return get_bytecode(shared_cache, script_path)
+
+    ScriptCache.get_bytecode = shared_bytecode
+
+
+class SimulatedUser:
+    """Одна сессия приложения: сценарий open → upload → generate → rerender."""
+
+    def __init__(self, user_id: int, catalog: List[Dict[str, Any]], mock: bool, max_workers: int, timeout: float):
+        from streamlit.testing.v1 import AppTest
+
+        self.user_id = user_id
+        self.catalog_bytes = json.dumps(catalog, ensure_ascii=False).encode("utf-8")
+        self.catalog_size = len(catalog)
+        self.mock = mock
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.app = AppTest.from_file(WEBAPP_PATH, default_timeout=timeout)
+        self.timings: List[Tuple[str, float]] = []
+        self.errors: List[Tuple[str, str]] = []
+
+    def _step(self, name: str, action) -> bool:
+        t0 = time.perf_counter()
+        try:
+            action()
+        except Exception as e:
+            self.errors.append((name, f"{type(e).__name__}: {e}"))
+            return False
+        self.timings.append((name, time.perf_counter() - t0))
+        if self.app.exception:
+            self.errors.append((name, self.app.exception[0].value))
+            return False
+        return True
+
+    def _upload(self) -> None:
+        at = self.app
+        if self.mock:
+            at.sidebar.checkbox[0].uncheck()
+        at.sidebar.slider[0].set_value(self.max_workers)
+        at.text_area[0].input(USER_INSTRUCTIONS)
+        at.file_uploader[0].set_value((f"catalog-{self.user_id}.json", self.catalog_bytes, "application/json"))
+        at.run()
+
+    def _generate(self) -> None:
+        at = self.app
+        button = next(b for b in at.button if "Начать генерацию" in b.label)
+        button.click().run()
+        run = at.session_state["generation_result"]
+        if not run["done"] or run["errors"] or len(run["results"]) != self.catalog_size:
+            raise RuntimeError(
+                f"готово {len(run['results'])} из {self.catalog_size}, ошибок {len(run['errors'])}"
+            )
+
+    def _rerender(self) -> None:
+        # любой виджет перезапускает скрипт; результаты рисуются из session_state
+        checkbox = next(c for c in self.app.checkbox if c.label == "Показать пример JSON")
+        checkbox.check().run()
+
+    def run(self, start: threading.Barrier) -> None:
+        start.wait()
+        _ = (
+            self._step("open", self.app.run)
+            and self._step("upload", self._upload)
+            and self._step("generate", self._generate)
+            and self._step("rerender", self._rerender)
+        )
+
+
+def run_level(
+    users: int,
+    catalog_size: int,
+    mock: bool,
+    max_workers: int,
+    timeout: float,
+    unique_catalogs: bool = True,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """users сессий одновременно; задержки по действиям, пропускная способность, память."""
+    gc.collect()
+    rss_before = _rss_mb()
+    sessions = [
+        SimulatedUser(
+            i,
+            synthetic_catalog(catalog_size, seed=seed + (i if unique_catalogs else 0)),
+            mock,
+            max_workers,
+            timeout,
+        )
+        for i in range(users)
+    ]
+    start = threading.Barrier(users + 1)
+    threads = [threading.Thread(target=s.run, args=(start,), daemon=True) for s in sessions]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    # сессии ещё живы (session_state с результатами) — это память «открытых вкладок»
+    gc.collect()
+    rss_live = _rss_mb()
+
+    by_interaction: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    samples: List[str] = []
+    for s in sessions:
+        for name, seconds in s.timings:
+            by_interaction[name].append(seconds)
+        for name, error in s.errors:
+            errors[name] += 1
+            if len(samples) < 5:
+                samples.append(f"{name}: {error}")
+    completed = sum(1 for s in sessions if not s.errors)
+
+    del sessions, threads
+    gc.collect()
+    rss_after = _rss_mb()
+
+    return {
+        "users": users,
+        "elapsed_s": round(elapsed, 3),
+        "completed_users": completed,
+        "sessions_per_min": round(completed / elapsed * 60, 1) if elapsed else 0.0,
+        "products_per_s": round(completed * catalog_size / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {name: _latency_ms(by_interaction[name]) for name in INTERACTIONS},
+        "errors": dict(errors),
+        "error_samples": samples,
+        "memory_mb": {
+            "rss_before": round(rss_before, 1),
+            "rss_live": round(rss_live, 1),
+            "per_session": round((rss_live - rss_before) / users, 2),
+            "retained_after_close": round(rss_after - rss_before, 1),
+        },
+    }
+
+
+def find_saturation(levels: List[Dict[str, Any]], p95_budget_ms: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Точка насыщения — последний уровень, на котором добавление пользователей ещё
+    заметно увеличивало пропускную способность, а p95 генерации укладывался в бюджет.
+    """
+    max_users, reason = levels[-1]["users"], None
+    for i, level in enumerate(levels):
+        p95 = level["latency_ms"]["generate"]["p95"]
+        if p95_budget_ms is not None and p95 > p95_budget_ms:
+            max_users = levels[i - 1]["users"] if i else 0
+            reason = f"p95 генерации {p95} мс при {level['users']} пользователях"
+            break
+        if i == 0:
+            continue
+        prev = levels[i - 1]["products_per_s"]
+        gain = (level["products_per_s"] - prev) / prev if prev else 0.0
+        if gain < SATURATION_GAIN:
+            max_users = levels[i - 1]["users"]
+            reason = f"пропускная способность {gain:+.0%} при {level['users']} пользователях"
+            break
+    return {
+        "max_users": max_users,
+        "saturated": reason is not None,
+        "reason": reason or "насыщение не достигнуто на проверенных уровнях",
+    }
+
+
+def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    import prompt
+    from scheduler import get_scheduler
+
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    _patch_app_test_for_concurrency()
+    if not args.provider_limits:
+        get_scheduler().configure("mistral", rpm=None, tpm=None)
+
+    def run_levels() -> List[Dict[str, Any]]:
+        # прогрев не в зачёт: импорты, cache_resource, клиенты LLM — иначе первый
+        # уровень получил бы их время и память
+        run_level(1, args.catalog_size, args.mock, args.max_workers, args.timeout, seed=-1)
+        results = []
+        for users in levels:
+            level = run_level(
+                users, args.catalog_size, args.mock, args.max_workers, args.timeout,
+                unique_catalogs=not args.same_catalog,
+            )
+            lat = level["latency_ms"]["generate"]
+            print(f"{users:>4} польз. | генерация p50 {lat['p50']:>8} мс, p95 {lat['p95']:>8} мс | "
+                  f"{level['products_per_s']:>7} тов./с | {level['memory_mb']['per_session']:>6} МБ/сессия | "
+                  f"ошибок {sum(level['errors'].values())}")
+            results.append(level)
+        return results
+
+    if args.mock:
+        results = run_levels()
+    else:
+        with StandinServer(llm_latency=args.llm_latency) as server:
+            saved = (prompt.MISTRAL_API_URL, os.environ.get("MISTRAL_API_KEY"))
+            prompt.MISTRAL_API_URL = f"{server.url}/v1/chat/completions"
+            os.environ.setdefault("MISTRAL_API_KEY", "standin")
+            try:
+                results = run_levels()
+            finally:
+                prompt.MISTRAL_API_URL = saved[0]
+                if saved[1] is None:
+                    os.environ.pop("MISTRAL_API_KEY", None)
+
+    return {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "catalog_size": args.catalog_size,
+            "llm": "mock" if args.mock else f"standin ({args.llm_latency} с)",
+            "max_workers": args.max_workers,
+            "provider_limits": args.provider_limits,
+            "unique_catalogs": not args.same_catalog,
+        },
+        "levels": results,
+        "saturation": find_saturation(results, args.p95_budget),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Streamlit-приложения GENAI-4")
+    parser.add_argument("--levels", default=DEFAULT_LEVELS, help="число одновременных пользователей, через запятую")
+    parser.add_argument("--catalog-size", type=int, default=10, help="товаров в каталоге каждого пользователя")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="задержка стенд-сервера LLM, с")
+    parser.add_argument("--mock", action="store_true", help="MockLLMClient вместо стенд-сервера")
+    parser.add_argument("--max-workers", type=int, default=8, help="ползунок параллельности в сайдбаре")
+    parser.add_argument("--same-catalog", action="store_true", help="один каталог на всех (проверка кэша разбора)")
+    parser.add_argument("--provider-limits", action="store_true", help="оставить RPM/TPM провайдера в scheduler")
+    parser.add_argument("--p95-budget", type=float, metavar="MS", help="бюджет p95 генерации, мс")
+    parser.add_argument("--timeout", type=float, default=300.0, help="на один перезапуск скрипта, с")
+    parser.add_argument("--out", metavar="PATH", help="записать JSON-отчёт")
+    args = parser.parse_args()
+
+    # предупреждения Streamlit об устаревших аргументах печатались бы
+    # на каждый перезапуск каждой сессии
+    from streamlit import config as st_config
+    from streamlit.logger import set_log_level
+
+    st_config.set_option("logger.level", "error")
+    set_log_level("error")
+
+    report = run_load_test(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report["saturation"], ensure_ascii=False, indent=2))
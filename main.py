@@ -1,17 +1,131 @@
 import json
-from typing import Dict
+import os
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
 
-# Загружаем описание персон (структура categorized_personas.json зависит от твоего проекта)
-# Здесь мы просто читаем файл, чтобы он был частью пайплайна —
-# в текущей заглушке evaluate_ad мы его не используем, но он готов.
-try:
-    with open("categorized_personas.json", "r", encoding="utf-8") as f:
-        parsed = json.load(f)
-except FileNotFoundError:
-    parsed = {}  # если файла нет — просто игнорируем, заглушка всё равно работает
+import metrics
+from eval_cache import get_default_cache
 
 
-def evaluate_ad(ad_text: str, target_audience: str) -> Dict[str, float]:
+# Описание персон (структура categorized_personas.json зависит от твоего проекта).
+# Эвристический оценщик его не использует, семантический строит по нему профили
+# сегментов — поэтому файл читается только при первом обращении, а не при импорте.
+@lru_cache(maxsize=1)
+def get_personas() -> Dict:
+    try:
+        with open("categorized_personas.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}  # если файла нет — просто игнорируем, заглушка всё равно работает
+
+
+def __getattr__(name):
+    if name == "parsed":
+        return get_personas()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Версия оценщика входит в ключ кэша: поменяли эвристику — подняли версию,
+# старые закэшированные оценки перестают совпадать.
+# Оценщик выбирается переменной окружения GENAI4_EVALUATOR:
+#   heuristic — правила по ключевым словам (по умолчанию, без моделей);
+#   semantic  — релевантность интересам сегмента по эмбеддингам (semantic_eval.py);
+#   llm       — feedback.AdTest, с ROUTING_CONFIG — router.RoutedAdTest (feedback.get_ad_test).
+EVALUATORS = {
+    "heuristic": "heuristic-v1",
+    "semantic": "semantic-v1",
+    "llm": "llm-v1",
+}
+EVALUATOR = os.getenv("GENAI4_EVALUATOR", "heuristic")
+if EVALUATOR not in EVALUATORS:
+    raise ValueError(f"GENAI4_EVALUATOR должен быть одним из {list(EVALUATORS)}, получено {EVALUATOR!r}")
+EVALUATOR_VERSION = EVALUATORS[EVALUATOR]
+# Оценщики мимо кэша: эвристику пересчитать дешевле, чем найти в кэше (единицы
+# микросекунд против нормализации, sha256 и блокировки), а AdTest кэширует разобранные
+# оценки сам — с моделью в ключе, которой здесь не видно при маршрутизации.
+UNCACHED_EVALUATORS = {"heuristic", "llm"}
+
+
+@lru_cache(maxsize=1)
+def get_ad_test():
+    from feedback import get_ad_test as make_ad_test
+
+    return make_ad_test()
+
+
+def _evaluate_ads_llm(pairs: Sequence[Tuple[str, str]]) -> List[Dict[str, float]]:
+    """Пары по сегментам: объявления одного сегмента уходят пачками в run_batch."""
+    by_segment: Dict[str, List[int]] = {}
+    for i, (_, segment) in enumerate(pairs):
+        by_segment.setdefault(segment, []).append(i)
+    results: List = [None] * len(pairs)
+    for segment, idx in by_segment.items():
+        for i, scores in zip(idx, get_ad_test().run_batch([pairs[i][0] for i in idx], [segment])):
+            if scores is None:
+                raise RuntimeError(f"LLM не вернул разборчивых оценок для сегмента {segment}")
+            results[i] = scores
+    return results
+
+
+def _compute(ad_text: str, target_audience: str) -> Dict[str, float]:
+    if EVALUATOR == "llm":
+        return _evaluate_ads_llm([(ad_text, target_audience)])[0]
+    if EVALUATOR == "semantic":
+        from semantic_eval import get_semantic_evaluator
+
+        return get_semantic_evaluator().evaluate(ad_text, target_audience)
+    return _evaluate_ad_heuristic(ad_text, target_audience)
+
+
+def evaluate_ad(ad_text: str, target_audience: str, use_cache: bool = True) -> Dict[str, float]:
+    """
+    Оценка рекламы с мемоизацией через eval_cache (ключ — нормализованный текст,
+    сегмент и EVALUATOR_VERSION). use_cache=False — посчитать заново; дешёвые
+    оценщики (UNCACHED_EVALUATORS) кэш не используют.
+    """
+    metrics.inc("genai4_evaluations_total", evaluator=EVALUATOR_VERSION)
+    if not use_cache or EVALUATOR in UNCACHED_EVALUATORS:
+        return _compute(ad_text, target_audience)
+    return get_default_cache().get_or_compute(
+        ad_text,
+        target_audience,
+        EVALUATOR_VERSION,
+        lambda: _compute(ad_text, target_audience),
+    )
+
+
+def evaluate_ads(pairs: Sequence[Tuple[str, str]], use_cache: bool = True) -> List[Dict[str, float]]:
+    """
+    Пакетная evaluate_ad для пар (объявление, сегмент). Семантический оценщик
+    считает все промахи кэша одним матричным произведением, LLM — пачками на сегмент.
+    """
+    if EVALUATOR == "llm":
+        metrics.inc("genai4_evaluations_total", len(pairs), evaluator=EVALUATOR_VERSION)
+        return _evaluate_ads_llm(pairs)
+    if EVALUATOR != "semantic":
+        return [evaluate_ad(ad_text, segment, use_cache) for ad_text, segment in pairs]
+
+    from eval_cache import make_key
+    from semantic_eval import get_semantic_evaluator
+
+    metrics.inc("genai4_evaluations_total", len(pairs), evaluator=EVALUATOR_VERSION)
+    cache = get_default_cache()
+    results: List = [None] * len(pairs)
+    todo = []
+    for i, (ad_text, segment) in enumerate(pairs):
+        if use_cache:
+            results[i] = cache.get(make_key(ad_text, segment, EVALUATOR_VERSION))
+        if results[i] is None:
+            todo.append(i)
+    if todo:
+        computed = get_semantic_evaluator().evaluate_pairs([pairs[i] for i in todo])
+        for i, value in zip(todo, computed):
+            results[i] = value
+            if use_cache:
+                cache.set(make_key(*pairs[i], EVALUATOR_VERSION), value)
+    return results
+
+
+def _evaluate_ad_heuristic(ad_text: str, target_audience: str) -> Dict[str, float]:
     """
     Простая эвристическая заглушка-оценщик рекламы.
     В реальной системе здесь мог бы быть вызов LLM по промпту,
@@ -0,0 +1,280 @@
+"""
+Лёгкие метрики процесса: счётчики, гистограммы, текущие значения (gauge) и таймеры.
+
+Куда уходит время и деньги: эмбеддинги, Wordstat, задержки и токены LLM,
+сбои разбора ответов, попадания в кэш оценок, число оценок, время этапов конвейера.
+Экспорт — текст в формате Prometheus (prometheus_text, эндпоинт /metrics в service.py)
+и JSON-отчёт за прогон (report / write_report).
+
+По умолчанию выключено (GENAI4_METRICS=1 или enable() — включить). В выключенном
+состоянии inc/observe сразу возвращаются, а timer() отдаёт общий пустой контекст,
+так что инструментирование горячих путей почти ничего не стоит.
+"""
+from __future__ import annotations
+
+import bisect
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+# Границы бакетов гистограмм задержек, секунды
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+# Описания метрик (строки HELP в Prometheus); все имена метрик проекта — здесь
+METRICS_HELP: Dict[str, str] = {
+    "genai4_embedding_seconds": "Время encode() модели эмбеддингов",
+    "genai4_wordstat_seconds": "Задержка запроса к Wordstat",
+    "genai4_wordstat_errors_total": "Неудачные запросы к Wordstat",
+    "genai4_llm_seconds": "Задержка запроса к LLM",
+    "genai4_llm_tokens_total": "Токены LLM по данным провайдера (usage)",
+    "genai4_llm_parse_failures_total": "Ответы LLM, из которых не удалось разобрать результат",
+    "genai4_eval_cache_total": "Обращения к кэшу оценок по результату",
+    "genai4_evaluations_total": "Вызовы evaluate_ad",
+    "genai4_stage_seconds": "Время обработки одного элемента этапом конвейера",
+    "genai4_creative_index_total": "Обращения к индексу креативов (hit/empty/error/write_error)",
+    "genai4_scheduler_queue_depth": "Запросы к провайдеру, ждущие в очереди планировщика",
+    "genai4_scheduler_wait_seconds": "Ожидание в очереди планировщика до отправки запроса",
+    "genai4_scheduler_requests_total": "Запросы, пропущенные планировщиком к провайдеру",
+    "genai4_dedup_saved_total": "Вызовы Wordstat и эмбеддингов, не сделанные благодаря группам дубликатов (kind)",
+}
+
+_enabled = os.getenv("GENAI4_METRICS", "").lower() in ("1", "true", "yes", "on")
+_lock = threading.Lock()
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # последний — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по бакетам: верхняя граница бакета, где накопилось q наблюдений."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, c in zip(self.buckets, self.counts):
+            cumulative += c
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+_counters: Dict[Tuple[str, LabelKey], float] = {}
+_histograms: Dict[Tuple[str, LabelKey], _Histogram] = {}
+_gauges: Dict[Tuple[str, LabelKey], float] = {}
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, LabelKey]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = on
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _gauges.clear()
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels: Any) -> None:
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = _Histogram(buckets)
+        hist.observe(value)
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: Dict[str, Any]):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopTimer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timer(name: str, **labels: Any):
+    """with metrics.timer("genai4_llm_seconds", provider="mistral"): ..."""
+    return _Timer(name, labels) if _enabled else _NOOP_TIMER
+
+
+def timed(name: str, **labels: Any) -> Callable:
+    """Декоратор-таймер для обычных и async-функций."""
+    def decorator(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timer(name, **labels):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(provider: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> None:
+    """Токены из usage ответа провайдера (OpenAI и Mistral отдают одинаковые поля)."""
+    if not _enabled:
+        return
+    if prompt_tokens:
+        inc("genai4_llm_tokens_total", prompt_tokens, provider=provider, kind="prompt")
+    if completion_tokens:
+        inc("genai4_llm_tokens_total", completion_tokens, provider=provider, kind="completion")
+
+
+# ==========================
+# ЭКСПОРТ
+# ==========================
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _format_bound(bound: float) -> str:
+    return repr(float(bound))
+
+
+def prometheus_text() -> str:
+    """Снимок всех метрик в текстовом формате Prometheus 0.0.4."""
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted(_histograms.items(), key=lambda kv: kv[0])
+
+        lines = []
+        seen = set()
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in values:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {METRICS_HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), hist in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {METRICS_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, c in zip(hist.buckets, hist.counts):
+                cumulative += c
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_bound(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {hist.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+    return "\n".join(lines) + "\n"
+
+
+def report() -> Dict[str, Any]:
+    """JSON-отчёт: счётчики, gauge и сводка гистограмм (count/sum/mean/min/p50/p95/max)."""
+    with _lock:
+        counters = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+        gauges = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_gauges.items())
+        ]
+        histograms = [
+            {
+                "name": name,
+                "labels": dict(labels),
+                "count": h.count,
+                "sum": round(h.sum, 6),
+                "mean": round(h.sum / h.count, 6) if h.count else 0.0,
+                "min": round(h.min, 6) if h.count else 0.0,
+                "p50": round(h.quantile(0.50), 6),
+                "p95": round(h.quantile(0.95), 6),
+                "max": round(h.max, 6) if h.count else 0.0,
+            }
+            for (name, labels), h in sorted(_histograms.items(), key=lambda kv: kv[0])
+        ]
+    return {"generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "counters": counters, "gauges": gauges, "histograms": histograms}
+
+
+def write_report(path: str, extra: Optional[Dict[str, Any]] = None) -> None:
+    data = report()
+    if extra:
+        data.update(extra)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
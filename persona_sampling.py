@@ -0,0 +1,306 @@
+"""
+Репрезентативные подмножества персон для LLM-оценки.
+
+Отправлять в LLM всех персон сегмента дорого: стоимость промпта растёт
+линейно с размером сегмента (financially_conservative_adults — 177 персон).
+Здесь персоны сегмента кластеризуются по атрибутам в k медоидов
+(реальных персон-представителей) с весами = долей кластера в сегменте.
+Оцениваются только медоиды, итог — взвешенное среднее.
+
+fidelity_report сравнивает такую оценку с оценкой по всему сегменту,
+чтобы подобрать k под компромисс цена/точность. Оценщик по умолчанию —
+модель отклика из simulation.py; с LLM — evaluator=AdTest().score_personas
+(или --llm в запуске модуля).
+"""
+from __future__ import annotations
+
+import json
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from feedback_helper import get_personas
+from simulation import (
+    AdProfile,
+    consumers_from_personas,
+    load_segment_distributions,
+    response_probabilities,
+)
+
+AGE_ORDER = ["13-17", "18-24", "25-34", "35-44", "45-54", "55-64", "65+"]
+SOCIAL_ORDER = ["low", "lower_middle", "middle", "upper_middle", "high"]
+
+# (ad_text, segment, personas) -> оценка на каждую персону (None — персону оценить не удалось)
+PersonaEvaluator = Callable[[str, str, Sequence[Dict]], List[Optional[Dict[str, float]]]]
+
+
+# ==========================
+# 1. РАССТОЯНИЕ МЕЖДУ ПЕРСОНАМИ
+# ==========================
+
+def _ordinal(values: List[str], order: List[str]) -> np.ndarray:
+    idx = np.array([order.index(v) if v in order else len(order) // 2 for v in values], dtype=float)
+    return idx / max(1, len(order) - 1)
+
+
+def _jaccard_distance(m: np.ndarray) -> np.ndarray:
+    m = m.astype(float)
+    inter = m @ m.T
+    sizes = m.sum(axis=1)
+    union = sizes[:, None] + sizes[None, :] - inter
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sim = np.where(union > 0, inter / union, 1.0)
+    return 1.0 - sim
+
+
+def _multi_hot(personas: Sequence[Dict], field: str) -> np.ndarray:
+    vocab = sorted({v for p in personas for v in p.get(field, [])})
+    index = {v: j for j, v in enumerate(vocab)}
+    m = np.zeros((len(personas), len(vocab)), dtype=bool)
+    for i, p in enumerate(personas):
+        for v in p.get(field, []):
+            m[i, index[v]] = True
+    return m
+
+
+def distance_matrix(personas: Sequence[Dict]) -> np.ndarray:
+    """
+    Расстояние Гауэра: среднее по признакам, каждый признак в [0, 1].
+    возраст и соц. статус — порядковые, пол и канал — совпадение,
+    интересы и поведение — Жаккар, ценовая чувствительность — |разница|.
+    """
+    age = _ordinal([p.get("age_range", "") for p in personas], AGE_ORDER)
+    social = _ordinal([p.get("social", "") for p in personas], SOCIAL_ORDER)
+    gender = np.array([p.get("gender", "") for p in personas])
+    channel = np.array([p.get("preferred_channel", "") for p in personas])
+    ps = np.array([float(p.get("price_sensitivity", 0.5)) for p in personas])
+
+    parts = [
+        np.abs(age[:, None] - age[None, :]),
+        np.abs(social[:, None] - social[None, :]),
+        (gender[:, None] != gender[None, :]).astype(float),
+        (channel[:, None] != channel[None, :]).astype(float),
+        _jaccard_distance(_multi_hot(personas, "interests")),
+        _jaccard_distance(_multi_hot(personas, "behaviors")),
+        np.abs(ps[:, None] - ps[None, :]),
+    ]
+    return sum(parts) / len(parts)
+
+
+# ==========================
+# 2. K-МЕДОИДЫ
+# ==========================
+
+def k_medoids(d: np.ndarray, k: int, seed: int = 0, max_iter: int = 100) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Итерации Вороного: назначили точки ближайшим медоидам,
+    в каждом кластере выбрали точку с минимальной суммой расстояний.
+    Старт — самая «центральная» точка + k-medoids++.
+    Возвращает (индексы медоидов, метки кластеров).
+    """
+    n = d.shape[0]
+    if k >= n:
+        return np.arange(n), np.arange(n)
+
+    rng = np.random.default_rng(seed)
+    medoids = [int(d.sum(axis=1).argmin())]
+    while len(medoids) < k:
+        nearest = d[:, medoids].min(axis=1)
+        weights = nearest ** 2
+        if weights.sum() == 0:
+            rest = [i for i in range(n) if i not in medoids]
+            medoids.append(int(rng.choice(rest)))
+            continue
+        medoids.append(int(rng.choice(n, p=weights / weights.sum())))
+    medoids = np.array(medoids)
+
+    for _ in range(max_iter):
+        labels = d[:, medoids].argmin(axis=1)
+        new_medoids = medoids.copy()
+        for c in range(k):
+            members = np.flatnonzero(labels == c)
+            if len(members) == 0:
+                continue
+            within = d[np.ix_(members, members)].sum(axis=1)
+            new_medoids[c] = members[within.argmin()]
+        if np.array_equal(new_medoids, medoids):
+            break
+        medoids = new_medoids
+
+    labels = d[:, medoids].argmin(axis=1)
+    return medoids, labels
+
+
+@dataclass
+class RepresentativeSet:
+    segment: str
+    segment_size: int
+    medoids: List[Dict]
+    weights: List[float]         # доля сегмента за каждым медоидом, сумма = 1
+    members: List[List[str]]     # id персон каждого кластера
+    mean_distance: float         # среднее расстояние персоны до своего медоида
+
+
+@lru_cache(maxsize=256)
+def representative_personas(
+    segment: str,
+    k: int,
+    seed: int = 0,
+) -> RepresentativeSet:
+    people = get_personas()[segment.lower()]
+    d = distance_matrix(people)
+    medoids, labels = k_medoids(d, k, seed=seed)
+
+    n = len(people)
+    weights = [float((labels == c).sum()) / n for c in range(len(medoids))]
+    members = [[people[i].get("id", str(i)) for i in np.flatnonzero(labels == c)] for c in range(len(medoids))]
+
+    return RepresentativeSet(
+        segment=segment.lower(),
+        segment_size=n,
+        medoids=[people[i] for i in medoids],
+        weights=weights,
+        members=members,
+        mean_distance=float(d[np.arange(n), medoids[labels]].mean()),
+    )
+
+
+# ==========================
+# 3. ОЦЕНКА И ОТЧЁТ О ТОЧНОСТИ
+# ==========================
+
+def heuristic_persona_scores(ad_text: str, segment: str, personas: Sequence[Dict]) -> List[Dict[str, float]]:
+    """Оценка каждой персоны моделью отклика из simulation.py (без LLM, без сэмплирования)."""
+    segment = segment.lower()
+    dist = load_segment_distributions()[segment]
+    consumers = consumers_from_personas(dist, personas)
+    p_click, p_buy = response_probabilities(AdProfile(text=ad_text), segment, dist, consumers)
+    return [
+        {"click_probability": float(c), "purchase_probability": float(c * b)}
+        for c, b in zip(p_click, p_buy)
+    ]
+
+
+def weighted_scores(
+    scores: Sequence[Optional[Dict[str, float]]],
+    weights: Sequence[float],
+) -> Optional[Dict[str, float]]:
+    """
+    Взвешенное среднее оценок персон. Неоценённые (None) пропускаются, веса
+    остальных нормируются заново; если не оценена ни одна — None.
+    """
+    pairs = [(s, w) for s, w in zip(scores, weights) if s is not None]
+    total = sum(w for _, w in pairs)
+    if not pairs or total <= 0:
+        return None
+    return {
+        key: float(sum(w * s[key] for s, w in pairs) / total)
+        for key in ("click_probability", "purchase_probability")
+    }
+
+
+def _weighted(scores: Sequence[Optional[Dict[str, float]]], weights: Sequence[float]) -> Dict[str, float]:
+    result = weighted_scores(scores, weights)
+    if result is None:
+        raise RuntimeError("Оценщик не вернул ни одной оценки персоны")
+    return result
+
+
+def evaluate_representative(
+    ad_text: str,
+    segment: str,
+    k: int,
+    evaluator: PersonaEvaluator = heuristic_persona_scores,
+    seed: int = 0,
+) -> Dict[str, float]:
+    reps = representative_personas(segment, k, seed)
+    return _weighted(evaluator(ad_text, segment, reps.medoids), reps.weights)
+
+
+def evaluate_full(
+    ad_text: str,
+    segment: str,
+    evaluator: PersonaEvaluator = heuristic_persona_scores,
+) -> Dict[str, float]:
+    people = get_personas()[segment.lower()]
+    return _weighted(evaluator(ad_text, segment, people), [1.0 / len(people)] * len(people))
+
+
+def _ranks(values: Sequence[float]) -> np.ndarray:
+    """Ранги с усреднением по равным значениям — иначе ничьи получают случайный порядок."""
+    values = np.asarray(values, dtype=float)
+    order = np.argsort(values, kind="stable")
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(len(values))
+    _, groups = np.unique(values, return_inverse=True)
+    sums = np.bincount(groups, weights=ranks)
+    return sums[groups] / np.bincount(groups)[groups]
+
+
+def _spearman(a: Sequence[float], b: Sequence[float]) -> float:
+    """
+    Ранговая корреляция. Если одно из ранжирований целиком из ничьих, корреляция
+    не определена (np.corrcoef дал бы NaN): 1.0, когда ничьи в обоих, иначе 0.0.
+    """
+    ra, rb = _ranks(a), _ranks(b)
+    flat_a, flat_b = np.ptp(ra) == 0, np.ptp(rb) == 0
+    if flat_a or flat_b:
+        return 1.0 if flat_a and flat_b else 0.0
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+
+def fidelity_report(
+    ads: Sequence[str],
+    segment: str,
+    ks: Sequence[int] = (3, 5, 10, 20),
+    evaluator: PersonaEvaluator = heuristic_persona_scores,
+    seed: int = 0,
+) -> Dict[str, object]:
+    """
+    Для каждого k: ошибка взвешенной оценки по медоидам относительно оценки
+    по всему сегменту, совпадение победителя и ранговая корреляция (Спирмен)
+    по списку объявлений, доля оцениваемых персон (≈ доля стоимости промпта).
+    """
+    full = [evaluate_full(a, segment, evaluator) for a in ads]
+    full_click = [s["click_probability"] for s in full]
+    n = len(get_personas()[segment.lower()])
+
+    rows = []
+    for k in ks:
+        approx = [evaluate_representative(a, segment, k, evaluator, seed) for a in ads]
+        approx_click = [s["click_probability"] for s in approx]
+        click_err = [abs(a - f) for a, f in zip(approx_click, full_click)]
+        purchase_err = [
+            abs(a["purchase_probability"] - f["purchase_probability"]) for a, f in zip(approx, full)
+        ]
+        spearman = _spearman(approx_click, full_click) if len(ads) > 1 else 1.0
+        rows.append({
+            "k": min(k, n),
+            "persona_share": min(k, n) / n,
+            "click_mae": float(np.mean(click_err)),
+            "click_max_error": float(np.max(click_err)),
+            "purchase_mae": float(np.mean(purchase_err)),
+            "winner_match": int(np.argmax(approx_click)) == int(np.argmax(full_click)),
+            "rank_spearman": spearman,
+            "mean_distance_to_medoid": representative_personas(segment, k, seed).mean_distance,
+        })
+
+    return {"segment": segment.lower(), "segment_size": n, "n_ads": len(ads), "by_k": rows}
+
+
+if __name__ == "__main__":
+    test_ads = [
+        "iPhone 17 — твой следующий уровень технологий!\n💥 Скидка 10% только сегодня!",
+        "iPhone 17. Новая камера и быстрый процессор. Хит продаж, купить онлайн с доставкой.",
+        "iPhone 17. Купить.",
+    ]
+    evaluator = heuristic_persona_scores
+    if "--llm" in sys.argv:
+        from feedback import AdTest
+
+        evaluator = AdTest().score_personas
+    report = fidelity_report(test_ads, "financially_conservative_adults", evaluator=evaluator)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,506 @@
+"""
+Сквозной конвейер кампании: каталог → ProductAnalyzer → генерация → оценка → campaign.json.
+
+Этапы работают одновременно как потоковый DAG на asyncio: у каждого этапа свой
+лимит параллельности и ограниченная входная очередь. Товар уходит в генерацию,
+как только отобран, а каждый вариант — в оценку, как только распарсен, без
+промежуточных файлов вроде best_products.json. Если следующий этап не успевает,
+его очередь заполняется и предыдущий этап ждёт (backpressure), а не копит всё в памяти.
+
+Почти-дубликаты каталога (цвета, объёмы, повторные карточки — dedup.py) получают
+один запрос к Wordstat и один эмбеддинг на группу; отчёт — stats.dedup. Включается
+--dedup; --one-per-group вдобавок оставляет в top_n не больше одного товара группы.
+
+С журналом (--journal, journal.py) скоринг, генерация и оценка каждого элемента
+записываются сразу; перезапуск после падения берёт готовое из журнала.
+
+Индекс креативов генератора (GENAI4_RAG=1, creative_index.py) пополняется на этапе
+оценки, как в campaign.remember_variants: вариант пишется с лучшим сегментом по уже
+посчитанным оценкам, без второй оценки; варианты, которые уже в индексе, пропускаются.
+
+    catalog → trends (Wordstat) → score (эмбеддинги) → select (top_n / порог)
+            → generate (LLM, по каналам) → evaluate (evaluate_ad по сегментам) → campaign
+
+Запуск:
+    python pipeline.py products.json --out campaign.json --mock
+    python pipeline.py products.json --out campaign.ndjson.gz --mock   (потоково, см. ниже)
+
+--out с суффиксом .ndjson/.jsonl[.gz] — каждый оценённый вариант пишется строкой сразу
+после оценки (sinks.NdjsonSink), в памяти варианты не копятся; файл появляется под
+итоговым именем только после успешного завершения, до того его можно читать из .part.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence
+
+import metrics
+from dedup import offer_top
+from journal import Journal, work_id
+from scheduler import call_context
+
+CHANNELS = ["telegram", "vk", "yandex_ads"]
+
+# Параллельность и размер входной очереди каждого этапа по умолчанию
+STAGE_CONCURRENCY: Dict[str, int] = {
+    "trends": 8,
+    "score": 1,       # модель эмбеддингов одна, encode() и так использует все ядра
+    "select": 1,      # этап с состоянием (top_n), должен быть один
+    "generate": 4,
+    "evaluate": 4,
+}
+QUEUE_SIZE = 16
+
+_END = object()  # конец потока в очереди
+
+# item -> async-генератор выходных элементов (0..N штук)
+StageFn = Callable[[Any], AsyncIterator[Any]]
+
+
+# ==========================
+# 1. ОБЩИЙ ДВИЖОК ЭТАПОВ
+# ==========================
+
+@dataclass
+class Stage:
+    name: str
+    fn: StageFn
+    concurrency: int = 1
+    queue_size: int = QUEUE_SIZE
+    # вызывается один раз, когда вход этапа исчерпан (для этапов с состоянием)
+    flush: Optional[Callable[[], AsyncIterator[Any]]] = None
+
+
+@dataclass
+class StageStats:
+    processed: int = 0
+    emitted: int = 0
+    errors: int = 0
+    busy_seconds: float = 0.0
+    first_start: Optional[float] = None
+    last_end: Optional[float] = None
+
+
+@dataclass
+class PipelineResult:
+    outputs: List[Any]
+    errors: List[Dict[str, Any]]
+    stats: Dict[str, StageStats]
+    elapsed: float
+
+
+def _item_ref(item: Any) -> Any:
+    if isinstance(item, dict):
+        return {k: item[k] for k in ("index", "channel", "variant_index") if k in item}
+    return repr(item)[:200]
+
+
+class Pipeline:
+    """
+    Линейная цепочка этапов на ограниченных asyncio.Queue.
+    Ошибка на элементе не останавливает конвейер: элемент попадает в errors и отбрасывается.
+    """
+
+    def __init__(self, stages: Sequence[Stage]):
+        self.stages = list(stages)
+
+    async def run(self, items: Iterable[Any], on_output: Optional[Callable[[Any], None]] = None) -> PipelineResult:
+        """on_output — выход последнего этапа отдаётся ему, а не копится в PipelineResult.outputs."""
+        started = time.perf_counter()
+        queues = [asyncio.Queue(maxsize=s.queue_size) for s in self.stages]
+        queues.append(asyncio.Queue(maxsize=QUEUE_SIZE))
+        stats = {s.name: StageStats() for s in self.stages}
+        errors: List[Dict[str, Any]] = []
+        outputs: List[Any] = []
+
+        async def feed() -> None:
+            for item in items:
+                await queues[0].put(item)
+            await queues[0].put(_END)
+
+        async def emit(stage: Stage, st: StageStats, out_q: asyncio.Queue, produced: AsyncIterator[Any]) -> None:
+            async for out in produced:
+                st.emitted += 1
+                await out_q.put(out)
+
+        async def run_stage(i: int) -> None:
+            stage, st = self.stages[i], stats[self.stages[i].name]
+            in_q, out_q = queues[i], queues[i + 1]
+            alive = [stage.concurrency]
+
+            async def worker() -> None:
+                while True:
+                    item = await in_q.get()
+                    if item is _END:
+                        # вернуть маркер для соседних воркеров этого же этапа
+                        in_q.put_nowait(_END)
+                        break
+                    t0 = time.perf_counter()
+                    st.first_start = st.first_start or t0
+                    try:
+                        await emit(stage, st, out_q, stage.fn(item))
+                    except Exception as e:
+                        st.errors += 1
+                        errors.append({"stage": stage.name, "item": _item_ref(item), "error": str(e)})
+                    st.processed += 1
+                    st.last_end = time.perf_counter()
+                    st.busy_seconds += st.last_end - t0
+                    metrics.observe("genai4_stage_seconds", st.last_end - t0, stage=stage.name)
+
+                alive[0] -= 1
+                if alive[0] == 0:
+                    if stage.flush is not None:
+                        try:
+                            await emit(stage, st, out_q, stage.flush())
+                        except Exception as e:
+                            st.errors += 1
+                            errors.append({"stage": stage.name, "item": "flush", "error": str(e)})
+                    await out_q.put(_END)
+
+            await asyncio.gather(*(worker() for _ in range(stage.concurrency)))
+
+        async def sink() -> None:
+            while True:
+                item = await queues[-1].get()
+                if item is _END:
+                    return
+                if on_output is not None:
+                    on_output(item)
+                else:
+                    outputs.append(item)
+
+        tasks = [asyncio.ensure_future(feed()), asyncio.ensure_future(sink())]
+        tasks += [asyncio.ensure_future(run_stage(i)) for i in range(len(self.stages))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+
+        return PipelineResult(outputs, errors, stats, time.perf_counter() - started)
+
+
+# ==========================
+# 2. ЭТАПЫ КАМПАНИИ
+# ==========================
+
+class _Selector:
+    """
+    top_n задан — копит оценённые товары и на flush отдаёт top_n лучших (ранжирование
+    требует весь каталог, но генерация стартует сразу после него, по одному товару).
+    top_n=None — пропускает товар со счётом >= min_score сразу, не дожидаясь остальных.
+    one_per_group — из группы почти-дубликатов (dedup.py) в top_n попадает только лучший товар.
+    """
+
+    def __init__(self, analyzer, top_n: Optional[int], min_score: float, one_per_group: bool = False):
+        self.analyzer = analyzer
+        self.top_n = top_n
+        self.min_score = min_score
+        self.one_per_group = one_per_group
+        self._top: List[tuple] = []
+
+    def _selected(self, item: Dict[str, Any], rank: Optional[int]) -> Dict[str, Any]:
+        scored = item["scored"]
+        return {
+            "index": item["index"],
+            "product": self.analyzer.recommend(scored),
+            "score": scored["_temp_final"],
+            "rank": rank,
+        }
+
+    async def __call__(self, item: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        score = item["scored"]["_temp_final"]
+        if score < self.min_score:
+            return
+        if self.top_n is None:
+            yield self._selected(item, None)
+            return
+        # в памяти не больше top_n оценённых товаров
+        group = item.get("group") if self.one_per_group else None
+        offer_top(self._top, self.top_n, (score, -item["index"], group, item))
+
+    async def flush(self) -> AsyncIterator[Dict[str, Any]]:
+        ranked = sorted(self._top, key=lambda e: e[:2], reverse=True)
+        for rank, (_, _, _, item) in enumerate(ranked, start=1):
+            yield self._selected(item, rank)
+
+
+def build_campaign_pipeline(
+    analyzer,
+    generator,
+    segments: Sequence[str],
+    channels: Sequence[str] = CHANNELS,
+    user_text: str = "",
+    top_n: Optional[int] = 3,
+    min_score: float = float("-inf"),
+    concurrency: Optional[Dict[str, int]] = None,
+    rate_limited: bool = True,
+    journal: Optional[Journal] = None,
+    dedup=None,
+    one_per_group: bool = False,
+) -> Pipeline:
+    from campaign import EmptyGenerationError, build_payload_for_record, generate_variants
+    from main import EVALUATOR_VERSION, evaluate_ads
+    from prompt import _remember, _variant_to_ad_text
+
+    limits = {**STAGE_CONCURRENCY, **(concurrency or {})}
+    # запросы к Wordstat и LLM идут через scheduler; rate_limited=False — мимо корзин
+    provider_limits = (lambda: call_context(rate_limited=False)) if not rate_limited else contextlib.nullcontext
+
+    def journaled(item_id: str, kind: str, compute: Callable[[], Any]) -> Any:
+        return journal.run(item_id, kind, compute) if journal is not None else compute()
+
+    async def trends(item):
+        score_id = work_id("analyze", item["product"])
+        # группа нужна и оценённому раньше товару — для отбора top_n по группам
+        group = dedup.assign(item["product"]) if dedup is not None else None
+        if journal is not None and journal.is_done(score_id):
+            # товар уже оценён в прошлом запуске — Wordstat не нужен
+            yield {**item, "trend": None, "score_id": score_id, "group": group}
+            return
+        from productAnalyzer import WordstatError
+
+        try:
+            with provider_limits():
+                if group is not None:
+                    # товары группы, пришедшие одновременно, ждут один общий запрос
+                    trend = await dedup.amemo(
+                        group, "wordstat", lambda: analyzer.get_trend_info(dedup.representative(group)["name"])
+                    )
+                else:
+                    trend = await analyzer.get_trend_info(item["product"]["name"])
+        except WordstatError as e:
+            # без спроса товар не оценивается: в журнале failed, перезапуск снова спросит Wordstat
+            if journal is not None:
+                journal.record_failed(score_id, "analyze", str(e))
+            raise
+        yield {**item, "trend": trend, "score_id": score_id, "group": group}
+
+    def score_one(item):
+        group = item.get("group")
+        embedding = None
+        if group is not None:
+            embedding = dedup.memo(group, "encode", lambda: analyzer.embed_product(dedup.representative(group)))
+        return analyzer.score_product(item["product"], item["trend"], embedding=embedding)
+
+    async def score(item):
+        scored = await asyncio.to_thread(
+            journaled,
+            item["score_id"],
+            "analyze",
+            lambda: score_one(item),
+        )
+        yield {"index": item["index"], "scored": scored, "group": item.get("group")}
+
+    async def generate(item):
+        payload, _, _ = build_payload_for_record(item["product"], user_text)
+        for channel in channels:
+            payload = {**payload, "channel": channel}
+            try:
+                with provider_limits():
+                    result = await asyncio.to_thread(
+                        journaled,
+                        work_id("generate", payload),
+                        "generate",
+                        lambda: generate_variants(generator, payload, False),
+                    )
+            except EmptyGenerationError:
+                # в журнале failed, а не done: перезапуск снова сгенерирует этот канал
+                continue
+            # каждый вариант уходит в оценку сразу, не дожидаясь остальных каналов
+            for n, variant in enumerate(result.get("variants", [])):
+                yield {
+                    **item,
+                    "channel": channel,
+                    "variant_index": n,
+                    "variant": variant,
+                    "ad_text": _variant_to_ad_text(variant),
+                }
+
+    index = getattr(generator, "index", None)
+
+    def remember(item, scores) -> None:
+        if not scores or index.contains(item["variant"]):
+            return
+        best = max(scores, key=lambda seg: scores[seg].get("click_probability", 0.0))
+        product = item["product"]
+        _remember(index, [{
+            "variant": item["variant"], "scores": scores[best], "category": product.get("category", ""),
+            "segment": best, "product": product.get("name", ""),
+        }])
+
+    async def evaluate(item):
+        scores = await asyncio.to_thread(
+            journaled,
+            work_id("evaluate", EVALUATOR_VERSION, item["ad_text"], sorted(segments)),
+            "evaluate",
+            lambda: dict(zip(segments, evaluate_ads([(item["ad_text"], seg) for seg in segments]))),
+        )
+        if index is not None:
+            # запись в индекс — эмбеддинг варианта, тоже блокирующий
+            await asyncio.to_thread(remember, item, scores)
+        yield {**item, "scores": scores}
+
+    selector = _Selector(analyzer, top_n, min_score, one_per_group=one_per_group and dedup is not None)
+    return Pipeline([
+        Stage("trends", trends, limits["trends"]),
+        Stage("score", score, limits["score"]),
+        Stage("select", selector, 1, flush=selector.flush if top_n is not None else None),
+        Stage("generate", generate, limits["generate"]),
+        Stage("evaluate", evaluate, limits["evaluate"]),
+    ])
+
+
+def assemble_campaign(result: PipelineResult, segments: Sequence[str]) -> Dict[str, Any]:
+    """Оценённые варианты → campaign.json: товары по убыванию счёта, варианты по каналам, лучший на сегмент."""
+    by_product: Dict[int, Dict[str, Any]] = {}
+    for v in result.outputs:
+        entry = by_product.setdefault(v["index"], {
+            "product": v["product"],
+            "score": v["score"],
+            "rank": v["rank"],
+            "channels": {},
+            "best_by_segment": {},
+        })
+        entry["channels"].setdefault(v["channel"], []).append({
+            "variant_index": v["variant_index"],
+            **v["variant"],
+            "ad_text": v["ad_text"],
+            "scores": v["scores"],
+        })
+        for seg, s in v["scores"].items():
+            best = entry["best_by_segment"].get(seg)
+            if best is None or s["click_probability"] > best["click_probability"]:
+                entry["best_by_segment"][seg] = {
+                    "channel": v["channel"],
+                    "variant_index": v["variant_index"],
+                    "ad_text": v["ad_text"],
+                    **s,
+                }
+
+    products = sorted(by_product.values(), key=lambda e: e["score"], reverse=True)
+    for entry in products:
+        for variants in entry["channels"].values():
+            variants.sort(key=lambda x: x["variant_index"])
+
+    return {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "segments": list(segments),
+        "products": products,
+        "errors": result.errors,
+        "stats": {
+            "elapsed_seconds": round(result.elapsed, 3),
+            "variants_evaluated": len(result.outputs),
+            "stages": {name: asdict(st) for name, st in result.stats.items()},
+        },
+    }
+
+
+async def run_campaign_pipeline(
+    products: Sequence[Dict[str, Any]],
+    analyzer=None,
+    generator=None,
+    segments: Optional[Sequence[str]] = None,
+    sink=None,
+    dedup: bool = False,
+    **kwargs,
+) -> Dict[str, Any]:
+    """
+    Весь конвейер: список товаров → словарь campaign.json.
+    sink (sinks.NdjsonSink) — оценённые варианты пишутся в него по одному; products
+    в словаре тогда пуст, а в "output" — путь файла. Закрывает sink вызывающий.
+    dedup — группы почти-дубликатов перед Wordstat и эмбеддингами (dedup.py), по умолчанию
+    выключено; one_per_group в kwargs — не больше одного товара группы в top_n.
+    """
+    if analyzer is None:
+        from productAnalyzer import ProductAnalyzer
+
+        analyzer = await asyncio.to_thread(ProductAnalyzer)
+    if generator is None:
+        from prompt import default_creative_index, get_generator
+
+        generator = get_generator(use_mistral=True, index=default_creative_index())
+    if segments is None:
+        from feedback import persona_types
+
+        segments = persona_types
+
+    deduplicator = None
+    if dedup:
+        from dedup import Deduplicator
+
+        deduplicator = Deduplicator()
+    pipeline = build_campaign_pipeline(analyzer, generator, segments, dedup=deduplicator, **kwargs)
+    items = ({"index": i, "product": p} for i, p in enumerate(products))
+    result = await pipeline.run(items, on_output=sink.write if sink is not None else None)
+    campaign_json = assemble_campaign(result, segments)
+    if deduplicator is not None:
+        campaign_json["stats"]["dedup"] = deduplicator.report()
+    if sink is not None:
+        campaign_json["output"] = sink.path
+        campaign_json["stats"]["variants_evaluated"] = sink.count
+    return campaign_json
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Сквозной конвейер кампании GENAI-4")
+    parser.add_argument("catalog", nargs="?", default="products.json")
+    parser.add_argument("--out", default="campaign.json")
+    parser.add_argument("--top-n", type=int, default=3, help="0 — без отбора, весь каталог")
+    parser.add_argument("--min-score", type=float, default=float("-inf"))
+    parser.add_argument("--segments", nargs="*")
+    parser.add_argument("--channels", nargs="*", default=CHANNELS)
+    parser.add_argument("--mock", action="store_true", help="MockLLMClient вместо Mistral")
+    parser.add_argument("--metrics", metavar="PATH", help="записать JSON-отчёт метрик прогона")
+    parser.add_argument("--journal", metavar="PATH", help="журнал для возобновления прогона после падения")
+    parser.add_argument("--dedup", action="store_true", help="схлопывать почти-дубликаты (dedup.py)")
+    parser.add_argument("--one-per-group", action="store_true", help="с --dedup: в top-n не больше товара на группу")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable()
+
+    from prompt import default_creative_index, get_generator
+    from sinks import NdjsonSink, is_ndjson_path, iter_records, write_json_atomic
+
+    catalog = iter_records(args.catalog)
+    journal = Journal(args.journal) if args.journal else None
+    sink = NdjsonSink(args.out) if is_ndjson_path(args.out) else None
+    try:
+        campaign_json = asyncio.run(run_campaign_pipeline(
+            catalog,
+            generator=get_generator(use_mistral=not args.mock, index=default_creative_index()),
+            segments=args.segments or None,
+            channels=args.channels,
+            top_n=args.top_n or None,
+            min_score=args.min_score,
+            journal=journal,
+            sink=sink,
+            dedup=args.dedup,
+            one_per_group=args.one_per_group,
+        ))
+    except BaseException:
+        if sink is not None:
+            sink.abort()
+        raise
+    finally:
+        if journal is not None:
+            journal.close()
+    if sink is not None:
+        sink.close()
+    else:
+        write_json_atomic(args.out, campaign_json, indent=2)
+
+    if args.metrics:
+        metrics.write_report(args.metrics, extra={"campaign_stats": campaign_json["stats"]})
+
+    stats = campaign_json["stats"]
+    where = f"варианты в {args.out}" if sink is not None else f"товаров в кампании: {len(campaign_json['products'])}"
+    print(f"Готово, {where}, "
+          f"вариантов оценено: {stats['variants_evaluated']}, "
+          f"ошибок: {len(campaign_json['errors'])}, время: {stats['elapsed_seconds']} с")
@@ -1,38 +1,63 @@
 import json
 import asyncio
-import httpx
+import itertools
 import math
 import time
 import os
-from sentence_transformers import SentenceTransformer, util
 
+import metrics
 
-class ProductAnalyzer:
-    def __init__(self, JSON_FILE):
-        self.model = SentenceTransformer('intfloat/multilingual-e5-base')
-        
-        self.visual_pos = self.model.encode(["query: яркий красочный насыщенный неоновый броский дизайн визуально привлекательный"], convert_to_tensor=True)
+# переопределяется переменной окружения (локальный стенд-сервер в benchmark.py)
+WORDSTAT_URL = os.getenv("WORDSTAT_URL", "https://api.wordstat.yandex.net/v1/topRequests")
+
+# товаров в одной пачке запросов к Wordstat: в памяти не больше пачки оценённых товаров
+ANALYZE_CHUNK = 64
 
-        self.visual_neg = self.model.encode(["query: тусклый серый блеклый простой стандартный обычный скучный матовый"], convert_to_tensor=True)
 
-        self.novelty_pos = self.model.encode(["query: новинка новый релиз последняя модель 2024 современный инновация тренд"], convert_to_tensor=True)
+class WordstatError(RuntimeError):
+    """Wordstat не ответил или ответил ошибкой — спрос неизвестен, а не нулевой."""
 
-        self.novelty_neg = self.model.encode(["query: старый антиквариат устаревший ретро винтаж прошлый век история"], convert_to_tensor=True)
 
-        self.hype_pos = self.model.encode(["query: бестселлер хит продаж топ популярный выбор покупателей высокий рейтинг"], convert_to_tensor=True)
+class ProductAnalyzer:
+    def __init__(self, JSON_FILE=None, encoder=None):
+        # энкодер по умолчанию — общий сервер эмбеддингов (EMBED_SERVER) или модель в процессе;
+        # sentence_transformers тянет torch, поэтому импорт только внутри get_encoder()
+        if encoder is None:
+            from embedding_client import get_encoder
+
+            encoder = get_encoder()
+        self.model = encoder
 
-        self.hype_neg = self.model.encode(["query: средний неизвестный нишевый базовый запасная часть обыденный"], convert_to_tensor=True)
+        # все якоря одним запросом: к серверу это один кадр вместо шести
+        with metrics.timer("genai4_embedding_seconds", kind="anchors"):
+            anchors = self.model.encode([
+                "query: яркий красочный насыщенный неоновый броский дизайн визуально привлекательный",
+                "query: тусклый серый блеклый простой стандартный обычный скучный матовый",
+                "query: новинка новый релиз последняя модель 2024 современный инновация тренд",
+                "query: старый антиквариат устаревший ретро винтаж прошлый век история",
+                "query: бестселлер хит продаж топ популярный выбор покупателей высокий рейтинг",
+                "query: средний неизвестный нишевый базовый запасная часть обыденный",
+            ], convert_to_tensor=False, normalize_embeddings=True)
+        (self.visual_pos, self.visual_neg,
+         self.novelty_pos, self.novelty_neg,
+         self.hype_pos, self.hype_neg) = anchors
 
         self.OAUTH_TOKEN = os.getenv("OAUTH_TOKEN")
 
         self.JSON_FILE = JSON_FILE 
+        # группы дубликатов последнего analyze() — для отчёта о сэкономленных вызовах
+        self.last_dedup = None
 
     def _get_score(self, embedding, pos, neg):
-        score = (util.cos_sim(embedding, pos).item() - util.cos_sim(embedding, neg).item()) * 100
+        # векторы нормированы — косинус это скалярное произведение
+        score = (float(embedding @ pos) - float(embedding @ neg)) * 100
         return max(0, score + 5)
 
     async def get_trend_info(self, phrase_name):
-        url = "https://api.wordstat.yandex.net/v1/topRequests"
+        """Ответ Wordstat по фразе; при ошибке HTTP или соединения — WordstatError."""
+        import httpx
+
+        url = WORDSTAT_URL
 
         payload = {
             "phrase": phrase_name,
@@ -44,81 +69,200 @@ class ProductAnalyzer:
             "Authorization": f"Bearer {self.OAUTH_TOKEN}"
         }
 
+        from scheduler import get_scheduler
+
         async with httpx.AsyncClient(timeout=10.0) as client:
             try:
-                response = await client.post(url, json=payload, headers=headers)
+                async with get_scheduler().aslot("wordstat"):
+                    with metrics.timer("genai4_wordstat_seconds"):
+                        response = await client.post(url, json=payload, headers=headers)
                 response.raise_for_status()
                 return response.json()
             except httpx.HTTPStatusError as e:
-                print(f"http ошибка для '{phrase_name}': {e}")
-                return None
+                metrics.inc("genai4_wordstat_errors_total", reason="http")
+                raise WordstatError(f"http ошибка для '{phrase_name}': {e}") from e
             except Exception as e:
-                print(f"Ошибка соединения для '{phrase_name}': {e}")
-                return None
+                metrics.inc("genai4_wordstat_errors_total", reason="connection")
+                raise WordstatError(f"Ошибка соединения для '{phrase_name}': {e}") from e
 
-    async def run(self):
+    async def _trend_or_none(self, trend):
+        """Для analyze(): без журнала повторять нечего — товар считается с нулевым спросом."""
         try:
-            with open(self.JSON_FILE, 'r', encoding='utf-8') as f:
-                products = json.load(f)
-        except FileNotFoundError:
-            print(f"Файл {self.JSON_FILE} не найден.")
-            return
+            return await trend
+        except WordstatError as e:
+            print(e)
+            return None
+
+    @staticmethod
+    def trend_total(json_data):
+        total_trend = 0
+        if json_data and 'topRequests' in json_data:
+            for item in json_data['topRequests']:
+                total_trend += item.get('count', 0)
+        return total_trend
 
-        tasks = [self.get_trend_info(p['name']) for p in products]
-        api_responses = await asyncio.gather(*tasks)
+    def embed_product(self, p):
+        with metrics.timer("genai4_embedding_seconds", kind="product"):
+            return self.model.encode(
+                f"passage: {p['name']}. {p['description']}", convert_to_tensor=False, normalize_embeddings=True
+            )
 
-        processed = []
+    def score_product(self, p, json_data=None, embedding=None):
+        """
+        Скоринг одного товара по ответу Wordstat; служебные поля начинаются с '_'.
+        embedding — готовый эмбеддинг описания (общий для группы дубликатов, см. dedup.py).
+        """
+        total_trend = self.trend_total(json_data)
         
-        print(f"\n{'ТОВАР':<25} | {'СПРОС (Сумма)':<13} | {'СЧЕТ'}")
-        print("-" * 55)
+        desc_emb = self.embed_product(p) if embedding is None else embedding
+        
+        m_score = (self._get_score(desc_emb, self.visual_pos, self.visual_neg) + 
+                   self._get_score(desc_emb, self.novelty_pos, self.novelty_neg) + 
+                   self._get_score(desc_emb, self.hype_pos, self.hype_neg)) / 3
+        
+        margin = 0
+        if p['price'] > 0:
+            margin = ((p['price'] - p['market_cost']) / p['price']) * 100
+
+        trend_score = math.log1p(total_trend) * 2.5 
+        final = (m_score * 1.5) + (margin * 0.4) + trend_score
+        
+        return {
+            **p, 
+            "_temp_trend": total_trend, 
+            "_temp_margin": margin, 
+            "_temp_final": final
+        }
+
+    @staticmethod
+    def recommend(item):
+        """Оценённый товар → чистая карточка товара с текстом рекомендации."""
+        rec_text = (f"Обладает привлекательными визуальными характеристиками: (Score: {item['_temp_final']:.1f}). "
+                    f"Спрос: {item['_temp_trend']} запросов. "
+                    f"Маржинальность: {int(item['_temp_margin'])}%.")
 
-        for i, p in enumerate(products):
-            json_data = api_responses[i]
-            total_trend = 0
-            if json_data and 'topRequests' in json_data:
-                for item in json_data['topRequests']:
-                    total_trend += item.get('count', 0)
-            
-            desc_emb = self.model.encode(f"passage: {p['name']}. {p['description']}", convert_to_tensor=True)
-            
-            m_score = (self._get_score(desc_emb, self.visual_pos, self.visual_neg) + 
-                       self._get_score(desc_emb, self.novelty_pos, self.novelty_neg) + 
-                       self._get_score(desc_emb, self.hype_pos, self.hype_neg)) / 3
-            
-            margin = 0
-            if p['price'] > 0:
-                margin = ((p['price'] - p['market_cost']) / p['price']) * 100
-
-            trend_score = math.log1p(total_trend) * 2.5 
-            final = (m_score * 1.5) + (margin * 0.4) + trend_score
-            
-            processed.append({
-                **p, 
-                "_temp_trend": total_trend, 
-                "_temp_margin": margin, 
-                "_temp_final": final
-            })
-
-        top3_raw = sorted(processed, key=lambda x: x['_temp_final'], reverse=True)[:3]
+        clean_product = {k: v for k, v in item.items() if not k.startswith('_')}
         
-        final_output = []
-
-        for item in top3_raw:
-            rec_text = (f"Обладает привлекательными визуальными характеристиками: (Score: {item['_temp_final']:.1f}). "
-                        f"Спрос: {item['_temp_trend']} запросов. "
-                        f"Маржинальность: {int(item['_temp_margin'])}%.")
-
-            clean_product = {k: v for k, v in item.items() if not k.startswith('_')}
-            
-            clean_product['recommendation'] = rec_text
-            
-            final_output.append(clean_product)
-
-        output_file = "best_products.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(final_output, f, ensure_ascii=False, indent=4)
+        clean_product['recommendation'] = rec_text
         
+        return clean_product
+
+    @staticmethod
+    def scored_record(item):
+        """Оценённый товар → строка потокового вывода: карточка товара и составляющие счёта."""
+        record = {k: v for k, v in item.items() if not k.startswith('_')}
+        record.update({
+            "score": item['_temp_final'],
+            "trend": item['_temp_trend'],
+            "margin": item['_temp_margin'],
+        })
+        if '_group' in item:
+            record["group"] = item['_group']
+        return record
+
+    async def analyze(self, products, top_n=3, sink=None, chunk_size=ANALYZE_CHUNK, dedup=False,
+                      one_per_group=False):
+        """
+        Скоринг товаров; возвращает top_n лучших с рекомендацией (без записи в файл).
+        products — любой итерируемый объект: товары идут пачками по chunk_size, из оценённых
+        хранятся только top_n лучших, так что память не растёт с размером каталога.
+        sink (sinks.NdjsonSink) — каждый оценённый товар пишется в него сразу.
+        dedup — почти-дубликаты (цвета, объёмы, повторные карточки) получают один запрос
+        к Wordstat и один эмбеддинг на группу. True — новый dedup.Deduplicator, свой
+        объект — общий между вызовами, False (по умолчанию) — выключено.
+        one_per_group — при dedup в top_n не больше одного товара группы; без него
+        top_n считается по товарам, как без dedup.
+        Отчёт о сэкономленных вызовах — self.last_dedup.report().
+        """
+        from dedup import Deduplicator, offer_top
+
+        if dedup is True:
+            dedup = Deduplicator()
+        self.last_dedup = dedup or None
+
+        top = []
+        counter = itertools.count()
+        products = iter(products)
+        while True:
+            chunk = list(itertools.islice(products, chunk_size))
+            if not chunk:
+                break
+            if dedup:
+                groups = [dedup.assign(p) for p in chunk]
+                api_responses = await asyncio.gather(*(
+                    self._trend_or_none(dedup.amemo(
+                        g, "wordstat", lambda g=g: self.get_trend_info(dedup.representative(g)['name'])
+                    ))
+                    for g in groups
+                ))
+            else:
+                groups = [None] * len(chunk)
+                api_responses = await asyncio.gather(*(self._trend_or_none(self.get_trend_info(p['name']))
+                                                       for p in chunk))
+
+            for p, response, group in zip(chunk, api_responses, groups):
+                embedding = None
+                if group is not None:
+                    embedding = dedup.memo(group, "encode", lambda: self.embed_product(dedup.representative(group)))
+                item = self.score_product(p, response, embedding=embedding)
+                if group is not None:
+                    item['_group'] = group
+                if sink is not None:
+                    sink.write(self.scored_record(item))
+                # при равном счёте выше тот, что раньше в каталоге — как при стабильной сортировке
+                offer_top(top, top_n, (item['_temp_final'], -next(counter), group if one_per_group else None, item))
+
+        top_raw = [item for _, _, _, item in sorted(top, key=lambda e: e[:2], reverse=True)]
+
+        return [self.recommend(item) for item in top_raw]
+
+    async def run(self, output_file="best_products.json", scores_file=None, top_n=3, dedup=False,
+                  one_per_group=False):
+        """
+        Каталог JSON_FILE (JSON или NDJSON) → output_file с top_n лучшими.
+        scores_file (.ndjson / .ndjson.gz) — все оценённые товары потоково, по мере готовности.
+        """
+        from sinks import NdjsonSink, iter_records, write_json_atomic
+
+        if not os.path.exists(self.JSON_FILE):
+            print(f"Файл {self.JSON_FILE} не найден.")
+            return
+
+        print(f"\n{'ТОВАР':<25} | {'СПРОС (Сумма)':<13} | {'СЧЕТ'}")
+        print("-" * 55)
+
+        sink = NdjsonSink(scores_file) if scores_file else None
+        try:
+            final_output = await self.analyze(iter_records(self.JSON_FILE), top_n=top_n, sink=sink, dedup=dedup,
+                                              one_per_group=one_per_group)
+        except BaseException:
+            if sink is not None:
+                sink.abort()
+            raise
+        if sink is not None:
+            sink.close()
+
+        write_json_atomic(output_file, final_output, indent=4)
+
+        if self.last_dedup is not None:
+            report = self.last_dedup.report()
+            print(f"Дубликаты: {report['products']} товаров в {report['groups']} группах, "
+                  f"сэкономлено запросов к Wordstat: {report['saved'].get('wordstat', 0)}, "
+                  f"эмбеддингов: {report['saved'].get('encode', 0)}")
+
 
 if __name__ == "__main__":
-    app = ProductAnalyzer("products.json")
-    asyncio.run(app.run())
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Отбор лучших товаров каталога")
+    parser.add_argument("catalog", nargs="?", default="products.json", help="JSON или NDJSON (.ndjson/.jsonl[.gz])")
+    parser.add_argument("--out", default="best_products.json")
+    parser.add_argument("--scores", metavar="PATH", help="все оценённые товары в NDJSON (.gz — со сжатием)")
+    parser.add_argument("--top-n", type=int, default=3)
+    parser.add_argument("--dedup", action="store_true", help="схлопывать почти-дубликаты (dedup.py)")
+    parser.add_argument("--one-per-group", action="store_true", help="с --dedup: в top-n не больше товара на группу")
+    args = parser.parse_args()
+
+    app = ProductAnalyzer(args.catalog)
+    asyncio.run(app.run(args.out, scores_file=args.scores, top_n=args.top_n,
+                      dedup=args.dedup, one_per_group=args.one_per_group))
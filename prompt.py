@@ -4,8 +4,9 @@ from typing import List, Dict, Any, Optional
 import json
 import os
 import re
+import threading
 
-import httpx
+import metrics
 from main import evaluate_ad  # импортируем оценщик из main.py
 
 
@@ -52,6 +53,9 @@ SYSTEM_PROMPT = """
 - channel — целевой канал ("telegram", "vk", "yandex_ads")
 - trends — активные маркетинговые тренды
 - n_variants — сколько вариантов рекламы нужно сгенерировать
+- examples — (необязательно) удачные объявления прошлых кампаний для похожих товаров
+  с их click_probability. Ориентируйся на их подачу и структуру, но не копируй текст
+  и не переноси чужие характеристики на текущий товар.
 
 =====================
 ШАБЛОНЫ ДЛЯ КАНАЛОВ
@@ -155,6 +159,7 @@ class GenerationRequest:
     channel: str               # "telegram" | "vk" | "yandex_ads"
     trends: List[str]
     n_variants: int = 1
+    examples: Optional[List[Dict[str, Any]]] = None  # few-shot из creative_index
 
 
 @dataclass
@@ -170,7 +175,8 @@ class AdVariant:
 # 3. LLM CLIENT (Mistral API)
 # ==========================
 
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
+# переопределяется переменной окружения (локальный стенд-сервер в benchmark.py)
+MISTRAL_API_URL = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
 
 
 def _extract_json_from_content(content: str) -> Dict[str, Any]:
@@ -212,6 +218,12 @@ class MistralClient:
             raise ValueError("MISTRAL_API_KEY не задан в переменных окружения!")
         self.api_key = api_key
         self.model = model
+        # usage последнего ответа — отдельно для каждого потока (клиент общий для пула)
+        self._local = threading.local()
+
+    @property
+    def last_usage(self) -> Dict[str, int]:
+        return getattr(self._local, "usage", {})
 
     def generate_variants(self, payload: Dict[str, Any]) -> List[AdVariant]:
         body = {
@@ -228,9 +240,19 @@ class MistralClient:
             "Content-Type": "application/json",
         }
 
-        resp = httpx.post(MISTRAL_API_URL, headers=headers, json=body, timeout=40.0)
-        resp.raise_for_status()
-        data = resp.json()
+        import httpx  # ленивый импорт: не нужен в Mock-режиме и при импорте модуля
+        from scheduler import estimate_tokens, get_scheduler
+
+        estimate = estimate_tokens(SYSTEM_PROMPT + body["messages"][1]["content"])
+        with get_scheduler().slot("mistral", tokens=estimate) as grant:
+            with metrics.timer("genai4_llm_seconds", provider="mistral"):
+                resp = httpx.post(MISTRAL_API_URL, headers=headers, json=body, timeout=40.0)
+            resp.raise_for_status()
+            data = resp.json()
+            usage = data.get("usage") or {}
+            grant.settle(usage.get("total_tokens"))
+        self._local.usage = usage
+        metrics.record_llm_usage("mistral", usage.get("prompt_tokens"), usage.get("completion_tokens"))
 
         content = data["choices"][0]["message"]["content"]
 
@@ -238,6 +260,7 @@ class MistralClient:
         try:
             parsed = _extract_json_from_content(content)
         except Exception as e:
+            metrics.inc("genai4_llm_parse_failures_total", provider="mistral")
             # чтобы легче отлаживать, выкидываем понятную ошибку
             raise ValueError(
                 f"Не удалось распарсить JSON из ответа Mistral. "
@@ -310,7 +333,7 @@ def build_payload_from_request(req: GenerationRequest) -> Dict[str, Any]:
     Превращает наш internal-объект GenerationRequest в JSON для LLM.
     Это изолирует формат, можно легко менять.
     """
-    return {
+    payload = {
         "product": {
             "name": req.product.name,
             "category": req.product.category,
@@ -328,6 +351,10 @@ def build_payload_from_request(req: GenerationRequest) -> Dict[str, Any]:
         "trends": req.trends,
         "n_variants": req.n_variants,
     }
+    # без примеров payload прежний — ключи кэшей и журналов не меняются
+    if req.examples:
+        payload["examples"] = req.examples
+    return payload
 
 
 def build_request_from_input_json(input_json: Dict[str, Any]) -> GenerationRequest:
@@ -367,6 +394,7 @@ def build_request_from_input_json(input_json: Dict[str, Any]) -> GenerationReque
         channel=input_json.get("channel", "telegram"),
         trends=input_json.get("trends", []),
         n_variants=input_json.get("n_variants", 1),
+        examples=input_json.get("examples"),
     )
     return req
 
@@ -419,6 +447,18 @@ def format_all_variants_human_readable(variants: List[AdVariant]) -> List[str]:
     return [format_variant_for_channel(v) for v in variants]
 
 
+def default_creative_index():
+    """
+    Общий индекс креативов, если включён GENAI4_RAG=1, иначе None.
+    creative_index тянет numpy, поэтому импорт только по запросу.
+    """
+    if not os.getenv("GENAI4_RAG"):
+        return None
+    from creative_index import get_default_index
+
+    return get_default_index()
+
+
 # ==========================
 # 6. FACADE (одна точка входа для всего твоего модуля)
 # ==========================
@@ -430,8 +470,21 @@ class AdGenerator:
     - и/или тексты объявлений
     """
 
-    def __init__(self, llm_client):
+    def __init__(self, llm_client, index=None):
         self.llm_client = llm_client
+        # creative_index.CreativeIndex: похожие прошлые победители уходят в payload как examples
+        self.index = index
+
+    def _with_examples(self, input_json: Dict[str, Any]) -> Dict[str, Any]:
+        if self.index is None or "examples" in input_json:
+            return input_json
+        try:
+            examples = self.index.examples_for(input_json)
+        except Exception:
+            # индекс — подсказка, а не зависимость: без примеров генерация всё равно работает
+            metrics.inc("genai4_creative_index_total", result="error")
+            return input_json
+        return {**input_json, "examples": examples} if examples else input_json
 
     def generate_from_json_dict(
         self,
@@ -445,7 +498,7 @@ class AdGenerator:
             "variants": List[AdVariant как dict]
             "texts": List[str] (если return_human_texts=True)
         """
-        req = build_request_from_input_json(input_json)
+        req = build_request_from_input_json(self._with_examples(input_json))
         payload = build_payload_from_request(req)
 
         variants = self.llm_client.generate_variants(payload)
@@ -476,6 +529,11 @@ class AdGenerator:
 
 BEST_CLICK_THRESHOLD = 0.7   # порог "достаточно хорошей" вероятности клика
 MAX_ITERS = 3                # максимум итераций улучшения
+BANDIT_BUDGET = 50_000       # бюджет симулированных показов для selector="thompson"
+
+
+def _variant_to_ad_text(v: Dict[str, Any]) -> str:
+    return f"{v['headline']}\n{v['text']}\n{v['cta']}"
 
 
 def generate_and_optimize_ad(
@@ -484,6 +542,9 @@ def generate_and_optimize_ad(
     target_audience: str,
     best_click_threshold: float = BEST_CLICK_THRESHOLD,
     max_iters: int = MAX_ITERS,
+    selector: str = "threshold",
+    bandit_budget: int = BANDIT_BUDGET,
+    remember: bool = True,
 ) -> Dict[str, Any]:
     """
     1) Генерирует варианты рекламы через AdGenerator.
@@ -492,27 +553,58 @@ def generate_and_optimize_ad(
     4) Если на какой-то итерации найден вариант с click_probability >= порога —
        сразу возвращаем его.
 
+    Если у генератора есть index (creative_index), все оценённые варианты
+    записываются в него (remember=False — не записывать) и становятся
+    примерами для следующих генераций.
+
+    selector="thompson" — вместо порогового цикла генерирует варианты один раз
+    и выбирает победителя через bandit.thompson_select (см. _select_by_thompson).
+    Для сегмента без распределения персон — обычный пороговый цикл.
+
     Возвращает dict:
     {
       "ad_text": "...",
       "variant": {...},
-      "scores": {"click_probability": ..., "purchase_probability": ...}
+      "scores": {"click_probability": ..., "purchase_probability": ...},
+      "iterations": сколько итераций генерации понадобилось
     }
     """
+    if selector == "thompson":
+        from bandit import is_known_segment
+
+        if is_known_segment(target_audience):
+            return _select_by_thompson(generator, input_json, target_audience, bandit_budget)
+        # свободная формулировка аудитории («молодёжь 18-25») — распределения персон
+        # для симуляции нет, выбираем пороговым циклом через evaluate_ad
+    elif selector != "threshold":
+        raise ValueError(f"Неизвестный selector: {selector}")
+
     best_variant: Optional[Dict[str, Any]] = None
     best_scores: Optional[Dict[str, float]] = None
-
-    for _ in range(max_iters):
-        result = generator.generate_from_json_dict(input_json, return_human_texts=False)
+    index = getattr(generator, "index", None) if remember else None
+    category = (input_json.get("product") or {}).get("category", "")
+    product_name = (input_json.get("product") or {}).get("name", "")
+
+    for it in range(max_iters):
+        if it > 0 and getattr(generator, "supports_finalist", False):
+            # первая попытка не дотянула до порога — доработку отдаём сильной модели (router.py)
+            result = generator.generate_from_json_dict(input_json, return_human_texts=False, finalist=True)
+        else:
+            result = generator.generate_from_json_dict(input_json, return_human_texts=False)
         variants = result["variants"]
+        evaluated = []
 
         for v in variants:
             # Собираем текст объявления (заголовок + текст + CTA)
-            ad_text = f"{v['headline']}\n{v['text']}\n{v['cta']}"
+            ad_text = _variant_to_ad_text(v)
 
             # Оцениваем рекламу через main.evaluate_ad
             scores = evaluate_ad(ad_text, target_audience)
             click_p = scores.get("click_probability", 0.0)
+            evaluated.append({
+                "variant": v, "scores": scores, "category": category,
+                "segment": target_audience, "product": product_name,
+            })
 
             # Обновляем лучший, если нужно
             if best_scores is None or click_p > best_scores.get("click_probability", 0.0):
@@ -521,24 +613,78 @@ def generate_and_optimize_ad(
 
             # Если вариант достаточно хорош — сразу возвращаем
             if click_p >= best_click_threshold:
+                _remember(index, evaluated)
                 return {
                     "ad_text": ad_text,
                     "variant": v,
                     "scores": scores,
+                    "iterations": it + 1,
                 }
+        _remember(index, evaluated)
 
     # Если порог так и не достигнут — возвращаем лучший из того, что было
     if best_variant is not None and best_scores is not None:
-        ad_text = f"{best_variant['headline']}\n{best_variant['text']}\n{best_variant['cta']}"
+        ad_text = _variant_to_ad_text(best_variant)
         return {
             "ad_text": ad_text,
             "variant": best_variant,
             "scores": best_scores,
+            "iterations": max_iters,
         }
 
     raise RuntimeError("Не удалось сгенерировать ни одного варианта рекламы")
 
 
+def _remember(index, evaluated: List[Dict[str, Any]]) -> None:
+    if index is None or not evaluated:
+        return
+    try:
+        index.add_many(evaluated)
+    except Exception:
+        # не записали в индекс — теряем будущие примеры, но не текущий результат
+        metrics.inc("genai4_creative_index_total", result="write_error")
+
+
+def _select_by_thompson(
+    generator: AdGenerator,
+    input_json: Dict[str, Any],
+    target_audience: str,
+    budget: int,
+) -> Dict[str, Any]:
+    """
+    Альтернатива пороговому циклу: один раз генерируем варианты и распределяем
+    бюджет симулированных показов между ними по Thompson sampling.
+
+    Помимо обычных полей возвращает:
+      "posterior" — Beta-параметры победителя,
+      "cost" — сколько симулированных показов потрачено,
+      "prob_best" — апостериорная вероятность, что победитель лучший.
+    """
+    # numpy тянем только когда реально нужен бандит
+    from bandit import thompson_select
+
+    result = generator.generate_from_json_dict(input_json, return_human_texts=False)
+    variants = result["variants"]
+    if not variants:
+        raise RuntimeError("Не удалось сгенерировать ни одного варианта рекламы")
+
+    ad_texts = [_variant_to_ad_text(v) for v in variants]
+    bandit = thompson_select(ad_texts, target_audience, budget=budget)
+    posterior = bandit.posterior
+
+    return {
+        "ad_text": ad_texts[bandit.winner],
+        "variant": variants[bandit.winner],
+        "scores": {
+            "click_probability": posterior.click_mean,
+            "purchase_probability": posterior.purchase_mean,
+        },
+        "posterior": posterior.to_dict(),
+        "cost": bandit.total_cost,
+        "prob_best": bandit.prob_best,
+    }
+
+
 # ==========================
 # 8. MAIN (запуск для проверки)
 # ==========================
@@ -552,6 +698,22 @@ def get_llm_client(use_mistral: bool = True):
     return MockLLMClient()
 
 
+def get_generator(use_mistral: bool = True, index=None):
+    """
+    Генератор приложений: с ROUTING_CONFIG — router.RoutedGenerator (дешёвая модель,
+    эскалация на сильную, финалисты — сразу сильной), иначе AdGenerator одной модели.
+    use_mistral=False — MockLLMClient, в том числе на всех уровнях маршрутизатора.
+    """
+    from router import routing_enabled
+
+    if not routing_enabled():
+        return AdGenerator(get_llm_client(use_mistral=use_mistral), index=index)
+    from router import RoutedGenerator, _default_client_factory, mock_client_factory
+
+    factory = _default_client_factory if use_mistral else mock_client_factory
+    return RoutedGenerator(client_factory=factory, index=index)
+
+
 if __name__ == "__main__":
     # 1. Путь к JSON с товаром
     JSON_FILE = "input/product_2.json"
@@ -561,8 +723,7 @@ if __name__ == "__main__":
         example_input = json.load(f)
 
     # 3. Инициализируем клиента LLM
-    llm_client = get_llm_client(use_mistral=True)
-    generator = AdGenerator(llm_client)
+    generator = get_generator(use_mistral=True, index=default_creative_index())
 
     # 4. Генерируем и оптимизируем рекламу для конкретной аудитории
     result = generate_and_optimize_ad(
@@ -0,0 +1,165 @@
+"""
+Простые лимитеры запросов к внешним провайдерам (token bucket).
+
+Лимитер не привязан к конкретному event loop: состояние защищено
+threading.Lock, а ожидание делается через asyncio.sleep / time.sleep.
+Поэтому один и тот же лимитер провайдера работает и в asyncio.run(...)
+из CLI, и в потоках Streamlit.
+
+Клиенты провайдеров ходят через scheduler.py: там поверх этих корзин —
+очередь с приоритетами и честным чередованием арендаторов.
+
+SharedRateLimiter — та же корзина, но в SQLite: один бюджет провайдера на
+несколько процессов (webapp и воркеры очереди задач, см. scheduler.share_across_processes).
+"""
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+# Запросов в минуту по умолчанию для каждого провайдера
+PROVIDER_RPM: Dict[str, float] = {
+    "openai": 500,
+    "mistral": 60,
+    "wordstat": 60,
+}
+
+# Токенов в минуту (вход + выход) — только для LLM-провайдеров
+PROVIDER_TPM: Dict[str, float] = {
+    "openai": 200_000,
+    "mistral": 500_000,
+}
+
+
+class RateLimiter:
+    def __init__(self, rate_per_minute: float, burst: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_take(self, amount: float) -> float:
+        """Берёт amount токенов, если есть. Иначе возвращает, сколько секунд подождать."""
+        with self._lock:
+            self._refill()
+            # запрос больше ёмкости корзины ждёт полную корзину, а не вечность
+            amount = min(amount, self.capacity)
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """Сколько секунд ждать, пока будет amount токенов (ничего не забирает)."""
+        with self._lock:
+            self._refill()
+            amount = min(amount, self.capacity)
+            return max(0.0, (amount - self._tokens) / self.rate)
+
+    def take(self, amount: float = 1.0) -> None:
+        """Забрать без ожидания; корзина может уйти в минус (долг отдаётся временем)."""
+        with self._lock:
+            self._refill()
+            self._tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        """Поправка после ответа: amount > 0 вернуть в корзину, < 0 дозабрать."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def acquire_sync(self, amount: float = 1.0) -> None:
+        while True:
+            wait = self._try_take(amount)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        while True:
+            wait = self._try_take(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+_SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Корзина в SQLite-файле, общая для всех процессов с тем же path и key.
+    Время — time.time(): monotonic у разных процессов несравним. Каждая операция —
+    короткая транзакция BEGIN IMMEDIATE (единицы миллисекунд), что незаметно на фоне
+    запроса к LLM, но корзины для тысяч операций в секунду сюда не годятся.
+    """
+
+    def __init__(self, path: str, key: str, rate_per_minute: float, burst: Optional[float] = None):
+        super().__init__(rate_per_minute, burst)
+        self.path = path
+        self.key = key
+        self._conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SHARED_SCHEMA)
+
+    def _update(self, change) -> float:
+        """change(tokens) -> (новые tokens, результат) в одной транзакции с пополнением."""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (self.key,)).fetchone()
+                tokens = self.capacity if row is None else min(
+                    self.capacity, row[0] + max(0.0, now - row[1]) * self.rate
+                )
+                tokens, result = change(tokens)
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    (self.key, tokens, now),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _try_take(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+
+        def change(tokens):
+            if tokens >= amount:
+                return tokens - amount, 0.0
+            return tokens, (amount - tokens) / self.rate
+
+        return self._update(change)
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        amount = min(amount, self.capacity)
+        return self._update(lambda tokens: (tokens, max(0.0, (amount - tokens) / self.rate)))
+
+    def take(self, amount: float = 1.0) -> None:
+        amount = min(amount, self.capacity)
+        self._update(lambda tokens: (tokens - amount, None))
+
+    def refund(self, amount: float) -> None:
+        self._update(lambda tokens: (min(self.capacity, tokens + amount), None))
+
+    def close(self) -> None:
+        self._conn.close()
+
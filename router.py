@@ -0,0 +1,384 @@
+"""
+Маршрутизация запросов к LLM по цене и задержке.
+
+Раньше каждый вызов шёл в одну модель: генерация — mistral-small-latest,
+оценка — фиксированный снимок gpt-4o-mini, независимо от сложности задачи.
+Теперь у каждой задачи есть лестница уровней (tiers) из политики маршрутизации:
+черновую генерацию и массовый скрининг делает быстрая дешёвая модель, а в сильную
+уходят только финалисты и ответы, которые не удалось разобрать.
+
+По каждому уровню копятся вызовы, сбои, эскалации, задержка, токены, стоимость
+и качество (доля полных ответов), router.report() отдаёт сводку, в том числе
+сколько результатов получено на доллар.
+
+Политика настраивается словарём или JSON-файлом (переменная окружения ROUTING_CONFIG):
+    {"tiers": {"mistral-fast": {"provider": "mistral", "model": "...", ...}},
+     "policy": {"generate": ["mistral-fast", "mistral-strong"]}}
+
+С ROUTING_CONFIG webapp, очередь задач, pipeline.py и service.py генерируют через
+RoutedGenerator (prompt.get_generator), а оценщик GENAI4_EVALUATOR=llm — через
+RoutedAdTest (feedback.get_ad_test); без него — одна модель, как раньше.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from feedback_helper import count_tokens
+
+
+@dataclass
+class ModelTier:
+    name: str
+    provider: str                       # "mistral" | "openai"
+    model: str
+    input_cost_per_1m: float            # $ за 1M входных токенов
+    output_cost_per_1m: float           # $ за 1M выходных токенов
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.input_cost_per_1m + completion_tokens * self.output_cost_per_1m) / 1e6
+
+
+# Цены — публичные прайсы провайдеров на момент написания; для точного учёта
+# переопределяются в ROUTING_CONFIG.
+DEFAULT_TIERS: Dict[str, ModelTier] = {
+    t.name: t
+    for t in [
+        ModelTier("mistral-fast", "mistral", "ministral-8b-latest", 0.10, 0.10),
+        ModelTier("mistral-strong", "mistral", "mistral-large-latest", 2.00, 6.00),
+        ModelTier("openai-fast", "openai", "gpt-4o-mini-2024-07-18", 0.15, 0.60),
+        ModelTier("openai-strong", "openai", "gpt-4o-2024-08-06", 2.50, 10.00),
+    ]
+}
+
+# задача -> уровни по порядку эскалации
+DEFAULT_POLICY: Dict[str, List[str]] = {
+    "generate": ["mistral-fast", "mistral-strong"],        # черновые варианты
+    "generate_finalist": ["mistral-strong"],               # доработка финалистов
+    "screen": ["openai-fast", "openai-strong"],            # массовая оценка
+    "evaluate_finalist": ["openai-strong"],                # точная оценка финалистов
+}
+
+
+@dataclass
+class TierStats:
+    calls: int = 0
+    failures: int = 0
+    escalations: int = 0          # сколько раз с этого уровня ушли на следующий
+    latency_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    quality_sum: float = 0.0      # сумма оценок качества удачных ответов (0..1)
+    results: int = 0              # сколько полезных результатов получено (вариантов, оценок)
+
+    def summary(self) -> Dict[str, Any]:
+        ok = self.calls - self.failures
+        return {
+            **asdict(self),
+            "cost": round(self.cost, 6),
+            "latency_seconds": round(self.latency_seconds, 3),
+            "mean_latency_s": round(self.latency_seconds / self.calls, 4) if self.calls else 0.0,
+            "failure_rate": round(self.failures / self.calls, 4) if self.calls else 0.0,
+            "mean_quality": round(self.quality_sum / ok, 4) if ok else 0.0,
+            "results_per_dollar": round(self.results / self.cost, 1) if self.cost else None,
+        }
+
+
+class RoutingFailed(Exception):
+    """Все уровни политики для задачи не дали годного ответа."""
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        tiers: Optional[Dict[str, ModelTier]] = None,
+        policy: Optional[Dict[str, List[str]]] = None,
+    ):
+        self.tiers = dict(tiers or DEFAULT_TIERS)
+        self.policy = {k: list(v) for k, v in (policy or DEFAULT_POLICY).items()}
+        for task, names in self.policy.items():
+            unknown = [n for n in names if n not in self.tiers]
+            if unknown:
+                raise ValueError(f"Политика '{task}' ссылается на неизвестные уровни: {unknown}")
+        self.stats: Dict[str, TierStats] = {name: TierStats() for name in self.tiers}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, path: Optional[str] = None) -> "ModelRouter":
+        """Уровни и политика по умолчанию + переопределения из JSON (path или ROUTING_CONFIG)."""
+        path = path or os.getenv("ROUTING_CONFIG")
+        if not path:
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        tiers = dict(DEFAULT_TIERS)
+        for name, spec in config.get("tiers", {}).items():
+            tiers[name] = ModelTier(name=name, **spec)
+        policy = {**DEFAULT_POLICY, **config.get("policy", {})}
+        return cls(tiers, policy)
+
+    def route(self, task: str) -> List[ModelTier]:
+        if task not in self.policy:
+            raise ValueError(f"Нет политики маршрутизации для задачи '{task}'")
+        return [self.tiers[name] for name in self.policy[task]]
+
+    def record(
+        self,
+        tier: ModelTier,
+        latency: float,
+        prompt_tokens: int,
+        completion_tokens: int,
+        ok: bool,
+        quality: float = 0.0,
+        results: int = 0,
+        escalated: bool = False,
+    ) -> None:
+        with self._lock:
+            st = self.stats[tier.name]
+            st.calls += 1
+            st.failures += 0 if ok else 1
+            st.escalations += 1 if escalated else 0
+            st.latency_seconds += latency
+            st.prompt_tokens += prompt_tokens
+            st.completion_tokens += completion_tokens
+            st.cost += tier.cost(prompt_tokens, completion_tokens)
+            if ok:
+                st.quality_sum += quality
+                st.results += results
+
+    def call(
+        self,
+        task: str,
+        run: Callable[[ModelTier], Tuple[Any, int, int]],
+        judge: Callable[[Any], Tuple[bool, float, int]],
+    ) -> Tuple[Any, ModelTier]:
+        """
+        Пробует уровни задачи по порядку.
+        run(tier) -> (результат, prompt_tokens, completion_tokens); исключение — сбой уровня.
+        judge(результат) -> (годен ли, качество 0..1, число полезных результатов).
+        Негодный ответ или исключение — эскалация на следующий уровень.
+        """
+        tiers = self.route(task)
+        last_error: Optional[BaseException] = None
+        for i, tier in enumerate(tiers):
+            has_next = i + 1 < len(tiers)
+            t0 = time.perf_counter()
+            try:
+                result, prompt_tokens, completion_tokens = run(tier)
+            except Exception as e:
+                self.record(tier, time.perf_counter() - t0, 0, 0, ok=False, escalated=has_next)
+                last_error = e
+                continue
+            ok, quality, n_results = judge(result)
+            self.record(
+                tier, time.perf_counter() - t0, prompt_tokens, completion_tokens,
+                ok=ok, quality=quality, results=n_results, escalated=has_next and not ok,
+            )
+            if ok:
+                return result, tier
+            last_error = None
+        raise RoutingFailed(f"Задача '{task}': ни один уровень не дал годного ответа ({last_error})")
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {name: st.summary() for name, st in self.stats.items() if st.calls}
+            total_cost = sum(st.cost for st in self.stats.values())
+            total_results = sum(st.results for st in self.stats.values())
+        return {
+            "policy": self.policy,
+            "tiers": tiers,
+            "total_cost": round(total_cost, 6),
+            "total_results": total_results,
+            "results_per_dollar": round(total_results / total_cost, 1) if total_cost else None,
+        }
+
+
+_default_router: Optional[ModelRouter] = None
+_default_lock = threading.Lock()
+
+
+def routing_enabled() -> bool:
+    return bool(os.getenv("ROUTING_CONFIG"))
+
+
+def get_default_router() -> ModelRouter:
+    global _default_router
+    with _default_lock:
+        if _default_router is None:
+            _default_router = ModelRouter.from_config()
+        return _default_router
+
+
+# ==========================
+# ГЕНЕРАЦИЯ
+# ==========================
+
+def _default_client_factory(tier: ModelTier):
+    from prompt import MistralClient
+
+    if tier.provider != "mistral":
+        raise ValueError(f"Генерация поддерживает только Mistral, а уровень {tier.name} — {tier.provider}")
+    return MistralClient(model=tier.model)
+
+
+def mock_client_factory(tier: ModelTier):
+    from prompt import MockLLMClient
+
+    return MockLLMClient()
+
+
+class RoutedGenerator:
+    """
+    Замена AdGenerator с тем же generate_from_json_dict: черновики — задача "generate"
+    (быстрая модель, эскалация при непарсящемся или неполном ответе),
+    finalist=True — задача "generate_finalist".
+    """
+
+    supports_finalist = True
+
+    def __init__(
+        self,
+        router: Optional[ModelRouter] = None,
+        client_factory: Callable[[ModelTier], Any] = _default_client_factory,
+        index=None,
+    ):
+        self.router = router or get_default_router()
+        self.client_factory = client_factory
+        # creative_index.CreativeIndex — передаётся в AdGenerator каждого уровня
+        self.index = index
+        self._generators: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _generator(self, tier: ModelTier):
+        from prompt import AdGenerator
+
+        with self._lock:
+            if tier.name not in self._generators:
+                self._generators[tier.name] = AdGenerator(self.client_factory(tier), index=self.index)
+            return self._generators[tier.name]
+
+    def generate_from_json_dict(
+        self,
+        input_json: Dict[str, Any],
+        return_human_texts: bool = True,
+        finalist: bool = False,
+    ) -> Dict[str, Any]:
+        wanted = max(1, int(input_json.get("n_variants", 1) or 1))
+        prompt_estimate = count_tokens(json.dumps(input_json, ensure_ascii=False))
+
+        def run(tier: ModelTier):
+            generator = self._generator(tier)
+            result = generator.generate_from_json_dict(input_json, return_human_texts=return_human_texts)
+            usage = getattr(generator.llm_client, "last_usage", None) or {}
+            prompt_tokens = usage.get("prompt_tokens") or prompt_estimate
+            completion_tokens = usage.get("completion_tokens") or count_tokens(
+                json.dumps(result["variants"], ensure_ascii=False)
+            )
+            return result, prompt_tokens, completion_tokens
+
+        def judge(result):
+            # пустой ответ эскалируем так же, как непарсящийся; неполный — годен, но снижает качество
+            n = len(result.get("variants", []))
+            return n > 0, min(1.0, n / wanted), n
+
+        result, tier = self.router.call("generate_finalist" if finalist else "generate", run, judge)
+        return {**result, "model_tier": tier.name}
+
+
+# ==========================
+# ОЦЕНКА
+# ==========================
+
+class RoutedAdTest:
+    """
+    Массовый скрининг run_batch на дешёвой модели ("screen"); объявления, по которым
+    она не дала разборчивых оценок, переоцениваются на следующем уровне.
+    evaluate_finalists — сразу на уровнях задачи "evaluate_finalist".
+    """
+
+    def __init__(self, router: Optional[ModelRouter] = None, ad_test_factory: Optional[Callable[[ModelTier], Any]] = None, **ad_test_kwargs):
+        self.router = router or get_default_router()
+        self.ad_test_factory = ad_test_factory
+        self.ad_test_kwargs = ad_test_kwargs
+        self._testers: Dict[str, Any] = {}
+
+    def _tester(self, tier: ModelTier):
+        if tier.name not in self._testers:
+            if self.ad_test_factory is not None:
+                self._testers[tier.name] = self.ad_test_factory(tier)
+            else:
+                from feedback import AdTest
+
+                self._testers[tier.name] = AdTest(model=tier.model, **self.ad_test_kwargs)
+        return self._testers[tier.name]
+
+    def _run_task(self, task: str, ads: Sequence[str], types: List[str]) -> List[Optional[Dict[str, float]]]:
+        scores: List[Optional[Dict[str, float]]] = [None] * len(ads)
+        pending = list(range(len(ads)))
+        tiers = self.router.route(task)
+        for i, tier in enumerate(tiers):
+            if not pending:
+                break
+            tester = self._tester(tier)
+            before = (tester.prompt_tokens_total, tester.usage_prompt_tokens, tester.usage_completion_tokens)
+            t0 = time.perf_counter()
+            try:
+                batch_scores = tester.run_batch([ads[j] for j in pending], types)
+            except Exception:
+                self.router.record(tier, time.perf_counter() - t0, 0, 0, ok=False, escalated=i + 1 < len(tiers))
+                continue
+            latency = time.perf_counter() - t0
+
+            prompt_tokens = (tester.usage_prompt_tokens - before[1]) or (tester.prompt_tokens_total - before[0])
+            completion_tokens = tester.usage_completion_tokens - before[2]
+            got = [(j, s) for j, s in zip(pending, batch_scores) if s is not None]
+            for j, s in got:
+                scores[j] = s
+            still_pending = [j for j, s in zip(pending, batch_scores) if s is None]
+            self.router.record(
+                tier, latency, prompt_tokens, completion_tokens,
+                ok=bool(got),
+                quality=len(got) / len(pending),
+                results=len(got),
+                escalated=bool(still_pending) and i + 1 < len(tiers),
+            )
+            pending = still_pending
+        return scores
+
+    def screen(self, ads: Sequence[str], types: List[str]) -> List[Optional[Dict[str, float]]]:
+        return self._run_task("screen", ads, types)
+
+    def evaluate_finalists(self, ads: Sequence[str], types: List[str]) -> List[Optional[Dict[str, float]]]:
+        return self._run_task("evaluate_finalist", ads, types)
+
+    def run_batch(self, ads: Sequence[str], types: List[str]) -> List[Optional[Dict[str, float]]]:
+        """Тот же интерфейс, что у AdTest.run_batch: массовая оценка — это скрининг."""
+        return self.screen(ads, types)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from campaign import build_payload_for_record, parse_products_json
+
+    parser = argparse.ArgumentParser(description="Генерация по каталогу через маршрутизатор моделей")
+    parser.add_argument("catalog", nargs="?", default="products.json")
+    parser.add_argument("--config", help="JSON с уровнями и политикой (иначе ROUTING_CONFIG)")
+    parser.add_argument("--mock", action="store_true", help="MockLLMClient на всех уровнях")
+    args = parser.parse_args()
+
+    router = ModelRouter.from_config(args.config)
+    factory = mock_client_factory if args.mock else _default_client_factory
+    generator = RoutedGenerator(router, client_factory=factory)
+    with open(args.catalog, "r", encoding="utf-8") as f:
+        records = parse_products_json(json.load(f))
+    for record in records:
+        payload, _, _ = build_payload_for_record(record, "")
+        generator.generate_from_json_dict(payload)
+
+    print(json.dumps(router.report(), ensure_ascii=False, indent=2))
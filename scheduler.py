@@ -0,0 +1,460 @@
+"""
+Общий планировщик исходящих запросов к провайдерам: Mistral, OpenAI, Wordstat.
+
+Раньше каждый клиент ходил к провайдеру сам по себе, поэтому интерактивный запрос
+из интерфейса стоял за ночным батчем, и оба упирались в лимиты провайдера.
+Теперь каждый вызов сначала получает «слот» у планировщика процесса:
+
+  * корзины на провайдера: запросы в минуту и токены в минуту
+    (rate_limit.PROVIDER_RPM / PROVIDER_TPM, RateLimiter оттуда же);
+  * классы приоритета: interactive всегда раньше batch;
+  * внутри класса — честное чередование арендаторов (сессия Streamlit, задача
+    очереди): по одному запросу от каждого по кругу, чтобы один большой прогон
+    не занял провайдера целиком;
+  * глубина очередей и время ожидания — в metrics (genai4_scheduler_*) и stats().
+
+По умолчанию корзины и приоритеты действуют внутри одного процесса. Воркеры очереди
+задач — отдельные процессы, и каждый со своими корзинами вместе с webapp превысил бы
+лимит провайдера в N+1 раз. share_across_processes(path) переносит корзины в общий
+SQLite-файл (rate_limit.SharedRateLimiter), а каждый процесс публишет там, сколько
+у него ждёт interactive-запросов: batch-запрос не выдаётся, пока interactive ждёт
+хоть в одном процессе. webapp и jobqueue включают это для файла рядом с jobs.db.
+
+Приоритет и арендатор задаются контекстом, а не аргументами каждого клиента:
+
+    with call_context(priority=BATCH, tenant=f"job:{job_id}"):
+        run_campaign(...)          # все вызовы LLM внутри — batch этого арендатора
+
+Контекст — contextvars: asyncio-задачи и asyncio.to_thread наследуют его сами,
+пулы потоков — через contextvars.copy_context().run (см. campaign.generate_catalog).
+
+Со стороны клиента:
+
+    with get_scheduler().slot("mistral", tokens=estimate) as grant:
+        resp = httpx.post(...)
+        grant.settle(resp_usage_total)   # поправить корзину токенов по факту
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional
+
+import metrics
+from rate_limit import PROVIDER_RPM, PROVIDER_TPM, RateLimiter, SharedRateLimiter
+
+INTERACTIVE, BATCH = "interactive", "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+DEFAULT_TENANT = "default"
+
+DEFAULT_RPM = 60            # для провайдера, которого нет в PROVIDER_RPM
+TOKEN_BURST_SECONDS = 10     # ёмкость корзины токенов — столько секунд TPM
+COMPLETION_ESTIMATE = 600    # токенов ответа LLM в оценке до запроса (поправляется settle)
+DEMAND_POLL = 0.25           # как часто batch перепроверяет interactive-спрос других процессов
+DEMAND_REFRESH = 5.0         # как часто процесс подтверждает, что его interactive всё ещё ждут
+DEMAND_STALE = 30.0          # спрос без подтверждения дольше этого — от упавшего процесса
+
+_context: ContextVar[Dict[str, Any]] = ContextVar(
+    "genai4_call_context",
+    default={"priority": INTERACTIVE, "tenant": DEFAULT_TENANT, "rate_limited": True},
+)
+
+
+@contextlib.contextmanager
+def call_context(
+    priority: Optional[str] = None,
+    tenant: Optional[str] = None,
+    rate_limited: Optional[bool] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Приоритет/арендатор для всех вызовов провайдеров внутри блока.
+    rate_limited=False — без ожидания в корзинах (локальные стенды в benchmark.py).
+    """
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError(f"priority должен быть одним из {PRIORITIES}")
+    current = _context.get()
+    updates = {"priority": priority, "tenant": tenant, "rate_limited": rate_limited}
+    token = _context.set({**current, **{k: v for k, v in updates.items() if v is not None}})
+    try:
+        yield _context.get()
+    finally:
+        _context.reset(token)
+
+
+def current_context() -> Dict[str, Any]:
+    return dict(_context.get())
+
+
+def estimate_tokens(text: str, completion: int = COMPLETION_ESTIMATE) -> int:
+    """Грубая оценка до запроса: ~4 байта UTF-8 на токен промпта плюс ожидаемый ответ."""
+    return max(1, len(text.encode("utf-8")) // 4) + completion
+
+
+class SchedulerTimeout(TimeoutError):
+    pass
+
+
+class Grant:
+    """Разрешение на один запрос; settle() поправляет корзину токенов по usage ответа."""
+
+    __slots__ = ("provider", "tokens", "waited", "_bucket", "_settled")
+
+    def __init__(self, provider: str, tokens: float, waited: float, bucket: Optional[RateLimiter]):
+        self.provider = provider
+        self.tokens = tokens
+        self.waited = waited
+        self._bucket = bucket
+        self._settled = False
+
+    def settle(self, actual_tokens: Optional[float]) -> None:
+        if self._settled or not actual_tokens or self._bucket is None:
+            return
+        self._settled = True
+        self._bucket.refund(self.tokens - actual_tokens)
+
+
+class _Ticket:
+    __slots__ = ("priority", "tenant", "tokens", "enqueued", "event", "loop", "future", "granted")
+
+    def __init__(self, priority: str, tenant: str, tokens: float):
+        self.priority = priority
+        self.tenant = tenant
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.event: Optional[threading.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.future: Optional[asyncio.Future] = None
+        self.granted = False
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        else:
+            self.event.set()
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+_DEMAND_SCHEMA = """
+CREATE TABLE IF NOT EXISTS demand (
+    provider TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    interactive INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (provider, pid)
+);
+"""
+
+
+class _SharedDemand:
+    """Сколько interactive-запросов ждёт в каждом процессе — по строке на (провайдер, pid)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pid = os.getpid()
+        self._conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_DEMAND_SCHEMA)
+        self._published: Dict[str, float] = {}
+
+    def publish(self, provider: str, waiting: int, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self._published.get(provider, 0.0) < DEMAND_REFRESH:
+            return
+        self._published[provider] = now
+        self._conn.execute(
+            "INSERT OR REPLACE INTO demand (provider, pid, interactive, updated) VALUES (?, ?, ?, ?)",
+            (provider, self.pid, waiting, now),
+        )
+
+    def others_waiting(self, provider: str) -> bool:
+        row = self._conn.execute(
+            "SELECT 1 FROM demand WHERE provider = ? AND pid != ? AND interactive > 0 AND updated >= ? LIMIT 1",
+            (provider, self.pid, time.time() - DEMAND_STALE),
+        ).fetchone()
+        return row is not None
+
+
+class _ProviderQueue:
+    def __init__(self, provider: str, rpm: Optional[float], tpm: Optional[float], shared_path: Optional[str] = None):
+        self.provider = provider
+        self.rpm = rpm
+        self.tpm = tpm
+        token_burst = max(1.0, tpm / 60 * TOKEN_BURST_SECONDS) if tpm else None
+        if shared_path is not None:
+            self.requests = SharedRateLimiter(shared_path, f"{provider}:requests", rpm) if rpm else None
+            self.tokens = SharedRateLimiter(shared_path, f"{provider}:tokens", tpm, burst=token_burst) if tpm else None
+        else:
+            self.requests = RateLimiter(rpm) if rpm else None
+            self.tokens = RateLimiter(tpm, burst=token_burst) if tpm else None
+        # приоритет -> арендатор -> его запросы по порядку; порядок арендаторов — очередь круга
+        self.waiting: Dict[str, "OrderedDict[str, Deque[_Ticket]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self.depth = {p: 0 for p in PRIORITIES}
+        self.granted = {p: 0 for p in PRIORITIES}
+        self.timer: Optional[threading.Timer] = None
+        self.timer_due = 0.0
+
+
+class Scheduler:
+    def __init__(
+        self,
+        rpm: Optional[Dict[str, float]] = None,
+        tpm: Optional[Dict[str, float]] = None,
+    ):
+        self._rpm = dict(PROVIDER_RPM if rpm is None else rpm)
+        self._tpm = dict(PROVIDER_TPM if tpm is None else tpm)
+        self._lock = threading.Lock()
+        self._queues: Dict[str, _ProviderQueue] = {}
+        self._shared_path: Optional[str] = None
+        self._demand: Optional[_SharedDemand] = None
+
+    def share(self, path: str) -> None:
+        """Корзины и interactive-спрос — в SQLite-файле path, общем с другими процессами."""
+        with self._lock:
+            if self._shared_path == os.path.abspath(path):
+                return
+            self._shared_path = os.path.abspath(path)
+            self._demand = _SharedDemand(self._shared_path)
+            for provider in list(self._queues):
+                self._rebuild(provider)
+
+    def configure(self, provider: str, rpm: Optional[float] = None, tpm: Optional[float] = None) -> None:
+        """Новые лимиты провайдера (None — без ограничения). Ждущие запросы переносятся."""
+        with self._lock:
+            self._rpm[provider] = rpm
+            self._tpm[provider] = tpm
+            self._rebuild(provider)
+
+    def _rebuild(self, provider: str) -> None:
+        """Пересоздать очередь провайдера с текущими лимитами. Под self._lock."""
+        old = self._queues.pop(provider, None)
+        q = self._queue(provider)
+        if old is not None:
+            if old.timer is not None:
+                old.timer.cancel()
+            q.waiting, q.depth, q.granted = old.waiting, old.depth, old.granted
+            self._dispatch(q)
+
+    def _queue(self, provider: str) -> _ProviderQueue:
+        q = self._queues.get(provider)
+        if q is None:
+            q = self._queues[provider] = _ProviderQueue(
+                provider, self._rpm.get(provider, DEFAULT_RPM), self._tpm.get(provider), self._shared_path
+            )
+        return q
+
+    # --- очередь ---
+
+    def _head(self, q: _ProviderQueue) -> Optional[_Ticket]:
+        for priority in PRIORITIES:
+            tenants = q.waiting[priority]
+            if tenants:
+                return next(iter(tenants.values()))[0]
+        return None
+
+    def _pop_head(self, q: _ProviderQueue, ticket: _Ticket) -> None:
+        tenants = q.waiting[ticket.priority]
+        tickets = tenants[ticket.tenant]
+        tickets.popleft()
+        if tickets:
+            tenants.move_to_end(ticket.tenant)  # следующий запрос арендатора — после остальных
+        else:
+            del tenants[ticket.tenant]
+        self._set_depth(q, ticket.priority, -1)
+
+    def _set_depth(self, q: _ProviderQueue, priority: str, delta: int) -> None:
+        q.depth[priority] += delta
+        metrics.set_gauge("genai4_scheduler_queue_depth", q.depth[priority], provider=q.provider, priority=priority)
+        if priority == INTERACTIVE and self._arbitrated(q):
+            # другим процессам важен только переход 0 <-> не 0, остальное — подтверждение раз в DEMAND_REFRESH
+            became = q.depth[INTERACTIVE] == (1 if delta > 0 else 0)
+            self._demand.publish(q.provider, q.depth[INTERACTIVE], force=became)
+
+    def _arbitrated(self, q: _ProviderQueue) -> bool:
+        # без корзин провайдер ничем не ограничен — делить между процессами нечего
+        return self._demand is not None and (q.requests is not None or q.tokens is not None)
+
+    def _dispatch(self, q: _ProviderQueue) -> None:
+        """Выдать слоты всем, кому позволяют корзины; иначе завести таймер. Под self._lock."""
+        while True:
+            ticket = self._head(q)
+            if ticket is None:
+                return
+            if self._arbitrated(q):
+                if ticket.priority == INTERACTIVE:
+                    self._demand.publish(q.provider, q.depth[INTERACTIVE])
+                elif self._demand.others_waiting(q.provider):
+                    # interactive ждёт в другом процессе (webapp) — batch этого процесса уступает
+                    self._arm_timer(q, DEMAND_POLL)
+                    return
+            wait = 0.0
+            if q.requests is not None:
+                wait = q.requests.wait_time(1)
+            if q.tokens is not None and ticket.tokens:
+                wait = max(wait, q.tokens.wait_time(ticket.tokens))
+            if wait > 0:
+                self._arm_timer(q, wait)
+                return
+            if q.requests is not None:
+                q.requests.take(1)
+            if q.tokens is not None and ticket.tokens:
+                q.tokens.take(ticket.tokens)
+            self._pop_head(q, ticket)
+            self._record_grant(q, ticket)
+            ticket.grant()
+
+    def _arm_timer(self, q: _ProviderQueue, wait: float) -> None:
+        due = time.monotonic() + wait
+        if q.timer is not None and q.timer.is_alive() and q.timer_due <= due:
+            return
+        if q.timer is not None:
+            q.timer.cancel()
+        q.timer = threading.Timer(wait, self._on_timer, args=(q.provider,))
+        q.timer.daemon = True
+        q.timer_due = due
+        q.timer.start()
+
+    def _on_timer(self, provider: str) -> None:
+        with self._lock:
+            q = self._queues.get(provider)
+            if q is not None:
+                q.timer = None
+                self._dispatch(q)
+
+    def _record_grant(self, q: _ProviderQueue, ticket: _Ticket) -> None:
+        q.granted[ticket.priority] += 1
+        metrics.inc("genai4_scheduler_requests_total", provider=q.provider, priority=ticket.priority)
+        metrics.observe(
+            "genai4_scheduler_wait_seconds",
+            time.monotonic() - ticket.enqueued,
+            provider=q.provider,
+            priority=ticket.priority,
+        )
+
+    def _enqueue(self, provider: str, ticket: _Ticket) -> None:
+        with self._lock:
+            q = self._queue(provider)
+            q.waiting[ticket.priority].setdefault(ticket.tenant, deque()).append(ticket)
+            self._set_depth(q, ticket.priority, +1)
+            self._dispatch(q)
+
+    def _cancel(self, provider: str, ticket: _Ticket) -> bool:
+        """Убрать из очереди не дождавшийся запрос. False — слот уже выдан."""
+        with self._lock:
+            if ticket.granted:
+                return False
+            q = self._queues[provider]
+            tickets = q.waiting[ticket.priority].get(ticket.tenant)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del q.waiting[ticket.priority][ticket.tenant]
+                self._set_depth(q, ticket.priority, -1)
+                # ушёл голова очереди — следующий, возможно, уже проходит
+                self._dispatch(q)
+            return True
+
+    def _ticket(self, tokens: float, priority: Optional[str], tenant: Optional[str]) -> Optional[_Ticket]:
+        ctx = _context.get()
+        if not ctx["rate_limited"]:
+            return None
+        priority = priority or ctx["priority"]
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority должен быть одним из {PRIORITIES}")
+        return _Ticket(priority, tenant or ctx["tenant"], float(tokens or 0))
+
+    def _unlimited_grant(self, provider: str, tokens: float) -> Grant:
+        metrics.inc("genai4_scheduler_requests_total", provider=provider, priority="unlimited")
+        return Grant(provider, tokens, 0.0, None)
+
+    # --- API клиентов ---
+
+    @contextlib.contextmanager
+    def slot(
+        self,
+        provider: str,
+        tokens: float = 0,
+        priority: Optional[str] = None,
+        tenant: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Iterator[Grant]:
+        """Синхронно дождаться слота (потоки Streamlit, пулы, CLI)."""
+        ticket = self._ticket(tokens, priority, tenant)
+        if ticket is None:
+            yield self._unlimited_grant(provider, tokens)
+            return
+        ticket.event = threading.Event()
+        self._enqueue(provider, ticket)
+        if not ticket.event.wait(timeout) and self._cancel(provider, ticket):
+            raise SchedulerTimeout(f"Нет слота к {provider} за {timeout} с")
+        yield Grant(provider, ticket.tokens, time.monotonic() - ticket.enqueued, self._queues[provider].tokens)
+
+    @contextlib.asynccontextmanager
+    async def aslot(
+        self,
+        provider: str,
+        tokens: float = 0,
+        priority: Optional[str] = None,
+        tenant: Optional[str] = None,
+    ) -> AsyncIterator[Grant]:
+        """То же для asyncio; отмена задачи снимает запрос с очереди."""
+        ticket = self._ticket(tokens, priority, tenant)
+        if ticket is None:
+            yield self._unlimited_grant(provider, tokens)
+            return
+        ticket.loop = asyncio.get_running_loop()
+        ticket.future = ticket.loop.create_future()
+        self._enqueue(provider, ticket)
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            self._cancel(provider, ticket)
+            raise
+        yield Grant(provider, ticket.tokens, time.monotonic() - ticket.enqueued, self._queues[provider].tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                provider: {
+                    "rpm": q.rpm,
+                    "tpm": q.tpm,
+                    "waiting": {
+                        p: {tenant: len(tickets) for tenant, tickets in q.waiting[p].items()}
+                        for p in PRIORITIES
+                    },
+                    "depth": dict(q.depth),
+                    "granted": dict(q.granted),
+                    "shared": self._shared_path,
+                }
+                for provider, q in self._queues.items()
+            }
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """Один планировщик на процесс — через него ходят все клиенты провайдеров."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def share_across_processes(path: str) -> Scheduler:
+    """Планировщик процесса делит корзины и приоритеты со всеми, кто указал тот же path."""
+    scheduler = get_scheduler()
+    scheduler.share(path)
+    return scheduler
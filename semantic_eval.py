@@ -0,0 +1,226 @@
+"""
+Семантический оценщик рекламы: релевантность объявления интересам сегмента.
+
+Эвристика в main.evaluate_ad видит только слова «скид», «бесплат», «новин» и не
+может сказать, про то ли объявление вообще, что интересно сегменту.
+Здесь у каждого сегмента есть профиль — взвешенная смесь эмбеддингов его описания,
+интересов и поведения персон (веса — доля персон сегмента с этим признаком).
+Матрица профилей [сегменты × dim] считается один раз; объявление эмбеддится один
+раз, и релевантность ко всем сегментам — одно матричное произведение.
+
+Поверх релевантности — ценовые поправки: ценовой сигнал в тексте (скидка, акция,
+бесплатно) сильнее действует на сегменты с высокой price_sensitivity и долей
+reacts_to_discounts.
+
+Включается переменной окружения GENAI4_EVALUATOR=semantic (см. main.py).
+Энкодер — embedding_client.get_encoder(): общий сервер эмбеддингов или своя модель.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from eval_cache import normalize_ad_text
+
+INTEREST_TEXT = {
+    "art_culture": "искусство, театр, музеи, культура",
+    "automotive": "автомобили, автотовары, тюнинг",
+    "diy_hobbies": "ремонт своими руками, хобби, инструменты",
+    "eco_sustainability": "экология, осознанное потребление, переработка",
+    "education_self_development": "обучение, курсы, саморазвитие",
+    "entertainment": "развлечения, кино, сериалы, музыка",
+    "fashion_beauty": "мода, одежда, косметика, красота",
+    "finance_investing": "финансы, инвестиции, сбережения",
+    "food_cooking": "еда, кулинария, рецепты",
+    "gaming": "видеоигры, консоли, киберспорт",
+    "health_fitness": "здоровье, фитнес, спорт, правильное питание",
+    "home_family": "дом, семья, дети, уют",
+    "sports": "спорт, тренировки, спортивные товары",
+    "tech_gadgets": "гаджеты, смартфоны, электроника, новые технологии",
+    "travel_experiences": "путешествия, туризм, отдых, впечатления",
+}
+
+BEHAVIOR_TEXT = {
+    "ad_blocking": "не любит рекламу и навязчивые объявления",
+    "brand_loyal": "верен известным брендам",
+    "early_adopter": "первым покупает новинки",
+    "high_engagement": "активно реагирует на контент",
+    "impulsive_buyer": "покупает импульсивно, здесь и сейчас",
+    "late_adopter": "покупает проверенное временем",
+    "passive_scroller": "пролистывает ленту без интереса",
+    "privacy_conscious": "заботится о приватности данных",
+    "quality_seeker": "ищет качество и надёжность",
+    "reacts_to_discounts": "реагирует на скидки и акции",
+    "researcher": "изучает характеристики и отзывы перед покупкой",
+    "social_proof_reactive": "доверяет отзывам и рейтингам",
+    "trend_follower": "следит за трендами",
+    "utilitarian_buyer": "покупает практичные вещи по необходимости",
+}
+
+# ценовой сигнал в тексте объявления (по корням слов, как в эвристике)
+PRICE_CUES = ("скид", "бесплат", "акци", "распродаж", "дешев", "выгод", "промокод", "кэшбэк", "%")
+
+SEGMENT_WEIGHT = 1.0   # вес описания сегмента относительно суммы весов интересов/поведения
+RELEVANCE_SCALE = 4.0  # сдвиг вероятности клика на единицу центрированной релевантности
+PRICE_WEIGHT = 0.15    # ценовой сигнал × (price_sensitivity − 0.5)
+DISCOUNT_WEIGHT = 0.1  # ценовой сигнал × доля reacts_to_discounts
+PURCHASE_PRICE_PENALTY = 0.1  # без ценового сигнала чувствительные к цене покупают реже
+AD_CACHE_SIZE = 10_000
+
+
+def _segment_description(segment: str) -> str:
+    return segment.replace("_", " ")
+
+
+def _price_cue(ad_text: str) -> float:
+    text = ad_text.lower()
+    return 1.0 if any(cue in text for cue in PRICE_CUES) else 0.0
+
+
+def _length_penalty(ad_text: str) -> float:
+    length = len(ad_text)
+    return -0.1 if length < 80 or length > 600 else 0.0
+
+
+class SemanticEvaluator:
+    def __init__(self, personas: Optional[Dict[str, List[Dict]]] = None, encoder=None):
+        if personas is None:
+            from main import get_personas
+
+            personas = get_personas()
+        if encoder is None:
+            from embedding_client import get_encoder
+
+            encoder = get_encoder()
+        self.encoder = encoder
+        self._lock = threading.Lock()
+        self._ad_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+        # словарь понятий: интересы, поведение, описания сегментов — один вызов encode
+        self.concepts = [f"interest:{k}" for k in INTEREST_TEXT] + [f"behavior:{k}" for k in BEHAVIOR_TEXT]
+        texts = [f"query: {v}" for v in INTEREST_TEXT.values()] + [f"query: {v}" for v in BEHAVIOR_TEXT.values()]
+        segments = list(personas)
+        texts += [f"query: {_segment_description(s)}" for s in segments]
+        emb = self._encode(texts)
+        concept_emb, segment_emb = emb[: len(self.concepts)], emb[len(self.concepts):]
+        index = {c: i for i, c in enumerate(self.concepts)}
+
+        weights = np.zeros((len(segments), len(self.concepts)), dtype=np.float32)
+        self.price_sensitivity = np.full(len(segments), 0.5, dtype=np.float32)
+        self.discount_share = np.zeros(len(segments), dtype=np.float32)
+        for row, segment in enumerate(segments):
+            members = personas[segment] or []
+            for p in members:
+                for k in p.get("interests", []):
+                    if f"interest:{k}" in index:
+                        weights[row, index[f"interest:{k}"]] += 1
+                for k in p.get("behaviors", []):
+                    if f"behavior:{k}" in index:
+                        weights[row, index[f"behavior:{k}"]] += 1
+            if members:
+                self.price_sensitivity[row] = np.mean([p.get("price_sensitivity", 0.5) for p in members])
+                self.discount_share[row] = np.mean(
+                    ["reacts_to_discounts" in p.get("behaviors", []) for p in members]
+                )
+        totals = weights.sum(axis=1, keepdims=True)
+        weights = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+        # профиль = взвешенное среднее понятий + описание сегмента; минус «средний профиль»,
+        # чтобы общая похожесть любых русских текстов (у e5 косинусы ~0.7–0.85) не давала плюс
+        profiles = (weights @ concept_emb + SEGMENT_WEIGHT * segment_emb) / (1 + SEGMENT_WEIGHT)
+        self._baseline = concept_emb.mean(axis=0)
+        self.profiles = (profiles - self._baseline).astype(np.float32)
+        self.segments = {s: i for i, s in enumerate(segments)}
+
+    def _encode(self, texts: Sequence[str]) -> np.ndarray:
+        emb = self.encoder.encode(list(texts), convert_to_tensor=False, normalize_embeddings=True)
+        return np.asarray(emb, dtype=np.float32)
+
+    def _segment_rows(self, segments: Sequence[str]) -> np.ndarray:
+        """Индексы строк профилей; сегмент не из файла персон получает профиль по своему названию."""
+        missing = [s for s in dict.fromkeys(segments) if s not in self.segments]
+        if missing:
+            emb = self._encode([f"query: {_segment_description(s)}" for s in missing])
+            with self._lock:
+                for s, e in zip(missing, emb):
+                    if s in self.segments:
+                        continue
+                    self.segments[s] = len(self.profiles)
+                    self.profiles = np.vstack([self.profiles, e - self._baseline])
+                    self.price_sensitivity = np.append(self.price_sensitivity, 0.5)
+                    self.discount_share = np.append(self.discount_share, 0.0)
+        return np.array([self.segments[s] for s in segments], dtype=np.intp)
+
+    def embed_ads(self, ad_texts: Sequence[str]) -> np.ndarray:
+        """Эмбеддинги объявлений; каждое уникальное объявление кодируется один раз."""
+        keys = [normalize_ad_text(t) for t in ad_texts]
+        with self._lock:
+            missing = [k for k in dict.fromkeys(keys) if k not in self._ad_cache]
+        if missing:
+            emb = self._encode([f"query: {k}" for k in missing])
+            with self._lock:
+                for k, e in zip(missing, emb):
+                    self._ad_cache[k] = e
+                while len(self._ad_cache) > AD_CACHE_SIZE:
+                    self._ad_cache.popitem(last=False)
+        with self._lock:
+            out = []
+            for k in keys:
+                vec = self._ad_cache.get(k)
+                if vec is None:
+                    # вытеснили между двумя блокировками — досчитаем отдельно
+                    vec = self._encode([f"query: {k}"])[0]
+                else:
+                    self._ad_cache.move_to_end(k)
+                out.append(vec)
+        return np.stack(out) if out else np.zeros((0, self.profiles.shape[1]), dtype=np.float32)
+
+    def score_matrix(self, ad_texts: Sequence[str], segments: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(клик, покупка) формы [объявления × сегменты]."""
+        rows = self._segment_rows(segments)
+        ads = self.embed_ads(ad_texts)
+        relevance = ads @ self.profiles[rows].T
+
+        cue = np.array([_price_cue(t) for t in ad_texts], dtype=np.float32)[:, None]
+        length = np.array([_length_penalty(t) for t in ad_texts], dtype=np.float32)[:, None]
+        ps = self.price_sensitivity[rows][None, :]
+        discount = self.discount_share[rows][None, :]
+
+        click = 0.5 + RELEVANCE_SCALE * relevance + cue * (PRICE_WEIGHT * (ps - 0.5) + DISCOUNT_WEIGHT * discount) + length
+        purchase = click - 0.1 - PURCHASE_PRICE_PENALTY * ps * (1 - cue)
+        return np.clip(click, 0.0, 1.0), np.clip(purchase, 0.0, 1.0)
+
+    def evaluate_pairs(self, pairs: Sequence[Tuple[str, str]]) -> List[Dict[str, float]]:
+        """Оценки для пар (объявление, сегмент) — формат main.evaluate_ad."""
+        if not pairs:
+            return []
+        ads = list(dict.fromkeys(a for a, _ in pairs))
+        segments = list(dict.fromkeys(s for _, s in pairs))
+        click, purchase = self.score_matrix(ads, segments)
+        ai = {a: i for i, a in enumerate(ads)}
+        si = {s: i for i, s in enumerate(segments)}
+        return [
+            {
+                "click_probability": float(click[ai[a], si[s]]),
+                "purchase_probability": float(purchase[ai[a], si[s]]),
+            }
+            for a, s in pairs
+        ]
+
+    def evaluate(self, ad_text: str, segment: str) -> Dict[str, float]:
+        return self.evaluate_pairs([(ad_text, segment)])[0]
+
+
+_evaluator: Optional[SemanticEvaluator] = None
+_evaluator_lock = threading.Lock()
+
+
+def get_semantic_evaluator() -> SemanticEvaluator:
+    global _evaluator
+    with _evaluator_lock:
+        if _evaluator is None:
+            _evaluator = SemanticEvaluator()
+        return _evaluator
@@ -0,0 +1,468 @@
+"""
+Headless HTTP-сервис GENAI-4: анализ каталога, генерация креативов и оценка рекламы
+без Streamlit — для программного запуска конвейера на больших объёмах.
+
+Эндпоинты:
+    GET  /health     — статус, число запросов в работе, статистика батчера оценок и маршрутизатора моделей
+    GET  /metrics    — метрики процесса в формате Prometheus (см. metrics.py)
+    POST /analyze    — {"products": [...], "top_n": 3} → лучшие товары (ProductAnalyzer)
+    POST /generate   — {"records": [...], "user_text": "", "use_mistral": true, "stream": true}
+                       → NDJSON по мере готовности: {"index", "result"} или {"index", "error"}
+    POST /evaluate   — {"ads": [...], "segments": [...], "stream": false}
+                       → оценки evaluate_ad для каждой пары (объявление, сегмент)
+
+Батчинг: одиночные оценки от всех клиентов собираются в пачки (до EVAL_BATCH_SIZE
+или EVAL_BATCH_WAIT секунд) и считаются одним вызовом в пуле потоков.
+Backpressure: сверх MAX_INFLIGHT запросов и при переполненной очереди батчера сервис
+сразу отвечает 503 с Retry-After; генерация держит в работе не больше GEN_WINDOW товаров
+на запрос и не берёт следующие, пока клиент не дочитал уже готовые строки.
+
+Запуск:
+    python service.py --port 8000          (или: uvicorn service:app)
+Приоритет и арендатор запросов к провайдерам (scheduler.py) — заголовки
+X-Priority: interactive|batch (по умолчанию interactive) и X-Tenant (по умолчанию
+адрес клиента).
+
+Нагрузочный тест — loadgen.py.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import metrics
+from campaign import MAX_WORKERS, generate_for_record, parse_products_json
+from router import get_default_router, routing_enabled
+from scheduler import INTERACTIVE, call_context, get_scheduler
+
+# Одновременных HTTP-запросов в работе; остальные получают 503
+MAX_INFLIGHT = int(os.getenv("SERVICE_MAX_INFLIGHT", "256"))
+# Параметры микробатчинга оценок
+EVAL_BATCH_SIZE = 64
+EVAL_BATCH_WAIT = 0.005
+EVAL_QUEUE_SIZE = 10_000
+# Одновременных обращений к LLM на весь процесс и товаров в работе на один запрос /generate
+GEN_CONCURRENCY = int(os.getenv("SERVICE_GEN_CONCURRENCY", str(MAX_WORKERS)))
+GEN_WINDOW = MAX_WORKERS
+RETRY_AFTER_SECONDS = 1
+
+NDJSON = "application/x-ndjson"
+
+
+class Overloaded(Exception):
+    """Сервис перегружен — клиенту стоит повторить запрос позже."""
+
+
+# ==========================
+# 1. МИКРОБАТЧИНГ
+# ==========================
+
+class MicroBatcher:
+    """
+    Копит одиночные задания и отдаёт их пачкой в синхронную функцию
+    fn(items) -> results (в том же порядке), которая выполняется в пуле потоков.
+    Очередь ограничена: при переполнении submit() сразу бросает Overloaded.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], List[Any]],
+        max_batch: int = EVAL_BATCH_SIZE,
+        max_wait: float = EVAL_BATCH_WAIT,
+        max_queue: int = EVAL_QUEUE_SIZE,
+    ):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        # очередь и задача создаются в том event loop, где их впервые используют
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        return self._queue
+
+    async def submit(self, item: Any) -> Any:
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise Overloaded("очередь оценок переполнена")
+        return await future
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = await asyncio.to_thread(self.fn, items)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():  # клиент ушёл, ожидание отменено
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+def _evaluate_many(pairs: List[Tuple[str, str]]) -> List[Any]:
+    from main import EVALUATOR, evaluate_ad, evaluate_ads
+
+    if EVALUATOR == "semantic":
+        # весь микробатч — одно матричное произведение; при ошибке падает по одному
+        try:
+            return evaluate_ads(pairs)
+        except Exception:
+            pass
+    results: List[Any] = []
+    for ad_text, segment in pairs:
+        try:
+            results.append(evaluate_ad(ad_text, segment))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+# ==========================
+# 2. СОСТОЯНИЕ СЕРВИСА
+# ==========================
+
+class ServiceState:
+    def __init__(self, max_inflight: int = MAX_INFLIGHT, gen_concurrency: int = GEN_CONCURRENCY):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.rejected = 0
+        self.eval_batcher = MicroBatcher(_evaluate_many)
+        self.gen_concurrency = gen_concurrency
+        self._gen_semaphore: Optional[asyncio.Semaphore] = None
+        self._generators: Dict[bool, Any] = {}
+        self._analyzer = None
+        self._analyzer_lock = asyncio.Lock()
+
+    @property
+    def gen_semaphore(self) -> asyncio.Semaphore:
+        if self._gen_semaphore is None:
+            self._gen_semaphore = asyncio.Semaphore(self.gen_concurrency)
+        return self._gen_semaphore
+
+    def generator(self, use_mistral: bool):
+        """Один генератор на тип клиента на весь процесс (как кэш ресурсов в webapp)."""
+        if use_mistral not in self._generators:
+            from prompt import get_generator
+
+            self._generators[use_mistral] = get_generator(use_mistral)
+        return self._generators[use_mistral]
+
+    async def analyzer(self):
+        # модель эмбеддингов грузится секунды — один экземпляр, строим вне event loop
+        async with self._analyzer_lock:
+            if self._analyzer is None:
+                from productAnalyzer import ProductAnalyzer
+
+                self._analyzer = await asyncio.to_thread(ProductAnalyzer)
+        return self._analyzer
+
+
+def _error(message: str, status: int = 400) -> JSONResponse:
+    headers = {"Retry-After": str(RETRY_AFTER_SECONDS)} if status == 503 else None
+    return JSONResponse({"error": message}, status_code=status, headers=headers)
+
+
+async def _json_body(request: Request) -> Dict[str, Any]:
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ValueError("Тело запроса должно быть JSON-объектом.")
+    if not isinstance(body, dict):
+        raise ValueError("Тело запроса должно быть JSON-объектом.")
+    return body
+
+
+def _ndjson_line(obj: Dict[str, Any]) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _int_field(body: Dict[str, Any], key: str, default: int, minimum: int = 1) -> int:
+    value = body.get(key, default)
+    # bool — подкласс int, но "top_n": true скорее ошибка клиента
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{key} — целое число не меньше {minimum}.")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{key} — целое число не меньше {minimum}.")
+    if value < minimum:
+        raise ValueError(f"{key} — целое число не меньше {minimum}.")
+    return value
+
+
+def _as_list(body: Dict[str, Any], many: str, one: str) -> List[Any]:
+    if many in body:
+        value = body[many]
+        return value if isinstance(value, list) else [value]
+    if one in body:
+        return [body[one]]
+    return []
+
+
+# ==========================
+# 3. ЭНДПОИНТЫ
+# ==========================
+
+async def health(request: Request) -> Response:
+    state: ServiceState = request.app.state.service
+    return JSONResponse({
+        "status": "ok",
+        "inflight": state.inflight,
+        "max_inflight": state.max_inflight,
+        "rejected": state.rejected,
+        "eval_batcher": state.eval_batcher.stats(),
+        "scheduler": get_scheduler().stats(),
+        # расходы и качество по уровням моделей, если генерация идёт через router.py
+        "routing": get_default_router().report() if routing_enabled() else None,
+    })
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return PlainTextResponse(metrics.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+async def analyze(request: Request) -> Response:
+    state: ServiceState = request.app.state.service
+    body = await _json_body(request)
+    products = parse_products_json(body.get("products", []))
+    top_n = _int_field(body, "top_n", 3)
+    analyzer = await state.analyzer()
+    # encode() модели блокирующий — весь анализ уходит в поток со своим event loop
+    top = await asyncio.to_thread(lambda: asyncio.run(analyzer.analyze(products, top_n=top_n)))
+    return JSONResponse({"products": top})
+
+
+async def _generate_stream(
+    state: ServiceState,
+    records: Sequence[Dict],
+    user_text: str,
+    use_mistral: bool,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Отдаёт результаты по мере готовности, держа в работе не больше GEN_WINDOW товаров.
+    Следующие товары берутся только когда потребитель забрал готовые — медленный
+    клиент не заставляет сервис копить в памяти весь каталог.
+    """
+    generator = state.generator(use_mistral)
+
+    async def one(idx: int, record: Dict) -> Dict[str, Any]:
+        async with state.gen_semaphore:
+            try:
+                result = await asyncio.to_thread(generate_for_record, record, user_text, generator)
+                return {"index": idx, "result": result}
+            except Exception as e:
+                return {"index": idx, "error": str(e)}
+
+    pending = set()
+    upcoming = iter(enumerate(records))
+    try:
+        while True:
+            for idx, record in upcoming:
+                pending.add(asyncio.ensure_future(one(idx, record)))
+                if len(pending) >= GEN_WINDOW:
+                    break
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # клиент отключился или запрос отменён — не запускаем оставшиеся товары
+        for task in pending:
+            task.cancel()
+
+
+async def generate(request: Request) -> Response:
+    state: ServiceState = request.app.state.service
+    body = await _json_body(request)
+    records = parse_products_json(body.get("records", body.get("record", [])))
+    user_text = str(body.get("user_text", ""))
+    use_mistral = bool(body.get("use_mistral", True))
+
+    stream = _generate_stream(state, records, user_text, use_mistral)
+    if body.get("stream", True):
+        async def lines() -> AsyncIterator[bytes]:
+            async for item in stream:
+                yield _ndjson_line(item)
+
+        return StreamingResponse(lines(), media_type=NDJSON)
+
+    items = [item async for item in stream]
+    items.sort(key=lambda item: item["index"])
+    return JSONResponse({"total": len(records), "items": items})
+
+
+async def evaluate(request: Request) -> Response:
+    state: ServiceState = request.app.state.service
+    body = await _json_body(request)
+    ads = _as_list(body, "ads", "ad")
+    segments = _as_list(body, "segments", "segment")
+    if not ads or not segments:
+        raise ValueError("Нужны поля ads (или ad) и segments (или segment).")
+    if not all(isinstance(a, str) for a in ads):
+        raise ValueError("ads — список строк.")
+
+    pairs = [(i, ad, segment) for i, ad in enumerate(ads) for segment in segments]
+    # свободного места в очереди батчера не хватит — отказываем сразу, а не на середине
+    if len(pairs) + state.eval_batcher.stats()["queued"] > state.eval_batcher.max_queue:
+        raise Overloaded("очередь оценок переполнена")
+
+    async def one(i: int, ad: str, segment: str) -> Dict[str, Any]:
+        try:
+            scores = await state.eval_batcher.submit((ad, segment))
+            return {"ad_index": i, "segment": segment, "scores": scores}
+        except Overloaded:
+            raise
+        except Exception as e:
+            return {"ad_index": i, "segment": segment, "error": str(e)}
+
+    tasks = [asyncio.ensure_future(one(*p)) for p in pairs]
+
+    if body.get("stream", False):
+        async def lines() -> AsyncIterator[bytes]:
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield _ndjson_line(await task)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingResponse(lines(), media_type=NDJSON)
+
+    try:
+        items = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return JSONResponse({"items": items})
+
+
+# ==========================
+# 4. ПРИЛОЖЕНИЕ
+# ==========================
+
+class AdmissionMiddleware:
+    """
+    Ограничивает число одновременных запросов (кроме /health) и превращает
+    ошибки обработчиков в JSON: ValueError → 400, Overloaded → 503 с Retry-After.
+    Для потоковых ответов слот занят, пока поток не дочитан; ошибка после начала
+    ответа уже не превращается в JSON — статус отправлен, соединение просто рвётся.
+    """
+
+    def __init__(self, app, state: ServiceState):
+        self.app = app
+        self.state = state
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in ("/health", "/metrics"):
+            await self.app(scope, receive, send)
+            return
+
+        state = self.state
+        if state.inflight >= state.max_inflight:
+            state.rejected += 1
+            await _error("Сервис перегружен, повторите позже.", 503)(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        client = scope.get("client") or ("unknown", 0)
+        priority = headers.get(b"x-priority", INTERACTIVE.encode()).decode("latin-1")
+        tenant = headers.get(b"x-tenant", client[0].encode()).decode("latin-1")
+
+        started = False
+
+        async def tracking_send(message) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        state.inflight += 1
+        try:
+            with call_context(priority=priority, tenant=tenant):
+                await self.app(scope, receive, tracking_send)
+        except ValueError as e:
+            if started:
+                raise
+            await _error(str(e), 400)(scope, receive, send)
+        except Overloaded as e:
+            state.rejected += 1
+            if started:
+                raise
+            await _error(f"Сервис перегружен: {e}", 503)(scope, receive, send)
+        finally:
+            state.inflight -= 1
+
+
+def create_app(state: Optional[ServiceState] = None) -> Starlette:
+    state = state or ServiceState()
+    app = Starlette(routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+        Route("/analyze", analyze, methods=["POST"]),
+        Route("/generate", generate, methods=["POST"]),
+        Route("/evaluate", evaluate, methods=["POST"]),
+    ])
+    app.state.service = state
+    app.add_middleware(AdmissionMiddleware, state=state)
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="HTTP-сервис GENAI-4")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
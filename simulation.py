@@ -0,0 +1,430 @@
+"""
+Монте-Карло симуляция синтетической аудитории.
+
+Вместо 1 100 сохранённых персон генерируем сколько угодно синтетических
+потребителей из распределений атрибутов каждого сегмента
+(categorized_personas.json), разыгрываем клики/покупки векторизованным
+генератором случайных чисел и считаем доверительные интервалы.
+
+Симуляция идёт пачками: после каждой пачки варианты, чей верхний край
+интервала ниже нижнего края лидера, выбывают. Как только интервал лидера
+отделился от интервала ближайшего соперника — останавливаемся.
+"""
+from __future__ import annotations
+
+import json
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from statistics import NormalDist
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from main import evaluate_ad
+
+PERSONAS_PATH = "categorized_personas.json"
+
+# Веса поведенческой модели (в логит-пространстве).
+# Базовая вероятность берётся из evaluate_ad, атрибуты потребителя её сдвигают.
+RESPONSE_WEIGHTS: Dict[str, float] = {
+    "discount_x_price_sensitivity": 1.2,
+    "discount_x_reacts_to_discounts": 0.4,
+    "novelty_x_early_adopter": 0.3,
+    "novelty_x_trend_follower": 0.3,
+    "social_proof_x_reactive": 0.3,
+    "channel_match": 0.5,
+    "interest_overlap": 0.6,
+    "high_engagement": 0.3,
+    "passive_scroller": -0.3,
+    "ad_blocking": -1.0,
+    # покупка при условии клика
+    "buy_impulsive": 0.4,
+    "buy_researcher": -0.2,
+    "buy_quality_seeker_discount": -0.2,
+}
+
+DISCOUNT_WORDS = ("скид", "акци", "выгод", "%")
+FREE_WORDS = ("бесплат",)
+NOVELTY_WORDS = ("новин", "нов", "релиз", "2024", "2025")
+SOCIAL_PROOF_WORDS = ("хит", "популяр", "отзыв", "выбирают", "бестселлер")
+
+
+# ==========================
+# 1. РАСПРЕДЕЛЕНИЯ СЕГМЕНТОВ
+# ==========================
+
+@dataclass
+class SegmentDistribution:
+    """
+    Маргинальные распределения атрибутов одного сегмента.
+    interests/behaviors — независимые бернуллиевские признаки,
+    channel — категориальный, price_sensitivity — эмпирическая выборка.
+    """
+    name: str
+    size: int
+    interests: List[str]
+    interest_p: np.ndarray
+    behaviors: List[str]
+    behavior_p: np.ndarray
+    channels: List[str]
+    channel_p: np.ndarray
+    price_sensitivity: np.ndarray
+
+
+@lru_cache(maxsize=4)
+def load_segment_distributions(path: str = PERSONAS_PATH) -> Dict[str, SegmentDistribution]:
+    with open(path, "r", encoding="utf-8") as f:
+        parsed = json.load(f)
+
+    distributions: Dict[str, SegmentDistribution] = {}
+    for segment, people in parsed.items():
+        if not people:
+            continue
+        n = len(people)
+
+        interests = sorted({i for p in people for i in p.get("interests", [])})
+        behaviors = sorted({b for p in people for b in p.get("behaviors", [])})
+        channels = sorted({p.get("preferred_channel", "") for p in people})
+
+        interest_p = np.array(
+            [sum(i in p.get("interests", []) for p in people) / n for i in interests]
+        )
+        behavior_p = np.array(
+            [sum(b in p.get("behaviors", []) for p in people) / n for b in behaviors]
+        )
+        channel_p = np.array(
+            [sum(p.get("preferred_channel", "") == c for p in people) / n for c in channels]
+        )
+        price_sensitivity = np.array(
+            [float(p.get("price_sensitivity", 0.5)) for p in people]
+        )
+
+        distributions[segment] = SegmentDistribution(
+            name=segment,
+            size=n,
+            interests=interests,
+            interest_p=interest_p,
+            behaviors=behaviors,
+            behavior_p=behavior_p,
+            channels=channels,
+            channel_p=channel_p,
+            price_sensitivity=price_sensitivity,
+        )
+    return distributions
+
+
+@dataclass
+class ConsumerBatch:
+    """Пачка синтетических потребителей в колоночном виде."""
+    size: int
+    interests: np.ndarray          # bool (n, n_interests)
+    behaviors: Dict[str, np.ndarray]  # имя -> bool (n,)
+    channel: np.ndarray            # int (n,) — индекс в dist.channels
+    price_sensitivity: np.ndarray  # float (n,)
+
+
+def sample_consumers(dist: SegmentDistribution, n: int, rng: np.random.Generator) -> ConsumerBatch:
+    interests = rng.random((n, len(dist.interests))) < dist.interest_p
+    behavior_matrix = rng.random((n, len(dist.behaviors))) < dist.behavior_p
+    behaviors = {b: behavior_matrix[:, j] for j, b in enumerate(dist.behaviors)}
+    channel = rng.choice(len(dist.channels), size=n, p=dist.channel_p)
+
+    # Бутстрэп по реальным значениям + небольшой шум, чтобы не было ровно 1100 уровней
+    ps = rng.choice(dist.price_sensitivity, size=n)
+    ps = np.clip(ps + rng.normal(0.0, 0.05, size=n), 0.0, 1.0)
+
+    return ConsumerBatch(
+        size=n,
+        interests=interests,
+        behaviors=behaviors,
+        channel=channel,
+        price_sensitivity=ps,
+    )
+
+
+def consumers_from_personas(dist: SegmentDistribution, personas: Sequence[Dict]) -> ConsumerBatch:
+    """Те же колонки, что у sample_consumers, но из конкретных персон (без сэмплирования)."""
+    n = len(personas)
+    interests = np.array(
+        [[i in p.get("interests", []) for i in dist.interests] for p in personas], dtype=bool
+    ).reshape(n, len(dist.interests))
+    behaviors = {
+        b: np.array([b in p.get("behaviors", []) for p in personas], dtype=bool)
+        for b in dist.behaviors
+    }
+    channel = np.array(
+        [
+            dist.channels.index(p["preferred_channel"]) if p.get("preferred_channel") in dist.channels else -1
+            for p in personas
+        ],
+        dtype=int,
+    )
+    price_sensitivity = np.array([float(p.get("price_sensitivity", 0.5)) for p in personas])
+    return ConsumerBatch(
+        size=n,
+        interests=interests,
+        behaviors=behaviors,
+        channel=channel,
+        price_sensitivity=price_sensitivity,
+    )
+
+
+# ==========================
+# 2. МОДЕЛЬ ОТКЛИКА
+# ==========================
+
+@dataclass
+class AdProfile:
+    """
+    Объявление, подготовленное для симуляции.
+    channel — значение preferred_channel персон (например "messenger_tg_whatsapp_wechat"),
+    interests — интересы, на которые нацелено объявление.
+    """
+    text: str
+    channel: Optional[str] = None
+    interests: List[str] = field(default_factory=list)
+
+
+def _has_any(text: str, words: Sequence[str]) -> bool:
+    return any(w in text for w in words)
+
+
+def _logit(p: float) -> float:
+    p = min(max(p, 1e-4), 1 - 1e-4)
+    return math.log(p / (1 - p))
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def response_probabilities(
+    ad: AdProfile,
+    segment: str,
+    dist: SegmentDistribution,
+    consumers: ConsumerBatch,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Возвращает (p_click, p_purchase_given_click) для каждого потребителя пачки.
+    """
+    w = RESPONSE_WEIGHTS
+    text_lower = ad.text.lower()
+    discount = _has_any(text_lower, DISCOUNT_WORDS) or _has_any(text_lower, FREE_WORDS)
+    novelty = _has_any(text_lower, NOVELTY_WORDS)
+    social_proof = _has_any(text_lower, SOCIAL_PROOF_WORDS)
+
+    base = evaluate_ad(ad.text, segment)
+    base_click = base["click_probability"]
+    base_buy = base["purchase_probability"] / max(base_click, 1e-4)
+
+    zeros = np.zeros(consumers.size, dtype=bool)
+    b = consumers.behaviors
+
+    x = np.full(consumers.size, _logit(base_click))
+    if discount:
+        x += w["discount_x_price_sensitivity"] * (consumers.price_sensitivity - 0.5)
+        x += w["discount_x_reacts_to_discounts"] * b.get("reacts_to_discounts", zeros)
+    if novelty:
+        x += w["novelty_x_early_adopter"] * b.get("early_adopter", zeros)
+        x += w["novelty_x_trend_follower"] * b.get("trend_follower", zeros)
+    if social_proof:
+        x += w["social_proof_x_reactive"] * b.get("social_proof_reactive", zeros)
+    if ad.channel and ad.channel in dist.channels:
+        x += w["channel_match"] * (consumers.channel == dist.channels.index(ad.channel))
+    if ad.interests:
+        cols = [dist.interests.index(i) for i in ad.interests if i in dist.interests]
+        if cols:
+            overlap = consumers.interests[:, cols].mean(axis=1)
+            x += w["interest_overlap"] * overlap
+    x += w["high_engagement"] * b.get("high_engagement", zeros)
+    x += w["passive_scroller"] * b.get("passive_scroller", zeros)
+    x += w["ad_blocking"] * b.get("ad_blocking", zeros)
+
+    y = np.full(consumers.size, _logit(base_buy))
+    y += w["buy_impulsive"] * b.get("impulsive_buyer", zeros)
+    y += w["buy_researcher"] * b.get("researcher", zeros)
+    if discount:
+        y += w["buy_quality_seeker_discount"] * b.get("quality_seeker", zeros)
+
+    return _sigmoid(x), _sigmoid(y)
+
+
+# ==========================
+# 3. СТАТИСТИКА И ОСТАНОВКА
+# ==========================
+
+def wilson_interval(successes: int, n: int, z: float) -> Tuple[float, float]:
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+@dataclass
+class VariantStats:
+    index: int
+    impressions: int = 0
+    clicks: int = 0
+    purchases: int = 0
+    click_ci: Tuple[float, float] = (0.0, 1.0)
+    purchase_ci: Tuple[float, float] = (0.0, 1.0)
+    eliminated_after: Optional[int] = None  # сколько потребителей было просимулировано к выбыванию
+
+    @property
+    def click_rate(self) -> float:
+        return self.clicks / self.impressions if self.impressions else 0.0
+
+    @property
+    def purchase_rate(self) -> float:
+        return self.purchases / self.impressions if self.impressions else 0.0
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "index": self.index,
+            "impressions": self.impressions,
+            "clicks": self.clicks,
+            "purchases": self.purchases,
+            "click_rate": self.click_rate,
+            "click_ci": list(self.click_ci),
+            "purchase_rate": self.purchase_rate,
+            "purchase_ci": list(self.purchase_ci),
+            "eliminated_after": self.eliminated_after,
+        }
+
+
+@dataclass
+class SimulationResult:
+    segment: str
+    variants: List[VariantStats]
+    winner: int
+    consumers_simulated: int
+    total_impressions: int
+    stopped_early: bool
+    confidence: float
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "segment": self.segment,
+            "winner": self.winner,
+            "consumers_simulated": self.consumers_simulated,
+            "total_impressions": self.total_impressions,
+            "stopped_early": self.stopped_early,
+            "confidence": self.confidence,
+            "variants": [v.to_dict() for v in self.variants],
+        }
+
+
+def simulate_audience(
+    ads: Sequence[AdProfile | str],
+    segment: str,
+    max_consumers: int = 1_000_000,
+    batch_size: int = 50_000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+    personas_path: str = PERSONAS_PATH,
+) -> SimulationResult:
+    """
+    Симулирует показ объявлений синтетической аудитории сегмента.
+
+    - каждый батч — новые batch_size потребителей, общие для всех активных
+      вариантов (общие случайные числа уменьшают дисперсию сравнения);
+    - после каждого батча пересчитываем интервалы Уилсона по кликам;
+    - варианты, которые уже точно хуже лидера, выбывают;
+    - стоп, когда остался один вариант или исчерпан max_consumers.
+
+    Уровень доверия делится между всеми промежуточными проверками
+    (поправка Бонферрони), иначе частые «подглядывания» завышают ошибку.
+    """
+    if not ads:
+        raise ValueError("Нужен хотя бы один вариант рекламы")
+
+    profiles = [a if isinstance(a, AdProfile) else AdProfile(text=a) for a in ads]
+    segment_key = segment.lower()
+    distributions = load_segment_distributions(personas_path)
+    if segment_key not in distributions:
+        raise KeyError(f"Неизвестный сегмент: {segment}")
+    dist = distributions[segment_key]
+
+    rng = np.random.default_rng(seed)
+    max_looks = max(1, math.ceil(max_consumers / batch_size))
+    alpha = (1 - confidence) / max_looks
+    z = NormalDist().inv_cdf(1 - alpha / 2)
+
+    stats = [VariantStats(index=i) for i in range(len(profiles))]
+    active = list(range(len(profiles)))
+    simulated = 0
+
+    while simulated < max_consumers and len(active) > 1:
+        n = min(batch_size, max_consumers - simulated)
+        consumers = sample_consumers(dist, n, rng)
+        simulated += n
+
+        # Один и тот же поток случайных чисел для всех вариантов пачки
+        u_click = rng.random(n)
+        u_buy = rng.random(n)
+
+        for i in active:
+            p_click, p_buy = response_probabilities(profiles[i], segment_key, dist, consumers)
+            clicked = u_click < p_click
+            bought = clicked & (u_buy < p_buy)
+
+            s = stats[i]
+            s.impressions += n
+            s.clicks += int(clicked.sum())
+            s.purchases += int(bought.sum())
+            s.click_ci = wilson_interval(s.clicks, s.impressions, z)
+            s.purchase_ci = wilson_interval(s.purchases, s.impressions, z)
+
+        leader = max(active, key=lambda i: stats[i].click_rate)
+        leader_low = stats[leader].click_ci[0]
+        for i in list(active):
+            if i != leader and stats[i].click_ci[1] < leader_low:
+                stats[i].eliminated_after = simulated
+                active.remove(i)
+
+    # Единственный вариант тоже получает оценку — интервал без сравнения
+    if len(profiles) == 1 and simulated == 0:
+        consumers = sample_consumers(dist, min(batch_size, max_consumers), rng)
+        simulated = consumers.size
+        p_click, p_buy = response_probabilities(profiles[0], segment_key, dist, consumers)
+        clicked = rng.random(simulated) < p_click
+        bought = clicked & (rng.random(simulated) < p_buy)
+        s = stats[0]
+        s.impressions, s.clicks, s.purchases = simulated, int(clicked.sum()), int(bought.sum())
+        s.click_ci = wilson_interval(s.clicks, s.impressions, z)
+        s.purchase_ci = wilson_interval(s.purchases, s.impressions, z)
+
+    winner = max(active, key=lambda i: stats[i].click_rate)
+    return SimulationResult(
+        segment=segment_key,
+        variants=stats,
+        winner=winner,
+        consumers_simulated=simulated,
+        total_impressions=sum(s.impressions for s in stats),
+        stopped_early=len(profiles) > 1 and len(active) == 1 and simulated < max_consumers,
+        confidence=confidence,
+    )
+
+
+if __name__ == "__main__":
+    test_ads = [
+        AdProfile(
+            text="iPhone 17 — твой следующий уровень технологий!\n"
+                 "Ощути невероятную скорость и улучшенную камеру.\n"
+                 "💥 Скидка 10% только сегодня!",
+            channel="messenger_tg_whatsapp_wechat",
+            interests=["tech_gadgets"],
+        ),
+        AdProfile(
+            text="iPhone 17. Новая камера и быстрый процессор. Купить онлайн.",
+            interests=["tech_gadgets"],
+        ),
+        AdProfile(text="iPhone 17. Купить."),
+    ]
+
+    res = simulate_audience(test_ads, "low_income_pragmatic_youth", seed=42)
+    print(json.dumps(res.to_dict(), ensure_ascii=False, indent=2))
@@ -0,0 +1,166 @@
+"""
+Потоковая запись результатов: NDJSON (опционально gzip) с атомарной публикацией.
+
+Раньше итоги собирались в список целиком и писались одним json.dump в конце —
+память росла с размером прогона, а упавший прогон не оставлял ничего.
+NdjsonSink пишет по строке на результат сразу, как он готов, в файл «<path>.part»
+и сбрасывает буфер после каждой записи, поэтому частичный результат можно
+читать во время прогона:
+
+    tail -f best_products.ndjson.part
+    zcat -f campaign.ndjson.gz.part       (gzip сбрасывается Z_SYNC_FLUSH — читается без конца файла)
+
+close() делает fsync и os.replace в итоговое имя: под итоговым именем файл либо
+полный, либо его нет. При ошибке (выход из with по исключению, abort()) остаётся
+только .part — для разбора, итоговый файл прошлого прогона не затирается.
+
+Сжатие — по суффиксу .gz или явным compress=True.
+
+    with NdjsonSink("scores.ndjson.gz") as sink:
+        for record in produce():
+            sink.write(record)
+"""
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import os
+import threading
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+PART_SUFFIX = ".part"
+NDJSON_SUFFIXES = (".ndjson", ".jsonl", ".ndjson.gz", ".jsonl.gz")
+
+
+def is_ndjson_path(path: str) -> bool:
+    return path.endswith(NDJSON_SUFFIXES)
+
+
+def _fsync_dir(path: str) -> None:
+    """После rename — fsync каталога, иначе переименование может не пережить сбой питания."""
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class NdjsonSink:
+    def __init__(self, path: str, compress: Optional[bool] = None, fsync: bool = True):
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.compress = path.endswith(".gz") if compress is None else compress
+        self.fsync = fsync
+        self.count = 0
+        self.closed = False
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._raw = open(self.part_path, "wb")
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6) if self.compress else None
+
+    def write(self, record: Any) -> None:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if self.closed:
+                raise ValueError(f"Запись в закрытый {self.path}")
+            if self._gzip is not None:
+                self._gzip.write(line)
+                self._gzip.flush(zlib.Z_SYNC_FLUSH)
+            else:
+                self._raw.write(line)
+            self._raw.flush()
+            self.count += 1
+
+    def write_many(self, records: Iterable[Any]) -> None:
+        for record in records:
+            self.write(record)
+
+    def _close_files(self) -> None:
+        if self._gzip is not None:
+            self._gzip.close()
+        self._raw.flush()
+        if self.fsync:
+            os.fsync(self._raw.fileno())
+        self._raw.close()
+
+    def close(self) -> str:
+        """Дописать, fsync и опубликовать под итоговым именем. Возвращает путь."""
+        with self._lock:
+            if self.closed:
+                return self.path
+            self.closed = True
+            self._close_files()
+            os.replace(self.part_path, self.path)
+            if self.fsync:
+                _fsync_dir(self.path)
+        return self.path
+
+    def abort(self) -> None:
+        """Закрыть без публикации: .part остаётся, итоговый файл не трогаем."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._close_files()
+
+    def __enter__(self) -> "NdjsonSink":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_json_atomic(path: str, data: Any, indent: Optional[int] = 2) -> None:
+    """Небольшой JSON-документ (best_products.json, campaign.json): .part → fsync → rename."""
+    part_path = path + PART_SUFFIX
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(part_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(part_path, path)
+    _fsync_dir(path)
+
+
+def read_ndjson(path: str) -> Iterator[Any]:
+    """
+    Записи NDJSON по одной (.gz распознаётся по суффиксу). Годится и для .part
+    идущего прогона: недописанная последняя строка и обрыв gzip-потока пропускаются.
+    """
+    compressed = path.endswith(".gz") or path.endswith(".gz" + PART_SUFFIX)
+    raw = open(path, "rb")
+    stream = gzip.GzipFile(fileobj=raw, mode="rb") if compressed else raw
+    try:
+        for line in io.TextIOWrapper(stream, encoding="utf-8"):
+            if not line.endswith("\n"):
+                break
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    except EOFError:
+        # gzip без завершающего блока — прогон ещё идёт
+        return
+    finally:
+        stream.close()
+        raw.close()
+
+
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Каталог товаров: NDJSON читается потоково, обычный JSON (объект или список) — целиком."""
+    if is_ndjson_path(path):
+        yield from read_ndjson(path)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    records: List[Dict[str, Any]] = [data] if isinstance(data, dict) else data
+    yield from records
@@ -0,0 +1,15 @@
+"""Модули проекта лежат в корне репозитория — тесты импортируют их оттуда."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def _repo_cwd(monkeypatch):
+    # данные (categorized_personas.json и т.п.) модули читают по относительным путям
+    monkeypatch.chdir(ROOT)
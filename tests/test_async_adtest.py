@@ -0,0 +1,90 @@
+import asyncio
+import re
+import time
+from types import SimpleNamespace
+
+from eval_cache import EvalCache
+from feedback import AsyncAdTest
+from scheduler import call_context
+
+SEGMENTS = ["price_sensitive_students", "tech_focused_professionals", "senior_value_seekers"]
+
+
+class FakeClient:
+    """Вместо AsyncOpenAI: отвечает по слотам промпта, click = номер сегмента / 10."""
+
+    def __init__(self, latency=0.1, hang_on=None):
+        self.latency = latency
+        self.hang_on = hang_on
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages):
+        prompt = messages[0]["content"]
+        segment = re.search(r"группа: (\w+)", prompt).group(1)
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(60 if segment == self.hang_on else self.latency)
+        finally:
+            self.in_flight -= 1
+        n = len(re.findall(r"РЕКЛАМА №\d+", prompt))
+        click = (SEGMENTS.index(segment) + 1) / 10
+        content = "\n".join(
+            f"ad_{i}_click_probability: {click}\nad_{i}_purchase_probability: 0.05" for i in range(1, n + 1)
+        )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20, total_tokens=120),
+        )
+
+
+def _tester(client, **kwargs):
+    return AsyncAdTest(cache=EvalCache(), client=client, **kwargs)
+
+
+def _evaluate(tester, ads, segments=SEGMENTS):
+    with call_context(rate_limited=False):
+        return asyncio.run(tester.evaluate_matrix(ads, segments))
+
+
+def test_segments_run_concurrently():
+    client = FakeClient(latency=0.2)
+    t0 = time.perf_counter()
+    matrix = _evaluate(_tester(client), ["a", "b"])
+    assert time.perf_counter() - t0 < 0.5
+    assert matrix.complete and not matrix.errors
+    assert matrix.click_matrix() == [[0.1, 0.1], [0.2, 0.2], [0.3, 0.3]]
+    assert matrix.purchase_matrix()[0] == [0.05, 0.05]
+    assert client.calls == len(SEGMENTS)
+
+
+def test_concurrency_is_bounded():
+    client = FakeClient(latency=0.05)
+    matrix = _evaluate(_tester(client, max_concurrency=2), ["a"])
+    assert matrix.complete
+    assert client.max_in_flight == 2
+
+
+def test_timeout_keeps_other_segments():
+    client = FakeClient(latency=0.01, hang_on=SEGMENTS[1])
+    matrix = _evaluate(_tester(client, timeout=0.2), ["a", "b"])
+    assert not matrix.complete
+    assert matrix.scores[SEGMENTS[1]] == [None, None]
+    assert matrix.scores[SEGMENTS[0]][0] == {"click_probability": 0.1, "purchase_probability": 0.05}
+    assert list(matrix.errors) == [SEGMENTS[1]]
+    assert "таймаут" in matrix.errors[SEGMENTS[1]][0]
+
+
+def test_reusable_across_event_loops_and_cached():
+    client = FakeClient(latency=0.01)
+    tester = _tester(client, max_concurrency=1)
+    first = _evaluate(tester, "a")
+    second = _evaluate(tester, "a")
+    assert first.scores == second.scores
+    assert client.calls == len(SEGMENTS)     # второй прогон — из кэша
+    _evaluate(tester, ["c"])
+    assert client.calls == 2 * len(SEGMENTS)
@@ -0,0 +1,30 @@
+import os
+
+from bandit import is_known_segment, thompson_select
+from conftest import ROOT
+
+PERSONAS = os.path.join(ROOT, "categorized_personas.json")
+SEGMENT = "price_sensitive_students"
+STRONG = "Скидка 30% на хит сезона! Бесплатная доставка, новинка 2025."
+WEAK = "Телефон. Купить."
+
+
+def test_known_segment():
+    assert is_known_segment(SEGMENT.upper(), personas_path=PERSONAS)
+    assert not is_known_segment("martians", personas_path=PERSONAS)
+
+
+def test_thompson_select():
+    result = thompson_select([WEAK, STRONG], SEGMENT, budget=50_000, seed=0, personas_path=PERSONAS)
+    assert result.winner == 1
+    assert result.total_cost <= 50_000
+    assert result.arms[1].impressions > result.arms[0].impressions
+    assert sum(a.impressions for a in result.arms) == result.total_cost
+
+
+def test_single_variant_spends_one_round():
+    result = thompson_select([STRONG], SEGMENT, budget=50_000, batch_size=500, check_every=1, seed=0,
+                             personas_path=PERSONAS)
+    assert result.winner == 0
+    assert result.total_cost == 500
+    assert result.prob_best == 1.0
@@ -0,0 +1,97 @@
+import json
+
+from batch_jobs import (
+    ID_SEP,
+    LocalBatchBackend,
+    ads_from_generation,
+    build_evaluation_requests,
+    build_generation_requests,
+    join_evaluation_results,
+    join_generation_results,
+    product_to_input_json,
+    read_jsonl,
+    run_batch_job,
+    write_jsonl,
+)
+from campaign import build_payload_for_record
+from prompt import _variant_to_ad_text
+
+SEGMENTS = ["price_sensitive_students", "senior_value_seekers"]
+PRODUCTS = [
+    {"name": "Наушники", "description": "Шумоподавление", "price": 9000, "market_cost": 3000},
+    {"product": {"name": "Лампа"}, "audience_profile": {"age_range": "30-45"}, "n_variants": 2},
+]
+
+
+def test_input_json_matches_interactive_payload():
+    payload, _, _ = build_payload_for_record(PRODUCTS[0], "")
+    assert product_to_input_json(PRODUCTS[0], "vk", n_variants=4) == {**payload, "channel": "vk", "n_variants": 4}
+    ready = product_to_input_json(PRODUCTS[1], "vk", n_variants=4)
+    assert ready["audience_profile"] == {"age_range": "30-45"}
+    assert ready["n_variants"] == 2 and ready["channel"] == "vk"
+
+
+def test_requests_jsonl_round_trip(tmp_path):
+    gen = build_generation_requests(PRODUCTS, channels=["telegram", "vk"])
+    assert [r["custom_id"] for r in gen] == [
+        ID_SEP.join(["gen", "0", "telegram"]), ID_SEP.join(["gen", "0", "vk"]),
+        ID_SEP.join(["gen", "1", "telegram"]), ID_SEP.join(["gen", "1", "vk"]),
+    ]
+    user = json.loads(gen[1]["body"]["messages"][-1]["content"])
+    assert user["channel"] == "vk"
+
+    ev = build_evaluation_requests({"a": "Скидка 10%"}, SEGMENTS)
+    assert [r["custom_id"] for r in ev] == [ID_SEP.join(["eval", "a", s]) for s in SEGMENTS]
+    assert "РЕКЛАМА: Скидка 10%" in ev[0]["body"]["messages"][0]["content"]
+
+    path = str(tmp_path / "requests.jsonl")
+    assert write_jsonl(path, gen + ev) == len(gen) + len(ev)
+    assert read_jsonl(path) == gen + ev
+
+
+def test_local_backend_generation_and_evaluation(tmp_path):
+    backend = LocalBatchBackend()
+    requests_path, output_path = str(tmp_path / "gen.jsonl"), str(tmp_path / "gen_out.jsonl")
+    write_jsonl(requests_path, build_generation_requests(PRODUCTS, channels=["telegram"]))
+    joined, report = join_generation_results(PRODUCTS, run_batch_job(backend, requests_path, output_path, 0))
+    assert report.joined == 2 and report.failed == report.unparsed == 0
+    assert [item["product"] for item in joined] == PRODUCTS
+    assert all(item["variants"]["telegram"] for item in joined)
+
+    ads = ads_from_generation(joined)
+    first = joined[0]["variants"]["telegram"][0]
+    assert ads["0.telegram.0"] == _variant_to_ad_text(first)
+
+    write_jsonl(requests_path, build_evaluation_requests(ads, SEGMENTS))
+    scores, report = join_evaluation_results(run_batch_job(backend, requests_path, output_path, 0))
+    assert report.joined == len(ads) * len(SEGMENTS)
+    assert set(scores) == set(ads)
+    assert set(scores["0.telegram.0"]) == set(SEGMENTS)
+
+
+def _row(custom_id, content=None, error=None, status=200):
+    response = None if content is None else {
+        "status_code": status, "body": {"choices": [{"message": {"content": content}}]},
+    }
+    return {"custom_id": custom_id, "response": response, "error": error}
+
+
+def test_join_counts_failed_and_unparsed_rows():
+    results = [
+        _row(ID_SEP.join(["gen", "1", "vk"]), '{"variants": [{"headline": "H", "text": "T", "cta": "C"}]}'),
+        _row(ID_SEP.join(["gen", "0", "vk"]), error={"message": "rate limit"}),
+        _row(ID_SEP.join(["gen", "0", "telegram"]), "не JSON"),
+        _row(ID_SEP.join(["eval", "x", "seg"]), "click_probability: 0.3\npurchase_probability: 0.1"),
+    ]
+    joined, report = join_generation_results(PRODUCTS, results)
+    assert (report.joined, report.failed, report.unparsed) == (1, 1, 1)
+    assert joined[0]["variants"] == {}
+    assert joined[1]["variants"]["vk"][0]["channel"] == "vk"
+
+    results += [
+        _row(ID_SEP.join(["eval", "x", "other"]), "не знаю"),
+        _row(ID_SEP.join(["eval", "y", "seg"]), "click_probability: 0.3", status=500),
+    ]
+    scores, report = join_evaluation_results(results)
+    assert scores == {"x": {"seg": {"click_probability": 0.3, "purchase_probability": 0.1}}}
+    assert (report.joined, report.failed, report.unparsed) == (1, 1, 1)
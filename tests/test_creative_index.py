@@ -0,0 +1,101 @@
+import asyncio
+import zlib
+
+import numpy as np
+import pytest
+
+import main
+from campaign import remember_variants
+from creative_index import CreativeIndex
+from pipeline import Pipeline, build_campaign_pipeline
+from prompt import _variant_to_ad_text
+
+SEGMENTS = ["price_sensitive_students", "senior_value_seekers"]
+PRODUCT = {"name": "Наушники", "category": "Электроника"}
+
+
+class StubEncoder:
+    def encode(self, texts, convert_to_tensor=False, normalize_embeddings=True):
+        out = np.zeros((len(texts), 16), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                out[row, zlib.crc32(word.encode("utf-8")) % 16] += 1
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-9)
+
+
+class IndexedGenerator:
+    def __init__(self, index):
+        self.index = index
+
+
+def variant(n, channel="telegram"):
+    return {"channel": channel, "headline": f"Заголовок {n}", "text": "Текст объявления", "cta": "Купить", "notes": ""}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return CreativeIndex(str(tmp_path / "index"), encoder=StubEncoder())
+
+
+@pytest.fixture
+def evaluations(monkeypatch):
+    calls = []
+    real = main.evaluate_ads
+
+    def counting(pairs, use_cache=True):
+        calls.extend(pairs)
+        return real(pairs, use_cache)
+
+    monkeypatch.setattr(main, "evaluate_ads", counting)
+    return calls
+
+
+def test_contains_matches_channel_and_normalized_text(index):
+    assert not index.contains(variant(1))
+    assert index.add(variant(1), {"click_probability": 0.4})
+    assert index.contains(variant(1))
+    assert index.contains({**variant(1), "headline": "  заголовок 1 "})
+    assert not index.contains(variant(1, channel="vk"))
+    # после перезагрузки с диска — то же
+    assert CreativeIndex(index.path, encoder=StubEncoder()).contains(variant(1))
+
+
+def test_remember_variants_skips_known_before_evaluating(index, evaluations):
+    generator = IndexedGenerator(index)
+    payload = {"product": PRODUCT}
+    remember_variants(generator, payload, [variant(1), variant(2)])
+    assert len(index) == 2
+    first = len(evaluations)
+    assert first > 0
+
+    # повтор из журнала: ничего нового — ни одной оценки
+    remember_variants(generator, payload, [variant(1), variant(2)])
+    assert len(evaluations) == first
+
+    remember_variants(generator, payload, [variant(2), variant(3)])
+    assert len(index) == 3
+    assert {ad for ad, _ in evaluations[first:]} == {_variant_to_ad_text(variant(3))}
+
+
+def test_pipeline_evaluate_stage_feeds_index_without_reevaluating(index, evaluations):
+    pipeline = build_campaign_pipeline(None, IndexedGenerator(index), SEGMENTS, rate_limited=False)
+    evaluate_stage = Pipeline([pipeline.stages[-1]])
+    items = [
+        {"index": 0, "product": PRODUCT, "channel": "telegram", "variant_index": n,
+         "variant": variant(n), "ad_text": _variant_to_ad_text(variant(n))}
+        for n in range(2)
+    ]
+
+    result = asyncio.run(evaluate_stage.run(items))
+    assert result.errors == []
+    assert len(index) == 2
+    # оценки этапа и есть оценки для индекса: по паре на сегмент, без второго прохода
+    assert len(evaluations) == len(items) * len(SEGMENTS)
+    entries = {e["headline"]: e for e in (index._read_meta(row) for row in range(len(index)))}
+    for out in result.outputs:
+        entry = entries[out["variant"]["headline"]]
+        assert entry["segment"] == max(SEGMENTS, key=lambda s: out["scores"][s]["click_probability"])
+        assert entry["scores"] == out["scores"][entry["segment"]]
+
+    asyncio.run(evaluate_stage.run(items))
+    assert len(index) == 2
@@ -0,0 +1,78 @@
+import asyncio
+
+from dedup import Deduplicator, model_numbers, normalize_name, offer_top
+
+
+def test_normalize_name_drops_variant_attributes():
+    assert normalize_name("iPhone 15 (Black) 128 ГБ") == "iphone 15"
+    assert normalize_name("Чёрный iPhone 15, 256 GB") == "iphone 15"
+
+
+def test_model_numbers_include_tier_words():
+    assert model_numbers("samsung galaxy s24 ultra") == ("s24", "ultra")
+    assert model_numbers("iphone 15 pro max") == ("15", "max", "pro")
+
+
+def test_groups():
+    dedup = Deduplicator()
+    names = [
+        "iPhone 15 128 ГБ черный",
+        "iPhone 15 (White) 256 GB",
+        "iPhone 16",
+        "Samsung Galaxy S24",
+        "Samsung Galaxy S24 Ultra",
+        "Samsung Galaxy S24 синий",
+    ]
+    groups = [dedup.assign({"name": n}) for n in names]
+    assert groups[0] == groups[1]
+    assert groups[2] != groups[0]
+    assert groups[3] == groups[5]
+    assert groups[4] != groups[3]
+    assert dedup.report()["groups"] == 4
+
+
+def test_category_separates_groups():
+    dedup = Deduplicator()
+    a = dedup.assign({"name": "Чехол универсальный", "category": "phones"})
+    b = dedup.assign({"name": "Чехол универсальный", "category": "tablets"})
+    assert a != b
+
+
+def test_memo_once_per_group():
+    dedup = Deduplicator()
+    gid = dedup.assign({"name": "iPhone 15"})
+    assert dedup.assign({"name": "iPhone 15 черный"}) == gid
+    calls = []
+    for _ in range(3):
+        dedup.memo(gid, "encode", lambda: calls.append(1) or "vec")
+    assert len(calls) == 1
+    assert dedup.report()["saved"] == {"encode": 2}
+
+
+def test_amemo_shares_inflight_call():
+    dedup = Deduplicator()
+    gid = dedup.assign({"name": "iPhone 15"})
+    calls = []
+
+    async def trend():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def main():
+        return await asyncio.gather(*(dedup.amemo(gid, "wordstat", trend) for _ in range(5)))
+
+    assert asyncio.run(main()) == [42] * 5
+    assert len(calls) == 1
+
+
+def test_offer_top():
+    top = []
+    for entry in [(5, 0, None, "a"), (4, -1, None, "b"), (6, -2, None, "c")]:
+        offer_top(top, 2, entry)
+    assert sorted(e[3] for e in top) == ["a", "c"]
+
+    top = []
+    for entry in [(5, 0, 1, "a"), (6, -1, 1, "b"), (3, -2, 2, "c")]:
+        offer_top(top, 2, entry)
+    assert sorted(e[3] for e in top) == ["b", "c"]
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from embedding_client import EmbeddingClient, EmbeddingServerError
+from embedding_server import EmbeddingServer
+
+
+class StubEncoder:
+    """Вектор текста — (длина, число пробелов, 1); normalize делит на норму. Пачки записываются."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts, normalize):
+        self.batches.append((list(texts), normalize))
+        if any(t == "boom" for t in texts):
+            raise RuntimeError("encode упал")
+        vectors = np.array([[len(t), t.count(" "), 1.0] for t in texts], dtype=np.float32)
+        if normalize:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+def expected(texts, normalize=False):
+    return StubEncoder()(texts, normalize)
+
+
+def test_concurrent_requests_share_one_encode_call():
+    encoder = StubEncoder()
+    server = EmbeddingServer(encoder, max_batch=64, max_wait=0.05)
+
+    async def main():
+        server._queue = asyncio.Queue()
+        batcher = asyncio.ensure_future(server._batch_loop())
+        try:
+            return await asyncio.gather(*(server.encode([f"текст {i}", "ещё"], False) for i in range(5)))
+        finally:
+            batcher.cancel()
+
+    results = asyncio.run(main())
+    assert len(encoder.batches) == 1
+    assert len(encoder.batches[0][0]) == 10
+    # каждому запросу — его строки из общей матрицы
+    for i, part in enumerate(results):
+        np.testing.assert_array_equal(part, expected([f"текст {i}", "ещё"]))
+    assert server.stats()["mean_batch_texts"] == 10
+
+
+def test_batch_respects_max_batch_and_normalize():
+    encoder = StubEncoder()
+    server = EmbeddingServer(encoder, max_batch=4, max_wait=0.05)
+
+    async def main():
+        server._queue = asyncio.Queue()
+        batcher = asyncio.ensure_future(server._batch_loop())
+        try:
+            return await asyncio.gather(
+                server.encode(["a", "b"], False),
+                server.encode(["c c"], True),
+                server.encode(["d", "e"], False),
+                server.encode(["f"], False),
+            )
+        finally:
+            batcher.cancel()
+
+    results = asyncio.run(main())
+    assert all(len(texts) <= 4 for texts, _ in encoder.batches)
+    # попутчик с другим normalize считается отдельно, а не с чужим флагом
+    assert (["c c"], True) in encoder.batches
+    np.testing.assert_allclose(results[1], expected(["c c"], True))
+    np.testing.assert_array_equal(results[2], expected(["d", "e"]))
+
+
+@pytest.fixture
+def running_server():
+    # путь unix-сокета ограничен ~100 символами — tmp_path pytest бывает длиннее
+    tmp = tempfile.mkdtemp(prefix="genai4-")
+    address = f"unix:{os.path.join(tmp, 'embed.sock')}"
+    encoder = StubEncoder()
+    server = EmbeddingServer(encoder, max_wait=0.05)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(server.serve(address))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        # serve() отменяет батчер в finally — даём отмене дойти
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not os.path.exists(address[len("unix:"):]):
+        assert time.monotonic() < deadline, "сервер эмбеддингов не запустился"
+        time.sleep(0.01)
+    yield address, encoder, server
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(5)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def test_binary_frame_round_trip(running_server):
+    address, _, _ = running_server
+    client = EmbeddingClient(address)
+    try:
+        texts = ["первый текст", "второй", "и третий текст тут"]
+        matrix = client.encode(texts)
+        assert matrix.dtype == np.float32 and matrix.shape == (3, 3)
+        np.testing.assert_array_equal(matrix, expected(texts))
+        np.testing.assert_allclose(client.encode(texts, normalize_embeddings=True), expected(texts, True))
+        np.testing.assert_array_equal(client.encode("один"), expected(["один"])[0])
+        assert client.encode([]).shape == (0, 0)
+        assert client.stats()["requests"] == 3
+    finally:
+        client.close()
+
+
+def test_float16_frames(running_server):
+    address, _, _ = running_server
+    client = EmbeddingClient(address, dtype="float16")
+    try:
+        matrix = client.encode(["короткий", "подлиннее текст"], normalize_embeddings=True)
+        assert matrix.dtype == np.float32
+        np.testing.assert_allclose(matrix, expected(["короткий", "подлиннее текст"], True), atol=1e-3)
+    finally:
+        client.close()
+
+
+def test_encode_error_is_reported_and_connection_survives(running_server):
+    address, _, _ = running_server
+    client = EmbeddingClient(address)
+    try:
+        with pytest.raises(EmbeddingServerError, match="encode упал"):
+            client.encode(["boom"])
+        np.testing.assert_array_equal(client.encode(["снова"]), expected(["снова"]))
+    finally:
+        client.close()
+
+
+def test_clients_in_threads_are_batched_together(running_server):
+    address, encoder, server = running_server
+    client = EmbeddingClient(address)
+    texts = [[f"запрос {i}"] for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(client.encode, texts))
+    for t, matrix in zip(texts, results):
+        np.testing.assert_array_equal(matrix, expected(t))
+    # восемь соединений, но encode() вызван заметно реже
+    assert server.requests == 8
+    assert len(encoder.batches) < 8
@@ -0,0 +1,84 @@
+from eval_cache import EvalCache, make_key, normalize_ad_text
+
+
+def test_normalized_text_shares_key():
+    assert normalize_ad_text("Скидка  10%!\n") == "скидка 10%!"
+    assert make_key("Скидка  10%!\n", "Students", "v1") == make_key("скидка 10%!", "students", "v1")
+    assert make_key("скидка", "students", "v1") != make_key("скидка", "students", "v2")
+
+
+def test_get_or_compute_calls_once():
+    cache = EvalCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"click_probability": 0.5}
+
+    assert cache.get_or_compute("ad", "seg", "v1", compute) == {"click_probability": 0.5}
+    assert cache.get_or_compute("AD ", "seg", "v1", compute) == {"click_probability": 0.5}
+    assert len(calls) == 1
+    assert cache.memory_hits == 1 and cache.misses == 1
+
+
+def test_returns_copies():
+    cache = EvalCache()
+    cache.set("k", {"a": [1]})
+    cache.get("k")["a"].append(2)
+    assert cache.get("k") == {"a": [1]}
+
+
+def test_lru_eviction():
+    cache = EvalCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_sqlite_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    EvalCache(sqlite_path=path).set("k", {"v": 1})
+    cache = EvalCache(sqlite_path=path)
+    assert cache.get("k") == {"v": 1}
+    assert cache.sqlite_hits == 1
+    assert cache.get("k") == {"v": 1}
+    assert cache.memory_hits == 1
+
+
+def test_heuristic_evaluator_bypasses_cache(monkeypatch):
+    import main
+
+    cache = EvalCache()
+    monkeypatch.setattr(main, "get_default_cache", lambda: cache)
+    monkeypatch.setattr(main, "EVALUATOR", "heuristic")
+    first = main.evaluate_ad("Скидка на новинку", "students")
+    assert main.evaluate_ad("Скидка на новинку", "students") == first
+    assert cache.lookups == 0
+
+
+class _ScriptedAdTest:
+    """AdTest, у которого ответы LLM — заранее заданные строки."""
+
+    def __new__(cls, answers):
+        from feedback import AdTest
+
+        class Tester(AdTest):
+            def _get_result(self, message):
+                self.calls += 1
+                return answers.pop(0)
+
+        tester = Tester(cache=EvalCache())
+        tester.calls = 0
+        return tester
+
+
+def test_run_test_caches_only_parsed_scores():
+    tester = _ScriptedAdTest(["не знаю", "click_probability: 0.4\npurchase_probability: 0.1"])
+    assert tester.run_test("ad", ["price_sensitive_students"]) == ("ad", None)
+    expected = {"click_probability": 0.4, "purchase_probability": 0.1}
+    assert tester.run_test("ad", ["price_sensitive_students"]) == ("ad", expected)
+    assert tester.run_test("ad", ["price_sensitive_students"]) == ("ad", expected)
+    assert tester.calls == 2
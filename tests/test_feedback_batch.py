@@ -0,0 +1,81 @@
+from eval_cache import EvalCache
+from feedback import AdTest
+from feedback_helper import parse_batch_scores, parse_scores
+
+SEGMENT = "price_sensitive_students"
+
+
+class ScriptedAdTest(AdTest):
+    """AdTest без сети: ответ LLM строит answer(prompt), промпты копятся в prompts."""
+
+    def __init__(self, answer, **kwargs):
+        super().__init__(cache=EvalCache(), **kwargs)
+        self.answer = answer
+        self.prompts = []
+
+    def _get_result(self, message):
+        self.prompts.append(message)
+        return self.answer(message)
+
+
+def _slots(*pairs):
+    return "\n".join(
+        f"ad_{i}_click_probability: {c}\nad_{i}_purchase_probability: {p}" for i, (c, p) in pairs
+    )
+
+
+def test_parse_batch_scores():
+    text = "ad_2_click_probability: 0,3\nAD_1_CLICK_PROBABILITY = .5\nad_1_purchase_probability: 1.7"
+    assert parse_batch_scores(text, 3) == [
+        {"click_probability": 0.5, "purchase_probability": 1.0},
+        None,          # нет purchase у слота 2
+        None,
+    ]
+    assert parse_scores("click_probability: 0.4\npurchase_probability: 0.1") == {
+        "click_probability": 0.4, "purchase_probability": 0.1,
+    }
+    assert parse_scores("click_probability: 0.4") is None
+
+
+def test_run_batch_one_prompt_and_order():
+    tester = ScriptedAdTest(lambda prompt: _slots((2, (0.2, 0.1)), (1, (0.6, 0.3)), (3, (0.4, 0.2))))
+    scores = tester.run_batch(["a", "b", "c"], [SEGMENT])
+    assert [s["click_probability"] for s in scores] == [0.6, 0.2, 0.4]
+    assert len(tester.prompts) == 1
+    # второй прогон — целиком из кэша
+    assert tester.run_batch(["a", "b", "c"], [SEGMENT]) == scores
+    assert len(tester.prompts) == 1
+
+
+def test_missed_slot_is_reevaluated_alone():
+    def answer(prompt):
+        if "РЕКЛАМА №" in prompt:
+            return _slots((1, (0.6, 0.3)))           # слот 2 пропущен
+        return "click_probability: 0.7\npurchase_probability: 0.2"
+
+    tester = ScriptedAdTest(answer)
+    scores = tester.run_batch(["a", "b"], [SEGMENT])
+    assert scores == [
+        {"click_probability": 0.6, "purchase_probability": 0.3},
+        {"click_probability": 0.7, "purchase_probability": 0.2},
+    ]
+    assert len(tester.prompts) == 2
+    assert "РЕКЛАМА: b" in tester.prompts[1]
+
+
+def test_unparsed_slot_is_none_and_not_cached():
+    tester = ScriptedAdTest(lambda prompt: "не знаю")
+    assert tester.run_batch(["a"], [SEGMENT]) == [None]
+    tester.run_batch(["a"], [SEGMENT])
+    assert len(tester.prompts) == 4       # пачка + одиночный запрос, дважды
+
+
+def test_split_batches_respects_limits():
+    tester = ScriptedAdTest(lambda prompt: "")
+    ads = [f"объявление {i} " + "слово " * 50 for i in range(7)]
+    assert tester._split_batches(ads, [SEGMENT], max_prompt_tokens=10**6, max_ads=3) == [[0, 1, 2], [3, 4, 5], [6]]
+
+    one_ad = tester._split_batches(ads[:1], [SEGMENT], max_prompt_tokens=10**6, max_ads=10)
+    base = tester._split_batches(ads, [SEGMENT], max_prompt_tokens=1, max_ads=10)
+    # объявление, не влезающее в бюджет, всё равно уходит — отдельной пачкой
+    assert one_ad == [[0]] and base == [[i] for i in range(7)]
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import feedback_helper
+from feedback_helper import count_tokens, generate_prompt, get_personas, serialize_personas
+
+SEGMENT = "price_sensitive_students"
+OTHER = "tech_focused_professionals"
+
+
+def test_json_format_is_the_segment():
+    assert json.loads(serialize_personas([SEGMENT], "json")) == get_personas()[SEGMENT]
+    both = json.loads(serialize_personas([SEGMENT, OTHER], "json"))
+    assert both == get_personas()[SEGMENT] + get_personas()[OTHER]
+
+
+def test_table_format_row_per_persona():
+    lines = serialize_personas([SEGMENT, SEGMENT], "table").splitlines()
+    assert lines[0] == feedback_helper._TABLE_HEADER
+    assert len(lines) == 1 + len(get_personas()[SEGMENT])
+    first = get_personas()[SEGMENT][0]
+    fields = lines[1].split(";")
+    assert len(fields) == len(lines[0].split(";"))
+    assert fields[0] == first.get("age_range", "")
+    assert fields[3] == ",".join(first.get("interests", []))
+    assert fields[-1] == f"{float(first.get('price_sensitivity', 0.5)):.2f}"
+
+
+def test_aggregate_covers_all_segments():
+    block = serialize_personas([SEGMENT, OTHER])
+    total = len(get_personas()[SEGMENT]) + len(get_personas()[OTHER])
+    assert block.splitlines()[0] == f"группа: {SEGMENT}, {OTHER}; персон: {total}"
+    assert "ценовая чувствительность: среднее" in block
+
+
+def test_unknown_format_and_empty_segments():
+    with pytest.raises(ValueError):
+        serialize_personas([SEGMENT], "yaml")
+    with pytest.raises(ValueError):
+        serialize_personas([])
+
+
+def test_compact_formats_are_smaller():
+    tokens = {
+        fmt: generate_prompt("Скидка 10%", [SEGMENT], persona_format=fmt, with_token_count=True)[1]
+        for fmt in feedback_helper.PERSONA_FORMATS
+    }
+    assert tokens["aggregate"] < tokens["table"] < tokens["json"]
+
+
+def test_token_count_matches_prompt():
+    prompt, tokens = generate_prompt("Скидка 10%", [SEGMENT], with_token_count=True)
+    assert prompt == generate_prompt("Скидка 10%", [SEGMENT])
+    assert tokens == count_tokens(prompt)
+
+
+def test_count_tokens_fallback(monkeypatch):
+    monkeypatch.setattr(feedback_helper, "_get_encoding", lambda: None)
+    assert count_tokens("abcdefgh") == 2
+    assert count_tokens("привет") == 3      # кириллица — 2 байта UTF-8 на символ
+    assert count_tokens("") == 1
@@ -0,0 +1,15 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_import_time_budget():
+    proc = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "check_import_time.py")],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    assert proc.returncode == 0, proc.stdout + proc.stderr
@@ -0,0 +1,86 @@
+import time
+
+import jobqueue
+from jobqueue import DONE, FAILED, QUEUED, RUNNING, JobLost, JobQueue, _Heartbeat, worker_loop
+
+
+def make_queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def test_writes_require_ownership(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.submit("campaign", {"records": []})
+    job = queue.claim("w1")
+    assert job.worker == "w1"
+
+    assert queue.update_progress(job_id, "w1", 1, 2)
+    assert not queue.update_progress(job_id, "w2", 2, 2)
+    assert not queue.finish(job_id, "w2", {"ok": True})
+    assert not queue.fail(job_id, "w2", "boom")
+    assert queue.get(job_id).status == RUNNING
+    assert queue.get(job_id).progress_done == 1
+
+    assert not queue.is_cancel_requested(job_id, "w1")
+    assert queue.is_cancel_requested(job_id, "w2")
+    assert queue.finish(job_id, "w1", {"ok": True})
+    assert queue.get(job_id).status == DONE
+    # завершённая задача больше не принимает записей и от владельца
+    assert not queue.heartbeat(job_id, "w1")
+
+
+def test_requeued_job_is_lost_for_previous_worker(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.submit("campaign", {"records": []})
+    queue.claim("w1")
+    assert queue.requeue_stale(stale_after=-1) == 1
+    assert queue.get(job_id).status == QUEUED
+    assert queue.claim("w2").worker == "w2"
+
+    assert not queue.heartbeat(job_id, "w1")
+    assert queue.is_cancel_requested(job_id, "w1")
+    assert not queue.finish(job_id, "w1", {"stale": True})
+    assert queue.fail(job_id, "w2", "boom")
+    assert queue.get(job_id).status == FAILED
+
+
+def test_heartbeat_thread_keeps_slow_job_claimed(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.submit("campaign", {"records": []})
+    job = queue.claim("w1")
+    with _Heartbeat(queue, job, interval=0.02):
+        time.sleep(0.3)
+        assert queue.requeue_stale(stale_after=0.2) == 0
+    time.sleep(0.3)
+    assert queue.requeue_stale(stale_after=0.2) == 1
+    assert queue.get(job_id).status == QUEUED
+
+
+def test_worker_skips_finish_when_job_lost(tmp_path, monkeypatch):
+    def handler(q, job):
+        # пока обработчик работал, задачу вернули в очередь и забрал другой воркер
+        q.requeue_stale(stale_after=-1)
+        q.claim("other")
+        assert q.is_cancel_requested(job.id, job.worker)
+        raise JobLost(job.id)
+
+    monkeypatch.setitem(jobqueue.HANDLERS, "slow", handler)
+    monkeypatch.setattr(jobqueue, "share_across_processes", lambda path: None)
+    queue = make_queue(tmp_path)
+    job_id = queue.submit("slow", {})
+    worker_loop(str(tmp_path / "jobs.db"), poll_interval=0.01, max_jobs=1)
+
+    job = queue.get(job_id)
+    assert job.status == RUNNING and job.worker == "other"
+    assert job.error is None
+
+
+def test_worker_finishes_owned_job(tmp_path, monkeypatch):
+    monkeypatch.setitem(jobqueue.HANDLERS, "quick", lambda q, job: {"done": True})
+    monkeypatch.setattr(jobqueue, "share_across_processes", lambda path: None)
+    queue = make_queue(tmp_path)
+    job_id = queue.submit("quick", {})
+    worker_loop(str(tmp_path / "jobs.db"), poll_interval=0.01, max_jobs=1)
+
+    job = queue.get(job_id)
+    assert job.status == DONE and job.result == {"done": True}
@@ -0,0 +1,145 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from dedup import Deduplicator
+from journal import DONE, FAILED, Journal, work_id
+from pipeline import Pipeline, build_campaign_pipeline
+from productAnalyzer import ProductAnalyzer, WordstatError
+
+
+def test_work_id_stable():
+    assert work_id("analyze", {"b": 1, "a": 2}) == work_id("analyze", {"a": 2, "b": 1})
+    assert work_id("analyze", 1) != work_id("evaluate", 1)
+
+
+def test_done_is_replayed(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    with Journal(path, fsync=False) as journal:
+        assert journal.run("x", "analyze", lambda: {"score": 1}) == {"score": 1}
+
+    calls = []
+    with Journal(path, fsync=False) as journal:
+        assert journal.is_done("x")
+        assert journal.run("x", "analyze", lambda: calls.append(1)) == {"score": 1}
+    assert calls == []
+
+
+def test_failed_is_retried(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+
+    def boom():
+        raise RuntimeError("лимит")
+
+    with Journal(path, fsync=False) as journal:
+        with pytest.raises(RuntimeError):
+            journal.run("x", "generate", boom)
+        with pytest.raises(RuntimeError):
+            journal.run("x", "generate", boom)
+        assert journal.status("x") == FAILED
+        assert journal._entries["x"]["attempts"] == 2
+
+    with Journal(path, fsync=False) as journal:
+        assert journal.run("x", "generate", lambda: [1]) == [1]
+        assert journal.summary() == {"generate": {DONE: 1, FAILED: 0}}
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    path = tmp_path / "run.jsonl"
+    with Journal(str(path), fsync=False) as journal:
+        journal.record_done("a", "analyze", 1)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"id": "b", "kind": "anal')
+
+    journal = Journal(str(path), fsync=False)
+    assert journal.corrupt_lines == 1
+    assert dict(journal.outputs("analyze")) == {"a": 1}
+    with pytest.raises(KeyError):
+        journal.output("b")
+    journal.close()
+
+
+def test_arun(tmp_path):
+    async def compute():
+        return "ok"
+
+    with Journal(str(tmp_path / "run.jsonl"), fsync=False) as journal:
+        assert asyncio.run(journal.arun("x", "evaluate", compute)) == "ok"
+        assert journal.output("x") == "ok"
+
+
+class StubEncoder:
+    def encode(self, texts, convert_to_tensor=False, normalize_embeddings=True):
+        if isinstance(texts, str):
+            return np.ones(4) / 2
+        return np.eye(len(texts), 4)
+
+
+class FlakyAnalyzer(ProductAnalyzer):
+    """Wordstat отказывает на товарах из failing; остальные запросы считаются."""
+
+    def __init__(self, failing=()):
+        super().__init__(encoder=StubEncoder())
+        self.failing = set(failing)
+        self.requests = []
+
+    async def get_trend_info(self, phrase_name):
+        self.requests.append(phrase_name)
+        if phrase_name in self.failing:
+            raise WordstatError(f"http ошибка для '{phrase_name}': 503")
+        return {"topRequests": [{"count": 100}]}
+
+
+PRODUCTS = [
+    {"name": "Лампа", "description": "Настольная", "price": 1000, "market_cost": 400},
+    {"name": "Коврик", "description": "Для йоги", "price": 2000, "market_cost": 500},
+]
+
+
+def _score_stages(analyzer, journal):
+    pipeline = build_campaign_pipeline(analyzer, None, [], top_n=None, rate_limited=False, journal=journal)
+    return Pipeline(pipeline.stages[:2])
+
+
+def test_failed_wordstat_is_retried_on_rerun(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    items = [{"index": i, "product": p} for i, p in enumerate(PRODUCTS)]
+
+    with Journal(path, fsync=False) as journal:
+        result = asyncio.run(_score_stages(FlakyAnalyzer(failing={"Лампа"}), journal).run(items))
+        assert [out["index"] for out in result.outputs] == [1]
+        assert [err["stage"] for err in result.errors] == ["trends"]
+        assert journal.status(work_id("analyze", PRODUCTS[0])) == FAILED
+        assert journal.summary()["analyze"] == {DONE: 1, FAILED: 1}
+
+    analyzer = FlakyAnalyzer()
+    with Journal(path, fsync=False) as journal:
+        result = asyncio.run(_score_stages(analyzer, journal).run(items))
+        # Wordstat спрошен только про упавший товар, и спрос у него не нулевой
+        assert analyzer.requests == ["Лампа"]
+        assert result.errors == []
+        scored = {out["index"]: out["scored"] for out in result.outputs}
+        assert scored[0]["_temp_trend"] == 100
+        assert journal.summary()["analyze"] == {DONE: 2, FAILED: 0}
+
+
+def test_analyze_without_journal_scores_failed_trend_as_zero():
+    analyzer = FlakyAnalyzer(failing={"Лампа"})
+    top = asyncio.run(analyzer.analyze(PRODUCTS, top_n=2))
+    assert {p["name"]: "Спрос: 0 запросов" in p["recommendation"] for p in top} == {"Лампа": True, "Коврик": False}
+
+
+def test_failed_wordstat_is_not_memoised_for_group():
+    dedup = Deduplicator()
+    group = dedup.assign(PRODUCTS[0])
+    analyzer = FlakyAnalyzer(failing={"Лампа"})
+
+    async def trend():
+        return await dedup.amemo(group, "wordstat", lambda: analyzer.get_trend_info("Лампа"))
+
+    with pytest.raises(WordstatError):
+        asyncio.run(trend())
+    analyzer.failing.clear()
+    assert asyncio.run(trend()) == {"topRequests": [{"count": 100}]}
+    assert analyzer.requests == ["Лампа", "Лампа"]
@@ -0,0 +1,83 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    was_enabled = metrics.enabled()
+    metrics.enable()
+    metrics.reset()
+    yield
+    metrics.reset()
+    metrics.enable(was_enabled)
+
+
+def test_disabled_metrics_record_nothing():
+    metrics.enable(False)
+    metrics.inc("genai4_evaluations_total")
+    metrics.observe("genai4_llm_seconds", 0.1)
+    with metrics.timer("genai4_llm_seconds"):
+        pass
+    assert metrics.prometheus_text() == "\n"
+
+
+def test_prometheus_text_counters_and_gauges():
+    metrics.inc("genai4_eval_cache_total", result="hit")
+    metrics.inc("genai4_eval_cache_total", 2, result="hit")
+    metrics.inc("genai4_eval_cache_total", result="miss")
+    metrics.set_gauge("genai4_scheduler_queue_depth", 7, provider="mistral")
+
+    lines = metrics.prometheus_text().splitlines()
+    assert "# HELP genai4_eval_cache_total Обращения к кэшу оценок по результату" in lines
+    assert "# TYPE genai4_eval_cache_total counter" in lines
+    assert 'genai4_eval_cache_total{result="hit"} 3' in lines
+    assert 'genai4_eval_cache_total{result="miss"} 1' in lines
+    assert "# TYPE genai4_scheduler_queue_depth gauge" in lines
+    assert 'genai4_scheduler_queue_depth{provider="mistral"} 7' in lines
+    # HELP/TYPE — один раз на метрику, а не на каждый набор меток
+    assert sum(line.startswith("# TYPE genai4_eval_cache_total") for line in lines) == 1
+
+
+def test_prometheus_text_histogram_is_cumulative():
+    for value in (0.002, 0.003, 0.2, 100.0):
+        metrics.observe("genai4_llm_seconds", value, provider="mock")
+
+    lines = metrics.prometheus_text().splitlines()
+    assert "# TYPE genai4_llm_seconds histogram" in lines
+    assert 'genai4_llm_seconds_bucket{provider="mock",le="0.001"} 0' in lines
+    assert 'genai4_llm_seconds_bucket{provider="mock",le="0.005"} 2' in lines
+    assert 'genai4_llm_seconds_bucket{provider="mock",le="0.25"} 3' in lines
+    assert 'genai4_llm_seconds_bucket{provider="mock",le="60.0"} 3' in lines
+    assert 'genai4_llm_seconds_bucket{provider="mock",le="+Inf"} 4' in lines
+    assert 'genai4_llm_seconds_sum{provider="mock"} 100.205000' in lines
+    assert 'genai4_llm_seconds_count{provider="mock"} 4' in lines
+
+
+def test_label_values_are_escaped():
+    metrics.inc("genai4_evaluations_total", evaluator='a"b\\c\nd')
+    assert 'genai4_evaluations_total{evaluator="a\\"b\\\\c\\nd"} 1' in metrics.prometheus_text().splitlines()
+
+
+def test_histogram_quantiles():
+    hist = metrics._Histogram((1.0, 2.0, 5.0))
+    assert hist.quantile(0.5) == 0.0
+    for value in (0.5, 0.7, 1.5, 4.0):
+        hist.observe(value)
+    # верхняя граница бакета, где накопилась доля q наблюдений, но не больше максимума
+    assert hist.quantile(0.5) == 1.0
+    assert hist.quantile(0.75) == 2.0
+    assert hist.quantile(1.0) == 4.0
+    hist.observe(9.0)
+    assert hist.quantile(1.0) == 9.0
+
+
+def test_report_summarises_histograms():
+    for value in (0.01, 0.02, 0.03):
+        metrics.observe("genai4_stage_seconds", value, stage="score")
+    (entry,) = metrics.report()["histograms"]
+    assert entry["labels"] == {"stage": "score"}
+    assert entry["count"] == 3
+    assert entry["min"] == 0.01 and entry["max"] == 0.03
+    assert entry["p50"] == 0.025
+    assert entry["mean"] == pytest.approx(0.02)
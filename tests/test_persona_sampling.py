@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+from feedback_helper import get_personas
+from persona_sampling import (
+    _ranks,
+    _spearman,
+    fidelity_report,
+    representative_personas,
+    weighted_scores,
+)
+
+SEGMENT = "financially_conservative_adults"
+
+
+def test_representatives_cover_segment():
+    reps = representative_personas(SEGMENT, 5)
+    assert len(reps.medoids) == 5
+    assert math.isclose(sum(reps.weights), 1.0)
+    assert sum(len(m) for m in reps.members) == len(get_personas()[SEGMENT]) == reps.segment_size
+
+
+def test_weighted_scores_skip_missing():
+    a = {"click_probability": 0.2, "purchase_probability": 0.1}
+    b = {"click_probability": 0.6, "purchase_probability": 0.3}
+    assert weighted_scores([a, None, b], [0.25, 0.5, 0.25]) == pytest.approx(
+        {"click_probability": 0.4, "purchase_probability": 0.2}
+    )
+    assert weighted_scores([None], [1.0]) is None
+
+
+def test_ties_get_average_ranks():
+    assert list(_ranks([0.3, 0.1, 0.3])) == [1.5, 0.0, 1.5]
+
+
+def test_spearman_without_variance():
+    assert _spearman([0.5, 0.5, 0.5], [0.5, 0.5, 0.5]) == 1.0
+    assert _spearman([0.5, 0.5, 0.5], [0.1, 0.2, 0.3]) == 0.0
+    assert _spearman([0.1, 0.2, 0.3], [0.3, 0.2, 0.1]) == pytest.approx(-1.0)
+
+
+def test_fidelity_report_with_constant_evaluator():
+    def constant(ad_text, segment, personas):
+        return [{"click_probability": 0.5, "purchase_probability": 0.1}] * len(personas)
+
+    report = fidelity_report(["a", "b", "c"], SEGMENT, ks=(3,), evaluator=constant)
+    row = report["by_k"][0]
+    assert row["rank_spearman"] == 1.0
+    assert row["click_mae"] == pytest.approx(0.0)
+
+
+def test_fidelity_report_default_evaluator():
+    report = fidelity_report(["Скидка 10% только сегодня!", "Купить."], SEGMENT, ks=(3, 10))
+    assert [row["k"] for row in report["by_k"]] == [3, 10]
+    assert all(not math.isnan(row["rank_spearman"]) for row in report["by_k"])
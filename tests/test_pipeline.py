@@ -0,0 +1,100 @@
+import asyncio
+
+from pipeline import Pipeline, Stage
+
+
+async def double(x):
+    yield x * 2
+
+
+def test_stages_chain_and_keep_every_output():
+    async def split(x):
+        yield x
+        yield x + 100
+
+    result = asyncio.run(Pipeline([Stage("double", double, 3), Stage("split", split, 2)]).run(range(5)))
+    assert sorted(result.outputs) == sorted([x * 2 for x in range(5)] + [x * 2 + 100 for x in range(5)])
+    assert result.stats["double"].processed == 5
+    assert result.stats["split"].emitted == 10
+    assert result.errors == []
+
+
+def test_stage_error_drops_item_and_pipeline_continues():
+    async def picky(x):
+        if x == 3:
+            raise ValueError("плохой элемент")
+        yield x
+
+    result = asyncio.run(Pipeline([Stage("picky", picky, 2), Stage("double", double)]).run(range(6)))
+    assert sorted(result.outputs) == [0, 2, 4, 8, 10]
+    assert result.stats["picky"].errors == 1
+    assert result.errors == [{"stage": "picky", "item": "3", "error": "плохой элемент"}]
+
+
+def test_flush_emits_after_input_is_exhausted():
+    seen = []
+
+    async def collect(x):
+        seen.append(x)
+        return
+        yield
+
+    async def flush():
+        # к моменту flush этап видел весь вход
+        yield sum(seen)
+
+    result = asyncio.run(Pipeline([Stage("sum", collect, 1, flush=flush), Stage("double", double)]).run(range(5)))
+    assert result.outputs == [20]
+    assert result.stats["sum"].emitted == 1
+
+
+def test_flush_error_is_reported():
+    async def passthrough(x):
+        yield x
+
+    async def flush():
+        raise RuntimeError("flush упал")
+        yield
+
+    result = asyncio.run(Pipeline([Stage("p", passthrough, flush=flush)]).run([1]))
+    assert result.outputs == [1]
+    assert result.errors == [{"stage": "p", "item": "flush", "error": "flush упал"}]
+
+
+def test_slow_stage_applies_backpressure():
+    pulled = []
+
+    def items():
+        for i in range(100):
+            pulled.append(i)
+            yield i
+
+    async def main():
+        release = asyncio.Event()
+
+        async def passthrough(x):
+            yield x
+
+        async def gated(x):
+            await release.wait()
+            yield x
+
+        pipeline = Pipeline([Stage("fast", passthrough, 1, queue_size=1), Stage("slow", gated, 1, queue_size=1)])
+        run = asyncio.ensure_future(pipeline.run(items()))
+        await asyncio.sleep(0.05)
+        # feed + две очереди по одному + по элементу в каждом этапе — дальше вход не читается
+        in_flight = len(pulled)
+        release.set()
+        result = await run
+        return in_flight, result
+
+    in_flight, result = asyncio.run(main())
+    assert in_flight <= 5
+    assert sorted(result.outputs) == list(range(100))
+
+
+def test_on_output_receives_results_instead_of_outputs():
+    received = []
+    result = asyncio.run(Pipeline([Stage("double", double)]).run([1, 2], on_output=received.append))
+    assert sorted(received) == [2, 4]
+    assert result.outputs == []
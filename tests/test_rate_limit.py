@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+
+from rate_limit import RateLimiter, SharedRateLimiter
+
+
+def test_bucket_takes_and_waits():
+    limiter = RateLimiter(60, burst=2)
+    assert limiter._try_take(1) == 0.0
+    assert limiter._try_take(1) == 0.0
+    wait = limiter._try_take(1)
+    assert 0.9 < wait <= 1.0
+
+
+def test_oversized_request_waits_for_full_bucket():
+    limiter = RateLimiter(60, burst=2)
+    limiter.take(2)
+    assert limiter.wait_time(100) <= 2.0
+
+
+def test_take_goes_into_debt_and_refund():
+    limiter = RateLimiter(60, burst=2)
+    limiter.take(2)
+    limiter.take(1)
+    assert limiter.wait_time(1) > 1.5
+    limiter.refund(3)
+    assert limiter.wait_time(2) == 0.0
+
+
+def test_acquire_waits_for_refill():
+    limiter = RateLimiter(600, burst=1)       # 10 в секунду
+    t0 = time.perf_counter()
+    limiter.acquire_sync()
+    asyncio.run(limiter.acquire())
+    assert 0.05 < time.perf_counter() - t0 < 0.5
+
+
+def test_shared_bucket_between_limiters(tmp_path):
+    path = str(tmp_path / "scheduler.db")
+    a = SharedRateLimiter(path, "mistral", 60, burst=3)
+    b = SharedRateLimiter(path, "mistral", 60, burst=3)
+    other = SharedRateLimiter(path, "wordstat", 60, burst=3)
+    try:
+        assert a._try_take(2) == 0.0
+        assert b._try_take(1) == 0.0
+        assert b._try_take(1) > 0.5
+        assert a.wait_time(1) > 0.5
+        assert other._try_take(3) == 0.0
+        b.refund(1)
+        assert a._try_take(1) == 0.0
+    finally:
+        for limiter in (a, b, other):
+            limiter.close()
+
+
+def test_shared_bucket_threads(tmp_path):
+    path = str(tmp_path / "scheduler.db")
+    limiters = [SharedRateLimiter(path, "openai", 1, burst=20) for _ in range(4)]
+    granted = []
+
+    def worker(limiter):
+        for _ in range(10):
+            if limiter._try_take(1) == 0.0:
+                granted.append(1)
+
+    threads = [threading.Thread(target=worker, args=(limiter,)) for limiter in limiters]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for limiter in limiters:
+        limiter.close()
+    assert len(granted) == 20
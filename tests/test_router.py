@@ -0,0 +1,139 @@
+import json
+
+import pytest
+
+import main
+import router
+from prompt import AdGenerator, AdVariant, generate_and_optimize_ad, get_generator
+from router import ModelRouter, RoutedAdTest, RoutedGenerator, RoutingFailed
+
+PAYLOAD = {
+    "product": {"name": "Наушники", "category": "Электроника"},
+    "audience_profile": {},
+    "channel": "telegram",
+    "n_variants": 1,
+}
+
+
+class TierClient:
+    """LLM уровня: fail — ответ не разбирается (как ValueError в MistralClient), иначе один вариант."""
+
+    def __init__(self, tier, calls, fail=False):
+        self.tier = tier
+        self.calls = calls
+        self.fail = fail
+
+    def generate_variants(self, payload):
+        self.calls.append(self.tier.name)
+        if self.fail:
+            raise ValueError("Не удалось распарсить JSON из ответа Mistral")
+        return [AdVariant(payload["channel"], f"Заголовок {self.tier.name}", "Текст", "Купить", "")]
+
+
+def make_generator(failing=()):
+    calls = []
+    generator = RoutedGenerator(
+        ModelRouter(), client_factory=lambda tier: TierClient(tier, calls, tier.name in failing)
+    )
+    return generator, calls
+
+
+def test_parse_failure_escalates_to_next_tier():
+    generator, calls = make_generator(failing={"mistral-fast"})
+    result = generator.generate_from_json_dict(PAYLOAD, return_human_texts=False)
+
+    assert calls == ["mistral-fast", "mistral-strong"]
+    assert result["model_tier"] == "mistral-strong"
+    report = generator.router.report()["tiers"]
+    assert report["mistral-fast"]["failures"] == 1
+    assert report["mistral-fast"]["escalations"] == 1
+    assert report["mistral-strong"]["results"] == 1
+
+
+def test_cheap_tier_answer_is_not_escalated():
+    generator, calls = make_generator()
+    assert generator.generate_from_json_dict(PAYLOAD)["model_tier"] == "mistral-fast"
+    assert calls == ["mistral-fast"]
+
+
+def test_all_tiers_failing_raises():
+    generator, _ = make_generator(failing={"mistral-fast", "mistral-strong"})
+    with pytest.raises(RoutingFailed):
+        generator.generate_from_json_dict(PAYLOAD)
+
+
+def test_finalist_iterations_go_to_strong_tier():
+    generator, calls = make_generator()
+    # порог недостижим — все итерации после первой идут финалистам
+    result = generate_and_optimize_ad(generator, PAYLOAD, "low_income_pragmatic_youth", best_click_threshold=1.1,
+                                      max_iters=3, remember=False)
+    assert calls == ["mistral-fast", "mistral-strong", "mistral-strong"]
+    assert result["iterations"] == 3
+
+
+class ScriptedTester:
+    """AdTest уровня: None для объявлений из unreadable — как пропущенный моделью слот."""
+
+    def __init__(self, tier, calls, unreadable=()):
+        self.tier = tier
+        self.calls = calls
+        self.unreadable = set(unreadable)
+        self.prompt_tokens_total = self.usage_prompt_tokens = self.usage_completion_tokens = 0
+
+    def run_batch(self, ads, types):
+        self.calls.append((self.tier.name, list(ads)))
+        self.usage_prompt_tokens += 100
+        self.usage_completion_tokens += 10
+        return [None if ad in self.unreadable else {"click_probability": 0.5, "purchase_probability": 0.1}
+                for ad in ads]
+
+
+def test_screen_escalates_only_unparsed_ads():
+    calls = []
+    tester = RoutedAdTest(ModelRouter(), ad_test_factory=lambda tier: ScriptedTester(
+        tier, calls, unreadable={"b"} if tier.name == "openai-fast" else ()
+    ))
+    scores = tester.run_batch(["a", "b", "c"], ["low_income_pragmatic_youth"])
+
+    assert calls == [("openai-fast", ["a", "b", "c"]), ("openai-strong", ["b"])]
+    assert all(s is not None for s in scores)
+    report = tester.router.report()["tiers"]
+    assert report["openai-fast"]["results"] == 2
+    assert report["openai-fast"]["escalations"] == 1
+    assert report["openai-strong"]["results"] == 1
+
+
+def test_finalists_are_evaluated_by_strong_tier_only():
+    calls = []
+    tester = RoutedAdTest(ModelRouter(), ad_test_factory=lambda tier: ScriptedTester(tier, calls))
+    tester.evaluate_finalists(["a"], ["low_income_pragmatic_youth"])
+    assert calls == [("openai-strong", ["a"])]
+
+
+def test_routing_config_selects_routed_generator(tmp_path, monkeypatch):
+    monkeypatch.delenv("ROUTING_CONFIG", raising=False)
+    assert isinstance(get_generator(use_mistral=False), AdGenerator)
+
+    config = tmp_path / "routing.json"
+    config.write_text(json.dumps({"policy": {"generate": ["mistral-strong"]}}), encoding="utf-8")
+    monkeypatch.setenv("ROUTING_CONFIG", str(config))
+    monkeypatch.setattr(router, "_default_router", None)
+    generator = get_generator(use_mistral=False)
+    assert isinstance(generator, RoutedGenerator)
+    assert generator.generate_from_json_dict(PAYLOAD)["model_tier"] == "mistral-strong"
+
+
+def test_llm_evaluator_batches_pairs_by_segment(monkeypatch):
+    calls = []
+    tester = ScriptedTester(router.DEFAULT_TIERS["openai-fast"], calls)
+    monkeypatch.setattr(main, "EVALUATOR", "llm")
+    monkeypatch.setattr(main, "get_ad_test", lambda: tester)
+
+    pairs = [("a", "s1"), ("b", "s2"), ("c", "s1")]
+    assert len(main.evaluate_ads(pairs)) == 3
+    assert calls == [("openai-fast", ["a", "c"]), ("openai-fast", ["b"])]
+    assert main.evaluate_ad("d", "s1") == {"click_probability": 0.5, "purchase_probability": 0.1}
+
+    tester.unreadable.add("e")
+    with pytest.raises(RuntimeError):
+        main.evaluate_ad("e", "s1")
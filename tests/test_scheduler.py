@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from scheduler import (
+    BATCH,
+    INTERACTIVE,
+    Scheduler,
+    SchedulerTimeout,
+    call_context,
+    current_context,
+    estimate_tokens,
+)
+
+
+def test_call_context_nests_and_resets():
+    assert current_context()["priority"] == INTERACTIVE
+    with call_context(priority=BATCH, tenant="job:1"):
+        with call_context(tenant="job:2"):
+            assert current_context()["priority"] == BATCH
+            assert current_context()["tenant"] == "job:2"
+        assert current_context()["tenant"] == "job:1"
+    assert current_context()["priority"] == INTERACTIVE
+    with pytest.raises(ValueError):
+        with call_context(priority="urgent"):
+            pass
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("", completion=0) == 1
+    assert estimate_tokens("a" * 400, completion=100) == 200
+
+
+def test_unlimited_without_rate_limit():
+    scheduler = Scheduler(rpm={"p": 1}, tpm={})
+    with call_context(rate_limited=False):
+        for _ in range(5):
+            with scheduler.slot("p") as grant:
+                assert grant.waited == 0.0
+    assert scheduler.stats() == {}
+
+
+def test_timeout_removes_ticket():
+    scheduler = Scheduler(rpm={"p": 1}, tpm={})
+    with scheduler.slot("p"):
+        pass
+    with pytest.raises(SchedulerTimeout):
+        with scheduler.slot("p", timeout=0.05):
+            pass
+    assert scheduler.stats()["p"]["depth"] == {INTERACTIVE: 0, BATCH: 0}
+
+
+def _order_of_grants(scheduler, requests):
+    """Заполняет очередь, пока корзина пуста, и возвращает порядок выдачи слотов."""
+    order = []
+    lock = threading.Lock()
+
+    def call(priority, tenant, label):
+        with scheduler.slot("p", priority=priority, tenant=tenant, timeout=10):
+            with lock:
+                order.append(label)
+
+    threads = []
+    for priority, tenant, label in requests:
+        t = threading.Thread(target=call, args=(priority, tenant, label))
+        t.start()
+        threads.append(t)
+        time.sleep(0.02)   # постановка в очередь в заданном порядке
+    for t in threads:
+        t.join()
+    return order
+
+
+def test_interactive_before_batch_and_tenants_alternate():
+    scheduler = Scheduler(rpm={"p": 600}, tpm={})   # 10 запросов в секунду, корзина на 10
+    scheduler._queue("p").requests.take(10)
+    order = _order_of_grants(scheduler, [
+        (BATCH, "a", "a1"),
+        (BATCH, "a", "a2"),
+        (BATCH, "a", "a3"),
+        (BATCH, "b", "b1"),
+        (INTERACTIVE, "ui", "ui1"),
+    ])
+    assert order[0] == "ui1"
+    assert order[1:] == ["a1", "b1", "a2", "a3"]
+    assert scheduler.stats()["p"]["granted"] == {INTERACTIVE: 1, BATCH: 4}
+
+
+def test_token_bucket_settle_refunds():
+    scheduler = Scheduler(rpm={"p": None}, tpm={"p": 600})   # ёмкость 100 токенов
+    with scheduler.slot("p", tokens=80) as grant:
+        grant.settle(20)
+    assert scheduler._queue("p").tokens.wait_time(80) == 0.0
+
+
+def test_aslot_cancel_leaves_queue():
+    scheduler = Scheduler(rpm={"p": 1}, tpm={})
+
+    async def main():
+        async with scheduler.aslot("p"):
+            pass
+        task = asyncio.ensure_future(scheduler.aslot("p").__aenter__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert scheduler.stats()["p"]["depth"][INTERACTIVE] == 0
+
+
+def test_batch_yields_to_interactive_in_other_process(tmp_path):
+    path = str(tmp_path / "scheduler.db")
+    webapp, worker = Scheduler(rpm={"p": 60}, tpm={}), Scheduler(rpm={"p": 60}, tpm={})
+    webapp.share(path)
+    worker.share(path)
+    # оба планировщика в одном процессе — спрос webapp публикуется под чужим pid
+    webapp._demand.pid += 1_000_000
+    webapp._queue("p").requests.take(1)   # корзина общая: пуста и для worker
+
+    order = []
+    lock = threading.Lock()
+
+    def call(scheduler, priority, label):
+        with scheduler.slot("p", priority=priority, timeout=10):
+            with lock:
+                order.append(label)
+
+    ui = threading.Thread(target=call, args=(webapp, INTERACTIVE, "ui"))
+    ui.start()
+    time.sleep(0.05)
+    assert worker._demand.others_waiting("p")
+    batch = threading.Thread(target=call, args=(worker, BATCH, "batch"))
+    batch.start()
+    ui.join()
+    batch.join()
+    assert order == ["ui", "batch"]
+    assert not worker._demand.others_waiting("p")
+    assert worker.stats()["p"]["shared"] == webapp.stats()["p"]["shared"]
@@ -0,0 +1,98 @@
+import re
+import zlib
+
+import numpy as np
+import pytest
+
+import semantic_eval
+from semantic_eval import SemanticEvaluator
+
+DIM = 64
+
+
+class StubEncoder:
+    """Мешок слов по хэшу: тексты с общими словами близки. Запоминает закодированные тексты."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, convert_to_tensor=False, normalize_embeddings=True):
+        self.encoded.extend(texts)
+        out = np.zeros((len(texts), DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower().removeprefix("query: ")):
+                out[row, zlib.crc32(word.encode("utf-8")) % DIM] += 1
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return np.divide(out, norms, out=np.zeros_like(out), where=norms > 0)
+
+
+PERSONAS = {
+    "gamers": [
+        {"interests": ["gaming", "tech_gadgets"], "behaviors": ["early_adopter"], "price_sensitivity": 0.3},
+        {"interests": ["gaming"], "behaviors": [], "price_sensitivity": 0.4},
+    ],
+    "savers": [
+        {"interests": ["finance_investing"], "behaviors": ["reacts_to_discounts"], "price_sensitivity": 0.9},
+        {"interests": ["home_family"], "behaviors": ["reacts_to_discounts"], "price_sensitivity": 0.8},
+    ],
+}
+
+GAME_AD = "Новые видеоигры и консоли для киберспорт турниров — играй на максимуме каждый вечер с друзьями"
+PLAIN_AD = "Практичный органайзер для дома и семьи: порядок на кухне, в детской и в прихожей без лишних хлопот"
+SALE_AD = "Практичный органайзер для дома и семьи: скидка 30% и бесплатная доставка только на этой неделе"
+
+
+@pytest.fixture
+def evaluator():
+    return SemanticEvaluator(PERSONAS, encoder=StubEncoder())
+
+
+def test_pairs_keep_order_and_match_score_matrix(evaluator):
+    pairs = [(GAME_AD, "savers"), (PLAIN_AD, "gamers"), (GAME_AD, "gamers"), (GAME_AD, "savers")]
+    results = evaluator.evaluate_pairs(pairs)
+    click, purchase = evaluator.score_matrix([GAME_AD, PLAIN_AD], ["savers", "gamers"])
+
+    assert results[0] == results[3]
+    assert results[0]["click_probability"] == pytest.approx(float(click[0, 0]))
+    assert results[1]["purchase_probability"] == pytest.approx(float(purchase[1, 1]))
+    assert results[2] == evaluator.evaluate(GAME_AD, "gamers")
+    for r in results:
+        assert 0.0 <= r["purchase_probability"] <= r["click_probability"] <= 1.0
+
+
+def test_each_unique_ad_is_encoded_once(evaluator):
+    encoder = evaluator.encoder
+    before = len(encoder.encoded)
+    evaluator.evaluate_pairs([(GAME_AD, s) for s in ("gamers", "savers")] * 3 + [(PLAIN_AD, "gamers")])
+    assert len(encoder.encoded) - before == 2
+    evaluator.evaluate_pairs([(GAME_AD, "savers")])
+    assert len(encoder.encoded) - before == 2
+
+
+def test_relevant_segment_scores_higher(evaluator):
+    game = evaluator.evaluate_pairs([(GAME_AD, "gamers"), (GAME_AD, "savers")])
+    assert game[0]["click_probability"] > game[1]["click_probability"]
+
+
+def test_price_cue_helps_price_sensitive_segment(evaluator, monkeypatch):
+    # без релевантности остаются только ценовые поправки
+    monkeypatch.setattr(semantic_eval, "RELEVANCE_SCALE", 0.0)
+    plain, sale = evaluator.evaluate_pairs([(PLAIN_AD, "savers"), (SALE_AD, "savers")])
+    plain_g, sale_g = evaluator.evaluate_pairs([(PLAIN_AD, "gamers"), (SALE_AD, "gamers")])
+    lift_savers = sale["click_probability"] - plain["click_probability"]
+    lift_gamers = sale_g["click_probability"] - plain_g["click_probability"]
+    assert lift_savers > 0 > lift_gamers
+    # без ценового сигнала чувствительные к цене покупают реже
+    assert plain["click_probability"] - plain["purchase_probability"] > (
+        plain_g["click_probability"] - plain_g["purchase_probability"]
+    )
+
+
+def test_unknown_segment_gets_profile_from_name(evaluator):
+    (result,) = evaluator.evaluate_pairs([(GAME_AD, "любители_видеоигры")])
+    assert "любители_видеоигры" in evaluator.segments
+    assert 0.0 <= result["click_probability"] <= 1.0
+
+
+def test_empty_pairs(evaluator):
+    assert evaluator.evaluate_pairs([]) == []
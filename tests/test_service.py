@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from starlette.testclient import TestClient
+
+from service import AdmissionMiddleware, Overloaded, ServiceState, create_app
+
+
+@pytest.fixture
+def client():
+    return TestClient(create_app(ServiceState()))
+
+
+@pytest.mark.parametrize("top_n", [None, "три", 0, True, [3]])
+def test_analyze_rejects_bad_top_n(client, top_n):
+    response = client.post("/analyze", json={"products": [], "top_n": top_n})
+    assert response.status_code == 400
+    assert "top_n" in response.json()["error"]
+
+
+def test_bad_body_is_400(client):
+    response = client.post("/evaluate", content=b"[1, 2]")
+    assert response.status_code == 400
+
+
+def _run_middleware(app):
+    state = ServiceState()
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "path": "/evaluate", "headers": [], "client": ("127.0.0.1", 1)}
+    middleware = AdmissionMiddleware(app, state=state)
+
+    async def call():
+        try:
+            await middleware(scope, receive, send)
+        finally:
+            assert state.inflight == 0
+
+    return call, messages
+
+
+def test_error_before_start_becomes_json():
+    async def app(scope, receive, send):
+        raise Overloaded("очередь оценок переполнена")
+
+    call, messages = _run_middleware(app)
+    asyncio.run(call())
+    assert [m["type"] for m in messages] == ["http.response.start", "http.response.body"]
+    assert messages[0]["status"] == 503
+
+
+def test_error_after_stream_started_is_not_a_second_response():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}\n", "more_body": True})
+        raise ValueError("поток оборвался")
+
+    call, messages = _run_middleware(app)
+    with pytest.raises(ValueError):
+        asyncio.run(call())
+    assert [m["type"] for m in messages].count("http.response.start") == 1
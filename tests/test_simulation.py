@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from conftest import ROOT
+from simulation import AdProfile, simulate_audience, wilson_interval
+
+PERSONAS = os.path.join(ROOT, "categorized_personas.json")
+SEGMENT = "price_sensitive_students"
+STRONG = AdProfile(
+    text="Скидка 30% на хит сезона! Бесплатная доставка, новинка 2025.",
+    channel="messenger_tg_whatsapp_wechat",
+)
+WEAK = "Телефон. Купить."
+
+
+def test_wilson_interval():
+    assert wilson_interval(0, 0, 1.96) == (0.0, 1.0)
+    low, high = wilson_interval(50, 100, 1.96)
+    assert low < 0.5 < high
+    assert wilson_interval(500, 1000, 1.96)[1] - wilson_interval(500, 1000, 1.96)[0] < high - low
+
+
+def test_simulation_is_reproducible():
+    a = simulate_audience([STRONG, WEAK], SEGMENT, max_consumers=20_000, batch_size=5_000, seed=1,
+                          personas_path=PERSONAS)
+    b = simulate_audience([STRONG, WEAK], SEGMENT, max_consumers=20_000, batch_size=5_000, seed=1,
+                          personas_path=PERSONAS)
+    assert a.to_dict() == b.to_dict()
+
+
+def test_simulation_picks_stronger_ad_and_stops_early():
+    result = simulate_audience([WEAK, STRONG], SEGMENT, max_consumers=500_000, batch_size=10_000, seed=0,
+                               personas_path=PERSONAS)
+    assert result.winner == 1
+    assert result.stopped_early
+    assert result.variants[0].eliminated_after is not None
+
+
+def test_single_variant_is_not_stopped_early():
+    result = simulate_audience([STRONG], SEGMENT, max_consumers=20_000, batch_size=5_000, seed=0,
+                               personas_path=PERSONAS)
+    assert result.winner == 0
+    assert result.consumers_simulated == 5_000
+    assert not result.stopped_early
+
+
+def test_unknown_segment():
+    with pytest.raises(KeyError):
+        simulate_audience([STRONG], "martians", personas_path=PERSONAS)
@@ -0,0 +1,51 @@
+import json
+import os
+
+import pytest
+
+from sinks import NdjsonSink, is_ndjson_path, iter_records, read_ndjson, write_json_atomic
+
+
+@pytest.mark.parametrize("name", ["out.ndjson", "out.ndjson.gz"])
+def test_close_publishes(tmp_path, name):
+    path = str(tmp_path / name)
+    with NdjsonSink(path, fsync=False) as sink:
+        sink.write_many([{"i": 1}, {"i": 2, "text": "привет"}])
+        # частичный результат читается во время прогона
+        assert list(read_ndjson(sink.part_path)) == [{"i": 1}, {"i": 2, "text": "привет"}]
+        assert not os.path.exists(path)
+    assert sink.count == 2
+    assert not os.path.exists(path + ".part")
+    assert list(read_ndjson(path)) == [{"i": 1}, {"i": 2, "text": "привет"}]
+
+
+def test_error_keeps_previous_output(tmp_path):
+    path = str(tmp_path / "out.ndjson")
+    with NdjsonSink(path, fsync=False) as sink:
+        sink.write({"run": 1})
+    with pytest.raises(RuntimeError):
+        with NdjsonSink(path, fsync=False) as sink:
+            sink.write({"run": 2})
+            raise RuntimeError
+    assert list(read_ndjson(path)) == [{"run": 1}]
+    assert list(read_ndjson(path + ".part")) == [{"run": 2}]
+    with pytest.raises(ValueError):
+        sink.write({"run": 3})
+
+
+def test_unfinished_line_is_skipped(tmp_path):
+    path = tmp_path / "out.ndjson"
+    path.write_text('{"a": 1}\n{"a": ', encoding="utf-8")
+    assert list(read_ndjson(str(path))) == [{"a": 1}]
+
+
+def test_iter_records(tmp_path):
+    json_path = tmp_path / "catalog.json"
+    write_json_atomic(str(json_path), [{"name": "a"}, {"name": "b"}])
+    assert list(iter_records(str(json_path))) == [{"name": "a"}, {"name": "b"}]
+
+    single = tmp_path / "one.json"
+    single.write_text(json.dumps({"name": "c"}), encoding="utf-8")
+    assert list(iter_records(str(single))) == [{"name": "c"}]
+
+    assert is_ndjson_path("catalog.jsonl.gz") and not is_ndjson_path("catalog.json")
@@ -1,82 +1,132 @@
+import atexit
+import hashlib
 import json
+import os
+import subprocess
+import sys
+import threading
 import time
-from typing import Any, Dict, List
+import uuid
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Tuple
 
 import streamlit as st
 # Убедитесь, что prompt.py лежит рядом, иначе закомментируйте импорт для теста интерфейса
-from prompt import get_llm_client, AdGenerator
+from prompt import AdGenerator, default_creative_index, get_generator
+from campaign import (
+    MAX_WORKERS,
+    generate_catalog,
+    generate_for_record,
+    parse_products_json,
+)
+from jobqueue import DONE, FAILED, QUEUED, JobQueue, load_campaign_run, scheduler_db_path
+from scheduler import INTERACTIVE, call_context, share_across_processes
 
 # Путь к встроенному примеру
 DEFAULT_JSON_PATH = "test.json"
+# Ключ session_state, под которым хранится последний прогон генерации
+RESULT_STATE_KEY = "generation_result"
+# Товаров на одной странице результатов
+PAGE_SIZE = 10
+# Фоновая очередь: id задачи в session_state, число воркеров, период опроса статуса
+JOB_STATE_KEY = "job_id"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = 1.0
+# Арендатор вкладки для честной очереди запросов к LLM (scheduler.py)
+TENANT_STATE_KEY = "scheduler_tenant"
 
-def parse_products_json(data: Any) -> List[Dict]:
-    if isinstance(data, dict):
-        return [data]
-    elif isinstance(data, list):
-        return data
-    else:
-        raise ValueError("Ожидался объект JSON или список объектов JSON.")
+# --- Кэширование между перезапусками скрипта ---
+# cache_resource — один объект на процесс (общий для всех сессий),
+# cache_data — копия результата на каждый вызов, ключ — аргументы.
 
-def generate_creatives(records: List[Dict], user_text: str, llm_client, use_mistral: bool = True) -> Dict[str, Any]:
-    """
-    Генерирует креативы через LLM API.
-    Логика полностью сохранена.
-    """
-    first = records[0]
-
-    if "product" in first:
-        product = first.get("product", {}) or {}
-        audience = first.get("audience_profile", {}) or {}
-        channel = first.get("channel", "telegram")
-        trends = first.get("trends", [])
-        n_variants = first.get("n_variants", 3)
-    else:
-        product = {
-            "name": first.get("name", ""),
-            "category": first.get("category", ""),
-            "price": first.get("price"),
-            "margin": "высокая" if first.get("price", 0) > first.get("market_cost", 0) * 1.5 else "средняя",
-            "tags": first.get("tags", []),
-            "features": [first.get("description", "")]
-        }
-        audience = {
-            "age_range": "20-35",
-            "interests": ["гаджеты", "технологии"],
-            "behavior": ["реагирует на скидки"]
-        }
-        channel = "telegram"
-        trends = ["минимализм", "FOMO"]
-        n_variants = 3
+@st.cache_resource(show_spinner=False)
+def get_cached_generator(use_mistral: bool):
+    """AdGenerator или, с ROUTING_CONFIG, router.RoutedGenerator (prompt.get_generator)."""
+    return get_generator(use_mistral, index=default_creative_index())
 
-    payload = {
-        "product": product,
-        "audience_profile": audience,
-        "channel": channel,
-        "trends": trends,
-        "n_variants": n_variants,
-    }
 
-    if user_text.strip():
-        if "user_instructions" not in payload:
-            payload["user_instructions"] = user_text.strip()
+@st.cache_resource(show_spinner=False)
+def get_job_queue() -> JobQueue:
+    return JobQueue()
 
-    generator = AdGenerator(llm_client)
-    result = generator.generate_from_json_dict(payload, return_human_texts=True)
 
-    variants = result.get("variants", [])
-    if not variants:
-        return {
-            "text": "❌ Не удалось сгенерировать креативы. Попробуйте еще раз.",
-            "image_url": "https://i.imgur.com/ilo8Prn.jpeg  ",
-        }
+@st.cache_resource(show_spinner=False)
+def share_provider_limits() -> str:
+    """Лимиты провайдеров — общие с воркерами очереди (отдельными процессами), а не свои на процесс."""
+    path = scheduler_db_path(get_job_queue().db_path)
+    share_across_processes(path)
+    return path
+
+
+class _JobWorkers:
+    """Процесс воркеров очереди: перезапускается, если завершился, и гасится вместе с сервером."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process: Optional[subprocess.Popen] = None
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+
+@st.cache_resource(show_spinner=False)
+def _get_job_workers() -> _JobWorkers:
+    return _JobWorkers()
+
+
+def ensure_job_workers(n: int) -> subprocess.Popen:
+    """
+    Один процесс с n воркерами на весь сервер Streamlit (не на сессию); упавший
+    запускается заново. --parent-pid: если сервер убит без atexit, воркеры выйдут сами.
+    """
+    workers = _get_job_workers()
+    with workers.lock:
+        if workers.process is None or workers.process.poll() is not None:
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobqueue.py")
+            workers.process = subprocess.Popen([
+                sys.executable, script, "--workers", str(n),
+                "--db", get_job_queue().db_path, "--parent-pid", str(os.getpid()),
+            ])
+        return workers.process
+
+
+@st.cache_data(show_spinner=False)
+def load_default_catalog(path: str) -> Tuple[bytes, List[Dict]]:
+    """Встроенный пример: сырые байты (для кнопки скачивания) и распарсенные записи."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return b"", []
+    return raw, parse_products_json(json.loads(raw.decode("utf-8")))
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def parse_uploaded_catalog(upload_hash: str, _raw_bytes: bytes) -> List[Dict]:
+    """
+    Разбор загруженного файла. Ключ кэша — только upload_hash
+    (аргументы с "_" Streamlit не хэширует), так что большой файл не хэшируется дважды.
+    """
+    return parse_products_json(json.loads(_raw_bytes.decode("utf-8")))
+
+
+def generate_creatives(
+    records: List[Dict],
+    user_text: str,
+    llm_client,
+    use_mistral: bool = True,
+    generator: Optional[AdGenerator] = None,
+) -> Dict[str, Any]:
+    """
+    Креативы для первой записи каталога (старое поведение, для обратной совместимости).
+    Весь каталог обрабатывает generate_catalog.
+    """
+    if generator is None:
+        generator = AdGenerator(llm_client)
+    return generate_for_record(records[0], user_text, generator)
 
-    placeholder_image_url = "https://i.imgur.com/ilo8Prn.jpeg  "
-    return {
-        "variants": variants,
-        "channel": channel,
-        "image_url": placeholder_image_url,
-        "product": product,
-    }
 
 def main():
     st.set_page_config(
@@ -84,6 +134,7 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded",
     )
+    share_provider_limits()
 
     # --- НОВЫЙ ДИЗАЙН (CSS) ---
     # Этот блок принудительно делает тему темной и красивой
@@ -290,6 +341,38 @@ def main():
         help="Для работы нужен ключ MISTRAL_API_KEY в переменных окружения или secrets.",
     )
     
+    max_workers = st.sidebar.slider(
+        "⚡ Параллельных запросов к LLM",
+        min_value=1,
+        max_value=32,
+        value=MAX_WORKERS,
+        help="Сколько товаров каталога генерируется одновременно.",
+    )
+    use_job_queue = st.sidebar.checkbox(
+        "🗂 Фоновая очередь задач",
+        value="job" in st.query_params,
+        help="Генерация выполняется отдельными процессами-воркерами: закрытая вкладка или перезапуск её не прерывают.",
+    )
+    if use_job_queue:
+        done_jobs = get_job_queue().list_jobs(status=DONE, limit=10)
+        if done_jobs:
+            job_options = {
+                f"{time.strftime('%d.%m %H:%M', time.localtime(j.created))} · {j.progress_total} тов. · {j.id}": j.id
+                for j in done_jobs
+            }
+
+            def _open_done_job():
+                picked = st.session_state.get("done_job_choice")
+                if picked in job_options:
+                    st.session_state[JOB_STATE_KEY] = job_options[picked]
+
+            st.sidebar.selectbox(
+                "📂 Готовые задачи",
+                ["—"] + list(job_options),
+                key="done_job_choice",
+                on_change=_open_done_job,
+            )
+    
     st.sidebar.markdown("---")
     st.sidebar.markdown("### 📊 Информация")
     st.sidebar.info("""
@@ -323,10 +406,11 @@ def main():
         )
         
         # Кнопка скачивания
-        with open(DEFAULT_JSON_PATH, "rb") as sample_file:
+        sample_bytes, _ = load_default_catalog(DEFAULT_JSON_PATH)
+        if sample_bytes:
             st.download_button(
                 label="⬇️ Скачать пример test.json",
-                data=sample_file,
+                data=sample_bytes,
                 file_name="test.json",
                 mime="application/json",
                 use_container_width=True,
@@ -371,117 +455,242 @@ def main():
 
 
     if generate_button:
-        # Читаем и парсим JSON
+        # Читаем и парсим JSON (распарсенный каталог кэшируется по хэшу содержимого)
         if uploaded_file is not None:
             try:
-                raw_bytes = uploaded_file.read()
-                raw_text = raw_bytes.decode("utf-8")
-                data = json.loads(raw_text)
-                records = parse_products_json(data)
+                raw_bytes = uploaded_file.getvalue()
+                records = parse_uploaded_catalog(hashlib.sha256(raw_bytes).hexdigest(), raw_bytes)
             except Exception as e:
                 st.error(f"Не удалось прочитать JSON: {e}")
                 return
         else:
             try:
-                with open(DEFAULT_JSON_PATH, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                records = parse_products_json(data)
+                _, records = load_default_catalog(DEFAULT_JSON_PATH)
+                if not records:
+                    raise FileNotFoundError(DEFAULT_JSON_PATH)
                 st.info(f"Используется встроенный пример: {DEFAULT_JSON_PATH}")
             except Exception as e:
                 st.error(f"Не удалось прочитать встроенный пример {DEFAULT_JSON_PATH}: {e}")
                 return
 
-        # Инициализация LLM
+        # Инициализация LLM (клиент и генератор живут между перезапусками и сессиями)
         try:
-            llm_client = get_llm_client(use_mistral=use_real_mistral)
+            generator = get_cached_generator(use_real_mistral)
         except Exception as e:
             st.error(f"Ошибка инициализации LLM-клиента: {e}")
             if use_real_mistral:
                 st.info("💡 Убедитесь, что переменная окружения MISTRAL_API_KEY установлена, или используйте заглушку.")
             return
 
-        # Генерация
-        with st.spinner("🎨 Генерация креативов... Это может занять несколько секунд"):
-            try:
-                result = generate_creatives(records, user_text, llm_client, use_real_mistral)
-            except Exception as e:
-                st.error(f"❌ Ошибка при генерации: {e}")
-                return
+        if use_job_queue:
+            # Кладём кампанию в очередь и дальше только опрашиваем статус (см. render_job ниже).
+            # Та же кампания, уже посчитанная в другой сессии, вернётся без повторной генерации.
+            ensure_job_workers(JOB_WORKERS)
+            job_id = get_job_queue().submit("campaign", {
+                "records": records,
+                "user_text": user_text,
+                "use_mistral": use_real_mistral,
+                "max_workers": max_workers,
+            })
+            st.session_state[JOB_STATE_KEY] = job_id
+            st.query_params["job"] = job_id
+            generate_button = False
 
-        st.success("✅ Генерация завершена успешно!")
+    if generate_button:
+        # Генерация всего каталога: карточки появляются по мере готовности.
+        # Кнопка «Остановить» перезапускает скрипт — Streamlit прерывает этот цикл,
+        # closing() закрывает generate_catalog и снимает с очереди оставшиеся товары.
+        run = {"total": len(records), "results": {}, "errors": {}, "done": False}
+        st.session_state[RESULT_STATE_KEY] = run
+
+        progress = st.progress(0.0, text=f"Генерация креативов: 0 из {run['total']}")
+        st.button("⏹ Остановить генерацию", key="stop_generation")
+        live_slot = st.empty()
+        live = live_slot.container()
+        shown = 0
+
+        # запросы к LLM этой вкладки — interactive, вкладки чередуются в очереди scheduler
+        tenant = st.session_state.setdefault(TENANT_STATE_KEY, f"session:{uuid.uuid4().hex[:12]}")
+        with call_context(priority=INTERACTIVE, tenant=tenant), \
+                closing(generate_catalog(records, user_text, generator, max_workers=max_workers)) as stream:
+            for idx, res, err in stream:
+                if err is not None:
+                    run["errors"][idx] = err
+                else:
+                    run["results"][idx] = res
+                done = len(run["results"]) + len(run["errors"])
+                progress.progress(done / run["total"], text=f"Генерация креативов: {done} из {run['total']}")
+
+                # Вживую показываем только первую страницу, остальное — через пагинацию ниже
+                if res is not None and shown < PAGE_SIZE:
+                    with live:
+                        render_result(res)
+                    shown += 1
+
+        run["done"] = True
+        live_slot.empty()
+        progress.empty()
+        if run["errors"]:
+            st.warning(f"⚠️ Готово с ошибками: {len(run['errors'])} из {run['total']} товаров не сгенерированы.")
+        else:
+            st.success("✅ Генерация завершена успешно!")
         st.markdown("<br>", unsafe_allow_html=True)
 
-        # Подготовка данных
-        variants = result.get("variants", [])
-        channel = result.get("channel", "telegram")
-        product = result.get("product", {})
+    # Фоновая задача: id в session_state и в адресе страницы (?job=...),
+    # поэтому после перезагрузки вкладки опрос продолжается.
+    job_id = st.session_state.get(JOB_STATE_KEY) or st.query_params.get("job")
+    if use_job_queue and job_id:
+        render_job(job_id)
+
+    # Результат живёт в session_state: изменение виджетов перезапускает скрипт,
+    # но не вызывает LLM повторно — просто перерисовываем сохранённое.
+    run = st.session_state.get(RESULT_STATE_KEY)
+    if run is None:
+        return
+    render_catalog(run)
+
+
+def render_job(job_id: str) -> None:
+    """
+    Статус фоновой задачи. Пока задача выполняется — прогресс и повторный запуск
+    скрипта через JOB_POLL_SECONDS; готовый результат кладётся в session_state.
+    """
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        st.warning(f"Задача {job_id} не найдена.")
+        st.session_state.pop(JOB_STATE_KEY, None)
+        return
+
+    if job.active:
+        # воркеры могли упасть или не запускаться в этом процессе сервера (?job=... из адреса)
+        ensure_job_workers(JOB_WORKERS)
+        total = job.progress_total or len(job.params.get("records", [])) or 1
+        label = "в очереди" if job.status == QUEUED else f"{job.progress_done} из {total}"
+        st.progress(min(1.0, job.progress_done / total), text=f"Задача {job.id}: {label}")
+        if st.button("⏹ Отменить задачу", key="cancel_job"):
+            queue.cancel(job.id)
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+
+    if job.status == FAILED:
+        st.error(f"❌ Задача {job.id} завершилась с ошибкой:\n\n{job.error}")
+        return
+
+    st.session_state[RESULT_STATE_KEY] = load_campaign_run(job)
+
+
+def render_catalog(run: Dict[str, Any]) -> None:
+    """Постраничный вывод результатов прогона: на странице PAGE_SIZE товаров."""
+    results = run["results"]
+    total = run["total"]
+    if not run["done"]:
+        st.info(f"⏹ Генерация остановлена: готово {len(results) + len(run['errors'])} из {total}.")
+
+    if not results:
+        st.warning("⚠️ Не удалось сгенерировать варианты рекламы. Попробуйте еще раз.")
+    else:
+        indices = sorted(results)
+        pages = (len(indices) + PAGE_SIZE - 1) // PAGE_SIZE
+        page = 1
+        if pages > 1:
+            page = st.number_input(
+                f"Страница (всего {pages}, товаров: {len(indices)})",
+                min_value=1,
+                max_value=pages,
+                value=1,
+                step=1,
+                key="results_page",
+            )
+        for idx in indices[(page - 1) * PAGE_SIZE: page * PAGE_SIZE]:
+            render_result(results[idx])
+
+    if run["errors"]:
+        with st.expander(f"Ошибки генерации ({len(run['errors'])})"):
+            for idx in sorted(run["errors"]):
+                st.markdown(f"Товар #{idx + 1}: {run['errors'][idx]}")
+
+    if results:
+        render_image(next(iter(results.values()))["image_url"])
+
+
+def render_result(result: Dict[str, Any]) -> None:
+    """Карточка товара и его варианты (вызывается и во время генерации, и на любом перезапуске скрипта)."""
+    # Подготовка данных
+    variants = result.get("variants", [])
+    channel = result.get("channel", "telegram")
+    product = result.get("product", {})
+    
+    if not variants:
+        name = product.get("name", "") if product else ""
+        st.warning(f"⚠️ {name}: не удалось сгенерировать варианты рекламы.")
+        return
+
+    # --- КАРТОЧКА ПРОДУКТА ---
+    if product:
+        product_name = product.get("name", "")
+        product_category = product.get("category", "")
+        product_tags = product.get("tags", [])
+        product_price = product.get("price")
         
-        if not variants:
-            st.warning("⚠️ Не удалось сгенерировать варианты рекламы. Попробуйте еще раз.")
-            return
+        tags_html = ""
+        if product_tags:
+            tags_list = "".join([f'<span class="tag">{tag}</span>' for tag in product_tags])
+            tags_html = f'<div style="margin-top:8px;">{tags_list}</div>'
+        
+        price_html = ""
+        if product_price:
+            price_html = f'<div style="color: #94a3b8; font-size: 13px; margin-bottom: 8px;">Цена: <span style="color:#e2e8f0; font-weight:600;">{product_price:,} ₽</span></div>'
+        
+        st.markdown(f"""
+        <div class="glass-container" style="border-left: 4px solid #60a5fa;">
+            <div style="font-size: 11px; text-transform:uppercase; color: #60a5fa; font-weight:700; margin-bottom:4px;">
+                {product_category if product_category else 'Товар'}
+            </div>
+            <h3 style="margin: 0 0 10px 0; font-size: 22px;">{product_name}</h3>
+            {price_html}
+            {tags_html}
+        </div>
+        """, unsafe_allow_html=True)
 
-        # --- КАРТОЧКА ПРОДУКТА ---
-        if product:
-            product_name = product.get("name", "")
-            product_category = product.get("category", "")
-            product_tags = product.get("tags", [])
-            product_price = product.get("price")
-            
-            tags_html = ""
-            if product_tags:
-                tags_list = "".join([f'<span class="tag">{tag}</span>' for tag in product_tags])
-                tags_html = f'<div style="margin-top:8px;">{tags_list}</div>'
-            
-            price_html = ""
-            if product_price:
-                price_html = f'<div style="color: #94a3b8; font-size: 13px; margin-bottom: 8px;">Цена: <span style="color:#e2e8f0; font-weight:600;">{product_price:,} ₽</span></div>'
-            
+    st.markdown(f"<div class='section-title'>Сгенерировано вариантов: {len(variants)} | Канал: {channel.upper()}</div>", unsafe_allow_html=True)
+    st.markdown(f"<div class='section-sub'>Показаны все варианты рекламных креативов</div>", unsafe_allow_html=True)
+
+    # --- ОТОБРАЖЕНИЕ ВАРИАНТОВ ---
+    # Делаем сетку для адаптивности
+    cols = st.columns(len(variants))
+    for idx, variant in enumerate(variants):
+        # Если вариантов много, переносим на новую строку, если мало - в одну линию
+        with cols[idx] if idx < len(cols) else st.container():
             st.markdown(f"""
-            <div class="glass-container" style="border-left: 4px solid #60a5fa;">
-                <div style="font-size: 11px; text-transform:uppercase; color: #60a5fa; font-weight:700; margin-bottom:4px;">
-                    {product_category if product_category else 'Товар'}
+            <div class="ad-card" style="height: 100%;">
+                <div class="variant-number">Вариант {idx + 1}</div>
+                <div class="ad-headline">{variant.get('headline', '')}</div>
+                <div class="ad-text">{variant.get('text', '')}</div>
+                <div style="margin-top:auto;">
+                    <span class="ad-cta">CTA: {variant.get('cta', '')}</span>
+                </div>
+                <div class="ad-meta">
+                    <strong>Примечания:</strong> {variant.get('notes', 'Нет примечаний')}
                 </div>
-                <h3 style="margin: 0 0 10px 0; font-size: 22px;">{product_name}</h3>
-                {price_html}
-                {tags_html}
             </div>
             """, unsafe_allow_html=True)
 
-        st.markdown(f"<div class='section-title'>Сгенерировано вариантов: {len(variants)} | Канал: {channel.upper()}</div>", unsafe_allow_html=True)
-        st.markdown(f"<div class='section-sub'>Показаны все варианты рекламных креативов</div>", unsafe_allow_html=True)
-
-        # --- ОТОБРАЖЕНИЕ ВАРИАНТОВ ---
-        # Делаем сетку для адаптивности
-        cols = st.columns(len(variants))
-        for idx, variant in enumerate(variants):
-            # Если вариантов много, переносим на новую строку, если мало - в одну линию
-            with cols[idx] if idx < len(cols) else st.container():
-                st.markdown(f"""
-                <div class="ad-card" style="height: 100%;">
-                    <div class="variant-number">Вариант {idx + 1}</div>
-                    <div class="ad-headline">{variant.get('headline', '')}</div>
-                    <div class="ad-text">{variant.get('text', '')}</div>
-                    <div style="margin-top:auto;">
-                        <span class="ad-cta">CTA: {variant.get('cta', '')}</span>
-                    </div>
-                    <div class="ad-meta">
-                        <strong>Примечания:</strong> {variant.get('notes', 'Нет примечаний')}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
 
-        # Изображение
-        st.markdown("---")
-        st.markdown("<div class='section-title'>Визуальный креатив</div>", unsafe_allow_html=True)
-        
-        # Обертка для картинки, чтобы не прилипала к краям на мобильном
-        st.markdown('<div class="glass-container" style="padding: 10px;">', unsafe_allow_html=True)
-        st.image(
-            result["image_url"],
-            caption="Здесь будет отображаться сгенерированный баннер/креатив",
-            use_container_width=True,
-        )
-        st.markdown('</div>', unsafe_allow_html=True)
+
+def render_image(image_url: str) -> None:
+    # Изображение
+    st.markdown("---")
+    st.markdown("<div class='section-title'>Визуальный креатив</div>", unsafe_allow_html=True)
+    
+    # Обертка для картинки, чтобы не прилипала к краям на мобильном
+    st.markdown('<div class="glass-container" style="padding: 10px;">', unsafe_allow_html=True)
+    st.image(
+        image_url,
+        caption="Здесь будет отображаться сгенерированный баннер/креатив",
+        use_container_width=True,
+    )
+    st.markdown('</div>', unsafe_allow_html=True)
 
 
 if __name__ == "__main__":
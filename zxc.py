@@ -4,7 +4,9 @@ import httpx
 import math
 import time
 import os
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import util
+
+from embedding_client import get_encoder
 
 OAUTH_TOKEN = os.getenv("OAUTH_TOKEN") 
 JSON_FILE = "products.json"
@@ -12,7 +14,8 @@ JSON_FILE = "products.json"
 class ProductAnalyzer:
     def __init__(self):
         print("Загрузка нейросети...")
-        self.model = SentenceTransformer('intfloat/multilingual-e5-base')
+        # общий сервер эмбеддингов, если задан EMBED_SERVER, иначе своя модель
+        self.model = get_encoder()
         
         self.visual_pos = self.model.encode(["query: яркий красочный насыщенный неоновый броский дизайн визуально привлекательный"], convert_to_tensor=True)
 